@@ -0,0 +1,186 @@
+"""
+Cost-aware admission control for expensive requests.
+
+Each request is given an estimated cost before it starts (input length,
+expected number of images, TTS characters). Requests run while the cost in
+flight fits the instance's capacity; later ones wait in a bounded FIFO
+queue, and anything beyond that is rejected with a Retry-After computed from
+how fast recent work has drained. A burst then turns into 429s instead of
+piling into the executors until the instance runs out of memory.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_MAX_WAIT = object()
+
+
+class AdmissionRejected(RuntimeError):
+    """The request was not admitted; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CostModel:
+    """Turns what is known about a request up front into abstract cost units."""
+
+    def __init__(self, base: float = 1.0, text_chars_per_unit: float = 2000, units_per_image: float = 4.0,
+                 tts_chars_per_unit: float = 1000):
+        self.base = base
+        self.text_chars_per_unit = text_chars_per_unit
+        self.units_per_image = units_per_image
+        self.tts_chars_per_unit = tts_chars_per_unit
+
+    def estimate(self, input_chars: int = 0, images: int = 0, tts_chars: int = 0) -> float:
+        return round(self.base + input_chars / self.text_chars_per_unit + images * self.units_per_image
+                     + tts_chars / self.tts_chars_per_unit, 2)
+
+
+class Admission:
+    """An admitted request's share of capacity; release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController", label: str, cost: float, started_at: float):
+        self.controller = controller
+        self.label = label
+        self.cost = cost
+        self.started_at = started_at
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Admits requests by estimated cost against a fixed capacity, with a bounded wait queue."""
+
+    def __init__(self, capacity: float = 100.0, max_queued: int = 20, max_wait_seconds: float = 30.0,
+                 default_seconds_per_unit: float = 3.0, min_retry_after: int = 1, max_retry_after: int = 300,
+                 window_size: int = 50, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.max_queued = max_queued
+        self.max_wait_seconds = max_wait_seconds
+        self.default_seconds_per_unit = default_seconds_per_unit
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._in_flight_cost = 0.0
+        self._running = 0
+        self._queue = deque()  # [cost] per waiting request, in arrival order
+        self._seconds_per_unit = deque(maxlen=window_size)
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+        self.by_label: Dict[str, Dict[str, int]] = {}
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self, label: str, cost: float, timeout=_MAX_WAIT) -> Admission:
+        """Admit a request of the given cost, waiting up to timeout seconds (None waits indefinitely).
+
+        The default timeout is max_wait_seconds. Raises AdmissionRejected when
+        the queue is full or the wait runs out.
+        """
+        if timeout is _MAX_WAIT:
+            timeout = self.max_wait_seconds
+        # A request bigger than the whole capacity still runs, just alone
+        cost = min(max(cost, 0.0), self.capacity)
+        arrived = self.clock()
+        with self._cond:
+            if not self._queue and self._fits(cost):
+                return self._start(label, cost, arrived)
+            if len(self._queue) >= self.max_queued:
+                self._count(label, "rejected")
+                retry_after = self._retry_after(cost)
+                logger.warning(f"Rejecting {label} (cost {cost}): {len(self._queue)} requests queued; retry in {retry_after}s")
+                raise AdmissionRejected(f"{len(self._queue)} requests already queued", retry_after)
+
+            entry = [cost]
+            self._queue.append(entry)
+            self._count(label, "queued")
+            expires_at = arrived + timeout if timeout is not None else None
+            while not (self._queue[0] is entry and self._fits(cost)):
+                remaining = expires_at - self.clock() if expires_at is not None else None
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(entry)
+                    self._count(label, "timed_out")
+                    self._cond.notify_all()
+                    retry_after = self._retry_after(cost)
+                    logger.warning(f"{label} (cost {cost}) waited {timeout:g}s without capacity; retry in {retry_after}s")
+                    raise AdmissionRejected(f"no capacity within {timeout:g}s", retry_after)
+                self._cond.wait(remaining)
+            self._queue.popleft()
+            admission = self._start(label, cost, arrived)
+            # The next request in line may fit in what is left
+            self._cond.notify_all()
+            return admission
+
+    def stats(self) -> Dict:
+        with self._cond:
+            admitted = self.counters["admitted"]
+            return {
+                "capacity": self.capacity,
+                "in_flight_cost": round(self._in_flight_cost, 2),
+                "running": self._running,
+                "waiting": len(self._queue),
+                "waiting_cost": round(sum(entry[0] for entry in self._queue), 2),
+                "max_queued": self.max_queued,
+                "seconds_per_unit": round(self._mean_seconds_per_unit(), 3),
+                "avg_wait_seconds": round(self._total_wait / admitted, 3) if admitted else 0.0,
+                "max_wait_seconds": round(self._max_wait, 3),
+                **self.counters,
+                "by_label": {label: dict(counts) for label, counts in self.by_label.items()},
+            }
+
+    def _fits(self, cost: float) -> bool:
+        return self._running == 0 or self._in_flight_cost + cost <= self.capacity
+
+    def _start(self, label: str, cost: float, arrived: float) -> Admission:
+        now = self.clock()
+        waited = now - arrived
+        self._in_flight_cost += cost
+        self._running += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        self._count(label, "admitted")
+        return Admission(self, label, cost, now)
+
+    def _release(self, admission: Admission):
+        duration = self.clock() - admission.started_at
+        with self._cond:
+            self._in_flight_cost = max(0.0, self._in_flight_cost - admission.cost)
+            self._running -= 1
+            if admission.cost > 0:
+                self._seconds_per_unit.append(duration / admission.cost)
+            self._cond.notify_all()
+
+    def _mean_seconds_per_unit(self) -> float:
+        if not self._seconds_per_unit:
+            return self.default_seconds_per_unit
+        return sum(self._seconds_per_unit) / len(self._seconds_per_unit)
+
+    def _retry_after(self, cost: float) -> int:
+        """Seconds until the work ahead (in flight + queued) has drained enough for cost to fit."""
+        ahead = self._in_flight_cost + sum(entry[0] for entry in self._queue) + cost - self.capacity
+        # capacity units drain in parallel, each taking seconds_per_unit
+        seconds = max(ahead, 0.0) * self._mean_seconds_per_unit() / self.capacity
+        return int(min(self.max_retry_after, max(self.min_retry_after, math.ceil(seconds))))
+
+    def _count(self, label: str, counter: str):
+        self.counters[counter] += 1
+        counts = self.by_label.setdefault(label, {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0})
+        counts[counter] += 1
@@ -0,0 +1,471 @@
+"""
+ASGI serving mode with native async handlers for the network-bound routes.
+
+Under gunicorn every in-flight Gemini, TTS or GCS call holds one of the
+worker's threads, so an instance serves at most --threads generations at a
+time even though they are almost all waiting on the network. This module
+serves the same API from an event loop:
+
+- /character_chat, /sessions/<id>/messages and /generate_tts are coroutines
+  on the google-genai async client (client.aio), the async Text-to-Speech
+  client and a small thread pool for the blocking GCS SDK, so hundreds of
+  requests waiting on the network share one process.
+- Every other route is forwarded to the Flask app through a WSGI bridge on a
+  thread pool, so its behaviour is unchanged.
+- The native routes take a slot in their priority class and the same
+  admission as their Flask views (see limited()), so overload still ends in
+  429 + Retry-After. Their classes are AsyncBulkheads sized for coroutines
+  (ASGI_<CLASS>_CONCURRENCY), not the thread-sized Flask bulkheads.
+
+Run with `uvicorn asgi:app --host 0.0.0.0 --port $PORT`; main:app under
+gunicorn keeps working for existing deployments.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from a2wsgi import WSGIMiddleware
+from google.cloud import texttospeech
+from google.genai import types
+from google.oauth2 import service_account
+
+import backend
+from admission import AdmissionRejected
+from llm_gateway import bind_context, deadline_scope
+from prompt_cache import is_cache_rejection
+from scheduler import BATCH, INTERACTIVE, STANDARD, AsyncBulkhead, BulkheadFull
+from single_flight import canonical_key
+from streaming import STREAM_HEADERS, STREAM_MIMETYPES, encode_event, negotiate_stream_format
+
+logger = logging.getLogger(__name__)
+
+# Threads for blocking SDK calls (GCS uploads/signing, prompt cache creation) and for bridged Flask routes
+ASGI_BLOCKING_WORKERS = int(os.getenv("ASGI_BLOCKING_WORKERS", "16"))
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "8"))
+
+# Native routes mostly wait on the network, so their priority classes get far more slots than the Flask
+# bulkheads, whose limits are sized to a thread pool; waiters queue on the event loop
+def async_bulkhead_from_env(priority, concurrency, max_queued):
+    prefix = f"ASGI_{priority.upper()}"
+    return AsyncBulkhead(
+        priority,
+        max_concurrent=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        max_queued=int(os.getenv(f"{prefix}_MAX_QUEUED", str(max_queued)))
+    )
+
+async_bulkheads = {bulkhead.name: bulkhead for bulkhead in (
+    async_bulkhead_from_env(INTERACTIVE, concurrency=256, max_queued=256),
+    async_bulkhead_from_env(STANDARD, concurrency=128, max_queued=128),
+    async_bulkhead_from_env(BATCH, concurrency=16, max_queued=16),
+)}
+
+# Threads that wait for admission: one per request its queue can hold, so none waits for a thread
+ASGI_ADMISSION_WAITERS = int(os.getenv("ASGI_ADMISSION_WAITERS", str(backend.ADMISSION_MAX_QUEUED)))
+
+blocking_executor = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+admission_waiters = ThreadPoolExecutor(max_workers=ASGI_ADMISSION_WAITERS, thread_name_prefix="asgi-admission")
+flask_bridge = WSGIMiddleware(backend.app, workers=ASGI_WSGI_WORKERS)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking SDK call on blocking_executor with the request deadline."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, bind_context(functools.partial(fn, *args, **kwargs)))
+
+
+async def wait_for_slot(acquire, *args, **kwargs):
+    """Run a blocking acquire() on admission_waiters; a grant that arrives after the caller was cancelled is released."""
+    future = asyncio.get_running_loop().run_in_executor(admission_waiters, functools.partial(acquire, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result().release())
+        raise
+
+
+# --- Model calls on the async client ---
+
+async def agenerate(label, timeout=None, hedge=True, **request):
+    """backend.llm_generate() on client.aio: same gateway timeouts, retries, hedging and stats."""
+    return await backend.llm_gateway.acall(label, backend.client.aio.models.generate_content,
+                                           timeout=timeout, hedge=hedge, **request)
+
+
+def agenerate_stream(label, **request):
+    return backend.llm_gateway.astream(label, backend.client.aio.models.generate_content_stream, **request)
+
+
+async def stream_content_cached(model, system_instruction, contents, label="text", **config):
+    """Async backend.generate_content_cached(..., stream=True).
+
+    A cache handle rejected before the first chunk is dropped and the request
+    repeated with the full system instruction.
+    """
+    cache_name = await run_blocking(backend.prompt_cache.get, model, system_instruction, None, label=label)
+    if cache_name:
+        received = False
+        try:
+            async for chunk in agenerate_stream(label, model=model, contents=contents,
+                                                config=types.GenerateContentConfig(cached_content=cache_name, **config)):
+                received = True
+                yield chunk
+            return
+        except Exception as e:
+            if received or not is_cache_rejection(e):
+                raise
+            logger.warning(f"Cached prefix {cache_name} rejected ({e}); sending full prompt")
+            backend.prompt_cache.invalidate(cache_name)
+
+    async for chunk in agenerate_stream(label, model=model, contents=contents,
+                                        config=types.GenerateContentConfig(system_instruction=system_instruction,
+                                                                           **config)):
+        yield chunk
+
+
+async def stream_session_reply(session, message):
+    """Async backend.stream_session_reply: yields reply text, records the turn once complete."""
+    label = f"session_{session.kind}"
+    config = {"temperature": 0.8} if session.kind == "character_chat" else {}
+    contents = session.contents(message, compactor=backend.history_compactor)
+    reply_filter = backend.session_reply_filter(session)
+    parts = []
+    usage = None
+    async for chunk in stream_content_cached(session.model, session.system_instruction, contents, label=label,
+                                             **config):
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        text = reply_filter.feed(getattr(chunk, "text", None) or "")
+        if text:
+            parts.append(text)
+            yield text
+    rest = reply_filter.flush()
+    if rest:
+        parts.append(rest)
+        yield rest
+    backend.prompt_cache.record_usage(usage, label)
+    backend.conversation_sessions.record_turn(session, message, "".join(parts).strip())
+
+
+# --- Text-to-Speech ---
+
+_tts_client = None
+
+
+def tts_client():
+    """Async Text-to-Speech client, created on the serving loop at first use."""
+    global _tts_client
+    if _tts_client is None:
+        try:
+            cred = service_account.Credentials.from_service_account_file("firebase-service-account.json")
+            _tts_client = texttospeech.TextToSpeechAsyncClient(credentials=cred)
+        except FileNotFoundError:
+            _tts_client = texttospeech.TextToSpeechAsyncClient()
+    return _tts_client
+
+
+async def _synthesize(text, voice_name):
+    response = await tts_client().synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(language_code="en-US", name=voice_name),
+        audio_config=texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.MP3,
+            speaking_rate=1.0,
+            pitch=0.0,
+            volume_gain_db=0.0
+        )
+    )
+    return response.audio_content
+
+
+async def synthesize_speech(text, voice_name):
+    """MP3 bytes; shares backend.tts_flight so identical threaded and async requests make one TTS call."""
+    return await backend.tts_flight.ado(canonical_key("tts", text, voice_name), _synthesize, text, voice_name)
+
+
+# --- Minimal HTTP layer ---
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1")
+                        for name, value in scope.get("headers", [])}
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+
+class EventStream:
+    """Handler result streamed as SSE or NDJSON; events is an async iterator of (event, payload)."""
+
+    def __init__(self, stream_format, events):
+        self.stream_format = stream_format
+        self.events = events
+
+
+class ReleasingEvents:
+    """EventStream events that release the request's slot and admission once the stream is closed."""
+
+    def __init__(self, events, release):
+        self.events = events
+        self.release = release
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.events.__anext__()
+
+    async def aclose(self):
+        try:
+            await self.events.aclose()
+        finally:
+            self.release()
+
+
+ROUTES = []
+
+
+def route(method, pattern):
+    """Register an async handler; it returns (payload, status[, headers]) like the Flask views, or an EventStream."""
+    def decorator(handler):
+        ROUTES.append((method, re.compile(f"^{pattern}$"), handler))
+        return handler
+    return decorator
+
+
+def busy(retry_after):
+    return ({"error": "The server is busy. Please retry shortly.", "retry_after": retry_after}, 429,
+            {"Retry-After": str(retry_after)})
+
+
+def limited(priority, kind=None):
+    """Async backend.prioritized(priority) + backend.admitted(kind).
+
+    The handler runs in a slot of the priority class's AsyncBulkhead and, except
+    for interactive requests, once admission_controller has room for its
+    estimated cost; 429 + Retry-After otherwise. A streamed result holds both
+    until the stream is closed.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request, **params):
+            held = []
+
+            def release():
+                for grant in reversed(held):
+                    grant.release()
+
+            try:
+                slots = async_bulkheads[priority]
+                held.append(await slots.acquire(timeout=backend.SCHEDULER_MAX_WAIT_SECONDS[priority]))
+                if kind and priority != INTERACTIVE:
+                    data = request.json()
+                    cost = backend.estimate_request_cost(kind, data if isinstance(data, dict) else {})
+                    held.append(await wait_for_slot(backend.admission_controller.acquire, kind, cost,
+                                                    timeout=backend.ADMISSION_MAX_WAIT_SECONDS))
+            except (BulkheadFull, AdmissionRejected) as e:
+                logger.warning(f"Rejecting {request.path}: {e}")
+                release()
+                return busy(e.retry_after)
+            except BaseException:
+                release()
+                raise
+            try:
+                result = await handler(request, **params)
+            except BaseException:
+                release()
+                raise
+            if isinstance(result, EventStream):
+                result.events = ReleasingEvents(result.events, release)
+            else:
+                release()
+            return result
+        return wrapper
+    return decorator
+
+
+def match_route(method, path):
+    for route_method, pattern, handler in ROUTES:
+        found = pattern.match(path)
+        if found and route_method == method:
+            return handler, found.groupdict()
+    return None, None
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in headers.items()]
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+
+async def send_response(send, result):
+    if isinstance(result, EventStream):
+        headers = {"content-type": STREAM_MIMETYPES[result.stream_format], **STREAM_HEADERS}
+        await send({"type": "http.response.start", "status": 200, "headers": _encode_headers(headers)})
+        try:
+            async for event, payload in result.events:
+                chunk = encode_event(result.stream_format, event, payload).encode("utf-8")
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            # A client that went away closes the generator, which cancels the upstream model stream
+            await result.events.aclose()
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    payload, status, *extra_headers = result
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"content-type": "application/json", "content-length": len(body)}
+    if extra_headers:
+        headers.update(extra_headers[0])
+    await send({"type": "http.response.start", "status": status, "headers": _encode_headers(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            backend.image_workers.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            blocking_executor.shutdown(wait=False)
+            admission_waiters.shutdown(wait=False)
+            backend.image_workers.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http":
+        handler, params = match_route(scope["method"], scope["path"])
+        if handler is not None:
+            request = Request(scope, await read_body(receive))
+            with deadline_scope(backend.request_deadline_seconds(request.headers.get("x-request-deadline"))):
+                try:
+                    result = await handler(request, **params)
+                except Exception as e:
+                    logger.error(f"Error in {handler.__name__}: {str(e)}")
+                    result = {"error": str(e)}, 500
+                await send_response(send, result)
+            return
+    await flask_bridge(scope, receive, send)
+
+
+# --- Native routes ---
+
+async def session_reply(request, session_id, message, data, response_key="response"):
+    """Async backend.session_reply_response."""
+    session = backend.conversation_sessions.get(session_id)
+    if session is None:
+        return {"error": "Session not found or expired", "session_expired": True}, 404
+    if not message:
+        return {"error": "Message required"}, 400
+
+    stream_format = negotiate_stream_format(data.get('stream'), request.headers.get('accept'))
+    if stream_format:
+        async def events():
+            yield "start", {"session_id": session.session_id}
+            parts = []
+            try:
+                async for text in stream_session_reply(session, message):
+                    parts.append(text)
+                    yield "token", {"text": text}
+            except Exception as e:
+                logger.error(f"Error streaming {session.kind} session reply: {e}")
+                yield "error", {"error": "Failed to generate a response", "session_id": session.session_id}
+                return
+            yield "done", {response_key: "".join(parts).strip(), "session_id": session.session_id,
+                           "turns": session.turns, **session.metadata}
+
+        return EventStream(stream_format, events())
+
+    try:
+        reply = "".join([text async for text in stream_session_reply(session, message)]).strip()
+    except Exception as e:
+        logger.error(f"Error generating {session.kind} session reply: {e}")
+        return {"error": f"Failed to generate response: {str(e)}", "session_id": session.session_id}, 500
+    return {response_key: reply, "session_id": session.session_id, "turns": session.turns, **session.metadata}, 200
+
+
+@route("POST", "/sessions/(?P<session_id>[^/]+)/messages")
+@limited(INTERACTIVE)
+async def session_message(request, session_id):
+    data = request.json() or {}
+    return await session_reply(request, session_id, data.get('message', ''), data)
+
+
+@route("POST", "/character_chat")
+@limited(INTERACTIVE)
+async def character_chat(request):
+    data = request.json() or {}
+    character_name = data.get('character_name', '')
+    user_message = data.get('user_message', '')
+
+    session_id = data.get('session_id')
+    if not session_id and data.get('create_session'):
+        session, error = backend.create_conversation_session('character_chat', data)
+        if error:
+            return {"error": error}, 400
+        session_id = session.session_id
+    if session_id:
+        return await session_reply(request, session_id, user_message, data)
+
+    if not character_name or not user_message:
+        return {"error": "Character name and user message required"}, 400
+    try:
+        response = await agenerate("character_chat", model=backend.CHARACTER_CHAT_MODEL,
+                                   contents=backend.character_chat_prompt(data),
+                                   config=types.GenerateContentConfig(temperature=0.8))
+    except Exception as e:
+        logger.error(f"Error generating character response: {str(e)}")
+        return {"error": f"Failed to generate character response: {str(e)}"}, 500
+    return {"response": backend.character_reply_text(response, character_name), "character": character_name}, 200
+
+
+@route("POST", "/generate_tts")
+@limited(STANDARD, "tts")
+async def generate_tts(request):
+    data = request.json() or {}
+    text = data.get('text', '')
+    voice = data.get('voice', 'narrator')
+    model = data.get('model', 'gemini-2.5-flash-preview-tts')
+    if not text:
+        return {"error": "No text provided"}, 400
+    if len(text) > backend.TTS_MAX_TEXT_CHARS:
+        text = text[:backend.TTS_MAX_TEXT_CHARS] + "..."
+        logger.warning(f"Text truncated to {backend.TTS_MAX_TEXT_CHARS} characters for TTS")
+
+    try:
+        audio = await synthesize_speech(text, backend.tts_voice_name(voice))
+    except Exception as e:
+        logger.error(f"❌ Error generating TTS: {str(e)}")
+        return {"error": "Failed to generate TTS audio"}, 500
+
+    gcs_path = f"tts/tts_{uuid4().hex}.mp3"
+    if not await run_blocking(backend.upload_bytes_to_gcs, audio, gcs_path, "audio/mpeg"):
+        return {"error": "Failed to upload TTS audio"}, 500
+    signed_url = await run_blocking(backend.sign_gcs_blob, gcs_path, 60)
+    return {"audio_url": signed_url, "voice": voice, "model": model, "text_length": len(text)}, 200
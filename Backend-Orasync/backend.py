@@ -4,19 +4,45 @@ import re
 import json
 from io import BytesIO
 from uuid import uuid4
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 
 from google.cloud import storage
 from google.cloud import texttospeech
-from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 import datetime
 import hashlib
+import functools
 import uuid
+from collections import deque
+
+from caching import TieredImageCache, MemoryCacheBackend, LocalDirectoryCacheBackend, GCSCacheBackend, TextResponseCache, text_cache_key, is_complete_json_response, finished_normally
+from single_flight import SingleFlight, coalesce, canonical_key, single_flight_stats
+from model_health import ModelHealthRegistry
+from image_processing import (negotiate_image_format, estimate_decode_bytes, inspect_png_header,
+                              needs_transcode, MAX_IMAGE_SIZE)
+from image_derivatives import DerivativeRegistry, blob_path_from_url
+from block_parser import IncrementalBlockParser, parse_blocks, IMAGE_PLACEHOLDER, GHIBLI_IMAGE_PATTERN
+from streaming import negotiate_stream_format, encode_event, STREAM_MIMETYPES, STREAM_HEADERS
+from schemas import (StructuredOutputStats, SchemaValidationError, parse_with_repair, response_config, validate_item,
+                     COMIC_PANELS_SCHEMA)
+from json_stream import JsonArrayStream
+from prompt_cache import PromptPrefixCache, GenAICachedContentBackend, is_cache_rejection
+from long_document import split_semantic, map_chunks, condense, merge_block_items, source_blocks
+from conversation_sessions import ConversationSessionStore, ReplyPrefixFilter, normalize_history
+from history_compaction import HistoryCompactor, conversation_key
+from llm_gateway import LLMGateway, CallTimeout, DeadlineExceeded, bind_context, set_deadline, reset_deadline, deadline_scope
+from jobs import JobConflict, JobManager, JobQueueFull
+from admission import AdmissionController, AdmissionRejected, CostModel
+from memory_budget import MB, MemoryBudget, read_rss_bytes
+from image_workers import ImageWorkerPool, default_worker_count
+from progress_store import create_progress_store
+from progress_publisher import ProgressPublisher, firestore_batch_commit
+from notifications import FCMTransport, NotificationDispatcher
+from scheduler import BATCH, INTERACTIVE, STANDARD, Bulkhead, BulkheadFull, PriorityScheduler
 <<<<<<< HEAD
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import Optional, Dict, List, Tuple
 import time
 =======
@@ -28,7 +54,6 @@ from firebase_admin import credentials, firestore, messaging
 from google import genai
 from google.genai import types
 import base64
-import gc
 from google.oauth2 import service_account
 
 # Try to import psutil for memory monitoring
@@ -39,30 +64,14 @@ except ImportError:
     PSUTIL_AVAILABLE = False
     print("psutil not available - memory monitoring disabled")
 
-# Memory management configuration
-MEMORY_LIMIT_MB = 1500  # Set memory limit to 1.5GB to leave buffer
-MEMORY_WARNING_MB = 1000  # Warning at 1GB
-FORCE_GC_THRESHOLD_MB = 1200  # Force garbage collection at 1.2GB
-
 def get_memory_usage():
-    """Get current memory usage in MB"""
-    if PSUTIL_AVAILABLE:
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        return memory_info.rss / 1024 / 1024
-    return 0
+    """Current memory usage in MB, as last sampled by memory_budget (no system call)"""
+    return memory_budget.rss_bytes() / MB
 
 def check_memory_and_cleanup():
-    """Check memory usage and perform cleanup if needed"""
+    """Current memory usage in MB; garbage collection under pressure runs on the memory sampler thread"""
     memory_mb = get_memory_usage()
     
-    if memory_mb > FORCE_GC_THRESHOLD_MB:
-        logger.warning(f"High memory usage detected: {memory_mb:.1f} MB. Forcing garbage collection...")
-        gc.collect()
-        time.sleep(1)  # Give GC time to work
-        memory_mb = get_memory_usage()
-        logger.info(f"Memory after cleanup: {memory_mb:.1f} MB")
-    
     if memory_mb > MEMORY_WARNING_MB:
         logger.warning(f"Memory usage is high: {memory_mb:.1f} MB")
     
@@ -83,33 +92,18 @@ def safe_image_processing(image_data_bytes, prompt):
             logger.warning(f"Image data too small ({len(image_data_bytes)} bytes) for prompt: {prompt}")
             raise ValueError("Image data too small to be a valid image")
         
-        # Open and verify image
-        image = Image.open(BytesIO(image_data_bytes))
-        image.verify()
-        
-        # Reopen for processing
-        image = Image.open(BytesIO(image_data_bytes))
-        
-        # Convert RGBA to RGB to save memory
-        if image.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            background.paste(image, mask=image.split()[-1])
-            image = background
-        
-        # Optimize image size if too large
-        max_size = (1024, 1024)  # Limit image size to save memory
-        if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            logger.debug(f"Resized image to {image.size}")
-        
-        # Save to buffer with optimization
-        buffer = BytesIO()
-        image.save(buffer, format="PNG", optimize=True, compress_level=6)
-        buffer.seek(0)
+        # Fast path: header/IHDR check only; full decode + re-encode just for resize or alpha,
+        # which first reserves its pixel buffers against the memory budget
+        decode_bytes = (estimate_decode_bytes(image_data_bytes)
+                        if needs_transcode(inspect_png_header(image_data_bytes), MAX_IMAGE_SIZE) else 0)
+        with memory_budget.reserve("image_decode", decode_bytes, timeout=MEMORY_RESERVATION_TIMEOUT_SECONDS):
+            processed_bytes, transcoded = image_workers.normalize(image_data_bytes, MAX_IMAGE_SIZE)
+        buffer = BytesIO(processed_bytes)
         
-        # Clean up image objects
-        del image
-        gc.collect()
+        if transcoded:
+            logger.debug(f"Transcoded image ({len(image_data_bytes)} -> {len(processed_bytes)} bytes)")
+        else:
+            logger.debug(f"Image passed through without re-encode ({len(processed_bytes)} bytes)")
         
         # Check memory after processing
         final_memory = get_memory_usage()
@@ -127,6 +121,36 @@ load_dotenv()
 GENAI_API_KEY = os.getenv("GENAI_API_KEY")
 BASE_URL = os.getenv("BASE_URL")
 
+# CPU-bound Pillow work (transcodes, derivatives, placeholders) runs in worker processes, one per CPU by default.
+# IMAGE_WORKERS=0 keeps it on the request threads. Workers are started after gunicorn forks (see gunicorn.conf.py).
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(default_worker_count())))
+IMAGE_WORKER_MAX_QUEUED = int(os.getenv("IMAGE_WORKER_MAX_QUEUED", "16"))
+IMAGE_WORKER_QUEUE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_WORKER_QUEUE_TIMEOUT_SECONDS", "60"))
+image_workers = ImageWorkerPool(
+    workers=IMAGE_WORKERS,
+    max_queued=IMAGE_WORKER_MAX_QUEUED,
+    queue_timeout=IMAGE_WORKER_QUEUE_TIMEOUT_SECONDS
+)
+
+def process_rss_bytes():
+    """RSS of this process plus its image workers"""
+    return read_rss_bytes() + image_workers.rss_bytes()
+
+# Memory budget: a fraction of the container limit read from the cgroup (MEMORY_CONTAINER_LIMIT_MB overrides it).
+# Image decode, compositing and buffer work reserve bytes against it; RSS is sampled in the background.
+MEMORY_CONTAINER_LIMIT_MB = int(os.getenv("MEMORY_CONTAINER_LIMIT_MB", "0"))
+MEMORY_BUDGET_FRACTION = float(os.getenv("MEMORY_BUDGET_FRACTION", "0.8"))
+MEMORY_RESERVATION_TIMEOUT_SECONDS = float(os.getenv("MEMORY_RESERVATION_TIMEOUT_SECONDS", "60"))
+memory_budget = MemoryBudget.for_container(
+    fallback_limit_bytes=2048 * MB,
+    override_limit_bytes=MEMORY_CONTAINER_LIMIT_MB * MB or None,
+    budget_fraction=MEMORY_BUDGET_FRACTION,
+    read_rss=process_rss_bytes
+).start()
+MEMORY_LIMIT_MB = memory_budget.budget_bytes / MB
+MEMORY_WARNING_MB = MEMORY_LIMIT_MB * 2 / 3
+FORCE_GC_THRESHOLD_MB = memory_budget.gc_threshold_bytes / MB
+
 # Initialize Firebase Admin SDK
 try:
     # Try to initialize with service account key
@@ -229,8 +253,147 @@ PRIMARY_IMAGE_MODEL = "gemini-3.0-pro-exp"  # Latest with Nano Banana Pro featur
 FALLBACK_IMAGE_MODEL = "gemini-2.5-flash-image"  # Fast fallback
 LEGACY_IMAGE_MODEL = "gemini-2.0-flash-exp-image-generation"  # Last resort
 
-# Thread pool for async image generation
-image_executor = ThreadPoolExecutor(max_workers=5)
+# Circuit breaker + latency tracking per image model; routing skips open circuits
+image_model_registry = ModelHealthRegistry(
+    [
+        (PRIMARY_IMAGE_MODEL, "Gemini 3 Pro"),
+        (FALLBACK_IMAGE_MODEL, "Gemini 2.5 Flash"),
+        (LEGACY_IMAGE_MODEL, "Gemini 2.0 Flash (Legacy)")
+    ],
+    failure_threshold=int(os.getenv("IMAGE_MODEL_FAILURE_THRESHOLD", "3")),
+    recovery_timeout=float(os.getenv("IMAGE_MODEL_RECOVERY_SECONDS", "60"))
+)
+
+# Priority classes: each has its own request slots, wait queue and worker pool (a bulkhead), so batch
+# generation (comics, lectures, stories) can never take the capacity interactive chat relies on
+def bulkhead_from_env(priority, concurrency, max_queued, workers):
+    prefix = f"SCHEDULER_{priority.upper()}"
+    return Bulkhead(
+        priority,
+        max_concurrent=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        max_queued=int(os.getenv(f"{prefix}_MAX_QUEUED", str(max_queued))),
+        pool_workers=int(os.getenv(f"{prefix}_WORKERS", str(workers)))
+    )
+
+MAX_PANEL_WORKERS = int(os.getenv("MAX_PANEL_WORKERS", "6"))
+scheduler = PriorityScheduler([
+    bulkhead_from_env(INTERACTIVE, concurrency=8, max_queued=8, workers=2),
+    bulkhead_from_env(STANDARD, concurrency=4, max_queued=4, workers=5),
+    bulkhead_from_env(BATCH, concurrency=2, max_queued=2, workers=MAX_PANEL_WORKERS)
+])
+# How long a request may queue for a slot in its class before it gets a 429
+SCHEDULER_MAX_WAIT_SECONDS = {
+    INTERACTIVE: float(os.getenv("SCHEDULER_INTERACTIVE_MAX_WAIT_SECONDS", "5")),
+    STANDARD: float(os.getenv("SCHEDULER_STANDARD_MAX_WAIT_SECONDS", "30")),
+    BATCH: float(os.getenv("SCHEDULER_BATCH_MAX_WAIT_SECONDS", "30"))
+}
+
+# Images from /process render on the standard class's pool
+image_executor = scheduler.bulkhead(STANDARD)
+
+# Single-flight groups: identical concurrent calls share one model request
+text_flight = SingleFlight("gemini_text")
+image_flight = SingleFlight("gemini_image")
+tts_flight = SingleFlight("cloud_tts")
+
+# Text responses keyed by model + normalized prompt + system instruction
+TEXT_MODEL = "gemini-2.5-flash"
+TEXT_CACHE_MAX_ENTRIES = int(os.getenv("TEXT_CACHE_MAX_ENTRIES", "512"))
+TEXT_CACHE_TTL_SECONDS = int(os.getenv("TEXT_CACHE_TTL_SECONDS", str(6 * 3600)))
+text_cache = TextResponseCache(max_entries=TEXT_CACHE_MAX_ENTRIES, ttl_seconds=TEXT_CACHE_TTL_SECONDS)
+
+# JSON prompts are constrained with a response schema; disable to compare against free-form output
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "true").lower() == "true"
+structured_output_stats = StructuredOutputStats(mode="structured" if STRUCTURED_OUTPUT_ENABLED else "freeform")
+
+def structured_config(kind):
+    """GenerateContentConfig kwargs for a structured-output kind (empty when disabled)"""
+    return response_config(kind, STRUCTURED_OUTPUT_ENABLED)
+
+# Provider-side cached contents for SYSTEM_INSTRUCTION and other large repeated prefixes
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "64"))
+prompt_cache = PromptPrefixCache(
+    GenAICachedContentBackend(client, types) if PROMPT_CACHE_ENABLED else None,
+    ttl_seconds=PROMPT_CACHE_TTL_SECONDS,
+    max_entries=PROMPT_CACHE_MAX_ENTRIES
+)
+
+# Character chat / dialogue sessions: static context kept server-side, turns referenced by session_id
+CONVERSATION_SESSION_TTL_SECONDS = int(os.getenv("CONVERSATION_SESSION_TTL_SECONDS", "1800"))  # Idle timeout
+CONVERSATION_SESSION_MAX = int(os.getenv("CONVERSATION_SESSION_MAX", "1000"))
+CONVERSATION_SESSION_MAX_TURNS = int(os.getenv("CONVERSATION_SESSION_MAX_TURNS", "20"))
+conversation_sessions = ConversationSessionStore(
+    ttl_seconds=CONVERSATION_SESSION_TTL_SECONDS,
+    max_sessions=CONVERSATION_SESSION_MAX,
+    max_turns=CONVERSATION_SESSION_MAX_TURNS
+)
+CHARACTER_CHAT_MODEL = "gemini-2.5-flash-preview-04-17"
+
+# Conversation history beyond the most recent messages is folded into a rolling summary
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+
+# Comic panels render on the batch class's pool, so a long comic never starves image_executor
+PANEL_MEMORY_ESTIMATE_MB = int(os.getenv("PANEL_MEMORY_ESTIMATE_MB", "150"))  # Peak cost of one in-flight panel
+panel_executor = scheduler.bulkhead(BATCH)
+
+COMIC_PANELS_MODEL = "gemini-2.5-flash"
+# Stream the panel script and start rendering each panel as soon as it is complete
+COMIC_PIPELINE_ENABLED = os.getenv("COMIC_PIPELINE_ENABLED", "true").lower() == "true"
+
+# Inputs longer than this are split into parts and processed map-reduce style instead of truncated
+LONG_DOCUMENT_CHUNK_CHARS = int(os.getenv("LONG_DOCUMENT_CHUNK_CHARS", "8000"))
+LONG_DOCUMENT_MAX_WORKERS = int(os.getenv("LONG_DOCUMENT_MAX_WORKERS", "4"))  # Parts generated concurrently per request
+
+# Every model call goes through llm_gateway: per-call timeout, request deadline, hedging past p95, jittered retries
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", "120"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "32"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))  # Max fraction of calls that may be duplicated
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "900"))
+llm_gateway = LLMGateway(
+    max_workers=LLM_MAX_CONCURRENT_CALLS,
+    call_timeout=LLM_CALL_TIMEOUT_SECONDS,
+    max_attempts=LLM_MAX_ATTEMPTS,
+    hedge_enabled=LLM_HEDGE_ENABLED,
+    hedge_budget=LLM_HEDGE_BUDGET
+)
+
+# Long-running endpoints can run as background jobs (202 Accepted + /jobs/<id>) on a bounded pool
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "100"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+job_manager = JobManager(max_workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, result_ttl_seconds=JOB_RESULT_TTL_SECONDS)
+
+# Admission control: expensive requests are costed up front and start only while the instance has capacity
+ADMISSION_CAPACITY = float(os.getenv("ADMISSION_CAPACITY", "100"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "20"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+ADMISSION_UNITS_PER_IMAGE = float(os.getenv("ADMISSION_UNITS_PER_IMAGE", "4"))
+admission_cost_model = CostModel(units_per_image=ADMISSION_UNITS_PER_IMAGE)
+admission_controller = AdmissionController(
+    capacity=ADMISSION_CAPACITY,
+    max_queued=ADMISSION_MAX_QUEUED,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS
+)
+
+# Images a request will produce, before the model has planned them (comics scale with input length). A Detailed
+# Explanation /process asks for a summary illustration plus at least three [Image:] placeholders per part
+ADMISSION_EXPECTED_IMAGES = {"story": 5, "lecture": 6, "image": 1, "process": 4}
+COMIC_CHARS_PER_PANEL = 400
+
+def llm_generate(label, stream=False, timeout=None, hedge=True, max_attempts=None, **request):
+    """client.models.generate_content(**request) (or _stream) through llm_gateway.
+
+    Hedging is for cheap, idempotent text calls; image calls pass hedge=False so a slow one never pays for a second.
+    """
+    if stream:
+        return llm_gateway.stream(label, client.models.generate_content_stream, max_attempts=max_attempts, **request)
+    return llm_gateway.call(label, client.models.generate_content, timeout=timeout, hedge=hedge,
+                            max_attempts=max_attempts, **request)
 
 # Logging
 logging.basicConfig(level=logging.DEBUG)
@@ -240,68 +403,289 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app, resources={r"/process": {"origins": ["http://localhost:3000","*"]}})
 
-# Add progress tracking for each request
-request_progress = {}  # Store progress for each request
-request_start_times = {}  # Store start times for each request
-request_data = {}  # Store request data for persistence
-request_user_tokens = {}  # Store user FCM tokens for notifications
+def request_deadline_seconds(header_value=None):
+    """REQUEST_DEADLINE_SECONDS, or less when the client asks for it with X-Request-Deadline."""
+    seconds = REQUEST_DEADLINE_SECONDS
+    try:
+        requested = float(header_value or 0)
+        if 0 < requested < seconds:
+            seconds = requested
+    except ValueError:
+        pass
+    return seconds
+
+@app.before_request
+def start_request_deadline():
+    """Bound all model calls made for this request."""
+    g.deadline_token = set_deadline(request_deadline_seconds(request.headers.get("X-Request-Deadline")))
+
+@app.teardown_request
+def end_request_deadline(exc=None):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        try:
+            reset_deadline(token)
+        except ValueError:
+            pass  # torn down from a different context (streamed response)
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+# A job id is all it takes to read the job's result, so client-supplied job ids must be hard to guess
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{32,128}$")
+JOB_FORWARDED_HEADERS = ("accept", "cache-control", "x-request-id")
+
+def resolve_request_id(data=None, pattern=REQUEST_ID_PATTERN):
+    """Client-supplied request id ("request_id" field or X-Request-ID header) when well-formed, else a new one."""
+    candidate = (data or {}).get('request_id') or request.headers.get('X-Request-ID')
+    if isinstance(candidate, str) and pattern.match(candidate):
+        return candidate
+    return str(uuid4())
+
+def wants_async_job(data):
+    return data.get('async') is True or "respond-async" in request.headers.get("Prefer", "").lower()
+
+def job_links(job_id):
+    return {"status_url": f"/jobs/{job_id}", "result_url": f"/jobs/{job_id}/result", "progress_url": f"/progress/{job_id}"}
+
+def async_job(kind):
+    """Let a long-running POST endpoint run on job_manager: "async": true or Prefer: respond-async returns 202.
+
+    The view itself is unchanged; the job replays it under a copy of the
+    request with the job id as its request_id, so /progress works while it runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict) or not wants_async_job(data):
+                return view(*args, **kwargs)
+
+            job_id = resolve_request_id(data, JOB_ID_PATTERN)
+            job_data = {key: value for key, value in data.items() if key != 'async'}
+            job_data['request_id'] = job_id
+            # A resubmission only gets the existing job back when it is the same request from the same caller
+            fingerprint = canonical_key(kind, job_data, request.headers.get('Authorization'))
+            headers = {name: value for name, value in request.headers.items() if name.lower() in JOB_FORWARDED_HEADERS}
+            path = request.path
+
+            def run():
+                with app.test_request_context(path, method='POST', json=job_data, headers=headers):
+                    g.background_job = True
+                    with deadline_scope(REQUEST_DEADLINE_SECONDS):
+                        response = app.make_response(view(*args, **kwargs))
+                return response.get_json(silent=True), response.status_code
+
+            try:
+                job, created = job_manager.submit(kind, run, job_id, fingerprint)
+            except JobConflict as e:
+                logger.warning(f"Rejecting {kind} job {job_id}: {e}")
+                return jsonify({"error": "This request_id is already used by a different request.",
+                                "request_id": job_id}), 409
+            except JobQueueFull as e:
+                logger.warning(f"Rejecting {kind} job {job_id}: {e}")
+                response = jsonify({"error": "Too many jobs are queued. Please try again shortly.", "request_id": job_id})
+                response.status_code = 503
+                response.headers["Retry-After"] = "30"
+                return response
+            if not created:
+                logger.info(f"{kind} job {job_id} already submitted; returning its status")
+            response = jsonify({**job.to_dict(), "request_id": job_id, **job_links(job_id)})
+            response.status_code = 202
+            response.headers["Location"] = f"/jobs/{job_id}"
+            return response
+        return wrapper
+    return decorator
+
+def estimate_request_cost(kind, data):
+    """Admission cost of a request from what is known before it starts: input, expected images, TTS text."""
+    text = data.get('input_text') or data.get('text') or data.get('prompt') or ''
+    chars = len(text) if isinstance(text, str) else 0
+    images = ADMISSION_EXPECTED_IMAGES.get(kind, 0)
+    tts_chars = 0
+    if kind == "comic":
+        images = min(COMIC_PANELS_SCHEMA.get("maxItems", 20), max(COMIC_PANELS_SCHEMA.get("minItems", 3),
+                                                                   chars // COMIC_CHARS_PER_PANEL))
+    elif kind == "process":
+        if data.get('dialogue_mode') or data.get('explain_again_mode') or data.get('output_format'):
+            images = 0  # dialogue, explain-again, flashcards and slideshows are text only
+        else:
+            # Long documents are generated part by part; only the first part's summary image is kept
+            parts = max(1, -(-chars // LONG_DOCUMENT_CHUNK_CHARS))
+            images = 1 + (images - 1) * parts
+    elif kind == "lecture":
+        # The narrated script is about as long as the (condensed) input
+        tts_chars = min(chars, LONG_DOCUMENT_CHUNK_CHARS)
+    elif kind == "tts":
+        tts_chars = min(chars, TTS_MAX_TEXT_CHARS)
+    return admission_cost_model.estimate(input_chars=chars, images=images, tts_chars=tts_chars)
+
+def busy_response(retry_after):
+    response = jsonify({"error": "The server is busy. Please retry shortly.", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
 
-def update_request_progress(request_id, step, step_number, total_steps, details=""):
-    """Update progress for a specific request"""
-    if request_id in request_progress:
-        request_progress[request_id].update({
+def run_holding(release, view, *args, **kwargs):
+    """Call the view, then release; a streamed response releases only once the stream is closed."""
+    try:
+        response = app.make_response(view(*args, **kwargs))
+    except Exception:
+        release()
+        raise
+    if response.is_streamed:
+        response.call_on_close(release)
+    else:
+        release()
+    return response
+
+def admitted(kind):
+    """Start the view only once admission_controller has room for its estimated cost; 429 + Retry-After otherwise.
+
+    Background jobs wait for capacity instead of being rejected, and a
+    streamed response keeps its admission until the stream is closed.
+    Interactive requests skip admission: their own bulkhead bounds them, and
+    queued batch cost must not delay a chat reply.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.get("priority_class") == INTERACTIVE:
+                return view(*args, **kwargs)
+            data = request.get_json(silent=True)
+            cost = estimate_request_cost(kind, data if isinstance(data, dict) else {})
+            timeout = None if g.get("background_job") else ADMISSION_MAX_WAIT_SECONDS
+            try:
+                admission = admission_controller.acquire(kind, cost, timeout=timeout)
+            except AdmissionRejected as e:
+                return busy_response(e.retry_after)
+            return run_holding(admission.release, view, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def process_priority(data):
+    """Dialogue and explain-again turns are someone waiting mid-conversation; other /process calls are standard."""
+    return INTERACTIVE if data.get('dialogue_mode') or data.get('explain_again_mode') else STANDARD
+
+def prioritized(priority):
+    """Run the view in a slot of its priority class's bulkhead; 429 + Retry-After when the class is full.
+
+    priority is a class name or a function of the request JSON. The class is
+    kept on g.priority_class for admitted(), and background jobs wait for a
+    slot instead of being rejected.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if callable(priority):
+                data = request.get_json(silent=True)
+                g.priority_class = priority(data if isinstance(data, dict) else {})
+            else:
+                g.priority_class = priority
+            timeout = None if g.get("background_job") else SCHEDULER_MAX_WAIT_SECONDS[g.priority_class]
+            try:
+                slot = scheduler.bulkhead(g.priority_class).acquire(timeout=timeout)
+            except BulkheadFull as e:
+                logger.warning(f"Rejecting {request.path}: {e}")
+                return busy_response(e.retry_after)
+            return run_holding(slot.release, view, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# Request progress lives in a shared store so /progress works from any worker or instance
+PROGRESS_STORE_BACKEND = os.getenv("PROGRESS_STORE", "memory")  # memory | sqlite | redis | firestore
+PROGRESS_STORE_URL = os.getenv("PROGRESS_STORE_URL")  # SQLite file path or redis:// URL
+PROGRESS_TTL_SECONDS = int(os.getenv("PROGRESS_TTL_SECONDS", "3600"))  # Refreshed on every update
+progress_store = create_progress_store(PROGRESS_STORE_BACKEND, ttl_seconds=PROGRESS_TTL_SECONDS,
+                                       url=PROGRESS_STORE_URL, firestore_db=db)
+# Private request state (user token, request data) has its own store: the request_context collection, table or
+# key prefix, never request_progress, which clients read
+request_context_store = create_progress_store(PROGRESS_STORE_BACKEND, ttl_seconds=PROGRESS_TTL_SECONDS,
+                                              url=PROGRESS_STORE_URL, firestore_db=db, collection='request_context')
+# Clients listen on request_progress/<request_id>; mirror there unless Firestore already is the store
+MIRROR_PROGRESS_TO_FIRESTORE = progress_store.name != "firestore"
+# The mirror and task statuses are written behind the request: merged per document, committed in debounced batches
+PROGRESS_PUBLISH_DEBOUNCE_SECONDS = float(os.getenv("PROGRESS_PUBLISH_DEBOUNCE_SECONDS", "1.0"))
+progress_publisher = (ProgressPublisher(firestore_batch_commit(db), debounce_seconds=PROGRESS_PUBLISH_DEBOUNCE_SECONDS)
+                      if db else None)
+TERMINAL_TASK_STATUSES = ('completed', 'failed')
+# Push notifications are queued and sent in batches from a background thread; rejected tokens are skipped afterwards
+notification_dispatcher = NotificationDispatcher(
+    FCMTransport(messaging),
+    linger_seconds=float(os.getenv("NOTIFICATION_LINGER_SECONDS", "0.5")),
+    max_attempts=int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "4")),
+    retry_base_delay=float(os.getenv("NOTIFICATION_RETRY_BASE_DELAY_SECONDS", "1.0")),
+    max_queued=int(os.getenv("NOTIFICATION_MAX_QUEUED", "10000")),
+)
+
+def start_request_progress(request_id, step="Starting...", total_steps=10, user_token=None, request_context=None):
+    """Create the progress record and private context for a request"""
+    now = datetime.now().isoformat()
+    context = {'started_at': now}
+    if user_token:
+        context['user_token'] = user_token  # For notifications
+    if request_context:
+        context['request'] = request_context  # Request data for persistence
+    try:
+        progress_store.put(request_id, {
             'step': step,
-            'step_number': step_number,
+            'step_number': 0,
             'total_steps': total_steps,
-            'details': details,
-            'last_updated': datetime.now().isoformat(),
-            'progress_percentage': min((step_number / total_steps) * 100, 100)
+            'details': '',
+            'last_updated': now,
+            'progress_percentage': 0
         })
+        request_context_store.put(request_id, context)
+    except Exception as e:
+        logger.error(f"Failed to start progress tracking for {request_id}: {e}")
+
+def update_request_progress(request_id, step, step_number, total_steps, details="", step_fraction=0.0):
+    """Update progress for a specific request
+
+    step_number stays an integer (the app decodes it as Int); step_fraction
+    (0..1) moves progress_percentage through a long step such as panel rendering.
+    """
+    fields = {
+        'step': step,
+        'step_number': step_number,
+        'total_steps': total_steps,
+        'details': details,
+        'last_updated': datetime.now().isoformat(),
+        'progress_percentage': round(min(((step_number + step_fraction) / total_steps) * 100, 100), 1),
+        'status': 'processing'
+    }
+    try:
+        updated = progress_store.update(request_id, fields)
+    except Exception as e:
+        logger.error(f"Failed to update progress for {request_id}: {e}")
+        return
+    if updated:
         print(f"[Progress] Request {request_id}: {step_number}/{total_steps} - {step} - {details}")
         
         # Update Firebase if available
-        if db:
-            try:
-                db.collection('request_progress').document(request_id).set({
-                    'step': step,
-                    'step_number': step_number,
-                    'total_steps': total_steps,
-                    'details': details,
-                    'last_updated': datetime.now().isoformat(),
-                    'progress_percentage': min((step_number / total_steps) * 100, 100),
-                    'status': 'processing'
-                }, merge=True)
-            except Exception as e:
-                logger.error(f"Failed to update Firebase progress: {e}")
-        else:
+        if db and MIRROR_PROGRESS_TO_FIRESTORE:
+            progress_publisher.merge('request_progress', request_id, fields)
+        elif not db:
             logger.debug(f"Firebase disabled - skipping progress update for {request_id}")
 
 def get_request_progress(request_id):
     """Get current progress for a request"""
-    return request_progress.get(request_id, {})
+    return progress_store.get(request_id) or {}
 
 def cleanup_request_progress(request_id):
     """Clean up progress data for a completed request"""
-    if request_id in request_progress:
-        del request_progress[request_id]
-    if request_id in request_start_times:
-        del request_start_times[request_id]
-    if request_id in request_data:
-        del request_data[request_id]
-    if request_id in request_user_tokens:
-        del request_user_tokens[request_id]
+    try:
+        progress_store.delete(request_id)
+        request_context_store.delete(request_id)
+    except Exception as e:
+        logger.error(f"Failed to cleanup progress for {request_id}: {e}")
     
     # Clean up from Firebase
-    if db:
-        try:
-            db.collection('request_progress').document(request_id).delete()
-        except Exception as e:
-            logger.error(f"Failed to cleanup Firebase progress: {e}")
-    else:
+    if db and MIRROR_PROGRESS_TO_FIRESTORE:
+        progress_publisher.delete('request_progress', request_id)
+    elif not db:
         logger.debug(f"Firebase disabled - skipping cleanup for {request_id}")
 
 def send_push_notification(user_token, title, body, data=None):
-    """Send push notification to user"""
+    """Queue a push notification to user; False when it will not be sent"""
     if not user_token:
         logger.warning("No user token provided for push notification")
         return False
@@ -310,25 +694,13 @@ def send_push_notification(user_token, title, body, data=None):
         logger.warning("Firebase not initialized - push notifications disabled")
         return False
     
-    try:
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body
-            ),
-            data=data or {},
-            token=user_token
-        )
-        
-        response = messaging.send(message)
-        logger.info(f"✅ Push notification sent successfully: {response}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Failed to send push notification: {e}")
+    if not notification_dispatcher.send(user_token, title, body, data):
+        logger.warning(f"Push notification '{title}' not queued (token rejected earlier or queue full)")
         return False
+    return True
 
 def update_firebase_task_status(request_id, status, result_data=None, error_message=None):
-    """Update task status in Firebase for background completion tracking"""
+    """Queue a task status update in Firebase for background completion tracking; terminal statuses skip the debounce"""
     if not db:
         logger.warning("Firestore not available for status update")
         return False
@@ -337,7 +709,7 @@ def update_firebase_task_status(request_id, status, result_data=None, error_mess
         update_data = {
             'status': status,
             'last_updated': datetime.now().isoformat(),
-            'completed_at': datetime.now().isoformat() if status in ['completed', 'failed'] else None
+            'completed_at': datetime.now().isoformat() if status in TERMINAL_TASK_STATUSES else None
         }
         
         if result_data:
@@ -346,8 +718,8 @@ def update_firebase_task_status(request_id, status, result_data=None, error_mess
         if error_message:
             update_data['error_message'] = error_message
         
-        db.collection('background_tasks').document(request_id).set(update_data, merge=True)
-        logger.info(f"✅ Firebase task status updated: {request_id} - {status}")
+        progress_publisher.merge('background_tasks', request_id, update_data, terminal=status in TERMINAL_TASK_STATUSES)
+        logger.info(f"✅ Firebase task status queued: {request_id} - {status}")
         return True
     except Exception as e:
         logger.error(f"❌ Failed to update Firebase task status: {e}")
@@ -389,6 +761,38 @@ def memory_status():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+@app.route('/diagnostics', methods=['GET'])
+def diagnostics():
+    """Cache and generation diagnostics for monitoring"""
+    try:
+        return jsonify({
+            "image_cache": image_service.cache_stats(),
+            "single_flight": single_flight_stats(),
+            "image_models": image_model_registry.snapshot(),
+            "image_derivatives": image_derivatives.stats(),
+            "text_cache": text_cache.stats(),
+            "structured_output": structured_output_stats.stats(),
+            "prompt_cache": prompt_cache.stats(),
+            "conversation_sessions": conversation_sessions.stats(),
+            "history_compaction": history_compactor.stats(),
+            "llm_gateway": llm_gateway.stats(),
+            "jobs": job_manager.stats(),
+            "admission": admission_controller.stats(),
+            "scheduler": scheduler.stats(),
+            "progress_store": progress_store.stats(),
+            "progress_publisher": progress_publisher.stats() if progress_publisher else None,
+            "notifications": notification_dispatcher.stats(),
+            "image_workers": image_workers.stats(),
+            "memory_budget": memory_budget.stats(),
+            "timestamp": datetime.now().isoformat()
+        }), 200
+    except Exception as e:
+        logger.error(f"Diagnostics check failed: {e}")
+        return jsonify({
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
 # Testing
 @app.route('/')
 def home():
@@ -701,6 +1105,14 @@ Text:
 """
 
 # Story Generation Instruction
+LONG_DOCUMENT_NOTES_PROMPT_TEMPLATE = """You are condensing part {part} of {total} of a long document so it can be taught as a whole.
+Rewrite this part as dense study notes in plain prose: keep every key concept, definition, example, name, number and the order in which ideas are introduced.
+Drop repetition, filler and formatting. Do not add an introduction or conclusion, and do not refer to "this part".
+
+Part {part} of {total}:
+{text}
+"""
+
 STORY_GENERATION_INSTRUCTION = """You are an expert storyteller creating engaging educational content. Your task is to transform the given text into a story that:
 1. Maintains all key educational information from the original text
 2. Presents it in an engaging narrative format
@@ -730,6 +1142,49 @@ Remember to:
 # Initialize GenAI models after SYSTEM_INSTRUCTION is defined
 
 
+@coalesce(tts_flight, lambda text, voice_name: canonical_key("tts", text, voice_name))
+def synthesize_speech(text: str, voice_name: str) -> bytes:
+    """Synthesize MP3 audio bytes; identical concurrent requests share one TTS call."""
+    # Initialize TTS client if needed
+    if not initialize_tts():
+        raise RuntimeError("TTS client not available")
+
+    # Create the text input
+    synthesis_input = texttospeech.SynthesisInput(text=text)
+
+<<<<<<< HEAD
+    # Build the voice request with Chirp3 HD voice
+    # Chirp3 HD voices are high-quality, natural-sounding voices
+=======
+    # Build the voice request
+>>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
+    voice = texttospeech.VoiceSelectionParams(
+        language_code="en-US",
+        name=voice_name
+    )
+
+<<<<<<< HEAD
+    # Select the type of audio file you want returned
+    # Optimized settings for storytelling/narration:
+=======
+    # Select the type of audio file to return
+>>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding.MP3,
+        speaking_rate=1.0,  # Normal speed (good for stories)
+        pitch=0.0,  # Normal pitch
+        volume_gain_db=0.0  # Normal volume
+    )
+
+    # Perform the text-to-speech request
+    response = tts_client.synthesize_speech(
+        input=synthesis_input,
+        voice=voice,
+        audio_config=audio_config
+    )
+
+    return response.audio_content
+
 def text_to_speech(text: str, filename: str, voice_name: str = "en-US-Chirp3-HD-Aoede") -> bool:
 <<<<<<< HEAD
     """
@@ -751,48 +1206,11 @@ def text_to_speech(text: str, filename: str, voice_name: str = "en-US-Chirp3-HD-
     """Convert text to speech and save as MP3 file."""
 >>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
     try:
-        # Initialize TTS client if needed
-        if not initialize_tts():
-            logger.error("❌ TTS client not available")
-            return False
-            
-        # Create the text input
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-
-<<<<<<< HEAD
-        # Build the voice request with Chirp3 HD voice
-        # Chirp3 HD voices are high-quality, natural-sounding voices
-=======
-        # Build the voice request
->>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="en-US",
-            name=voice_name
-        )
-
-<<<<<<< HEAD
-        # Select the type of audio file you want returned
-        # Optimized settings for storytelling/narration:
-=======
-        # Select the type of audio file to return
->>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=1.0,  # Normal speed (good for stories)
-            pitch=0.0,  # Normal pitch
-            volume_gain_db=0.0  # Normal volume
-        )
-
-        # Perform the text-to-speech request
-        response = tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
+        audio_content = synthesize_speech(text, voice_name)
 
         # Write the response to an audio file
         with open(filename, "wb") as out:
-            out.write(response.audio_content)
+            out.write(audio_content)
 
         logger.info(f"🔊 Audio content written to file: {filename} (voice: {voice_name})")
         return True
@@ -801,19 +1219,20 @@ def text_to_speech(text: str, filename: str, voice_name: str = "en-US-Chirp3-HD-
         logger.error(f"❌ Error generating TTS for {filename}: {str(e)}")
         return False
 
-def generate_lecture_script(text: str) -> str:
+# Chirp3 HD voices for /generate_tts: Aoede is a warm narrator, Autonoe voices characters
+TTS_VOICES = {"narrator": "en-US-Chirp3-HD-Aoede", "character": "en-US-Chirp3-HD-Autonoe"}
+TTS_MAX_TEXT_CHARS = 50000
+
+def tts_voice_name(voice):
+    return TTS_VOICES.get(voice, TTS_VOICES["narrator"])
+
+def generate_lecture_script(text: str, use_cache: bool = True) -> str:
     """Generate a lecture script from input text."""
-    prompt = LECTURE_GENERATION_PROMPT_TEMPLATE.format(text=text[:8000])
+    prompt = LECTURE_GENERATION_PROMPT_TEMPLATE.format(text=condense_long_document(text, use_cache=use_cache))
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_INSTRUCTION
-            )
-        )
-        return response.text
+        return generate_dyslexic_text(prompt, use_cache=use_cache, cache_if=is_complete_json_response,
+                                      structured_output="lecture")
     except Exception as e:
         logger.error(f"Error generating lecture script: {e}")
         return None
@@ -839,25 +1258,23 @@ def clean_lecture_json_string(json_str: str) -> str:
 
     return json_str
 
-def generate_lecture_audio_and_images(lecture_json_text: str, level: str = "moderate", image_style: str = None):
-    """Generate audio files and images for a lecture."""
+def repair_lecture_json(lecture_json_text: str) -> dict:
+    """Legacy repair path for lecture output that does not match LECTURE_SCHEMA."""
     cleaned_text = clean_lecture_json_string(lecture_json_text)
 
     try:
-        lecture_data = json.loads(cleaned_text)
+        return json.loads(cleaned_text)
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse JSON output: {str(e)}")
         logger.info("Attempting alternative parsing...")
 
         # Alternative approach: try to fix common JSON issues
         try:
-            # Remove problematic characters that might break JSON
-            import re
-
             # Method 1: Simple whitespace normalization
             normalized_text = re.sub(r'\s+', ' ', cleaned_text)
             lecture_data = json.loads(normalized_text)
             logger.info("Successfully parsed with whitespace normalization!")
+            return lecture_data
 
         except json.JSONDecodeError:
             try:
@@ -868,11 +1285,21 @@ def generate_lecture_audio_and_images(lecture_json_text: str, level: str = "mode
                 quote_fixed = re.sub(r'\s*,\s*', ', ', quote_fixed)
                 lecture_data = json.loads(quote_fixed)
                 logger.info("Successfully parsed with quote fixing!")
+                return lecture_data
 
             except json.JSONDecodeError:
                 logger.error("All parsing attempts failed. Raw output:")
                 logger.error(cleaned_text[:500] + "..." if len(cleaned_text) > 500 else cleaned_text)
-                return None
+                raise
+
+def generate_lecture_audio_and_images(lecture_json_text: str, level: str = "moderate", image_style: str = None):
+    """Generate audio files and images for a lecture."""
+    try:
+        lecture_data = parse_with_repair("lecture", lecture_json_text, repair=repair_lecture_json,
+                                         stats=structured_output_stats)
+    except SchemaValidationError as e:
+        logger.error(f"Lecture script is unusable: {e}")
+        return None
 
     # Generate unique filenames for audio files
     lecture_id = str(uuid4())
@@ -1051,13 +1478,42 @@ consistency_manager = ConsistencyManager()
 # Image Generation Service - Handles caching, async generation, and optimization
 # ============================================================================
 
+# Image cache configuration: L1 is in-process, L2 is shared and survives restarts
+IMAGE_CACHE_BACKEND = os.getenv("IMAGE_CACHE_BACKEND", "gcs")  # gcs | local | memory
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/liroo_image_cache")
+IMAGE_CACHE_L1_SIZE = int(os.getenv("IMAGE_CACHE_L1_SIZE", "512"))
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SIGNED_URL_EXPIRATION_MINUTES = 60
+
+# Thumbnail/medium/full derivatives in WebP, JPEG and PNG, served as a srcset
+IMAGE_DERIVATIVES_ENABLED = os.getenv("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+IMAGE_DERIVATIVE_FORMATS = [f.strip() for f in os.getenv("IMAGE_DERIVATIVE_FORMATS", "webp,jpeg,png").split(",") if f.strip()]
+IMAGE_DERIVATIVE_REGISTRY_SIZE = int(os.getenv("IMAGE_DERIVATIVE_REGISTRY_SIZE", "2048"))
+# Rendered off the request path; images beyond MAX_PENDING waiting renders get no srcset
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2"))
+IMAGE_DERIVATIVE_UPLOAD_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_UPLOAD_WORKERS", "4"))
+IMAGE_DERIVATIVE_MAX_PENDING = int(os.getenv("IMAGE_DERIVATIVE_MAX_PENDING", "32"))
+# Responses wait up to this long (in total) for their images' pending derivatives, so fresh images get a srcset
+IMAGE_DERIVATIVE_WAIT_SECONDS = float(os.getenv("IMAGE_DERIVATIVE_WAIT_SECONDS", "5"))
+
+def create_image_cache_backend():
+    """Build the L2 image cache backend selected by IMAGE_CACHE_BACKEND"""
+    if IMAGE_CACHE_BACKEND == "memory":
+        return MemoryCacheBackend()
+    if IMAGE_CACHE_BACKEND == "local":
+        return LocalDirectoryCacheBackend(IMAGE_CACHE_DIR)
+    return GCSCacheBackend(lambda: bucket if initialize_gcs() else None)
+
 class ImageGenerationService:
     """Service for managing image generation with caching and performance optimization."""
     
-    def __init__(self):
-        # Simple in-memory cache: {prompt_hash: (url, timestamp)}
-        self.image_cache: Dict[str, Tuple[str, float]] = {}
-        self.cache_ttl = 3600  # 1 hour cache TTL
+    def __init__(self, cache: Optional[TieredImageCache] = None):
+        # Records map a content key to the GCS blob path; URLs are signed on each hit
+        self.image_cache = cache or TieredImageCache(
+            create_image_cache_backend(),
+            l1_max_entries=IMAGE_CACHE_L1_SIZE,
+            ttl_seconds=IMAGE_CACHE_TTL_SECONDS
+        )
         
     def _get_cache_key(self, prompt: str, level: str, style_hint: Optional[str], 
                        aspect_ratio: Optional[str] = None) -> str:
@@ -1068,26 +1524,31 @@ class ImageGenerationService:
     
     def get_cached_image(self, prompt: str, level: str, style_hint: Optional[str],
                         aspect_ratio: Optional[str] = None) -> Optional[str]:
-        """Check if image exists in cache."""
+        """Check if image exists in cache and return a freshly signed URL for it."""
         cache_key = self._get_cache_key(prompt, level, style_hint, aspect_ratio)
-        if cache_key in self.image_cache:
-            url, timestamp = self.image_cache[cache_key]
-            # Check if cache entry is still valid
-            if time.time() - timestamp < self.cache_ttl:
-                logger.debug(f"Cache hit for prompt: {prompt[:50]}...")
-                return url
-            else:
-                # Expired, remove from cache
-                del self.image_cache[cache_key]
-        return None
+        # Records promoted from L2 may point at a blob deleted since (lifecycle rules); those are evicted
+        record = self.image_cache.get(cache_key, validate=lambda record: gcs_blob_exists(record["blob_path"]))
+        if not record:
+            return None
+        if record.get("derivatives"):
+            image_derivatives.register(record["blob_path"], record["derivatives"])
+        signed_url = sign_gcs_blob(record["blob_path"])
+        if signed_url:
+            logger.debug(f"Cache hit for prompt: {prompt[:50]}...")
+        return signed_url
     
     def cache_image(self, prompt: str, level: str, style_hint: Optional[str],
-                   url: str, aspect_ratio: Optional[str] = None):
-        """Cache generated image URL."""
+                   blob_path: str, aspect_ratio: Optional[str] = None,
+                   derivatives: Optional[List[Dict]] = None):
+        """Cache the GCS blob path of a generated image (and its derivative blob paths)."""
         cache_key = self._get_cache_key(prompt, level, style_hint, aspect_ratio)
-        self.image_cache[cache_key] = (url, time.time())
+        self.image_cache.put(cache_key, blob_path, derivatives=derivatives or [])
         logger.debug(f"Cached image for prompt: {prompt[:50]}...")
     
+    def cache_stats(self) -> Dict:
+        """Hit/miss/eviction counters for both cache tiers."""
+        return self.image_cache.stats()
+    
     async def generate_images_async(self, prompts: List[Tuple[str, str]], 
                                    level: str, style_hint: Optional[str] = None) -> List[Optional[str]]:
         """Generate multiple images asynchronously."""
@@ -1109,6 +1570,11 @@ class ImageGenerationService:
 # Global image generation service instance
 image_service = ImageGenerationService()
 
+# Source blob path -> derivative blob paths; URLs are signed when responses are built
+image_derivatives = DerivativeRegistry(max_entries=IMAGE_DERIVATIVE_REGISTRY_SIZE, workers=IMAGE_DERIVATIVE_WORKERS,
+                                       upload_workers=IMAGE_DERIVATIVE_UPLOAD_WORKERS,
+                                       max_pending=IMAGE_DERIVATIVE_MAX_PENDING)
+
 def generate_unique_image_filename(prompt, level=None, style_hint=None, prefix=None):
     base = f"{prompt}|{level or ''}|{style_hint or ''}"
     prompt_hash = hashlib.sha256(base.encode('utf-8')).hexdigest()[:10]
@@ -1120,40 +1586,7 @@ def create_placeholder_image(prompt, style_hint=None):
     output_filename = generate_unique_image_filename(prompt, style_hint=style_hint, prefix="placeholder")
     logger.debug(f"Creating placeholder for '{prompt}' as '{output_filename}'")
     try:
-        image = Image.new('RGB', (512, 512), color='lightblue')
-        draw = ImageDraw.Draw(image)
-        try:
-            font = ImageFont.truetype("Arial.ttf", 20)
-        except IOError:
-            logger.warning("Arial.ttf not found, using default PIL font.")
-            font = ImageFont.load_default()
-
-        max_chars_line = 40
-        wrapped_prompt = f"Placeholder:\n{prompt}"
-        lines = []
-        current_line = ""
-        for word in wrapped_prompt.split():
-            if len(current_line) + len(word) + 1 <= max_chars_line:
-                current_line += f" {word}" if current_line else word
-            else:
-                lines.append(current_line.strip())
-                current_line = word
-        lines.append(current_line.strip())
-        text = "\n".join(lines)
-
-        # Clean text to avoid Unicode encoding issues
-        text = text.encode('ascii', 'ignore').decode('ascii')
-
-        bbox = draw.textbbox((0, 0), text, font=font, align="center")
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        pos = ((512 - text_width) // 2, (512 - text_height) // 2)
-
-        draw.text(pos, text, fill='black', font=font, align="center")
-
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        buffer.seek(0)
+        buffer = BytesIO(image_workers.render_placeholder(prompt))
         
         # Upload to GCS using helper function
         signed_url = upload_buffer_to_gcs(buffer, f"images/{output_filename}", "image/png")
@@ -1169,7 +1602,21 @@ def create_placeholder_image(prompt, style_hint=None):
         logger.error(f"Error creating placeholder: {e}")
         return None
 
+def _image_flight_key(prompt, output_filename=None, retries=2, level=None, style_hint=None,
+                      aspect_ratio=None, consistency_prompt=None, story_id=None, character_name=None,
+                      use_cache=True, **_):
+    """Single-flight key for generate_and_save_image: the image content, plus use_cache.
+
+    output_filename is left out on purpose: every caller generates a unique
+    name, so concurrent callers for the same image share the leader's blob
+    and signed URL instead of each rendering their own. use_cache=False
+    callers asked for a fresh render and only coalesce with each other.
+    """
+    return canonical_key("image", prompt, level, style_hint, aspect_ratio, consistency_prompt, story_id, character_name,
+                         use_cache)
+
 <<<<<<< HEAD
+@coalesce(image_flight, _image_flight_key)
 def generate_and_save_image(prompt, output_filename=None, retries=2, level="Standard", 
                            style_hint=None, aspect_ratio=None, consistency_prompt=None,
                            story_id=None, character_name=None, use_cache=True):
@@ -1183,6 +1630,7 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="Stan
             logger.info(f"Using cached image for prompt: {prompt[:50]}...")
             return cached_url
 =======
+@coalesce(image_flight, _image_flight_key)
 def generate_and_save_image(prompt, output_filename=None, retries=2, level="moderate", style_hint=None):
     logger.debug(f"Generating image for '{prompt}' with style_hint: {style_hint}")
     
@@ -1307,12 +1755,8 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
     elif consistency_prompt is None:
         consistency_prompt = ""
     
-    # Model fallback chain
-    models_to_try = [
-        (PRIMARY_IMAGE_MODEL, "Gemini 3 Pro"),
-        (FALLBACK_IMAGE_MODEL, "Gemini 2.5 Flash"),
-        (LEGACY_IMAGE_MODEL, "Gemini 2.0 Flash (Legacy)")
-    ]
+    # Model fallback chain, fastest healthy model first, open circuits skipped
+    models_to_try = image_model_registry.route()
     
     start_time = time.time()
     last_error = None
@@ -1321,6 +1765,11 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
     for attempt in range(retries):
         try:
 <<<<<<< HEAD
+                if not image_model_registry.allow_request(model_name):
+                    logger.info(f"Skipping {model_label}: circuit is open")
+                    break
+                call_started = time.time()
+
                 enhanced_prompt, negative_prompts = build_enhanced_prompt(
                     prompt, style_hint, level, aspect_ratio, consistency_prompt
                 )
@@ -1347,7 +1796,7 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                         # This is a placeholder for aspect ratio support
                         logger.debug(f"Using aspect ratio: {aspect_ratio_map[aspect_ratio]}")
 
-            resp = client.models.generate_content(
+            resp = llm_generate(f"image:{model_name}", max_attempts=1, hedge=False,
                     model=model_name,
                 contents=[enhanced_prompt],
                     config=types.GenerateContentConfig(**config_params)
@@ -1385,21 +1834,11 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                 raise ValueError("Image data is not a valid PNG")
 
             logger.debug(f"Raw PNG data validated. First 8 bytes: {image_data_bytes[:8].hex()}")
+            # The model delivered; processing and upload failures below are ours, not its
+            image_model_registry.record_success(model_name, time.time() - call_started)
             try:
-                image = Image.open(BytesIO(image_data_bytes))
-                image.verify()
-                logger.debug("Pillow successfully opened and verified image data.")
-                image = Image.open(BytesIO(image_data_bytes))
-
-                # Optional: Add basic image enhancement
-                if image.mode in ('RGBA', 'LA'):
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[-1])
-                    image = background
-
-                buffer = BytesIO()
-                image.save(buffer, format="PNG", optimize=True)
-                buffer.seek(0)
+                # Opaque PNGs within limits are uploaded as-is; only resize/alpha cases are re-encoded
+                buffer = safe_image_processing(image_data_bytes, prompt)
 
                 blob = bucket.blob(f"images/{output_filename}")
                 blob.upload_from_file(buffer, content_type="image/png")
@@ -1413,9 +1852,14 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                 )
                 logger.debug(f"Generated signed URL: {signed_url[:80]}...")
                     
-                    # Cache the result
+                    # Cache the blob path; hits re-sign it so cached links never expire
+                    blob_path = f"images/{output_filename}"
                     if use_cache:
-                        image_service.cache_image(prompt, level, style_hint, signed_url, aspect_ratio)
+                        image_service.cache_image(prompt, level, style_hint, blob_path, aspect_ratio)
+                    # Derivatives render in the background; the cache record gains them when they are ready
+                    create_image_derivatives(buffer.getvalue(), blob_path, on_ready=(
+                        (lambda sources: image_service.cache_image(prompt, level, style_hint, blob_path, aspect_ratio,
+                                                                   derivatives=sources)) if use_cache else None))
                     
                     generation_time = time.time() - start_time
                     logger.info(f"Successfully generated image using {model_label} in {generation_time:.2f}s")
@@ -1438,16 +1882,10 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                     break
 
 =======
-            # Check memory before each attempt
-            current_memory = check_memory_and_cleanup()
-            if current_memory > MEMORY_LIMIT_MB:
-                logger.error(f"Memory usage too high ({current_memory:.1f} MB) for image generation. Skipping.")
-                raise MemoryError(f"Memory usage exceeds limit: {current_memory:.1f} MB")
-            
             enhanced_prompt = build_enhanced_prompt(prompt, style_hint, level)
             logger.debug(f"Calling GenAI image model with enhanced prompt: {enhanced_prompt}")
             
-            response = client.models.generate_content(
+            response = llm_generate("image", max_attempts=1, hedge=False,
                 model="gemini-2.0-flash-preview-image-generation",
                 contents=enhanced_prompt,
                 config=types.GenerateContentConfig(
@@ -1484,11 +1922,11 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                     if signed_url:
                         logger.info(f"Image uploaded to GCS: {output_filename}")
                         logger.debug(f"Generated signed URL: {signed_url[:80]}...")
+                        create_image_derivatives(buffer.getvalue(), f"images/{output_filename}")
                         
                         # Clean up buffer
                         buffer.close()
                         del buffer
-                        gc.collect()
                         
                         # Final memory check
                         final_memory = get_memory_usage()
@@ -1499,7 +1937,6 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                         logger.error(f"Failed to upload image to GCS: {output_filename}")
                         buffer.close()
                         del buffer
-                        gc.collect()
                         raise Exception("Failed to upload image to GCS")
                 
             if not found_image:
@@ -1507,9 +1944,8 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
                 raise ValueError("No image data part in response")
                 
         except MemoryError as e:
+            # Raised when the decode reservation timed out; the wait already happened there
             logger.error(f"Memory error on attempt {attempt+1}: {e}")
-            gc.collect()
-            time.sleep(2)  # Wait before retry
             if attempt == retries - 1:
                 logger.warning(f"All attempts failed due to memory issues for prompt '{prompt}'. Falling back to placeholder.")
                 return create_placeholder_image(prompt, style_hint=style_hint)
@@ -1517,6 +1953,11 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
 >>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
         except Exception as e:
                 logger.error(f"{model_label} API call failed (attempt {attempt+1}): {e}")
+                if isinstance(e, (DeadlineExceeded, CallTimeout)):
+                    # The request ran out of time or the call pool was full: not the model's fault
+                    image_model_registry.release_trial(model_name)
+                else:
+                    image_model_registry.record_failure(model_name, time.time() - call_started, e)
                 last_error = e
                 if attempt < retries - 1:
             continue
@@ -1535,28 +1976,95 @@ def generate_and_save_image(prompt, output_filename=None, retries=2, level="mode
     return create_placeholder_image(prompt, style_hint=style_hint)
 >>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
 
-def generate_dyslexic_text(level_adjusted_input_text, system_instruction_override=None):
+def generate_content_cached(model, system_instruction, contents, prefix_contents=None, label="text", stream=False,
+                            **config):
+    """generate_content(_stream) with system_instruction + prefix_contents served from a cached prefix when possible.
+
+    Without a usable cache the full prompt is sent. A cache handle the API
+    rejects (is_cache_rejection) is dropped and the request is repeated with
+    the full prompt; for a stream that happens if it fails before its first
+    chunk. Streaming callers record usage from the final chunk themselves.
+    """
+    cache_name = prompt_cache.get(model, system_instruction, prefix_contents, label=label)
+    full_contents = [*prefix_contents, contents] if prefix_contents else contents
+
+    def full_prompt():
+        return llm_generate(label, stream=stream, model=model, contents=full_contents,
+                            config=types.GenerateContentConfig(system_instruction=system_instruction, **config))
+
+    def cached_prompt():
+        return llm_generate(label, stream=stream, model=model, contents=contents,
+                            config=types.GenerateContentConfig(cached_content=cache_name, **config))
+
+    def rejected(e):
+        if not is_cache_rejection(e):
+            return False
+        logger.warning(f"Cached prefix {cache_name} rejected ({e}); sending full prompt")
+        prompt_cache.invalidate(cache_name)
+        return True
+
+    if stream:
+        return stream_with_cache_fallback(cached_prompt, full_prompt, rejected) if cache_name else full_prompt()
+
+    resp = None
+    if cache_name:
+        try:
+            resp = cached_prompt()
+        except Exception as e:
+            if not rejected(e):
+                raise
+    if resp is None:
+        resp = full_prompt()
+    prompt_cache.record_usage(getattr(resp, "usage_metadata", None), label)
+    return resp
+
+def stream_with_cache_fallback(cached_prompt, full_prompt, rejected):
+    """Chunks of cached_prompt(); when it is rejected before the first chunk, the chunks of full_prompt() instead"""
+    received = False
+    try:
+        for chunk in cached_prompt():
+            received = True
+            yield chunk
+        return
+    except Exception as e:
+        if received or not rejected(e):
+            raise
+    yield from full_prompt()
+
+@coalesce(text_flight, lambda level_adjusted_input_text, system_instruction_override=None, use_cache=True, cache_if=None,
+          structured_output=None, store=True:
+          canonical_key(TEXT_MODEL, level_adjusted_input_text, system_instruction_override, use_cache, structured_output))
+def generate_dyslexic_text(level_adjusted_input_text, system_instruction_override=None, use_cache=True, cache_if=None,
+                           structured_output=None, store=True):
+    """Generate text with Gemini, served from text_cache when an identical request was answered recently.
+
+    use_cache=False skips the lookup but still refreshes the entry; store=False
+    also leaves the cache alone, for replies that are never looked up again
+    (dialogue turns). cache_if can reject responses (e.g. truncated JSON) so
+    they are never cached.
+    structured_output names a schema in schemas.STRUCTURED_OUTPUTS to
+    constrain the response to JSON of that shape.
+    """
     # Use the model with system instruction set in constructor
     logger.debug(f"Generating text for input (first 100 chars): {level_adjusted_input_text[:100]}...")
     
+    output_config = structured_config(structured_output)
+    cache_key = text_cache_key(TEXT_MODEL, level_adjusted_input_text, system_instruction_override or SYSTEM_INSTRUCTION,
+                               structured_output=structured_output if output_config else None)
+    cached_text = text_cache.lookup(cache_key, bypass=not use_cache)
+    if cached_text is not None:
+        logger.info(f"Text cache hit. Content length: {len(cached_text)}")
+        return cached_text
+    
     try:
-        # If we need to override the system instruction, create a new model instance
-        if system_instruction_override:
-           
-            resp = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=level_adjusted_input_text,
-                 config=types.GenerateContentConfig(
-        system_instruction=system_instruction_override),
-                )
-        else:
-            # Use the default model with SYSTEM_INSTRUCTION
-            resp = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=level_adjusted_input_text,
-                 config=types.GenerateContentConfig(
-        system_instruction=SYSTEM_INSTRUCTION),
-                )
+        # The (multi-kilobyte) system instruction is sent as a cached prefix when possible
+        resp = generate_content_cached(
+            TEXT_MODEL,
+            system_instruction_override or SYSTEM_INSTRUCTION,
+            level_adjusted_input_text,
+            label=structured_output or "text",
+            **output_config
+        )
 
         # Keep the improved response validation logic
         if not resp.candidates or not hasattr(resp.candidates[0].content, 'parts') or not resp.candidates[0].content.parts:
@@ -1568,6 +2076,8 @@ def generate_dyslexic_text(level_adjusted_input_text, system_instruction_overrid
         # Extract text using .text shortcut if available and safe
         if hasattr(resp, 'text'):
             logger.info(f"Text generation successful. Content length: {len(resp.text)}")
+            if store and resp.text and finished_normally(resp) and (cache_if is None or cache_if(resp.text)):
+                text_cache.store(cache_key, resp.text)
             return resp.text
         else:
             # Fallback to checking parts manually (as in the 'levels' version)
@@ -1579,6 +2089,8 @@ def generate_dyslexic_text(level_adjusted_input_text, system_instruction_overrid
                      logger.error(f"Prompt Feedback: {resp.prompt_feedback}")
                  return None
             logger.info(f"Text generation successful (via parts). Content length: {len(text_part.text)}")
+            if store and text_part.text and finished_normally(resp) and (cache_if is None or cache_if(text_part.text)):
+                text_cache.store(cache_key, text_part.text)
             return text_part.text
 
     except Exception as e:
@@ -1586,21 +2098,126 @@ def generate_dyslexic_text(level_adjusted_input_text, system_instruction_overrid
         logger.exception("Exception details:")
         return None
 
+def stream_dyslexic_text(level_adjusted_input_text, system_instruction_override=None, use_cache=True):
+    """Yield text chunks from the streaming Gemini API as they arrive (one chunk on a text cache hit)"""
+    logger.debug(f"Streaming text for input (first 100 chars): {level_adjusted_input_text[:100]}...")
+    system_instruction = system_instruction_override or SYSTEM_INSTRUCTION
+    cache_key = text_cache_key(TEXT_MODEL, level_adjusted_input_text, system_instruction)
+    cached_text = text_cache.lookup(cache_key, bypass=not use_cache)
+    if cached_text is not None:
+        logger.info(f"Text cache hit for streamed request. Content length: {len(cached_text)}")
+        yield cached_text
+        return
+
+    stream = generate_content_cached(TEXT_MODEL, system_instruction, level_adjusted_input_text,
+                                     label="text_stream", stream=True)
+    parts = []
+    usage = None
+    last_chunk = None
+    for chunk in stream:
+        last_chunk = chunk
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        text = getattr(chunk, "text", None)
+        if text:
+            parts.append(text)
+            yield text
+    prompt_cache.record_usage(usage, "text_stream")
+    # Only a fully consumed stream is cached; a disconnected client leaves no partial entry, and
+    # a reply cut off at MAX_TOKENS or by a SAFETY stop (final chunk's finish_reason) is never replayed
+    if finished_normally(last_chunk):
+        text_cache.store(cache_key, "".join(parts))
+    else:
+        logger.warning("Streamed text did not finish normally; not caching it")
+
+def long_document_executor():
+    """The pool of the caller's priority class; long-document parts share its workers"""
+    return scheduler.bulkhead(g.get("priority_class", STANDARD) if has_request_context() else STANDARD)
+
+def condense_long_document(text, use_cache=True):
+    """Condense text longer than LONG_DOCUMENT_CHUNK_CHARS into notes covering the whole document.
+
+    Parts are summarized concurrently and joined in order, so single-prompt
+    formats (lecture, story, flashcards, slides) see all of the input instead
+    of its first few pages.
+    """
+    if not text or len(text) <= LONG_DOCUMENT_CHUNK_CHARS:
+        return text
+
+    def summarize_part(index, total, chunk):
+        prompt = LONG_DOCUMENT_NOTES_PROMPT_TEMPLATE.format(part=index + 1, total=total, text=chunk)
+        return generate_dyslexic_text(prompt, system_instruction_override="You write faithful, dense study notes.",
+                                      use_cache=use_cache)
+
+    condensed = condense(text, bind_context(summarize_part), max_chars=LONG_DOCUMENT_CHUNK_CHARS,
+                         max_workers=LONG_DOCUMENT_MAX_WORKERS, executor=long_document_executor())
+    logger.info(f"Condensed long document from {len(text)} to {len(condensed)} characters")
+    return condensed
+
+def generate_document_blocks(input_text, header, use_cache=True):
+    """Generate and parse content blocks for input_text, one part at a time when it is long.
+
+    Returns (text_content, parsed_items); text_content is None when nothing
+    could be generated. Parts run concurrently and their blocks are merged
+    into one list with a single summary image and a single quiz. A part that
+    fails twice is kept as its source text, so no section is silently lost.
+    """
+    chunks = split_semantic(input_text, LONG_DOCUMENT_CHUNK_CHARS) if len(input_text) > LONG_DOCUMENT_CHUNK_CHARS else [input_text]
+    if len(chunks) == 1:
+        text_content = generate_dyslexic_text(f"{header}\n\n{input_text}", use_cache=use_cache)
+        return text_content, (parse_blocks(text_content) if text_content else [])
+
+    logger.info(f"Long document ({len(input_text)} chars) split into {len(chunks)} parts")
+
+    def generate_part(index, chunk):
+        return generate_dyslexic_text(f"{header} [Part: {index + 1} of {len(chunks)}]\n\n{chunk}", use_cache=use_cache)
+
+    executor = long_document_executor()
+    part_texts = map_chunks(chunks, bind_context(generate_part), LONG_DOCUMENT_MAX_WORKERS, executor)
+    failed = [index for index, text in enumerate(part_texts) if not text]
+    if failed:
+        logger.warning(f"Retrying {len(failed)} of {len(chunks)} long document parts")
+        retried = map_chunks([chunks[index] for index in failed],
+                             bind_context(lambda n, chunk: generate_part(failed[n], chunk)),
+                             LONG_DOCUMENT_MAX_WORKERS, executor)
+        for index, text in zip(failed, retried):
+            part_texts[index] = text
+    if not any(part_texts):
+        return None, []
+
+    parts = []
+    for index, (chunk, text) in enumerate(zip(chunks, part_texts)):
+        if text:
+            parts.append(parse_blocks(text))
+        else:
+            logger.error(f"Long document part {index + 1}/{len(chunks)} failed twice; keeping its source text")
+            parts.append(source_blocks(chunk))
+    return "\n\n".join(text or chunk for text, chunk in zip(part_texts, chunks)), merge_block_items(parts)
+
+def is_story_generation_input(input_text):
+    """Story requests from the app embed a fixed instruction in the input text"""
+    return "[Level:" in input_text and "Please convert the following text into an engaging" in input_text
+
+def format_profile_context(profile_context):
+    """Render the learner profile for prompt templates"""
+    if not profile_context:
+        return "Not specified"
+    student_level_info = profile_context.get('studentLevel', 'Not specified')
+    topics_of_interest_info = profile_context.get('topicsOfInterest', 'Not specified')
+    if isinstance(topics_of_interest_info, list):
+        topics_of_interest_info = ", ".join(topics_of_interest_info)
+    return f"Student Level={student_level_info}, Interests={topics_of_interest_info}"
+
 def process_input_text(input_text, level="moderate", summarization_tier="Detailed Explanation", profile_context=None,
                        explain_again_mode=False, original_paragraph_text=None,
                        output_format=None,
                        dialogue_mode=False, selected_text_snippet=None, original_block_content=None, conversation_history=None, user_question=None,
-                       image_style=None, request_id=None, user_token=None):  # Add user_token parameter
+                       image_style=None, request_id=None, user_token=None, use_cache=True):  # Add user_token parameter
     # Generate request ID if not provided
     if not request_id:
         request_id = str(uuid4())
     
-    # Store user token for notifications
-    if user_token:
-        request_user_tokens[request_id] = user_token
-    
-    # Store request data for persistence
-    request_data[request_id] = {
+    # Progress record, plus user token and request data for notifications and persistence
+    start_request_progress(request_id, user_token=user_token, request_context={
         'input_text': input_text,
         'level': level,
         'summarization_tier': summarization_tier,
@@ -1614,20 +2231,8 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         'conversation_history': conversation_history,
         'user_question': user_question,
         'image_style': image_style,
-        'user_token': user_token,
         'created_at': datetime.now().isoformat()
-    }
-    
-    # Initialize progress tracking
-    request_progress[request_id] = {
-        'step': 'Starting...',
-        'step_number': 0,
-        'total_steps': 10,  # Will be updated based on content type
-        'details': '',
-        'last_updated': datetime.now().isoformat(),
-        'progress_percentage': 0
-    }
-    request_start_times[request_id] = datetime.now()
+    })  # total_steps is updated based on content type
     
     # Update Firebase with initial task status
     update_firebase_task_status(request_id, 'started')
@@ -1640,7 +2245,7 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
     main_character = None
 
     # Parse story generation parameters from input text
-    if "[Level:" in input_text and "Please convert the following text into an engaging" in input_text:
+    if is_story_generation_input(input_text):
         is_story_generation = True
         # Extract genre
         genre_match = re.search(r"into an engaging (\w+) story", input_text)
@@ -1687,13 +2292,7 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         logger.warning(f"Invalid summarization_tier '{summarization_tier}'. Defaulting to 'Detailed Explanation'.")
         summarization_tier = "Detailed Explanation"
 
-    profile_info_str_for_prompt = "Not specified"
-    if profile_context:
-        student_level_info = profile_context.get('studentLevel', 'Not specified')
-        topics_of_interest_info = profile_context.get('topicsOfInterest', 'Not specified')
-        if isinstance(topics_of_interest_info, list):
-            topics_of_interest_info = ", ".join(topics_of_interest_info)
-        profile_info_str_for_prompt = f"Student Level={student_level_info}, Interests={topics_of_interest_info}"
+    profile_info_str_for_prompt = format_profile_context(profile_context)
 
     if dialogue_mode:
         update_request_progress(request_id, "Processing dialogue", 1, 3, "Generating conversational response")
@@ -1704,12 +2303,12 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
             update_firebase_task_status(request_id, 'failed', error_message="Missing required information for dialogue mode")
             return {"error": "Missing required information for dialogue mode."}, 400
 
-        history_str = ""
-        if conversation_history:
-            for msg in conversation_history:
-                sender = "User" if msg.get("sender") == "user" else "AI"
-                history_str += f"{sender}: {msg.get('text')}\n"
-        else:
+        # Long sessions keep recent turns verbatim and fold older ones into a cached rolling summary
+        turns = normalize_history(conversation_history)
+        history_key = conversation_key("dialogue", selected_text_snippet, original_block_content,
+                                       turns[0]["text"] if turns else "")
+        history_str = history_compactor.compact(history_key, turns).as_text(user_label="User", model_label="AI")
+        if not history_str:
             history_str = "No previous conversation in this session."
 
         dialogue_prompt_filled = DIALOGUE_PROMPT_TEMPLATE.format(
@@ -1722,7 +2321,7 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         )
 
         update_request_progress(request_id, "Generating dialogue response", 2, 3, "Using AI model")
-        dialogue_response_text = generate_dyslexic_text(dialogue_prompt_filled, system_instruction_override="You are an AI Conversational Tutor for ReadBuddy. Respond to the user's latest question based on the provided context and conversation history.")
+        dialogue_response_text = generate_dyslexic_text(dialogue_prompt_filled, system_instruction_override=DIALOGUE_SYSTEM_INSTRUCTION, use_cache=False, store=False)
 
         if not dialogue_response_text or not dialogue_response_text.strip():
             logger.error("Failed to generate dialogue response or got empty response.")
@@ -1757,7 +2356,7 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         )
 
         update_request_progress(request_id, "Generating alternative explanation", 2, 2, "Using AI model")
-        re_explained_text_content = generate_dyslexic_text(prompt_for_re_explanation, system_instruction_override="You are an expert at rephrasing and clarifying text for better understanding. Follow the user's instructions precisely.")
+        re_explained_text_content = generate_dyslexic_text(prompt_for_re_explanation, system_instruction_override="You are an expert at rephrasing and clarifying text for better understanding. Follow the user's instructions precisely.", use_cache=use_cache)
 
         if not re_explained_text_content or not re_explained_text_content.strip():
             logger.error("Failed to generate re-explained content or got empty response.")
@@ -1786,10 +2385,10 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         flashcard_prompt = FLASHCARD_PROMPT_TEMPLATE.format(
             level=level,
             profile_context_str=profile_info_str_for_prompt,
-            input_text=input_text
+            input_text=condense_long_document(input_text, use_cache=use_cache)
         )
         update_request_progress(request_id, "Creating flashcard content", 2, 3, "Using AI model")
-        flashcard_json_string = generate_dyslexic_text(flashcard_prompt, system_instruction_override="Generate flashcards based on the input text and context. Output **only** the JSON array as specified.")
+        flashcard_json_string = generate_dyslexic_text(flashcard_prompt, system_instruction_override="Generate flashcards based on the input text and context. Output **only** the JSON array as specified.", use_cache=use_cache, cache_if=is_complete_json_response, structured_output="flashcards")
         if not flashcard_json_string or not flashcard_json_string.strip():
             logger.error("Failed to generate flashcard content or got empty response.")
             cleanup_request_progress(request_id)
@@ -1797,13 +2396,9 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
             return {"error": "Failed to generate flashcards."}, 500
         try:
             update_request_progress(request_id, "Processing flashcard data", 3, 3, "Validating JSON format")
-            cleaned_json = clean_json_string(flashcard_json_string)
-            flashcards_data = json.loads(cleaned_json)
-            if not isinstance(flashcards_data, list):
-                raise ValueError("Generated flashcards are not a JSON array.")
-            for item in flashcards_data:
-                if not isinstance(item, dict) or "front" not in item or "back" not in item:
-                    raise ValueError("Invalid flashcard item structure.")
+            flashcards_data = parse_with_repair("flashcards", flashcard_json_string,
+                                                repair=lambda text: json.loads(clean_json_string(text)),
+                                                stats=structured_output_stats)
             if not flashcards_data:
                 logger.warning("AI returned empty flashcard array. Adding fallback card.")
                 flashcards_data = [{"front": "No content", "back": "No flashcards could be generated for this topic."}]
@@ -1821,13 +2416,8 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
             update_firebase_task_status(request_id, 'completed', {'flashcards': flashcards_data})
             cleanup_request_progress(request_id)
             return {"flashcards": flashcards_data}, 200
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode generated flashcards JSON: {e}. String was: {cleaned_json[:500]}...")
-            cleanup_request_progress(request_id)
-            update_firebase_task_status(request_id, 'failed', error_message="Failed to parse generated flashcards format")
-            return {"error": "Failed to parse generated flashcards format."}, 500
         except ValueError as e:
-            logger.error(f"Generated flashcards validation error: {e}. String was: {cleaned_json[:500]}...")
+            logger.error(f"Generated flashcards validation error: {e}. String was: {flashcard_json_string[:500]}...")
             cleanup_request_progress(request_id)
             update_firebase_task_status(request_id, 'failed', error_message=f"Generated flashcards had unexpected structure: {e}")
             return {"error": f"Generated flashcards had unexpected structure: {e}"}, 500
@@ -1838,22 +2428,21 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
         slideshow_prompt = SLIDESHOW_PROMPT_TEMPLATE.format(
             level=level,
             profile_context_str=profile_info_str_for_prompt,
-            input_text=input_text
+            input_text=condense_long_document(input_text, use_cache=use_cache)
         )
         update_request_progress(request_id, "Creating slide content", 2, 3, "Using AI model")
-        slideshow_json_string = generate_dyslexic_text(slideshow_prompt, system_instruction_override="Generate a slideshow based on the input text and context. Output **only** the JSON array as specified.")
-        slideshow_data = process_json_response(slideshow_json_string, "array")
+        slideshow_json_string = generate_dyslexic_text(slideshow_prompt, system_instruction_override="Generate a slideshow based on the input text and context. Output **only** the JSON array as specified.", use_cache=use_cache, cache_if=is_complete_json_response, structured_output="slideshow")
+        try:
+            slideshow_data = parse_with_repair("slideshow", slideshow_json_string,
+                                               repair=lambda text: process_json_response(text, "array"),
+                                               stats=structured_output_stats)
+        except ValueError as e:
+            logger.error(f"Generated slideshow validation error: {e}")
+            slideshow_data = []
 
-        # Validate slideshow structure
         if not slideshow_data:
             logger.warning("AI returned empty slideshow array. Adding fallback slide.")
             slideshow_data = [{"content": ["No content provided."]}]
-        else:
-            for item in slideshow_data:
-                if not isinstance(item, dict) or "content" not in item or not isinstance(item["content"], list):
-                    raise ValueError("Invalid slide item structure (missing 'content' array)")
-                if "title" in item and not isinstance(item["title"], (str, type(None))):
-                    raise ValueError("Invalid slide item structure ('title' must be string or null)")
 
         update_request_progress(request_id, "Slideshow complete", 3, 3, f"Generated {len(slideshow_data)} slides")
         logger.info(f"Successfully generated and parsed {len(slideshow_data)} slides.")
@@ -1874,11 +2463,11 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
     # Default content generation with detailed progress tracking
     update_request_progress(request_id, "Preparing content generation", 1, 8, f"Level: {level}, Type: {summarization_tier}")
     logger.info("Default content block generation mode selected.")
-    level_adjusted_input = f"[Level: {level}] [Summary Tier: {summarization_tier}] [Profile: {profile_info_str_for_prompt}]\n\n{input_text}"
-    logger.debug(f"Constructed level_adjusted_input for full generation: {level_adjusted_input[:200]}...")
+    level_header = f"[Level: {level}] [Summary Tier: {summarization_tier}] [Profile: {profile_info_str_for_prompt}]"
+    logger.debug(f"Constructed level header for full generation: {level_header[:200]}...")
 
     update_request_progress(request_id, "Generating text content", 2, 8, "Using AI model")
-    text_content = generate_dyslexic_text(level_adjusted_input)
+    text_content, parsed_items = generate_document_blocks(input_text, level_header, use_cache=use_cache)
     if not text_content:
         logger.error("Failed to generate text content.")
         cleanup_request_progress(request_id)
@@ -1890,11 +2479,10 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
     blocks = []
 
     logger.debug("Detailed Explanation tier. Proceeding with image extraction and full block parsing.")
-    current_text_to_process = text_content
-    ghibli_image_match = re.search(r'\[GhibliImage:\s*(.*?)\s*\]\n?', current_text_to_process, re.IGNORECASE)
-    if ghibli_image_match:
+    summary_item = next((item for item in parsed_items if item.get("summary")), None)
+    if summary_item:
         update_request_progress(request_id, "Generating summary image", 4, 8, "Creating Ghibli-style illustration")
-        ghibli_prompt = ghibli_image_match.group(1).strip()
+        ghibli_prompt = summary_item["prompt"]
         logger.info(f"Found GhibliImage prompt: '{ghibli_prompt}'")
         ghibli_filename = generate_unique_image_filename(ghibli_prompt, level=level, style_hint=image_style, prefix="ghibli_summary")
         ghibli_signed_url = generate_and_save_image(ghibli_prompt, ghibli_filename, level=level, style_hint=image_style)
@@ -1913,133 +2501,23 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
                 "content": f"Failed to generate summary image for: {ghibli_prompt[:50]}...",
                 "id": str(uuid4())
             })
-        current_text_to_process = current_text_to_process.replace(ghibli_image_match.group(0), "", 1)
+        parsed_items.remove(summary_item)
     else:
         logger.warning("No GhibliImage prompt found at the beginning of the Detailed Explanation content.")
     
     update_request_progress(request_id, "Processing content blocks", 5, 8, "Extracting text and images")
-    image_placeholders = []
-    for match in re.finditer(r'\[Image:\s*(.*?)\s*\]', current_text_to_process, re.IGNORECASE):
-        image_placeholders.append({'type': 'image', 'prompt': match.group(1).strip(), 'match_obj': match})
-    all_placeholders = sorted(image_placeholders, key=lambda p: p['match_obj'].start())
-    last_idx = 0
-    processed_text_parts = []
-    for placeholder in all_placeholders:
-        match_obj = placeholder['match_obj']
-        if match_obj.start() > last_idx:
-            processed_text_parts.append({'type': 'text_segment', 'content': current_text_to_process[last_idx:match_obj.start()]})
-        processed_text_parts.append(placeholder)
-        last_idx = match_obj.end()
-    if last_idx < len(current_text_to_process):
-        processed_text_parts.append({'type': 'text_segment', 'content': current_text_to_process[last_idx:]})
+    image_total = sum(1 for item in parsed_items if item["type"] == IMAGE_PLACEHOLDER)
     
-    update_request_progress(request_id, "Generating content images", 6, 8, f"Processing {len(image_placeholders)} images")
+    update_request_progress(request_id, "Generating content images", 6, 8, f"Processing {image_total} images")
     image_idx_counter = 0
-    for part in processed_text_parts:
-        if part['type'] == 'text_segment':
-            segment_content = part['content']
-            lines = segment_content.split('\n')
-            quiz_heading_pattern = re.compile(r"^\*\*(Quiz Time!|Test Your Knowledge!?)\*\*", re.IGNORECASE)
-            question_start_pattern = re.compile(r"^\d+\.\s*(.+)$")
-            option_pattern = re.compile(r"^([a-z])\)\s*(.+)$", re.IGNORECASE)
-            correct_answer_pattern = re.compile(r"^Correct Answer:\s*([a-z])$", re.IGNORECASE)
-            explanation_pattern = re.compile(r"^Explanation:\s*(.+)$", re.IGNORECASE)
-            heading_pattern = re.compile(r"^\*\*(?!(?:Quiz Time!|Test Your Knowledge!?)$)(.+?)\*\*$")
-            current_paragraph_lines = []
-            def flush_paragraph_segment(lines_list, block_list_target):
-                if lines_list:
-                    content = "\n".join(lines_list).strip()
-                    if content:
-                        block_list_target.append({"type": "paragraph", "content": content, "id": str(uuid4())})
-                        logger.debug(f"Added Paragraph block (from segment): {content[:50]}...")
-                    lines_list.clear()
-            line_idx_segment = 0
-            while line_idx_segment < len(lines):
-                line = lines[line_idx_segment].strip()
-                if not line:
-                    flush_paragraph_segment(current_paragraph_lines, blocks)
-                    line_idx_segment += 1
-                    continue
-                quiz_head_match = quiz_heading_pattern.match(line)
-                if quiz_head_match:
-                    flush_paragraph_segment(current_paragraph_lines, blocks)
-                    quiz_title = line.strip('*!? ')
-                    blocks.append({"type": "quizHeading", "content": quiz_title, "id": str(uuid4())})
-                    logger.debug(f"Added Quiz Heading block (from segment): {quiz_title}")
-                    line_idx_segment += 1
-                    continue
-                q_start_match = question_start_pattern.match(line)
-                if q_start_match:
-                    flush_paragraph_segment(current_paragraph_lines, blocks)
-                    question_text = q_start_match.group(1).strip()
-                    parsed_options = []
-                    parsed_correct_answer_id = None
-                    parsed_explanation = None
-                    option_id_map = {}
-                    temp_line_idx = line_idx_segment + 1
-                    while temp_line_idx < len(lines):
-                        opt_line = lines[temp_line_idx].strip()
-                        if not opt_line:
-                            temp_line_idx +=1
-                            continue
-                        opt_match = option_pattern.match(opt_line)
-                        if opt_match:
-                            opt_char = opt_match.group(1).lower()
-                            opt_text = opt_match.group(2).strip()
-                            full_opt_id = f"opt-{opt_char}-{uuid4().hex[:6]}"
-                            parsed_options.append({"id": full_opt_id, "text": opt_text})
-                            option_id_map[opt_char] = full_opt_id
-                            temp_line_idx += 1
-                        else:
-                            break
-                    if temp_line_idx < len(lines):
-                        corr_ans_line = lines[temp_line_idx].strip()
-                        if not corr_ans_line and temp_line_idx + 1 < len(lines):
-                            temp_line_idx += 1
-                            corr_ans_line = lines[temp_line_idx].strip()
-                        corr_ans_match = correct_answer_pattern.match(corr_ans_line)
-                        if corr_ans_match:
-                            corr_char = corr_ans_match.group(1).lower()
-                            if corr_char in option_id_map:
-                                parsed_correct_answer_id = option_id_map[corr_char]
-                            temp_line_idx += 1
-                    if temp_line_idx < len(lines):
-                        expl_line = lines[temp_line_idx].strip()
-                        if not expl_line and temp_line_idx + 1 < len(lines):
-                            temp_line_idx += 1
-                            expl_line = lines[temp_line_idx].strip()
-                        expl_match = explanation_pattern.match(expl_line)
-                        if expl_match:
-                            parsed_explanation = expl_match.group(1).strip()
-                            temp_line_idx += 1
-                    if question_text and parsed_options and parsed_correct_answer_id:
-                        blocks.append({
-                            "type": "multipleChoiceQuestion", "content": question_text,
-                            "options": parsed_options, "correctAnswerID": parsed_correct_answer_id,
-                            "explanation": parsed_explanation, "id": str(uuid4())
-                        })
-                        logger.debug(f"Added MCQ block (from segment): {question_text[:50]}...")
-                        line_idx_segment = temp_line_idx
-                        continue
-                    else:
-                        current_paragraph_lines.append(line)
-                        line_idx_segment += 1
-                        continue
-                head_match = heading_pattern.match(line)
-                if head_match:
-                    flush_paragraph_segment(current_paragraph_lines, blocks)
-                    heading_content = head_match.group(1).strip()
-                    blocks.append({"type": "heading", "content": heading_content, "id": str(uuid4())})
-                    logger.debug(f"Added Heading block (from segment): {heading_content[:50]}...")
-                    line_idx_segment += 1
-                    continue
-                current_paragraph_lines.append(line)
-                line_idx_segment += 1
-            flush_paragraph_segment(current_paragraph_lines, blocks)
-        elif part['type'] == 'image':
+    for item in parsed_items:
+        if item["type"] != IMAGE_PLACEHOLDER:
+            blocks.append(item)
+            logger.debug(f"Added {item['type']} block: {item['content'][:50]}...")
+        else:
             image_idx_counter += 1
-            update_request_progress(request_id, f"Generating image {image_idx_counter}", 6, 8, f"Processing image {image_idx_counter}/{len(image_placeholders)}")
-            prompt = part['prompt']
+            update_request_progress(request_id, f"Generating image {image_idx_counter}", 6, 8, f"Processing image {image_idx_counter}/{image_total}")
+            prompt = item["prompt"]
             filename = generate_unique_image_filename(prompt, level=level, style_hint=image_style, prefix="image")
             logger.debug(f"Requesting regular image {image_idx_counter} for prompt: '{prompt}' -> filename: {filename}")
             signed_url = generate_and_save_image(prompt, filename, level=level, style_hint=image_style)
@@ -2056,9 +2534,7 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
     is_only_ghibli_related = len(final_blocks) == 1 and final_blocks[0].get("type") in ["image", "error"] and ("ghibli_summary" in final_blocks[0].get("url","") or "summary image" in final_blocks[0].get("alt","") or "summary image" in final_blocks[0].get("content",""))
     if not final_blocks or (is_only_ghibli_related and not text_content.strip()):
          logger.warning("No main content blocks were parsed for Detailed Explanation (beyond Ghibli image). Adding entire original content as a single paragraph if available.")
-         original_content_without_ghibli_tag = text_content
-         if ghibli_image_match:
-             original_content_without_ghibli_tag = text_content.replace(ghibli_image_match.group(0), "", 1).strip()
+         original_content_without_ghibli_tag = GHIBLI_IMAGE_PATTERN.sub("", text_content, count=1).strip()
          if original_content_without_ghibli_tag:
              if not final_blocks or is_only_ghibli_related:
                  final_blocks.append({"type": "paragraph", "content": original_content_without_ghibli_tag, "id": str(uuid4())})
@@ -2086,7 +2562,108 @@ def process_input_text(input_text, level="moderate", summarization_tier="Detaile
     cleanup_request_progress(request_id)
     return {"blocks": final_blocks, "request_id": request_id}, 200
 
+STREAM_HEARTBEAT_SECONDS = 15
+
+def stream_process_blocks(input_text, level="moderate", summarization_tier="Detailed Explanation", profile_context=None,
+                          image_style=None, request_id=None, user_token=None, image_format=None, use_cache=True):
+    """Block mode as a stream of (event, payload) pairs.
+
+    Text blocks are emitted as soon as the parser completes them; image blocks
+    are emitted when their URL resolves. Every block carries its final index.
+    """
+    start_request_progress(request_id, total_steps=4, user_token=user_token)
+    update_firebase_task_status(request_id, 'started')
+    yield "start", {"request_id": request_id}
+
+    level_adjusted_input = f"[Level: {level}] [Summary Tier: {summarization_tier}] [Profile: {format_profile_context(profile_context)}]\n\n{input_text}"
+    parser = IncrementalBlockParser()
+    blocks = {}   # index -> block, for the final Firebase status
+    pending = {}  # image future -> (index, prompt, alt text)
+    text_parts = []
+    text_block_count = 0
+
+    def place(items):
+        nonlocal text_block_count
+        for item in items:
+            index = len(blocks) + len(pending)
+            if item["type"] == IMAGE_PLACEHOLDER:
+                prompt = item["prompt"]
+                prefix = "ghibli_summary" if item["summary"] else "image"
+                alt = f"Summary illustration: {prompt}" if item["summary"] else prompt
+                filename = generate_unique_image_filename(prompt, level=level, style_hint=image_style, prefix=prefix)
+                future = image_executor.submit(bind_context(generate_and_save_image), prompt, filename, level=level,
+                                               style_hint=image_style)
+                pending[future] = (index, prompt, alt)
+                continue
+            text_block_count += 1
+            blocks[index] = item
+            yield "block", {"index": index, "block": item}
+
+    def resolve(done):
+        for future in done:
+            index, prompt, alt = pending.pop(future)
+            try:
+                signed_url = future.result()
+            except Exception as e:
+                logger.error(f"Streaming image generation failed for prompt '{prompt[:50]}': {e}")
+                signed_url = None
+            if signed_url:
+                block = {"type": "image", "url": signed_url, "alt": alt, "id": str(uuid4())}
+                attach_srcsets([block], "url", image_format)
+            else:
+                block = {"type": "error", "content": f"Failed to generate image for: {prompt[:50]}...", "id": str(uuid4())}
+            blocks[index] = block
+            yield "block", {"index": index, "block": block}
+
+    try:
+        update_request_progress(request_id, "Generating text content", 1, 4, "Streaming from AI model")
+        for chunk in stream_dyslexic_text(level_adjusted_input, use_cache=use_cache):
+            text_parts.append(chunk)
+            yield from place(parser.feed(chunk))
+            yield from resolve([f for f in list(pending) if f.done()])
+        yield from place(parser.close())
+
+        text_content = "".join(text_parts)
+        if not text_content.strip():
+            raise ValueError("Empty response from text model")
+        if not text_block_count:
+            # Nothing parsed beyond images: fall back to the raw text as one paragraph
+            fallback_text = GHIBLI_IMAGE_PATTERN.sub("", text_content, count=1).strip()
+            if fallback_text:
+                yield from place([{"type": "paragraph", "content": fallback_text, "id": str(uuid4())}])
+
+        update_request_progress(request_id, "Generating content images", 3, 4, f"{len(pending)} images remaining")
+        while pending:
+            done, _ = wait(list(pending), timeout=STREAM_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+            if not done:
+                yield "ping", None
+            yield from resolve(done)
+
+        final_blocks = [blocks[i] for i in sorted(blocks)]
+        update_request_progress(request_id, "Content generation complete", 4, 4, f"Generated {len(final_blocks)} blocks")
+        if user_token:
+            send_push_notification(
+                user_token,
+                "Content Ready! 📚",
+                f"Generated {len(final_blocks)} content blocks for you",
+                {'request_id': request_id, 'type': 'content', 'block_count': str(len(final_blocks))}
+            )
+        update_firebase_task_status(request_id, 'completed', {'blocks': final_blocks})
+        yield "done", {"request_id": request_id, "block_count": len(final_blocks)}
+    except Exception as e:
+        logger.error(f"Streaming block generation failed for {request_id}: {e}")
+        update_firebase_task_status(request_id, 'failed', error_message=str(e))
+        yield "error", {"request_id": request_id, "error": "Failed to generate educational content. Please try again later."}
+    finally:
+        # On failure or client disconnect (GeneratorExit), images nobody will receive are dropped from the queue
+        if pending:
+            cancelled = sum(1 for future in list(pending) if future.cancel())
+            logger.info(f"Stream {request_id} ended with {len(pending)} images pending; cancelled {cancelled} queued")
+        cleanup_request_progress(request_id)
+
 @app.route('/process', methods=['POST'])
+@prioritized(process_priority)
+@admitted("process")
 def process():
     if not request.is_json:
          logger.warning("Request received is not JSON.")
@@ -2110,8 +2687,8 @@ def process():
     conversation_history = data.get('conversation_history', None)
     user_question = data.get('user_question', None)
 
-    # Generate request ID for progress tracking
-    request_id = str(uuid4())
+    # Request ID for progress tracking (client-supplied or generated)
+    request_id = resolve_request_id(data)
 
     if not isinstance(level, str) or level not in READING_LEVELS:
          logger.warning(f"Invalid or missing level in request: '{level}'. Defaulting to moderate.")
@@ -2125,6 +2702,9 @@ def process():
     current_input_text_for_processing = ""
 
     if dialogue_mode:
+        session_response = session_turn_response('dialogue', data, user_question, response_key="dialogue_response")
+        if session_response is not None:
+            return session_response
         logger.info(f"Received Dialogue request: level='{level}', profile='{profile_context}', user_question='{user_question}', request_id='{request_id}'")
         if not user_question or not selected_text_snippet or not original_block_content:
             logger.warning("Dialogue mode: Missing one or more required fields: user_question, selected_text_snippet, original_block_content.")
@@ -2148,6 +2728,25 @@ def process():
            return jsonify({"error": "No input text provided"}), 400
         current_input_text_for_processing = text_from_input
 
+    # Opt-in streaming (SSE or NDJSON) for plain block generation
+    stream_format = negotiate_stream_format(data.get('stream'), request.headers.get('Accept'))
+    if (stream_format and not dialogue_mode and not explain_again_mode and output_format is None
+            and not is_story_generation_input(current_input_text_for_processing)):
+        logger.info(f"Streaming blocks as {stream_format} for request_id='{request_id}'")
+        events = stream_process_blocks(
+            current_input_text_for_processing,
+            level=level,
+            summarization_tier=summarization_tier,
+            profile_context=profile_context,
+            image_style=image_style,
+            request_id=request_id,
+            user_token=user_token,
+            image_format=preferred_image_format(data),
+            use_cache=text_cache_enabled(data)
+        )
+        body = (encode_event(stream_format, event, payload) for event, payload in events)
+        return Response(stream_with_context(body), mimetype=STREAM_MIMETYPES[stream_format], headers=STREAM_HEADERS)
+
     result, status_code = process_input_text(
         input_text=current_input_text_for_processing,
         level=level,
@@ -2163,13 +2762,18 @@ def process():
         user_question=user_question,
         image_style=image_style,  # NEW image_style parameter
         request_id=request_id,  # NEW request_id parameter
-        user_token=user_token  # NEW user_token parameter
+        user_token=user_token,  # NEW user_token parameter
+        use_cache=text_cache_enabled(data)
     )
     
     # Add request_id to the response if not already present
     if isinstance(result, dict) and "request_id" not in result:
         result["request_id"] = request_id
     
+    if isinstance(result, dict) and result.get("blocks"):
+        image_blocks = [b for b in result["blocks"] if b.get("type") == "image"]
+        attach_srcsets(image_blocks, "url", preferred_image_format(data))
+    
     return jsonify(result), status_code
 
 @app.route('/test-api', methods=['GET'])
@@ -2178,6 +2782,9 @@ def test_api():
     return jsonify({"message": "Backend is running and supports reading levels!"}), 200
 
 @app.route('/generate_story', methods=['POST'])
+@async_job("story")
+@prioritized(BATCH)
+@admitted("story")
 def generate_story_endpoint():
     """Endpoint to generate a story from input text, and also generate images for each chapter."""
     try:
@@ -2193,19 +2800,11 @@ def generate_story_endpoint():
         image_style = data.get('image_style', None)  # Add image_style parameter
 >>>>>>> 9129cfe4b41d693ce0501e8a686c17ac643b01c0
 
-        # Generate request ID for progress tracking
-        request_id = str(uuid4())
+        # Request ID for progress tracking (client-supplied ids let /progress be polled from the start)
+        request_id = resolve_request_id(data)
         
-        # Initialize progress tracking
-        request_progress[request_id] = {
-            'step': 'Starting story generation...',
-            'step_number': 0,
-            'total_steps': 6,  # Story generation + image generation per chapter
-            'details': '',
-            'last_updated': datetime.now().isoformat(),
-            'progress_percentage': 0
-        }
-        request_start_times[request_id] = datetime.now()
+        # Initialize progress tracking: story generation + image generation per chapter
+        start_request_progress(request_id, 'Starting story generation...', total_steps=6)
 
         main_character_for_image = None
         text_for_story_model = full_input_text_from_request
@@ -2249,7 +2848,7 @@ def generate_story_endpoint():
 
         update_request_progress(request_id, "Generating story content", 1, 6, f"Level: {level_from_payload}")
         logger.debug(f"Text for story model (first 50 chars): '{text_for_story_model[:50]}', Level: {level_from_payload}")
-        story = generate_story(text_for_story_model, level_from_payload)
+        story = generate_story(text_for_story_model, level_from_payload, use_cache=text_cache_enabled(data))
 
         if not story or not story.get('chapters'):
             logger.error("Story generation failed or returned no chapters.")
@@ -2321,6 +2920,7 @@ def generate_story_endpoint():
         update_request_progress(request_id, "Story generation complete", 6, 6, f"Generated story with {len(story.get('chapters', []))} chapters")
         if 'images' in story:
             del story['images']
+        attach_srcsets(story.get('chapters', []), 'imageUrl', preferred_image_format(data), srcset_key='imageSrcset')
         
 <<<<<<< HEAD
         # Return consistency references if consistency mode was used
@@ -2346,7 +2946,7 @@ def generate_story_endpoint():
             cleanup_request_progress(request_id)
         return jsonify({"error": str(e)}), 500
 
-def generate_story(input_text, level="moderate"):
+def generate_story(input_text, level="moderate", use_cache=True):
     """Generate a story based on the input text and reading level."""
     story_system_instruction = f"""You are a creative storyteller who adapts content into engaging stories for different reading levels.
     Transform the given text into a story with 2-3 chapters, following these guidelines:
@@ -2382,7 +2982,9 @@ def generate_story(input_text, level="moderate"):
 
     try:
         # Generate the story using the AI model
-        response = generate_dyslexic_text(input_text, story_system_instruction)
+        response = generate_dyslexic_text(condense_long_document(input_text, use_cache=use_cache),
+                                          story_system_instruction, use_cache=use_cache,
+                                          cache_if=is_complete_json_response, structured_output="story")
         logger.info(f"Raw AI response for story: {str(response)[:1000]}")
 
         # === FIX: Check for None response ===
@@ -2424,56 +3026,55 @@ def generate_story(input_text, level="moderate"):
             
             return fixed_json
 
-        raw_json = extract_json_from_response(response)
+        def repair_story_json(resp):
+            """Legacy repair path for output that does not match STORY_SCHEMA"""
+            raw_json = extract_json_from_response(resp)
         
-        # Try to fix truncated JSON
-        fixed_json = fix_truncated_json(raw_json)
+            # Try to fix truncated JSON
+            fixed_json = fix_truncated_json(raw_json)
         
-        try:
-            story_data = json.loads(fixed_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse story JSON after fixing. Error: {e}. Raw: {raw_json[:1000]}")
-            logger.error(f"Fixed JSON: {fixed_json[:1000]}")
-            
-            # Try to extract partial story data if possible
             try:
-                # Look for title and content even in truncated JSON
-                title_match = re.search(r'"title":\s*"([^"]*)"', raw_json)
-                content_match = re.search(r'"content":\s*"([^"]*)"', raw_json)
-                level_match = re.search(r'"level":\s*"([^"]*)"', raw_json)
+                story_data = json.loads(fixed_json)
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to parse story JSON after fixing. Error: {e}. Raw: {raw_json[:1000]}")
+                logger.error(f"Fixed JSON: {fixed_json[:1000]}")
+            
+                # Try to extract partial story data if possible
+                try:
+                    # Look for title and content even in truncated JSON
+                    title_match = re.search(r'"title":\s*"([^"]*)"', raw_json)
+                    content_match = re.search(r'"content":\s*"([^"]*)"', raw_json)
+                    level_match = re.search(r'"level":\s*"([^"]*)"', raw_json)
                 
-                if title_match and content_match:
-                    # Create a minimal valid story structure
-                    story_data = {
-                        "title": title_match.group(1),
-                        "content": content_match.group(1),
-                        "level": level_match.group(1) if level_match else level,
-                        "chapters": [
-                            {
-                                "title": "Chapter 1",
-                                "content": content_match.group(1),
-                                "order": 1
-                            },
-                            {
-                                "title": "Chapter 2",
-                                "content": content_match.group(1),
-                                "order": 2
-                            }
-                        ]
-                    }
-                    logger.info("Created fallback story structure from partial JSON")
-                else:
-                    raise ValueError("Could not extract even basic story information from truncated response")
-            except Exception as fallback_error:
-                logger.error(f"Fallback parsing also failed: {fallback_error}")
-                raise ValueError("The AI did not return a valid story in JSON format. Please try again or rephrase your input.")
-
-        # Validate the story structure
-        if not all(key in story_data for key in ["title", "content", "level", "chapters"]):
-            raise ValueError("Invalid story structure in AI response")
-        for chapter in story_data["chapters"]:
-            if not all(key in chapter for key in ["title", "content", "order"]):
-                raise ValueError("Invalid chapter structure in AI response")
+                    if title_match and content_match:
+                        # Create a minimal valid story structure
+                        story_data = {
+                            "title": title_match.group(1),
+                            "content": content_match.group(1),
+                            "level": level_match.group(1) if level_match else level,
+                            "chapters": [
+                                {
+                                    "title": "Chapter 1",
+                                    "content": content_match.group(1),
+                                    "order": 1
+                                },
+                                {
+                                    "title": "Chapter 2",
+                                    "content": content_match.group(1),
+                                    "order": 2
+                                }
+                            ]
+                        }
+                        logger.info("Created fallback story structure from partial JSON")
+                    else:
+                        raise ValueError("Could not extract even basic story information from truncated response")
+                except Exception as fallback_error:
+                    logger.error(f"Fallback parsing also failed: {fallback_error}")
+                    raise ValueError("The AI did not return a valid story in JSON format. Please try again or rephrase your input.")
+            return story_data
+
+        # Schema-constrained output parses directly; the repair path is only for malformed responses
+        story_data = parse_with_repair("story", response, repair=repair_story_json, stats=structured_output_stats)
         return story_data
     except Exception as e:
         logger.error(f"Error generating story: {str(e)}")
@@ -2562,6 +3163,8 @@ def is_safe_prompt(prompt, level):
     return True
 
 @app.route('/generate_image', methods=['POST'])
+@prioritized(STANDARD)
+@admitted("image")
 def generate_image_endpoint():
     """Legacy endpoint - maintained for backwards compatibility."""
     try:
@@ -2590,6 +3193,8 @@ def generate_image_endpoint():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/generate_image_v2', methods=['POST'])
+@prioritized(STANDARD)
+@admitted("image")
 def generate_image_v2_endpoint():
     """Enhanced image generation endpoint with aspect ratio, consistency, and quality options."""
     try:
@@ -2652,6 +3257,8 @@ def generate_image_v2_endpoint():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/generate_consistent_image', methods=['POST'])
+@prioritized(STANDARD)
+@admitted("image")
 def generate_consistent_image_endpoint():
     """Generate image with character/style consistency using reference images."""
     try:
@@ -2721,6 +3328,9 @@ def generate_consistent_image_endpoint():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/generate_lecture', methods=['POST'])
+@async_job("lecture")
+@prioritized(BATCH)
+@admitted("lecture")
 def generate_lecture_endpoint():
     """Endpoint to generate a lecture with audio and images from input text."""
     try:
@@ -2732,25 +3342,17 @@ def generate_lecture_endpoint():
         if not input_text:
             return jsonify({"error": "No text provided for lecture generation"}), 400
 
-        # Generate request ID for progress tracking
-        request_id = str(uuid4())
+        # Request ID for progress tracking (client-supplied ids let /progress be polled from the start)
+        request_id = resolve_request_id(data)
         
-        # Initialize progress tracking
-        request_progress[request_id] = {
-            'step': 'Starting lecture generation...',
-            'step_number': 0,
-            'total_steps': 5,  # Script generation + audio generation + image generation
-            'details': '',
-            'last_updated': datetime.now().isoformat(),
-            'progress_percentage': 0
-        }
-        request_start_times[request_id] = datetime.now()
+        # Initialize progress tracking: script generation + audio generation + image generation
+        start_request_progress(request_id, 'Starting lecture generation...', total_steps=5)
 
         logger.info(f"Generating lecture for text length: {len(input_text)}, level: {level}, request_id: {request_id}")
 
         # Generate lecture script
         update_request_progress(request_id, "Generating lecture script", 1, 5, "Creating structured content")
-        lecture_json = generate_lecture_script(input_text)
+        lecture_json = generate_lecture_script(input_text, use_cache=text_cache_enabled(data))
         if not lecture_json:
             cleanup_request_progress(request_id)
             return jsonify({"error": "Failed to generate lecture script"}), 500
@@ -2762,6 +3364,8 @@ def generate_lecture_endpoint():
             cleanup_request_progress(request_id)
             return jsonify({"error": "Failed to generate lecture audio and images"}), 500
 
+        attach_srcsets(result["lecture_data"].get("sections", []), "image_url", preferred_image_format(data),
+                       srcset_key="image_srcset")
         update_request_progress(request_id, "Lecture generation complete", 5, 5, f"Generated {len(result['audio_files'])} audio files")
         cleanup_request_progress(request_id)
         return jsonify({
@@ -2777,8 +3381,251 @@ def generate_lecture_endpoint():
             cleanup_request_progress(request_id)
         return jsonify({"error": str(e)}), 500
 
+# --- Conversation sessions (character chat, dialogue mode) ---
+
+CHARACTER_CHAT_RULES = """Respond as {character_name} would. Stay in character, be friendly and engaging. 
+Keep your response concise (2-3 sentences max), natural, and appropriate for a children's story.
+Do not break character or mention that you're an AI. Just respond as the character naturally would."""
+
+DIALOGUE_SYSTEM_INSTRUCTION = "You are an AI Conversational Tutor for ReadBuddy. Respond to the user's latest question based on the provided context and conversation history."
+DIALOGUE_SESSION_HISTORY_NOTE = "(The conversation so far follows as chat turns.)"
+DIALOGUE_SESSION_QUESTION_NOTE = "(The user's latest message is the final chat turn.)"
+
+HISTORY_SUMMARY_PROMPT_TEMPLATE = """Update the running summary of a tutoring conversation with the new messages below.
+Keep what the user asked, what was explained, examples that were used, what the user found confusing and anything they said about themselves.
+Write at most {max_words} words of plain prose. Output only the updated summary.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
+def summarize_conversation(summary, turns):
+    """Fold turns into summary for history_compactor (runs on its background pool)."""
+    messages = "\n".join(f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['text']}" for turn in turns)
+    prompt = HISTORY_SUMMARY_PROMPT_TEMPLATE.format(max_words=max(50, history_compactor.summary_budget * 3 // 4),
+                                                    summary=summary or "(none yet)", messages=messages)
+    return generate_dyslexic_text(prompt, system_instruction_override="You summarize conversations faithfully and briefly.")
+
+history_compactor = HistoryCompactor(
+    summarize_conversation,
+    token_budget=HISTORY_TOKEN_BUDGET,
+    recent_messages=HISTORY_RECENT_MESSAGES
+)
+
+def build_character_context(character_name, character_description, character_dialogue_examples, comic_title, comic_theme):
+    character_context = f"""
+Character Name: {character_name}
+Description: {character_description}
+Story: {comic_title}
+Theme: {comic_theme}
+
+Character's dialogue examples from the story:
+"""
+    for dialogue in (character_dialogue_examples or [])[:5]:  # Limit to 5 examples
+        character_context += f"- \"{dialogue}\"\n"
+    return character_context
+
+def character_chat_prompt(data):
+    """Single-turn character chat prompt (legacy stateless requests that resend the context every turn)."""
+    character_name = data.get('character_name', '')
+    comic_title = data.get('comic_title', '')
+    character_context = build_character_context(character_name, data.get('character_description', ''),
+                                                 data.get('character_dialogue_examples', []), comic_title,
+                                                 data.get('comic_theme', ''))
+    history_context = ""
+    turns = normalize_history(data.get('conversation_history', []))
+    if turns:
+        history_key = conversation_key("character_chat", character_name, comic_title, turns[0]["text"])
+        compacted = history_compactor.compact(history_key, turns)
+        history_context = f"\nRecent conversation:\n{compacted.as_text(user_label='User', model_label=character_name)}\n"
+
+    return f"""You are {character_name}, a character from the comic "{comic_title}".
+
+{character_context}
+
+{history_context}
+
+User asks: "{data.get('user_message', '')}"
+
+{CHARACTER_CHAT_RULES.format(character_name=character_name)}
+
+{character_name}:"""
+
+def character_reply_text(response, character_name):
+    """Reply text of a character chat response, without a repeated "Name:" prefix."""
+    if hasattr(response, 'text'):
+        response_text = (response.text or "").strip()
+    elif response.candidates and response.candidates[0].content.parts:
+        # Fallback: extract from candidates
+        text_part = next((p for p in response.candidates[0].content.parts if hasattr(p, 'text')), None)
+        response_text = text_part.text.strip() if text_part else ""
+    else:
+        response_text = ""
+    if response_text.startswith(character_name + ":"):
+        response_text = response_text[len(character_name) + 1:].strip()
+    return response_text
+
+def create_conversation_session(kind, data):
+    """Create a session from the static context fields of a character chat or dialogue request.
+
+    Returns (session, None), or (None, error message) when required context is missing.
+    """
+    if kind == "character_chat":
+        character_name = data.get('character_name', '')
+        if not character_name:
+            return None, "Character name required"
+        comic_title = data.get('comic_title', '')
+        character_context = build_character_context(
+            character_name, data.get('character_description', ''), data.get('character_dialogue_examples', []),
+            comic_title, data.get('comic_theme', ''))
+        system_instruction = (f"You are {character_name}, a character from the comic \"{comic_title}\".\n"
+                              f"{character_context}\n{CHARACTER_CHAT_RULES.format(character_name=character_name)}")
+        session = conversation_sessions.create(kind, system_instruction, CHARACTER_CHAT_MODEL,
+                                               metadata={"character": character_name},
+                                               history=data.get('conversation_history'))
+        return session, None
+
+    if kind == "dialogue":
+        selected_text_snippet = data.get('selected_text_snippet')
+        original_block_content = data.get('original_block_content')
+        if not selected_text_snippet or not original_block_content:
+            return None, "Missing required information for dialogue mode."
+        level = data.get('level', 'moderate')
+        if level not in READING_LEVELS:
+            level = "moderate"
+        dialogue_context = DIALOGUE_PROMPT_TEMPLATE.format(
+            level=level,
+            profile_context_str=format_profile_context(data.get('profile_context')),
+            original_block_content=original_block_content,
+            selected_text_snippet=selected_text_snippet,
+            conversation_history=DIALOGUE_SESSION_HISTORY_NOTE,
+            user_question=DIALOGUE_SESSION_QUESTION_NOTE
+        )
+        session = conversation_sessions.create(kind, f"{DIALOGUE_SYSTEM_INSTRUCTION}\n\n{dialogue_context}", TEXT_MODEL,
+                                               metadata={"level": level}, history=data.get('conversation_history'))
+        return session, None
+
+    return None, f"Unknown session kind '{kind}'"
+
+def session_reply_filter(session):
+    # Character replies sometimes start with "Name:"; hold the first characters back until that is known
+    return ReplyPrefixFilter(f"{session.metadata['character']}:" if session.kind == "character_chat" else None)
+
+def stream_session_reply(session, message):
+    """Yield reply text chunks for message; the exchange is added to the session once the reply is complete.
+
+    The session's system instruction is the static context, so it is served
+    from a cached prefix when large enough; only history and message vary.
+    """
+    label = f"session_{session.kind}"
+    config = {"temperature": 0.8} if session.kind == "character_chat" else {}
+    stream = generate_content_cached(session.model, session.system_instruction,
+                                     session.contents(message, compactor=history_compactor),
+                                     label=label, stream=True, **config)
+    reply_filter = session_reply_filter(session)
+    parts = []
+    usage = None
+    for chunk in stream:
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        text = reply_filter.feed(getattr(chunk, "text", None) or "")
+        if text:
+            parts.append(text)
+            yield text
+    rest = reply_filter.flush()
+    if rest:
+        parts.append(rest)
+        yield rest
+    prompt_cache.record_usage(usage, label)
+    conversation_sessions.record_turn(session, message, "".join(parts).strip())
+
+def session_reply_response(session_id, message, data, response_key="response"):
+    """Flask response for one session turn: token events when streaming was requested, otherwise JSON."""
+    session = conversation_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found or expired", "session_expired": True}), 404
+    if not message:
+        return jsonify({"error": "Message required"}), 400
+
+    stream_format = negotiate_stream_format(data.get('stream'), request.headers.get('Accept'))
+    if stream_format:
+        def events():
+            yield "start", {"session_id": session.session_id}
+            parts = []
+            try:
+                for text in stream_session_reply(session, message):
+                    parts.append(text)
+                    yield "token", {"text": text}
+            except Exception as e:
+                logger.error(f"Error streaming {session.kind} session reply: {e}")
+                yield "error", {"error": "Failed to generate a response", "session_id": session.session_id}
+                return
+            yield "done", {response_key: "".join(parts).strip(), "session_id": session.session_id,
+                           "turns": session.turns, **session.metadata}
+
+        body = (encode_event(stream_format, event, payload) for event, payload in events())
+        return Response(stream_with_context(body), mimetype=STREAM_MIMETYPES[stream_format], headers=STREAM_HEADERS)
+
+    try:
+        reply = "".join(stream_session_reply(session, message)).strip()
+    except Exception as e:
+        logger.error(f"Error generating {session.kind} session reply: {e}")
+        return jsonify({"error": f"Failed to generate response: {str(e)}", "session_id": session.session_id}), 500
+    return jsonify({response_key: reply, "session_id": session.session_id, "turns": session.turns,
+                    **session.metadata}), 200
+
+def session_turn_response(kind, data, message, response_key="response"):
+    """Answer a turn through a session when the request names one (session_id) or asks for one (create_session).
+
+    Returns None for legacy stateless requests.
+    """
+    session_id = data.get('session_id')
+    if not session_id and data.get('create_session'):
+        session, error = create_conversation_session(kind, data)
+        if error:
+            return jsonify({"error": error}), 400
+        session_id = session.session_id
+    if not session_id:
+        return None
+    return session_reply_response(session_id, message, data, response_key=response_key)
+
+@app.route('/sessions', methods=['POST'])
+def create_session_endpoint():
+    """Create a character chat or dialogue session; later turns send only session_id and the new message."""
+    try:
+        data = request.get_json() or {}
+        kind = data.get('kind', 'character_chat')
+        session, error = create_conversation_session(kind, data)
+        if error:
+            return jsonify({"error": error}), 400
+        return jsonify({
+            "session_id": session.session_id,
+            "kind": session.kind,
+            "expires_in_seconds": CONVERSATION_SESSION_TTL_SECONDS
+        }), 201
+    except Exception as e:
+        logger.error(f"Error in create_session_endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/sessions/<session_id>/messages', methods=['POST'])
+@prioritized(INTERACTIVE)
+def session_message_endpoint(session_id):
+    """Send one user message to a session; streams tokens with "stream": "sse"/"ndjson"."""
+    data = request.get_json() or {}
+    return session_reply_response(session_id, data.get('message', ''), data)
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session_endpoint(session_id):
+    if not conversation_sessions.delete(session_id):
+        return jsonify({"error": "Session not found or expired"}), 404
+    return jsonify({"deleted": session_id}), 200
+
 <<<<<<< HEAD
 @app.route('/generate_tts', methods=['POST'])
+@prioritized(STANDARD)
+@admitted("tts")
 def generate_tts_endpoint():
     """
     Generate text-to-speech audio using Gemini 2.5 Flash Preview TTS model.
@@ -2800,7 +3647,7 @@ def generate_tts_endpoint():
             return jsonify({"error": "No text provided"}), 400
         
         # Limit text length to prevent very long audio files
-        max_length = 50000  # ~50k characters
+        max_length = TTS_MAX_TEXT_CHARS
         if len(text) > max_length:
             text = text[:max_length] + "..."
             logger.warning(f"Text truncated to {max_length} characters for TTS")
@@ -2811,14 +3658,8 @@ def generate_tts_endpoint():
         filename = f"tts_{uuid4().hex}.mp3"
         local_filepath = f"/tmp/{filename}"
         
-        # Use Google Cloud TTS with Chirp3 HD voices
-        # These voices are high-quality and friendly, perfect for narration
-        # Voice selection optimized for storytelling:
-        # - Aoede: Warm, friendly narrator voice (like a parent reading)
-        # - Autonoe: Alternative voice for character dialogue
-        voice_name = "en-US-Chirp3-HD-Aoede"  # Friendly, warm voice for narration
-        if voice == "character":
-            voice_name = "en-US-Chirp3-HD-Autonoe"  # Different voice for characters
+        # Use Google Cloud TTS with Chirp3 HD voices (see TTS_VOICES)
+        voice_name = tts_voice_name(voice)
         
         # Generate TTS audio
         success = text_to_speech(text, local_filepath, voice_name)
@@ -2857,58 +3698,26 @@ def generate_tts_endpoint():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/character_chat', methods=['POST'])
+@prioritized(INTERACTIVE)
 def character_chat_endpoint():
     """Generate character responses for interactive character chat."""
     try:
         data = request.get_json()
         character_name = data.get('character_name', '')
-        character_description = data.get('character_description', '')
-        character_dialogue_examples = data.get('character_dialogue_examples', [])
-        comic_title = data.get('comic_title', '')
-        comic_theme = data.get('comic_theme', '')
         user_message = data.get('user_message', '')
-        conversation_history = data.get('conversation_history', [])
         
+        # Session turns only carry the new message; the character context is kept server-side
+        session_response = session_turn_response('character_chat', data, user_message)
+        if session_response is not None:
+            return session_response
+
         if not character_name or not user_message:
             return jsonify({"error": "Character name and user message required"}), 400
         
         logger.info(f"Generating character chat response for {character_name}")
         
-        # Build character context
-        character_context = f"""
-Character Name: {character_name}
-Description: {character_description}
-Story: {comic_title}
-Theme: {comic_theme}
-
-Character's dialogue examples from the story:
-"""
-        for dialogue in character_dialogue_examples[:5]:  # Limit to 5 examples
-            character_context += f"- \"{dialogue}\"\n"
-        
-        # Build conversation history context
-        history_context = ""
-        if conversation_history:
-            history_context = "\nRecent conversation:\n"
-            for msg in conversation_history[-6:]:  # Last 6 messages
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                history_context += f"{role.capitalize()}: {content}\n"
-        
-        # Build prompt for Gemini
-        prompt = f"""You are {character_name}, a character from the comic "{comic_title}".
-
-{character_context}
-
-{history_context}
-
-User asks: "{user_message}"
-
-Respond as {character_name} would. Stay in character, be friendly and engaging. 
-Keep your response concise (2-3 sentences max), natural, and appropriate for a children's story.
-Do not break character or mention that you're an AI. Just respond as the character naturally would.
-
-{character_name}:"""
+        # Build prompt for Gemini (character sheet, compacted history, rules)
+        prompt = character_chat_prompt(data)
         
         try:
             # Generate response using Gemini with config for more creative responses
@@ -2916,26 +3725,13 @@ Do not break character or mention that you're an AI. Just respond as the charact
                 'temperature': 0.8,  # More creative, natural responses
             }
             
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-preview-04-17",
+            response = llm_generate("character_chat",
+                model=CHARACTER_CHAT_MODEL,
                 contents=prompt,
                 config=types.GenerateContentConfig(**config_params) if config_params else None
             )
             
-            # Extract text from response
-            if hasattr(response, 'text'):
-                response_text = response.text.strip()
-            else:
-                # Fallback: extract from candidates
-                if response.candidates and response.candidates[0].content.parts:
-                    text_part = next((p for p in response.candidates[0].content.parts if hasattr(p, 'text')), None)
-                    response_text = text_part.text.strip() if text_part else ""
-                else:
-                    response_text = ""
-            
-            # Clean up response (remove character name if it's repeated)
-            if response_text.startswith(character_name + ":"):
-                response_text = response_text[len(character_name) + 1:].strip()
+            response_text = character_reply_text(response, character_name)
             
             logger.info(f"✅ Character chat response generated for {character_name}")
             
@@ -2974,7 +3770,7 @@ COMIC_CHARACTERS_PROMPT_TEMPLATE = '''You are an expert comic scriptwriter. Give
 Your output must be a JSON object with:
 - comic_title: A catchy title for the comic
 - theme: The overall theme and tone
-- character_style_guide: A dictionary where each key is a character name and value is their visual description (clothing, colors, unique features)
+- character_style_guide: A JSON array with one {{"name": character name, "description": visual description (clothing, colors, unique features)}} object per character
 
 Text:
 """{input_text}"""
@@ -2991,10 +3787,10 @@ Your output must be a JSON array of panel objects, each with:
 - panel_id: sequential number
 - scene: short description of what's happening
 - image_prompt: detailed visual prompt for the panel (NO TEXT, NO CAPTIONS, NO SPEECH BUBBLES)
-- dialogue: dictionary of character name -> what they say (REQUIRED - each panel should have meaningful dialogue)
+- dialogue: JSON array of {{"speaker": character name, "line": what they say}} objects in speaking order (can include Narrator; an empty array for a deliberately silent panel)
 
 IMPORTANT DIALOGUE REQUIREMENTS:
-- Each panel MUST have dialogue from at least one character
+- Give each panel dialogue from at least one character unless the scene is meant to be silent
 - Dialogue should be natural, engaging, and advance the story
 - Use character names from the character_style_guide
 - Make dialogue conversational and appropriate to the scene
@@ -3007,7 +3803,7 @@ IMPORTANT DIALOGUE REQUIREMENTS:
 
 IMPORTANT: 
 - Generate 7-20 panels based on story complexity
-- Each panel MUST have dialogue from at least one character
+- Keep silent panels rare: most panels should have dialogue
 - Image prompts should NOT include any text, captions, or speech bubbles
 - Make dialogue natural and engaging
 
@@ -3015,6 +3811,13 @@ Text:
 """{input_text}"""
 '''
 
+# Panel prompt split for prefix caching: the source text goes first (cacheable per document),
+# the per-comic instructions follow it
+COMIC_SOURCE_TEXT_TEMPLATE = 'Text:\n"""{input_text}"""\n'
+COMIC_PANELS_INSTRUCTIONS_TEMPLATE = COMIC_PANELS_PROMPT_TEMPLATE.replace(
+    "Given the following text and character information", "Given the text above and the character information below"
+).replace(COMIC_SOURCE_TEXT_TEMPLATE, "")
+
 def extract_json_from_response(text):
     """Extract the first JSON object or array from a string, ignoring preamble or code block markers."""
     # Remove code block markers if present
@@ -3037,7 +3840,7 @@ def generate_comic_script(input_text: str) -> dict:
         # Step 1: Generate characters and theme
         logger.info("Step 1: Generating characters and theme")
         characters_prompt = COMIC_CHARACTERS_PROMPT_TEMPLATE.format(input_text=input_text)
-        characters_response = client.models.generate_content(
+        characters_response = llm_generate("comic_characters",
             model="gemini-2.5-pro",
             contents=characters_prompt,
             config=types.GenerateContentConfig(
@@ -3102,11 +3905,11 @@ def generate_comic_script(input_text: str) -> dict:
             theme=characters_data.get('theme', 'Adventure')
         )
         
-        panels_response = client.models.generate_content(
+        panels_response = llm_generate("comic_panels",
             model="gemini-2.5-flash",
             contents=panels_prompt,
             config=types.GenerateContentConfig(
-                system_instruction="You are an expert comic scriptwriter. You MUST generate meaningful, natural dialogue for each panel. Each panel should have at least one character speaking with engaging, story-advancing dialogue. Do not create empty dialogue objects or use generic phrases. Generate 7-20 panels based on story complexity. Make dialogue conversational and appropriate to each scene."
+                system_instruction="You are an expert comic scriptwriter. You MUST generate meaningful, natural dialogue for each panel. Each panel should have at least one character speaking with engaging, story-advancing dialogue. Leave dialogue empty only for a deliberately silent panel, and do not use generic phrases. Generate 7-20 panels based on story complexity. Make dialogue conversational and appropriate to each scene."
             )
         )
         
@@ -3217,6 +4020,13 @@ def generate_comic_script(input_text: str) -> dict:
         return None
 
 
+def parse_partial_dialogue(dialogue_block: str) -> dict:
+    """Dialogue from a truncated panel: [{"speaker": ..., "line": ...}] pairs or the legacy {name: line} object"""
+    pairs = re.findall(r'"speaker":\s*"([^"]*)"\s*,\s*"line":\s*"([^"]*)"', dialogue_block)
+    if not pairs and '"speaker"' not in dialogue_block:
+        pairs = re.findall(r'"([^"]+)":\s*"([^"]*)"', dialogue_block)
+    return {char: text for char, text in pairs if char.strip()}
+
 def extract_partial_panels(partial_panels_json: str, character_style_guide: dict) -> list:
     """Extract partial panels from truncated JSON response, always using whatever dialogue is present. Only use fallback if no panels can be extracted."""
     logger.info("Attempting to extract partial panels from truncated JSON")
@@ -3227,16 +4037,12 @@ def extract_partial_panels(partial_panels_json: str, character_style_guide: dict
     character_names = list(character_style_guide.keys()) if character_style_guide else ["Character"]
     
     # Pattern: extract panel_id, scene, image_prompt, and dialogue (as much as possible)
-    panel_pattern = r'\{[^{}]*"panel_id":\s*(\d+)[^{}]*"scene":\s*"([^"]*)"[^{}]*"image_prompt":\s*"([^"]*)"[^{}]*"dialogue":\s*\{([^}]*)\}'
+    panel_pattern = r'\{[^{}]*"panel_id":\s*(\d+)[^{}]*"scene":\s*"([^"]*)"[^{}]*"image_prompt":\s*"([^"]*)"[^{}]*"dialogue":\s*(\{[^}]*\}|\[[^\]]*\])'
     matches = re.findall(panel_pattern, partial_panels_json, re.DOTALL)
     print(f"Found {len(matches)} panel matches using regex")
     for match in matches:
         panel_id, scene, image_prompt, dialogue_block = match
-        # Try to parse dialogue block as a dict
-        dialogue = {}
-        dialogue_items = re.findall(r'"([^"]+)":\s*"([^"]*)"', dialogue_block)
-        for char, text in dialogue_items:
-            dialogue[char] = text
+        dialogue = parse_partial_dialogue(dialogue_block)
         if not dialogue and character_names:
             dialogue = {character_names[0]: ""}
         panel = {
@@ -3260,12 +4066,8 @@ def extract_partial_panels(partial_panels_json: str, character_style_guide: dict
     if first_panel_start != -1:
         scene_match = re.search(r'"scene":\s*"([^"]*)"', partial_panels_json[first_panel_start:])
         prompt_match = re.search(r'"image_prompt":\s*"([^"]*)"', partial_panels_json[first_panel_start:])
-        dialogue_match = re.search(r'"dialogue":\s*\{([^}]*)\}', partial_panels_json[first_panel_start:])
-        dialogue = {}
-        if dialogue_match:
-            dialogue_items = re.findall(r'"([^"]+)":\s*"([^"]*)"', dialogue_match.group(1))
-            for char, text in dialogue_items:
-                dialogue[char] = text
+        dialogue_match = re.search(r'"dialogue":\s*(\{[^}]*\}|\[[^\]]*\]?)', partial_panels_json[first_panel_start:])
+        dialogue = parse_partial_dialogue(dialogue_match.group(1)) if dialogue_match else {}
         if scene_match and prompt_match:
             panel = {
                 "panel_id": 1,
@@ -3279,8 +4081,90 @@ def extract_partial_panels(partial_panels_json: str, character_style_guide: dict
     print("Could not extract any partial panels")
     return []
 
-def generate_comic_panel_images(comic_data, level="moderate", image_style=None):
-    """Generate images for each panel in batches to prevent memory overflow."""
+def panel_worker_budget():
+    """Number of panels that can render concurrently within the memory limit"""
+    headroom_mb = memory_budget.available_bytes() / MB
+    return max(0, min(MAX_PANEL_WORKERS, int(headroom_mb // PANEL_MEMORY_ESTIMATE_MB)))
+
+COMIC_STYLE_ENHANCER = "Comic style, bright, vibrant, good colors, visually appealing, dynamic composition, expressive characters. IMPORTANT: NO TEXT, NO CAPTIONS, NO SPEECH BUBBLES, NO WRITING in the image - only visual art."
+
+def render_comic_panel(panel_num, panel, style_guide_str, level="moderate", image_style=None):
+    """Render one panel image and return its URL"""
+    base_prompt = panel.get('image_prompt', '')
+    full_prompt = f"{base_prompt}\nCharacter Style Guide:\n{style_guide_str}\n{COMIC_STYLE_ENHANCER}"
+    # Use panel_num (actual index) instead of panel_id to ensure unique filenames
+    filename = generate_unique_image_filename(full_prompt, level=level, style_hint=image_style, prefix=f"comic_panel_{panel_num}")
+    logger.info(f"Rendering panel {panel_num} (panel_id={panel.get('panel_id', 'N/A')}) -> {filename}")
+    return generate_and_save_image(full_prompt, filename, level=level, style_hint=image_style)
+
+class PanelRenderQueue:
+    """Renders panels on panel_executor as they are added, bounded by the memory budget.
+
+    Image URLs are written back into each panel dict, so panel_layout keeps
+    its order no matter which render finishes first.
+    """
+
+    def __init__(self, style_guide, level="moderate", image_style=None, on_complete=None):
+        self.style_guide_str = '\n'.join([f"{k}: {v}" for k, v in style_guide.items()]) if isinstance(style_guide, dict) else str(style_guide)
+        self.level = level
+        self.image_style = image_style
+        self.on_complete = on_complete  # called with the number of completed panels
+        self.pending = deque()
+        self.in_flight = {}
+        self.completed = 0
+
+    def add(self, panel_num, panel):
+        self.pending.append((panel_num, panel))
+        self._top_up()
+
+    def poll(self):
+        """Collect finished renders without blocking and start queued ones"""
+        self._collect([future for future in self.in_flight if future.done()])
+        self._top_up()
+
+    def drain(self):
+        """Block until every queued panel has rendered (or memory forces the rest to be skipped)"""
+        while self.pending or self.in_flight:
+            if not self.in_flight and get_memory_usage() > MEMORY_LIMIT_MB:
+                logger.error(f"Memory usage too high ({get_memory_usage():.1f} MB) with no panels in flight. Skipping remaining {len(self.pending)} panels.")
+                self.pending.clear()
+                break
+            self._top_up()
+            done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            self._collect(done)
+
+    def abandon(self):
+        """Drop every panel not yet rendered: queued ones are cancelled, running ones finish unobserved"""
+        cancelled = len(self.pending) + sum(1 for future in self.in_flight if future.cancel())
+        self.pending.clear()
+        self.in_flight.clear()
+        self.completed = 0
+        return cancelled
+
+    def _top_up(self):
+        # Fill the pool as far as the current memory headroom allows (always at least one panel)
+        budget = max(panel_worker_budget(), 1)
+        while self.pending and len(self.in_flight) < budget:
+            panel_num, panel = self.pending.popleft()
+            future = panel_executor.submit(bind_context(render_comic_panel), panel_num, panel, self.style_guide_str,
+                                           self.level, self.image_style)
+            self.in_flight[future] = (panel_num, panel)
+
+    def _collect(self, futures):
+        for future in futures:
+            panel_num, panel = self.in_flight.pop(future)
+            try:
+                panel['image_url'] = future.result()
+            except Exception as e:
+                logger.error(f"Panel {panel_num} image generation failed: {e}")
+                panel['image_url'] = None
+            self.completed += 1
+            logger.info(f"Panel {panel_num} complete ({self.completed} rendered). Memory: {get_memory_usage():.1f} MB")
+            if self.on_complete:
+                self.on_complete(self.completed)
+
+def generate_comic_panel_images(comic_data, level="moderate", image_style=None, request_id=None):
+    """Generate images for all panels concurrently, bounded by the memory budget."""
     if not comic_data or 'panel_layout' not in comic_data or 'character_style_guide' not in comic_data:
         logger.error("Comic data missing panel_layout or character_style_guide.")
         return None
@@ -3289,74 +4173,104 @@ def generate_comic_panel_images(comic_data, level="moderate", image_style=None):
     initial_memory = check_memory_and_cleanup()
     logger.info(f"Starting comic panel generation with memory: {initial_memory:.1f} MB")
     
-    # Allow unlimited panels (removed MAX_PANELS limit)
-    # MAX_PANELS = 8
     panels = comic_data['panel_layout']
-    # if len(panels) > MAX_PANELS:
-    #     logger.warning(f"Too many panels ({len(panels)}), limiting to {MAX_PANELS} to prevent memory overflow")
-    #     panels = panels[:MAX_PANELS]
-    #     comic_data['panel_layout'] = panels
-    
-    style_guide = comic_data['character_style_guide']
-    style_guide_str = '\n'.join([f"{k}: {v}" for k, v in style_guide.items()]) if isinstance(style_guide, dict) else str(style_guide)
-    comic_style_enhancer = "Comic style, bright, vibrant, good colors, visually appealing, dynamic composition, expressive characters. IMPORTANT: NO TEXT, NO CAPTIONS, NO SPEECH BUBBLES, NO WRITING in the image - only visual art."
-    
-    # Process panels one at a time to minimize memory usage
-    BATCH_SIZE = 1  # Process one panel at a time to prevent memory overflow
     total_panels = len(panels)
+
+    def report(completed):
+        if request_id:
+            update_request_progress(request_id, "Generating panel images", 3, 5, f"Panel {completed}/{total_panels} complete",
+                                    step_fraction=completed / total_panels)
     
-    logger.info(f"Starting single-panel processing for {total_panels} panels")
-    
-    for panel_idx, panel in enumerate(panels):
-        panel_num = panel_idx + 1
-        logger.info(f"Processing panel {panel_num}/{total_panels}")
-        
-        # Check memory before each panel
-        current_memory = check_memory_and_cleanup()
-        if current_memory > MEMORY_LIMIT_MB:
-            logger.error(f"Memory usage too high ({current_memory:.1f} MB) for panel {panel_num}. Skipping remaining panels.")
-            break
-        
-        base_prompt = panel.get('image_prompt', '')
-        full_prompt = f"{base_prompt}\nCharacter Style Guide:\n{style_guide_str}\n{comic_style_enhancer}"
-        # Use panel_num (actual index) instead of panel_id to ensure unique filenames
-        filename = generate_unique_image_filename(full_prompt, level=level, style_hint=image_style, prefix=f"comic_panel_{panel_num}")
-        
-        print(f"\n=== GENERATING PANEL {panel_num} ===")
-        print(f"Panel ID: {panel.get('panel_id', 'N/A')}")
-        print(f"Scene: {panel.get('scene', 'N/A')}")
-        print(f"Image Prompt: {base_prompt[:100]}...")
-        print(f"Filename: {filename}")
-        print(f"Current Memory: {current_memory:.1f} MB")
-        
-        url = generate_and_save_image(full_prompt, filename, level=level, style_hint=image_style)
-        panel['image_url'] = url
-        
-        print(f"Generated URL: {url[:80]}...")
-        
-        # Aggressive memory cleanup after each image
-        gc.collect()
-        
-        # Monitor memory usage
-        memory_mb = get_memory_usage()
-        logger.info(f"Memory usage after panel {panel_num}: {memory_mb:.1f} MB")
-        if memory_mb > MEMORY_WARNING_MB:
-            logger.warning(f"High memory usage after panel {panel_num}: {memory_mb:.1f} MB")
-        
-        # Longer delay between panels to allow memory cleanup
-        if panel_num < total_panels:  # Don't delay after the last panel
-            logger.info(f"Panel {panel_num} complete. Waiting 5 seconds before next panel...")
-            time.sleep(5)  # Increased delay for better memory cleanup
+    logger.info(f"Starting concurrent processing for {total_panels} panels (max {MAX_PANEL_WORKERS} workers)")
+    queue = PanelRenderQueue(comic_data['character_style_guide'], level=level, image_style=image_style, on_complete=report)
+    for panel_num, panel in enumerate(panels, start=1):
+        queue.pending.append((panel_num, panel))
+    queue.drain()
     
     final_memory = get_memory_usage()
-    logger.info(f"Completed processing for all {total_panels} panels. Final memory: {final_memory:.1f} MB")
+    logger.info(f"Completed processing for {queue.completed}/{total_panels} panels. Final memory: {final_memory:.1f} MB")
     return comic_data
 
+def generate_comic_pipelined(input_text, level="moderate", image_style=None, request_id=None):
+    """Comic script and panel images with overlapping latency.
+
+    The panel array is streamed and each panel starts rendering as soon as its
+    JSON object closes, while the rest of the script is still generating.
+    When streaming yields fewer than three usable panels, the panels are
+    regenerated with the non-streaming step and rendered afterwards.
+    """
+    characters_data = generate_comic_characters(input_text)
+    style_guide = characters_data.get('character_style_guide', {})
+    if request_id:
+        update_request_progress(request_id, "Streaming comic panels", 2, 5, "Rendering panels as they arrive")
+
+    def report(completed):
+        if request_id:
+            update_request_progress(request_id, "Generating panel images", 3, 5, f"Panel {completed} complete")
+
+    check_memory_and_cleanup()
+    queue = PanelRenderQueue(style_guide, level=level, image_style=image_style, on_complete=report)
+    parser = JsonArrayStream()
+    panels = []
+    max_panels = COMIC_PANELS_SCHEMA.get("maxItems", 20)
+    stream_error = None
+    try:
+        stream = request_comic_panels(input_text, characters_data, stream=True)
+        usage = None
+        for chunk in stream:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = getattr(chunk, "text", None)
+            if text:
+                for item in parser.feed(text):
+                    if len(panels) >= max_panels:
+                        continue
+                    try:
+                        panel = validate_item("comic_panels", item, len(panels))
+                    except SchemaValidationError as e:
+                        parser.skipped += 1
+                        logger.warning(f"Dropping streamed panel that failed validation: {e}")
+                        continue
+                    panels.append(panel)
+                    queue.add(len(panels), panel)
+            queue.poll()
+        prompt_cache.record_usage(usage, "comic_panels")
+    except Exception as e:
+        stream_error = e
+        logger.error(f"Panel stream failed after {len(panels)} panels: {e}")
+
+    if len(panels) >= 3:
+        # A stream that broke off still yields a usable, if shorter, comic: that counts as repaired, not valid
+        truncated = stream_error is not None or parser.skipped or parser.pending
+        structured_output_stats.record("comic_panels", "repaired" if truncated else "valid")
+        if stream_error is not None:
+            logger.warning(f"Keeping the {len(panels)} panels streamed before the error")
+        logger.info(f"Streamed {len(panels)} panels; {queue.completed} already rendered when the script finished")
+    else:
+        structured_output_stats.record("comic_panels", "failed")
+        # Renders of the discarded script are not waited for; queued ones are cancelled
+        cancelled = queue.abandon()
+        logger.warning(f"Only {len(panels)} usable panels streamed; regenerating the panel script "
+                       f"({cancelled} queued renders cancelled)")
+        panels = generate_comic_panels(input_text, characters_data)
+        for panel_num, panel in enumerate(panels, start=1):
+            queue.add(panel_num, panel)
+    queue.drain()
+
+    return validate_comic_response({
+        "comic_title": characters_data.get('comic_title', 'Generated Comic'),
+        "theme": characters_data.get('theme', 'Adventure'),
+        "character_style_guide": style_guide,
+        "panel_layout": panels
+    })
+
 
 @app.route('/generate_comic', methods=['POST'])
+@async_job("comic")
+@prioritized(BATCH)
+@admitted("comic")
 def generate_comic_endpoint():
     """Enhanced endpoint to generate a comic with robust error handling and frontend compatibility"""
-    request_id = str(uuid4())
+    request_id = resolve_request_id(request.get_json(silent=True))
     
     try:
         # Validate request
@@ -3372,6 +4286,7 @@ def generate_comic_endpoint():
         level = data.get('level', 'moderate')
         image_style = data.get('image_style', None)
         user_token = data.get('user_token', None)
+        pipelined = data.get('pipelined', COMIC_PIPELINE_ENABLED)
         
         if not input_text:
             return jsonify(create_frontend_compatible_response(
@@ -3380,40 +4295,32 @@ def generate_comic_endpoint():
                 request_id=request_id
             )), 400
         
-        # Initialize progress tracking
-        request_progress[request_id] = {
-            'step': 'Starting comic generation...',
-            'step_number': 0,
-            'total_steps': 5,
-            'details': '',
-            'last_updated': datetime.now().isoformat(),
-            'progress_percentage': 0
-        }
-        request_start_times[request_id] = datetime.now()
-        
-        # Store user token for notifications
-        if user_token:
-            request_user_tokens[request_id] = user_token
+        # Initialize progress tracking, with the user token for notifications
+        start_request_progress(request_id, 'Starting comic generation...', total_steps=5, user_token=user_token)
         
         logger.info(f"Comic generation started - Request ID: {request_id}, Text length: {len(input_text)}, Level: {level}")
         
         # Step 1: Generate comic script
         update_request_progress(request_id, "Generating comic script", 1, 5, "Creating characters and story")
-        comic_data = generate_comic_script_robust(input_text)
-        
-        if not comic_data or not comic_data.get('panel_layout'):
-            return jsonify(create_frontend_compatible_response(
-                success=False,
-                error="Failed to generate comic script",
-                request_id=request_id
-            )), 500
-        
-        panel_count = len(comic_data.get('panel_layout', []))
-        update_request_progress(request_id, "Comic script complete", 2, 5, f"Generated {panel_count} panels")
-        
-        # Step 2: Generate images
-        update_request_progress(request_id, "Generating panel images", 3, 5, f"Processing {panel_count} panels")
-        comic_with_images = generate_comic_panel_images(comic_data, level=level, image_style=image_style)
+        if pipelined:
+            # Panels render while the rest of the panel script is still streaming
+            comic_with_images = generate_comic_pipelined(input_text, level=level, image_style=image_style, request_id=request_id)
+        else:
+            comic_data = generate_comic_script_robust(input_text)
+            
+            if not comic_data or not comic_data.get('panel_layout'):
+                return jsonify(create_frontend_compatible_response(
+                    success=False,
+                    error="Failed to generate comic script",
+                    request_id=request_id
+                )), 500
+            
+            panel_count = len(comic_data.get('panel_layout', []))
+            update_request_progress(request_id, "Comic script complete", 2, 5, f"Generated {panel_count} panels")
+            
+            # Step 2: Generate images
+            update_request_progress(request_id, "Generating panel images", 3, 5, f"Processing {panel_count} panels")
+            comic_with_images = generate_comic_panel_images(comic_data, level=level, image_style=image_style, request_id=request_id)
         
         if not comic_with_images:
             return jsonify(create_frontend_compatible_response(
@@ -3423,6 +4330,8 @@ def generate_comic_endpoint():
             )), 500
         
         final_panel_count = len(comic_with_images.get('panel_layout', []))
+        attach_srcsets(comic_with_images.get('panel_layout', []), 'image_url', preferred_image_format(data),
+                       srcset_key='image_srcset')
         update_request_progress(request_id, "Comic generation complete", 5, 5, f"Successfully generated {final_panel_count} panels with images")
         
         # Send completion notification
@@ -3628,6 +4537,83 @@ def create_fallback_panels(partial_panels_json: str, character_style_guide: dict
     logger.info(f"Created {len(panels)} fallback panels")
     return panels
 
+def sign_gcs_blob(gcs_path, minutes=SIGNED_URL_EXPIRATION_MINUTES):
+    """Generate a fresh V4 signed GET URL for an existing blob"""
+    try:
+        if not initialize_gcs():
+            logger.error("❌ GCS client not available")
+            return None
+        return bucket.blob(gcs_path).generate_signed_url(
+            version="v4",
+            expiration=timedelta(minutes=minutes),
+            method="GET"
+        )
+    except Exception as e:
+        logger.error(f"❌ Error signing GCS blob {gcs_path}: {e}")
+        return None
+
+def gcs_blob_exists(gcs_path):
+    """False only when GCS confirms the blob is gone; lookup errors count as present so records are not dropped"""
+    try:
+        if not initialize_gcs():
+            return True
+        return bucket.blob(gcs_path).exists()
+    except Exception as e:
+        logger.warning(f"Could not check GCS blob {gcs_path}: {e}")
+        return True
+
+def upload_bytes_to_gcs(data, gcs_path, content_type="application/octet-stream"):
+    """Upload raw bytes without signing; returns True on success"""
+    try:
+        if not initialize_gcs():
+            logger.error("❌ GCS client not available")
+            return False
+        bucket.blob(gcs_path).upload_from_string(data, content_type=content_type)
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error uploading {gcs_path} to GCS: {e}")
+        return False
+
+def create_image_derivatives(image_bytes, blob_path, on_ready=None):
+    """Render and upload thumbnail/medium/full derivatives of a stored image in the background; never blocks the caller"""
+    if not IMAGE_DERIVATIVES_ENABLED:
+        return None
+    reserve = lambda: memory_budget.reserve("image_derivatives", estimate_decode_bytes(image_bytes),
+                                            timeout=MEMORY_RESERVATION_TIMEOUT_SECONDS)
+    return image_derivatives.create_later(image_bytes, blob_path, upload_bytes_to_gcs, IMAGE_DERIVATIVE_FORMATS,
+                                          render=image_workers.render_derivatives, reserve=reserve,
+                                          on_ready=on_ready)
+
+def preferred_image_format(data=None):
+    """Negotiate the srcset image format from the image_format field or the Accept header"""
+    if data is None:
+        data = request.get_json(silent=True) or {}
+    return negotiate_image_format(data.get("image_format"), request.headers.get("Accept"))
+
+def text_cache_enabled(data=None):
+    """False when the request opts out of cached text via "cache": "bypass" or Cache-Control: no-cache"""
+    if data is None:
+        data = request.get_json(silent=True) or {}
+    if str(data.get("cache", "")).lower() in ("bypass", "no-cache", "false"):
+        return False
+    return "no-cache" not in (request.headers.get("Cache-Control") or "").lower()
+
+def attach_srcsets(items, url_key, image_format, srcset_key="srcset"):
+    """Add a srcset next to url_key on every dict in items that carries an image URL
+
+    Derivatives of just-generated images are still rendering in the background;
+    they get up to IMAGE_DERIVATIVE_WAIT_SECONDS to finish before the srcsets are built.
+    """
+    urls = [item[url_key] for item in items or [] if isinstance(item, dict) and item.get(url_key)]
+    if not urls:
+        return
+    image_derivatives.wait([blob_path_from_url(url, GCS_BUCKET_NAME) for url in urls], IMAGE_DERIVATIVE_WAIT_SECONDS)
+    for item in items or []:
+        if isinstance(item, dict) and item.get(url_key):
+            srcset = image_derivatives.srcset(item[url_key], image_format, sign_gcs_blob, GCS_BUCKET_NAME)
+            if srcset:
+                item[srcset_key] = srcset
+
 def upload_to_gcs(file_path, gcs_path, content_type="application/octet-stream"):
     """Safely upload a file to Google Cloud Storage"""
     try:
@@ -3641,12 +4627,7 @@ def upload_to_gcs(file_path, gcs_path, content_type="application/octet-stream"):
             blob.upload_from_file(file, content_type=content_type)
         
         # Generate signed URL
-        expiration_time = timedelta(minutes=60)
-        signed_url = blob.generate_signed_url(
-            version="v4",
-            expiration=expiration_time,
-            method="GET"
-        )
+        signed_url = sign_gcs_blob(gcs_path)
         
         logger.info(f"✅ File uploaded to GCS: {gcs_path}")
         return signed_url
@@ -3668,12 +4649,7 @@ def upload_buffer_to_gcs(buffer, gcs_path, content_type="application/octet-strea
         blob.upload_from_file(buffer, content_type=content_type)
         
         # Generate signed URL
-        expiration_time = timedelta(minutes=60)
-        signed_url = blob.generate_signed_url(
-            version="v4",
-            expiration=expiration_time,
-            method="GET"
-        )
+        signed_url = sign_gcs_blob(gcs_path)
         
         logger.info(f"✅ Buffer uploaded to GCS: {gcs_path}")
         return signed_url
@@ -3846,141 +4822,148 @@ def create_frontend_compatible_response(success: bool, data: dict = None, error:
     return response
 
 # Enhanced comic generation with better error handling
+def generate_comic_characters(input_text: str, max_retries: int = 3) -> dict:
+    """Step 1 of comic generation: title, theme and character style guide, with retries."""
+    characters_data = None
+    
+    for attempt in range(max_retries):
+        try:
+            print(f"[Comic Generation] Step 1: Generating characters and theme (attempt {attempt + 1}/{max_retries})")
+            logger.info(f"Step 1: Generating characters and theme (attempt {attempt + 1}/{max_retries})")
+            characters_prompt = COMIC_CHARACTERS_PROMPT_TEMPLATE.format(input_text=input_text)
+            characters_response = llm_generate("comic_characters",
+                model="gemini-2.5-pro",
+                contents=characters_prompt,
+                config=types.GenerateContentConfig(
+                    system_instruction="You are an expert comic scriptwriter. Always return valid JSON.",
+                    **structured_config("comic_characters")
+                )
+            )
+            
+            characters_text = None
+            if characters_response:
+                if hasattr(characters_response, 'text') and characters_response.text:
+                    characters_text = characters_response.text
+                elif (hasattr(characters_response, 'candidates') and 
+                      characters_response.candidates and 
+                      len(characters_response.candidates) > 0 and
+                      hasattr(characters_response.candidates[0], 'content') and
+                      characters_response.candidates[0].content and
+                      hasattr(characters_response.candidates[0].content, 'parts') and
+                      characters_response.candidates[0].content.parts and
+                      len(characters_response.candidates[0].content.parts) > 0 and
+                      hasattr(characters_response.candidates[0].content.parts[0], 'text')):
+                    characters_text = characters_response.candidates[0].content.parts[0].text
+            
+            if not characters_text:
+                print("[Comic Generation] No text in characters model response or response is None.")
+                raise ValueError("No text in characters model response")
+            
+            characters_data = parse_with_repair(
+                "comic_characters", characters_text,
+                repair=lambda text: json.loads(extract_json_from_response(text)),
+                stats=structured_output_stats
+            )
+            print("[Comic Generation] Characters and theme generated:", characters_data)
+            logger.info("Successfully generated characters and theme")
+            break
+            
+        except Exception as e:
+            print(f"[Comic Generation] Attempt {attempt + 1} failed: {e}")
+            logger.error(f"Attempt {attempt + 1} failed: {e}")
+            if attempt == max_retries - 1:
+                raise e
+            structured_output_stats.record_retry("comic_characters")
+            time.sleep(2)  # Wait before retry
+    return characters_data
+
+COMIC_PANELS_SYSTEM_INSTRUCTION = "You are an expert comic scriptwriter. Generate 7-20 panels with meaningful dialogue. Always return valid JSON array."
+
+def request_comic_panels(input_text: str, characters_data: dict, stream: bool = False):
+    """Call the panel model; the source text goes first so retries and repeat comics reuse its cached prefix."""
+    instructions = COMIC_PANELS_INSTRUCTIONS_TEMPLATE.format(
+        character_style_guide=json.dumps(characters_data.get('character_style_guide', {})),
+        theme=characters_data.get('theme', 'Adventure')
+    )
+    return generate_content_cached(
+        COMIC_PANELS_MODEL,
+        COMIC_PANELS_SYSTEM_INSTRUCTION,
+        instructions,
+        prefix_contents=[COMIC_SOURCE_TEXT_TEMPLATE.format(input_text=input_text)],
+        label="comic_panels",
+        stream=stream,
+        **structured_config("comic_panels")
+    )
+
+def generate_comic_panels(input_text: str, characters_data: dict, max_retries: int = 3) -> list:
+    """Step 2 of comic generation: the panel array, with retries and fallback panels."""
+    panels_data = None
+    
+    for attempt in range(max_retries):
+        try:
+            print(f"[Comic Generation] Step 2: Generating panels (attempt {attempt + 1}/{max_retries})")
+            logger.info(f"Step 2: Generating panels (attempt {attempt + 1}/{max_retries})")
+            panels_response = request_comic_panels(input_text, characters_data)
+            
+            panels_text = None
+            if panels_response:
+                if hasattr(panels_response, 'text') and panels_response.text:
+                    panels_text = panels_response.text
+                elif (hasattr(panels_response, 'candidates') and 
+                      panels_response.candidates and 
+                      len(panels_response.candidates) > 0 and
+                      hasattr(panels_response.candidates[0], 'content') and
+                      panels_response.candidates[0].content and
+                      hasattr(panels_response.candidates[0].content, 'parts') and
+                      panels_response.candidates[0].content.parts and
+                      len(panels_response.candidates[0].content.parts) > 0 and
+                      hasattr(panels_response.candidates[0].content.parts[0], 'text')):
+                    panels_text = panels_response.candidates[0].content.parts[0].text
+            
+            if not panels_text:
+                print("[Comic Generation] No text in panels model response or response is None.")
+                raise ValueError("No text in panels model response")
+            
+            def repair_panels_json(text):
+                text = extract_json_from_response(text)
+                # Try multiple parsing strategies
+                try:
+                    return json.loads(text)
+                except json.JSONDecodeError:
+                    print("[Comic Generation] Panels JSON decode error, trying to fix truncated JSON...")
+                    return json.loads(fix_truncated_panels_json(text))
+
+            # The schema also enforces the 3-panel minimum
+            panels_data = parse_with_repair("comic_panels", panels_text, repair=repair_panels_json,
+                                            stats=structured_output_stats)
+            print("[Comic Generation] Panels generated:", panels_data)
+            
+            logger.info(f"Successfully generated {len(panels_data)} panels")
+            break
+            
+        except Exception as e:
+            print(f"[Comic Generation] Panel generation attempt {attempt + 1} failed: {e}")
+            logger.error(f"Panel generation attempt {attempt + 1} failed: {e}")
+            if attempt == max_retries - 1:
+                # Create fallback panels
+                panels_data = create_fallback_panels("", characters_data.get('character_style_guide', {}))
+                print(f"[Comic Generation] Using {len(panels_data)} fallback panels")
+            else:
+                structured_output_stats.record_retry("comic_panels")
+                time.sleep(2)  # Wait before retry
+    return panels_data
+
 def generate_comic_script_robust(input_text: str) -> dict:
     print("[Comic Generation] Starting robust comic script generation...")
     try:
         logger.info("Starting robust comic script generation")
         
         # Step 1: Generate characters and theme with retry logic
-        characters_data = None
         max_retries = 3
-        
-        for attempt in range(max_retries):
-            try:
-                print(f"[Comic Generation] Step 1: Generating characters and theme (attempt {attempt + 1}/{max_retries})")
-                logger.info(f"Step 1: Generating characters and theme (attempt {attempt + 1}/{max_retries})")
-                characters_prompt = COMIC_CHARACTERS_PROMPT_TEMPLATE.format(input_text=input_text)
-                characters_response = client.models.generate_content(
-                    model="gemini-2.5-pro",
-                    contents=characters_prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction="You are an expert comic scriptwriter. Always return valid JSON."
-                    )
-                )
-                
-                characters_text = None
-                if characters_response:
-                    if hasattr(characters_response, 'text') and characters_response.text:
-                        characters_text = characters_response.text
-                    elif (hasattr(characters_response, 'candidates') and 
-                          characters_response.candidates and 
-                          len(characters_response.candidates) > 0 and
-                          hasattr(characters_response.candidates[0], 'content') and
-                          characters_response.candidates[0].content and
-                          hasattr(characters_response.candidates[0].content, 'parts') and
-                          characters_response.candidates[0].content.parts and
-                          len(characters_response.candidates[0].content.parts) > 0 and
-                          hasattr(characters_response.candidates[0].content.parts[0], 'text')):
-                        characters_text = characters_response.candidates[0].content.parts[0].text
-                
-                if not characters_text:
-                    print("[Comic Generation] No text in characters model response or response is None.")
-                    raise ValueError("No text in characters model response")
-                
-                characters_text = extract_json_from_response(characters_text)
-                characters_data = json.loads(characters_text)
-                print("[Comic Generation] Characters and theme generated:", characters_data)
-                
-                # Validate basic structure
-                if not isinstance(characters_data, dict):
-                    raise ValueError("Characters response is not a dictionary")
-                
-                if "character_style_guide" not in characters_data:
-                    raise ValueError("Missing character_style_guide in response")
-                
-                logger.info("Successfully generated characters and theme")
-                break
-                
-            except Exception as e:
-                print(f"[Comic Generation] Attempt {attempt + 1} failed: {e}")
-                logger.error(f"Attempt {attempt + 1} failed: {e}")
-                if attempt == max_retries - 1:
-                    raise e
-                time.sleep(2)  # Wait before retry
+        characters_data = generate_comic_characters(input_text, max_retries)
         
         # Step 2: Generate panels with retry logic
-        panels_data = None
-        
-        for attempt in range(max_retries):
-            try:
-                print(f"[Comic Generation] Step 2: Generating panels (attempt {attempt + 1}/{max_retries})")
-                logger.info(f"Step 2: Generating panels (attempt {attempt + 1}/{max_retries})")
-                character_style_guide_str = json.dumps(characters_data.get('character_style_guide', {}))
-                panels_prompt = COMIC_PANELS_PROMPT_TEMPLATE.format(
-                    input_text=input_text,
-                    character_style_guide=character_style_guide_str,
-                    theme=characters_data.get('theme', 'Adventure')
-                )
-                
-                panels_response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=panels_prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction="You are an expert comic scriptwriter. Generate 7-20 panels with meaningful dialogue. Always return valid JSON array."
-                    )
-                )
-                
-                panels_text = None
-                if panels_response:
-                    if hasattr(panels_response, 'text') and panels_response.text:
-                        panels_text = panels_response.text
-                    elif (hasattr(panels_response, 'candidates') and 
-                          panels_response.candidates and 
-                          len(panels_response.candidates) > 0 and
-                          hasattr(panels_response.candidates[0], 'content') and
-                          panels_response.candidates[0].content and
-                          hasattr(panels_response.candidates[0].content, 'parts') and
-                          panels_response.candidates[0].content.parts and
-                          len(panels_response.candidates[0].content.parts) > 0 and
-                          hasattr(panels_response.candidates[0].content.parts[0], 'text')):
-                        panels_text = panels_response.candidates[0].content.parts[0].text
-                
-                if not panels_text:
-                    print("[Comic Generation] No text in panels model response or response is None.")
-                    raise ValueError("No text in panels model response")
-                
-                panels_text = extract_json_from_response(panels_text)
-                
-                # Try multiple parsing strategies
-                try:
-                    panels_data = json.loads(panels_text)
-                    print("[Comic Generation] Panels generated:", panels_data)
-                except json.JSONDecodeError:
-                    print("[Comic Generation] Panels JSON decode error, trying to fix truncated JSON...")
-                    fixed_panels_text = fix_truncated_panels_json(panels_text)
-                    panels_data = json.loads(fixed_panels_text)
-                    print("[Comic Generation] Panels generated after fixing:", panels_data)
-                
-                # Validate panels structure
-                if not isinstance(panels_data, list):
-                    raise ValueError("Panels response is not a list")
-                
-                if len(panels_data) < 3:
-                    print(f"[Comic Generation] Too few panels generated: {len(panels_data)}")
-                    raise ValueError(f"Too few panels generated: {len(panels_data)}")
-                
-                logger.info(f"Successfully generated {len(panels_data)} panels")
-                break
-                
-            except Exception as e:
-                print(f"[Comic Generation] Panel generation attempt {attempt + 1} failed: {e}")
-                logger.error(f"Panel generation attempt {attempt + 1} failed: {e}")
-                if attempt == max_retries - 1:
-                    # Create fallback panels
-                    panels_data = create_fallback_panels("", characters_data.get('character_style_guide', {}))
-                    print(f"[Comic Generation] Using {len(panels_data)} fallback panels")
-                else:
-                    time.sleep(2)  # Wait before retry
+        panels_data = generate_comic_panels(input_text, characters_data, max_retries)
         
         # Combine and validate final comic data
         comic_data = {
@@ -4014,10 +4997,44 @@ def generate_comic_script_robust(input_text: str) -> dict:
             ]
         }
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job, with its live progress while it runs."""
+    job = job_manager.get(job_id) if REQUEST_ID_PATTERN.match(job_id) else None
+    if job is None:
+        return jsonify({"error": "Job not found or expired", "job_id": job_id}), 404
+    body = {**job.to_dict(), "request_id": job_id, **job_links(job_id)}
+    position = job_manager.queue_position(job)
+    if position is not None:
+        body["queue_position"] = position
+    progress = get_request_progress(job_id)
+    if progress:
+        body["progress"] = progress
+    return jsonify(body), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """The job's response body and status code once finished; 202 while it is still queued or running."""
+    job = job_manager.get(job_id) if REQUEST_ID_PATTERN.match(job_id) else None
+    if job is None:
+        return jsonify({"error": "Job not found or expired", "job_id": job_id}), 404
+    if not job.finished:
+        response = jsonify({**job.to_dict(), "request_id": job_id, **job_links(job_id)})
+        response.status_code = 202
+        response.headers["Retry-After"] = "5"
+        return response
+    return jsonify(job.payload), job.status_code
+
 # Enhanced progress endpoint with better error handling
 @app.route('/progress/<request_id>', methods=['GET'])
 def get_progress(request_id):
     """Enhanced progress endpoint with better error handling"""
+    if not REQUEST_ID_PATTERN.match(request_id):
+        return jsonify(create_frontend_compatible_response(
+            success=False,
+            error="Invalid request id",
+            request_id=request_id
+        )), 400
     try:
         progress = get_request_progress(request_id)
         if progress:
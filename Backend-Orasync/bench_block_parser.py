@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the content block parser.
+
+Compares the legacy batch parser (reference copy in test_block_parser.py) with
+the incremental parser, both on complete responses and fed in small chunks as
+the streaming API delivers them.
+
+Usage: python bench_block_parser.py [repeat]
+"""
+
+import sys
+import time
+
+from block_parser import IncrementalBlockParser, parse_blocks
+from test_block_parser import legacy_parse_blocks, load_corpus
+
+
+def streamed(text, chunk_size=64):
+    parser = IncrementalBlockParser()
+    items = []
+    for i in range(0, len(text), chunk_size):
+        items += parser.feed(text[i:i + chunk_size])
+    return items + parser.close()
+
+
+def measure(parse, documents, repeat):
+    total_bytes = sum(len(doc.encode("utf-8")) for doc in documents) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for doc in documents:
+            parse(doc)
+    elapsed = time.perf_counter() - start
+    return total_bytes / elapsed / 1_000_000, elapsed
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    documents = list(load_corpus().values())
+    size_kb = sum(len(doc.encode("utf-8")) for doc in documents) / 1024
+    print(f"Corpus: {len(documents)} responses, {size_kb:.1f} KB, repeated {repeat}x\n")
+    print(f"{'parser':<28}{'MB/s':>10}{'seconds':>10}")
+    for label, parse in (
+        ("legacy (batch)", legacy_parse_blocks),
+        ("incremental (complete)", parse_blocks),
+        ("incremental (64-char chunks)", streamed),
+    ):
+        throughput, elapsed = measure(parse, documents, repeat)
+        print(f"{label:<28}{throughput:>10.2f}{elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
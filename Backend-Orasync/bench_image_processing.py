@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark the image fast path against the full decode/re-encode path.
+
+Each path runs in its own subprocess so peak RSS is measured in isolation.
+
+Usage: python bench_image_processing.py [iterations]
+"""
+
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from image_processing import normalize_image_bytes
+
+
+def sample_png(size=(1024, 1024)) -> bytes:
+    """Opaque PNG shaped like model output (noisy, so compression does real work)."""
+    image = Image.effect_noise(size, 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def run_path(path: str, iterations: int):
+    data = sample_png()
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        normalize_image_bytes(data, force_transcode=(path == "transcode"))
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{path},{cpu / iterations * 1000:.3f},{wall / iterations * 1000:.3f},"
+          f"{peak_kb / 1024:.1f},{(peak_kb - baseline_kb) / 1024:.1f}")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"Processing a 1024x1024 opaque PNG, {iterations} iterations per path\n")
+    print(f"{'path':<12}{'cpu ms/img':>12}{'wall ms/img':>13}{'peak RSS MB':>13}{'RSS delta MB':>14}")
+    results = {}
+    for path in ("fast", "transcode"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", path, str(iterations)],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip().split(",")
+        name, cpu, wall, peak, delta = out[0], *map(float, out[1:])
+        results[name] = cpu
+        print(f"{name:<12}{cpu:>12.3f}{wall:>13.3f}{peak:>13.1f}{delta:>14.1f}")
+    if results["fast"] > 0:
+        print(f"\n⚡ Fast path uses {results['transcode'] / results['fast']:.0f}x less CPU per image")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run_path(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,244 @@
+"""
+Incremental parser for generated lesson text.
+
+Turns the model's marked-up output into content blocks (heading, paragraph,
+quizHeading, multipleChoiceQuestion) and image placeholders while the text is
+still streaming in. A block is only emitted once it is complete.
+
+process_input_text parses complete responses with parse_blocks; the streaming
+/process mode feeds the parser chunk by chunk. Both give the same blocks.
+"""
+
+import re
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+GHIBLI_IMAGE_PATTERN = re.compile(r'\[GhibliImage:\s*(.*?)\s*\]\n?', re.IGNORECASE)
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r'\[Image:\s*(.*?)\s*\]', re.IGNORECASE)
+QUIZ_HEADING_PATTERN = re.compile(r"^\*\*(Quiz Time!|Test Your Knowledge!?)\*\*", re.IGNORECASE)
+QUESTION_START_PATTERN = re.compile(r"^\d+\.\s*(.+)$")
+OPTION_PATTERN = re.compile(r"^([a-z])\)\s*(.+)$", re.IGNORECASE)
+CORRECT_ANSWER_PATTERN = re.compile(r"^Correct Answer:\s*([a-z])$", re.IGNORECASE)
+EXPLANATION_PATTERN = re.compile(r"^Explanation:\s*(.+)$", re.IGNORECASE)
+HEADING_PATTERN = re.compile(r"^\*\*(?!(?:Quiz Time!|Test Your Knowledge!?)$)(.+?)\*\*$")
+
+# Openers used to hold back text whose placeholder may still be completed by later chunks
+_GHIBLI_OPENER = re.compile(r'\[GhibliImage:', re.IGNORECASE)
+_IMAGE_OPENER = re.compile(r'\[Image:', re.IGNORECASE)
+
+IMAGE_PLACEHOLDER = "imagePlaceholder"
+
+
+class IncrementalBlockParser:
+    """Feed text chunks in, get completed blocks and image placeholders out.
+
+    Image placeholders are dicts {"type": "imagePlaceholder", "prompt": ...,
+    "summary": bool}; the caller turns them into image blocks. The first
+    [GhibliImage: ...] tag is the summary image.
+    """
+
+    def __init__(self):
+        # Only the current partial line, an unresolved question or a tag that
+        # may still close is ever held back
+        self._buffer = ""     # text not yet split into segments
+        self._tail = ""       # partial last line of the current segment
+        self._lines = deque()  # complete lines of the current segment not yet parsed
+        self._paragraph: List[str] = []
+        self._summary_found = False
+        self.closed = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Add a chunk of generated text; returns the items completed by it."""
+        if self.closed:
+            raise ValueError("Parser is closed")
+        self._buffer += chunk
+        return self._drain(final=False)
+
+    def close(self, chunk: str = "") -> List[Dict]:
+        """Signal end of text (optionally with a last chunk); returns the remaining items."""
+        if self.closed:
+            return []
+        self._buffer += chunk
+        items = self._drain(final=True)
+        self.closed = True
+        return items
+
+    # -- segmenting -------------------------------------------------------
+
+    def _safe_limit(self) -> int:
+        """End of the prefix of the buffer that later chunks can no longer change."""
+        limit = self._buffer.rfind('\n') + 1
+        if '[' not in self._buffer:
+            return limit
+        while True:
+            checks = [(_IMAGE_OPENER, IMAGE_PLACEHOLDER_PATTERN)]
+            if not self._summary_found:
+                checks.insert(0, (_GHIBLI_OPENER, GHIBLI_IMAGE_PATTERN))
+            new_limit = limit
+            for opener, pattern in checks:
+                pos = 0
+                while True:
+                    start = opener.search(self._buffer, pos, new_limit)
+                    if not start:
+                        break
+                    match = pattern.match(self._buffer, start.start(), new_limit)
+                    if not match:
+                        # The tag may still close in text we have not seen yet
+                        new_limit = self._buffer.rfind('\n', 0, start.start()) + 1
+                        break
+                    pos = match.end()
+            if new_limit == limit:
+                return limit
+            limit = new_limit
+
+    def _drain(self, final: bool) -> List[Dict]:
+        items: List[Dict] = []
+        limit = len(self._buffer) if final else self._safe_limit()
+        if not self._summary_found:
+            match = GHIBLI_IMAGE_PATTERN.search(self._buffer, 0, limit)
+            if match:
+                self._summary_found = True
+                items.append({"type": IMAGE_PLACEHOLDER, "prompt": match.group(1).strip(), "summary": True})
+                self._buffer = self._buffer[:match.start()] + self._buffer[match.end():]
+                limit = len(self._buffer) if final else self._safe_limit()
+
+        region, self._buffer = self._buffer[:limit], self._buffer[limit:]
+        last_idx = 0
+        for match in IMAGE_PLACEHOLDER_PATTERN.finditer(region):
+            self._add_segment_text(region[last_idx:match.start()], items, parse=False)
+            self._end_segment(items)
+            items.append({"type": IMAGE_PLACEHOLDER, "prompt": match.group(1).strip(), "summary": False})
+            last_idx = match.end()
+        self._add_segment_text(region[last_idx:], items, parse=not final)
+        if final:
+            self._end_segment(items)
+        return items
+
+    def _add_segment_text(self, text: str, items: List[Dict], parse: bool = True):
+        if not text:
+            return
+        parts = (self._tail + text).split('\n')
+        self._tail = parts.pop()
+        self._lines.extend(parts)
+        if parse:
+            self._parse_lines(items, final=False)
+
+    def _end_segment(self, items: List[Dict]):
+        self._lines.append(self._tail)
+        self._tail = ""
+        self._parse_lines(items, final=True)
+        self._flush_paragraph(items)
+
+    # -- line rules -------------------------------------------------------
+
+    def _flush_paragraph(self, items: List[Dict]):
+        if self._paragraph:
+            content = "\n".join(self._paragraph).strip()
+            if content:
+                items.append({"type": "paragraph", "content": content, "id": str(uuid4())})
+            self._paragraph.clear()
+
+    def _parse_lines(self, items: List[Dict], final: bool):
+        lines = self._lines
+        while lines:
+            line = lines[0].strip()
+            if not line:
+                self._flush_paragraph(items)
+                lines.popleft()
+                continue
+            first_char = line[0]
+            if first_char != '*' and not first_char.isdigit():
+                # Plain text line: none of the block patterns can match
+                self._paragraph.append(line)
+                lines.popleft()
+                continue
+            if QUIZ_HEADING_PATTERN.match(line):
+                self._flush_paragraph(items)
+                items.append({"type": "quizHeading", "content": line.strip('*!? '), "id": str(uuid4())})
+                lines.popleft()
+                continue
+            question_match = QUESTION_START_PATTERN.match(line)
+            if question_match:
+                self._flush_paragraph(items)
+                parsed = self._parse_question(question_match.group(1).strip(), final)
+                if parsed is None:
+                    return  # Wait for more lines before deciding
+                consumed, block = parsed
+                if block:
+                    items.append(block)
+                    for _ in range(consumed):
+                        lines.popleft()
+                else:
+                    self._paragraph.append(line)
+                    lines.popleft()
+                continue
+            heading_match = HEADING_PATTERN.match(line)
+            if heading_match:
+                self._flush_paragraph(items)
+                items.append({"type": "heading", "content": heading_match.group(1).strip(), "id": str(uuid4())})
+                lines.popleft()
+                continue
+            self._paragraph.append(line)
+            lines.popleft()
+
+    def _parse_question(self, question_text: str, final: bool) -> Optional[Tuple[int, Optional[Dict]]]:
+        """Look ahead from a question line; None means the answer depends on lines not yet received."""
+        lines = self._lines
+        options = []  # (letter, text); ids are only minted once the question is accepted
+        correct_answer_char = None
+        explanation = None
+
+        idx = 1
+        while idx < len(lines):
+            option_line = lines[idx].strip()
+            if not option_line:
+                idx += 1
+                continue
+            option_match = OPTION_PATTERN.match(option_line)
+            if not option_match:
+                break
+            options.append((option_match.group(1).lower(), option_match.group(2).strip()))
+            idx += 1
+
+        for pattern in (CORRECT_ANSWER_PATTERN, EXPLANATION_PATTERN):
+            if idx >= len(lines):
+                if not final:
+                    return None
+                break
+            candidate = lines[idx].strip()
+            if not candidate:
+                if idx + 1 >= len(lines) and not final:
+                    return None
+                if idx + 1 < len(lines):
+                    idx += 1
+                    candidate = lines[idx].strip()
+            match = pattern.match(candidate)
+            if not match:
+                continue
+            if pattern is CORRECT_ANSWER_PATTERN:
+                correct_answer_char = match.group(1).lower()
+            else:
+                explanation = match.group(1).strip()
+            idx += 1
+
+        if not (question_text and options and correct_answer_char):
+            return 0, None
+        parsed_options = []
+        option_id_map = {}
+        for option_char, option_text in options:
+            option_id = f"opt-{option_char}-{uuid4().hex[:6]}"
+            parsed_options.append({"id": option_id, "text": option_text})
+            option_id_map[option_char] = option_id
+        if correct_answer_char not in option_id_map:
+            return 0, None
+        return idx, {
+            "type": "multipleChoiceQuestion", "content": question_text,
+            "options": parsed_options, "correctAnswerID": option_id_map[correct_answer_char],
+            "explanation": explanation, "id": str(uuid4())
+        }
+
+
+def parse_blocks(text: str) -> List[Dict]:
+    """Parse a complete text in one go."""
+    return IncrementalBlockParser().close(text)
@@ -0,0 +1,361 @@
+"""
+Caching primitives shared by the generation services.
+
+L1 is a bounded in-process LRU. L2 is a pluggable, content-addressed record
+store (in-memory, local directory or a GCS prefix) that survives restarts and
+is shared between instances when backed by GCS. Text responses use an LRU
+keyed by the canonical (normalized) request.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU cache with optional TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self.ttl_seconds is not None and time.time() - stored_at >= self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries when full."""
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# ============================================================================
+# Text generation responses
+# ============================================================================
+
+_HORIZONTAL_WHITESPACE = re.compile(r"[ \t\f\v]+")
+_EXTRA_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_prompt_text(text: Optional[str]) -> str:
+    """Canonical form of prompt text for cache keys: NFC, LF newlines, collapsed spacing."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    lines = [_HORIZONTAL_WHITESPACE.sub(" ", line).strip() for line in text.split("\n")]
+    return _EXTRA_BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def text_cache_key(model: str, contents: str, system_instruction: Optional[str] = None, **params) -> str:
+    """Hash of the model, normalized prompt, normalized system instruction and any extra generation params.
+
+    Params set to None are left out, so passing one as None keys the same as not passing it.
+    """
+    payload = json.dumps({
+        "model": model,
+        "contents": normalize_prompt_text(contents),
+        "system_instruction": normalize_prompt_text(system_instruction),
+        "params": {name: value for name, value in params.items() if value is not None},
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TextResponseCache(LRUCache):
+    """LRU + TTL cache of model text responses that also counts bypassed lookups and stores."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: Optional[float] = None):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.bypasses = 0
+        self.stores = 0
+
+    def lookup(self, key: str, bypass: bool = False) -> Optional[str]:
+        """Cached text for key; a bypassed lookup always misses so the caller refreshes the entry."""
+        if bypass:
+            with self._lock:
+                self.bypasses += 1
+            return None
+        return self.get(key)
+
+    def store(self, key: str, text: Optional[str]):
+        if not text or not text.strip():
+            return
+        self.set(key, text)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        with self._lock:
+            stats.update({"bypasses": self.bypasses, "stores": self.stores})
+        return stats
+
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def is_complete_json_response(text: Optional[str]) -> bool:
+    """True when a JSON response (optionally fenced) parses as-is, so truncated output is never cached."""
+    if not text:
+        return False
+    body = _CODE_FENCE.sub("", text.strip())
+    starts = [i for i in (body.find("{"), body.find("[")) if i != -1]
+    if not starts:
+        return False
+    start = min(starts)
+    end = body.rfind("}" if body[start] == "{" else "]")
+    if end < start:
+        return False
+    try:
+        json.loads(body[start:end + 1])
+        return True
+    except ValueError:
+        return False
+
+
+def finished_normally(response) -> bool:
+    """True when the (final streamed) response's first candidate stopped on its own, not at MAX_TOKENS or SAFETY."""
+    candidates = getattr(response, "candidates", None) or []
+    reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    return getattr(reason, "name", reason) == "STOP"
+
+
+# ============================================================================
+# L2 record stores - each maps a content key to a small JSON-serialisable dict
+# ============================================================================
+
+class MemoryCacheBackend:
+    """Process-local L2 store, mainly for tests and local development."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._records: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record else None
+
+    def put(self, key: str, record: dict):
+        with self._lock:
+            self._records[key] = dict(record)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class LocalDirectoryCacheBackend:
+    """L2 store that keeps one JSON file per key under a local directory."""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cache record {key}: {e}")
+            return None
+
+    def put(self, key: str, record: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)  # Atomic, so readers never see a partial record
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class GCSCacheBackend:
+    """L2 store backed by small JSON objects under a GCS prefix, shared by all instances."""
+
+    name = "gcs"
+
+    def __init__(self, get_bucket: Callable, prefix: str = "cache/images/"):
+        # get_bucket is called lazily so GCS can be initialised after import
+        self._get_bucket = get_bucket
+        self.prefix = prefix
+
+    def _blob(self, key: str):
+        bucket = self._get_bucket()
+        if bucket is None:
+            raise RuntimeError("GCS bucket not available")
+        return bucket.blob(f"{self.prefix}{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._blob(key).download_as_text())
+        except Exception as e:
+            # google.api_core NotFound is the common case; anything else is logged
+            if type(e).__name__ != "NotFound":
+                logger.warning(f"GCS cache lookup failed for {key}: {e}")
+            return None
+
+    def put(self, key: str, record: dict):
+        self._blob(key).upload_from_string(json.dumps(record), content_type="application/json")
+
+    def delete(self, key: str):
+        try:
+            self._blob(key).delete()
+        except Exception:
+            pass
+
+
+class TieredImageCache:
+    """Two-level cache of generated image records keyed by content hash.
+
+    Records store the GCS blob path rather than a signed URL, so a hit can be
+    re-signed on demand and never hands out an expired link.
+    """
+
+    def __init__(self, l2_backend, l1_max_entries: int = 512, ttl_seconds: Optional[float] = None):
+        self.l1 = LRUCache(max_entries=l1_max_entries, ttl_seconds=ttl_seconds)
+        self.l2 = l2_backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self.l2_invalidated = 0
+
+    def get(self, key: str, validate: Optional[Callable[[dict], bool]] = None) -> Optional[dict]:
+        """Return the record for key from L1, falling back to L2 (and promoting it).
+
+        validate(record) is checked before an L2 record is promoted; records
+        it rejects (e.g. their blob no longer exists) are deleted from L2.
+        """
+        record = self.l1.get(key)
+        if record is not None:
+            return record
+
+        try:
+            record = self.l2.get(key) if self.l2 else None
+        except Exception as e:
+            logger.warning(f"L2 image cache lookup failed: {e}")
+            with self._lock:
+                self.l2_errors += 1
+            return None
+
+        if record and self.ttl_seconds is not None and time.time() - record.get("created_at", 0) >= self.ttl_seconds:
+            record = None
+        if record and validate and not validate(record):
+            self.l2.delete(key)
+            record = None
+            with self._lock:
+                self.l2_invalidated += 1
+
+        with self._lock:
+            if record is None:
+                self.l2_misses += 1
+                return None
+            self.l2_hits += 1
+        self.l1.set(key, record)
+        return record
+
+    def put(self, key: str, blob_path: str, **metadata):
+        """Record that the image for key lives at blob_path."""
+        record = {"blob_path": blob_path, "created_at": time.time(), **metadata}
+        self.l1.set(key, record)
+        if self.l2:
+            try:
+                self.l2.put(key, record)
+            except Exception as e:
+                logger.warning(f"L2 image cache write failed: {e}")
+                with self._lock:
+                    self.l2_errors += 1
+
+    def delete(self, key: str):
+        self.l1.delete(key)
+        if self.l2:
+            self.l2.delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "l1": self.l1.stats(),
+                "l2": {
+                    "backend": getattr(self.l2, "name", type(self.l2).__name__) if self.l2 else None,
+                    "hits": self.l2_hits,
+                    "misses": self.l2_misses,
+                    "errors": self.l2_errors,
+                    "invalidated": self.l2_invalidated,
+                },
+            }
@@ -0,0 +1,205 @@
+"""
+Server-side conversation sessions for character chat and dialogue mode.
+
+A session is created once with the static context of a conversation (the
+character sheet, or the content block being discussed) rendered into a
+system instruction, and is then referenced by session_id. Each turn only
+carries the new user message; the server appends it to the stored history
+and sends system instruction + history to the model, so the unchanging part
+of the prompt can be served from a cached prefix.
+
+Sessions live in process memory with a sliding idle timeout.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_KINDS = ("character_chat", "dialogue")
+
+USER_ROLE = "user"
+MODEL_ROLE = "model"
+
+
+def normalize_history(messages: Optional[Iterable[Dict]]) -> List[Dict[str, str]]:
+    """Turn client-side histories into [{"role": "user"|"model", "text": ...}].
+
+    Accepts the character chat shape ({"role", "content"}) and the dialogue
+    shape ({"sender", "text"}); empty messages are dropped.
+    """
+    turns = []
+    for message in messages or []:
+        if not isinstance(message, dict):
+            continue
+        text = message.get("content", message.get("text"))
+        if not isinstance(text, str) or not text.strip():
+            continue
+        speaker = (message.get("role") or message.get("sender") or USER_ROLE).lower()
+        turns.append({"role": USER_ROLE if speaker == USER_ROLE else MODEL_ROLE, "text": text.strip()})
+    return turns
+
+
+class ReplyPrefixFilter:
+    """Drops a leading "Name:" from a streamed reply, holding back only the first few characters."""
+
+    def __init__(self, prefix: Optional[str]):
+        self.prefix = prefix
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """Text that can be emitted now; "" while the start of the reply may still be the prefix."""
+        if self.prefix is None:
+            return text
+        self._pending += text
+        head = self._pending.lstrip()
+        if len(head) < len(self.prefix) and self.prefix.startswith(head):
+            return ""
+        if head.startswith(self.prefix):
+            head = head[len(self.prefix):].lstrip()
+        self.prefix, self._pending = None, ""
+        return head
+
+    def flush(self) -> str:
+        """Whatever was still held back when the stream ended."""
+        rest, self._pending = self._pending.strip(), ""
+        return rest
+
+
+class ConversationSession:
+    """Static system instruction plus the turn history of one conversation."""
+
+    def __init__(self, session_id: str, kind: str, system_instruction: str, model: str,
+                 metadata: Optional[Dict] = None, history: Optional[List[Dict[str, str]]] = None,
+                 max_turns: int = 20, created_at: Optional[float] = None):
+        self.session_id = session_id
+        self.kind = kind
+        self.system_instruction = system_instruction
+        self.model = model
+        self.metadata = dict(metadata or {})
+        self.max_turns = max_turns
+        self.history: List[Dict[str, str]] = list(history or [])
+        self.created_at = created_at if created_at is not None else time.time()
+        self.last_used = self.created_at
+        self.turns = 0
+        self._lock = threading.Lock()
+        self._trim()
+
+    def contents(self, message: str, compactor=None) -> List[Dict]:
+        """Gemini contents for the next turn: stored history followed by the new user message.
+
+        With a history_compaction.HistoryCompactor, older turns are replaced by
+        its rolling summary so the history stays within its token budget.
+        """
+        with self._lock:
+            history = list(self.history)
+        if compactor is not None:
+            contents = compactor.compact(self.session_id, history).as_contents()
+        else:
+            contents = [{"role": turn["role"], "parts": [{"text": turn["text"]}]} for turn in history]
+        return contents + [{"role": USER_ROLE, "parts": [{"text": message}]}]
+
+    def add_turn(self, message: str, reply: str):
+        """Record a completed exchange; an empty reply records nothing so the user can retry."""
+        if not reply:
+            return
+        with self._lock:
+            self.history.append({"role": USER_ROLE, "text": message})
+            self.history.append({"role": MODEL_ROLE, "text": reply})
+            self.turns += 1
+            self._trim()
+
+    def _trim(self):
+        # Keep the last max_turns exchanges, starting on a user message
+        limit = self.max_turns * 2
+        if len(self.history) > limit:
+            self.history = self.history[-limit:]
+        while self.history and self.history[0]["role"] != USER_ROLE:
+            self.history.pop(0)
+
+    def to_dict(self, now: Optional[float] = None) -> Dict:
+        now = time.time() if now is None else now
+        with self._lock:
+            messages = len(self.history)
+        return {"session_id": self.session_id, "kind": self.kind, "turns": self.turns, "messages": messages,
+                "idle_seconds": round(now - self.last_used), **self.metadata}
+
+
+class ConversationSessionStore:
+    """Thread-safe, size-bounded session registry with a sliding idle timeout."""
+
+    def __init__(self, ttl_seconds: int = 1800, max_sessions: int = 1000, max_turns: int = 20,
+                 clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.clock = clock
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "turns": 0, "expired": 0, "evicted": 0, "misses": 0}
+
+    def create(self, kind: str, system_instruction: str, model: str, metadata: Optional[Dict] = None,
+               history: Optional[Iterable[Dict]] = None) -> ConversationSession:
+        if kind not in SESSION_KINDS:
+            raise ValueError(f"Unknown session kind '{kind}'")
+        session = ConversationSession(uuid.uuid4().hex, kind, system_instruction, model, metadata=metadata,
+                                      history=normalize_history(history), max_turns=self.max_turns,
+                                      created_at=self.clock())
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+            self.counters["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+        logger.info(f"Created {kind} session {session.session_id}")
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[ConversationSession]:
+        """The live session for session_id (refreshing its idle timer), or None if unknown or expired."""
+        if not session_id:
+            return None
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                self.counters["misses"] += 1
+                return None
+            session.last_used = self.clock()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def record_turn(self, session: ConversationSession, message: str, reply: str):
+        session.add_turn(message, reply)
+        with self._lock:
+            session.last_used = self.clock()
+            if session.session_id in self._sessions:
+                self._sessions.move_to_end(session.session_id)
+            self.counters["turns"] += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire()
+            by_kind = {kind: 0 for kind in SESSION_KINDS}
+            for session in self._sessions.values():
+                by_kind[session.kind] += 1
+            return {"active": len(self._sessions), "by_kind": by_kind, "ttl_seconds": self.ttl_seconds,
+                    **self.counters}
+
+    def _expire(self):
+        # Sessions are ordered by last use, so expired ones sit at the front
+        cutoff = self.clock() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self.counters["expired"] += 1
@@ -1,5 +1,6 @@
 # Gunicorn configuration for Cloud Run
 bind = "0.0.0.0:8080"
+# Jobs, conversation sessions and history summaries are still per process, so stay on one worker
 workers = 1
 worker_class = "sync"
 worker_connections = 1000
@@ -8,4 +9,11 @@ keepalive = 2
 max_requests = 1000
 max_requests_jitter = 100
 preload_app = True
-reload = False 
\ No newline at end of file
+reload = False
+
+
+def post_fork(server, worker):
+    # Image worker processes and the memory sampler belong to the serving process, not the preloading master
+    from backend import image_workers, memory_budget
+    image_workers.start()
+    memory_budget.start()
@@ -0,0 +1,210 @@
+"""
+Rolling compaction of long conversation histories.
+
+HistoryCompactor keeps the most recent turns verbatim and folds older turns
+into a running summary, so the history sent with each tutoring or character
+chat turn stays within a token budget however long the conversation gets.
+
+Summaries are produced in the background and cached per conversation; until
+a summary catches up, the newest unsummarized turns that still fit the budget
+are sent verbatim and the rest are left out of that one prompt.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from prompt_cache import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+USER_ROLE = "user"
+SUMMARY_LABEL = "Summary of the earlier conversation"
+
+# Hashes of the last few folded messages locate the summarized prefix even after
+# the history has been trimmed at the front
+ANCHOR_MESSAGES = 2
+
+
+def conversation_key(*context) -> str:
+    """Stable key for a stateless conversation from its static context (e.g. snippet, character, first message)."""
+    digest = hashlib.sha256()
+    for part in context:
+        digest.update(str(part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _turn_tokens(turn: Dict[str, str]) -> int:
+    return estimate_tokens(turn["text"]) + 4  # role label and separators
+
+
+def _anchor(turns: List[Dict[str, str]]) -> str:
+    return conversation_key(*(f"{t['role']}:{t['text']}" for t in turns[-ANCHOR_MESSAGES:]))
+
+
+class CompactedHistory:
+    """Summary of folded turns (or None) plus the turns to send verbatim."""
+
+    def __init__(self, summary: Optional[str], turns: List[Dict[str, str]], folded: int = 0, dropped: int = 0):
+        self.summary = summary
+        self.turns = turns
+        self.folded = folded
+        self.dropped = dropped
+
+    def as_text(self, user_label: str = "User", model_label: str = "AI") -> str:
+        lines = [f"{SUMMARY_LABEL}: {self.summary}"] if self.summary else []
+        for turn in self.turns:
+            lines.append(f"{user_label if turn['role'] == USER_ROLE else model_label}: {turn['text']}")
+        return "\n".join(lines)
+
+    def as_contents(self) -> List[Dict]:
+        """Gemini contents; the summary becomes a leading user turn."""
+        contents = [{"role": turn["role"], "parts": [{"text": turn["text"]}]} for turn in self.turns]
+        if self.summary:
+            contents.insert(0, {"role": USER_ROLE, "parts": [{"text": f"({SUMMARY_LABEL}: {self.summary})"}]})
+        return contents
+
+
+class _SummaryEntry:
+    __slots__ = ("summary", "anchor", "stored_at")
+
+    def __init__(self, summary: str, anchor: str, stored_at: float):
+        self.summary = summary
+        self.anchor = anchor
+        self.stored_at = stored_at
+
+
+class HistoryCompactor:
+    """Bounds conversation history to token_budget using cached, asynchronously updated summaries.
+
+    summarize(previous_summary, turns) returns a new summary that folds turns
+    into previous_summary (None for the first fold).
+    """
+
+    def __init__(self, summarize: Callable[[Optional[str], List[Dict[str, str]]], Optional[str]],
+                 token_budget: int = 2000, recent_messages: int = 6, max_entries: int = 1000,
+                 ttl_seconds: float = 6 * 3600, executor=None, clock: Callable[[], float] = time.time):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.executor = executor or ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+        self.clock = clock
+        self._entries: "OrderedDict[str, _SummaryEntry]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {"compacted": 0, "summary_hits": 0, "scheduled": 0, "completed": 0, "failed": 0,
+                         "dropped_messages": 0}
+
+    @property
+    def summary_budget(self) -> int:
+        return self.token_budget // 4
+
+    def compact(self, key: str, turns: List[Dict[str, str]]) -> CompactedHistory:
+        """Fit turns into the token budget; schedules a summary update for any newly folded turns."""
+        turns = list(turns or [])
+        recent_budget = self.token_budget - self.summary_budget
+        split, used = len(turns), 0
+        while split > 0 and len(turns) - split < self.recent_messages:
+            cost = _turn_tokens(turns[split - 1])
+            if used + cost > recent_budget and split < len(turns):
+                break
+            used += cost
+            split -= 1
+        # Verbatim history starts on a user turn
+        while split < len(turns) - 1 and turns[split]["role"] != USER_ROLE:
+            used -= _turn_tokens(turns[split])
+            split += 1
+        older, recent = turns[:split], turns[split:]
+        if not older:
+            return CompactedHistory(None, recent)
+
+        with self._lock:
+            self.counters["compacted"] += 1
+        summary, covered = self._cached_summary(key, older)
+        unsummarized = older[covered:]
+        if unsummarized:
+            self._schedule(key, summary, older, covered)
+
+        # While the summary catches up, send the newest unsummarized turns that still fit
+        remaining = self.token_budget - used - (estimate_tokens(summary) if summary else 0)
+        gap = []
+        for turn in reversed(unsummarized):
+            cost = _turn_tokens(turn)
+            if cost > remaining:
+                break
+            gap.insert(0, turn)
+            remaining -= cost
+        while gap and gap[0]["role"] != USER_ROLE:
+            gap.pop(0)
+        dropped = len(unsummarized) - len(gap)
+        if dropped:
+            with self._lock:
+                self.counters["dropped_messages"] += dropped
+        return CompactedHistory(summary, gap + recent, folded=covered, dropped=dropped)
+
+    def wait(self, key: str, timeout: Optional[float] = None):
+        """Block until a pending summary for key is done (tests, shutdown)."""
+        with self._lock:
+            future = self._pending.get(key)
+        if future:
+            future.result(timeout=timeout)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "pending": len(self._pending),
+                    "token_budget": self.token_budget, **self.counters}
+
+    def _cached_summary(self, key: str, older: List[Dict[str, str]]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self.clock() - entry.stored_at >= self.ttl_seconds:
+                self._entries.pop(key)
+                entry = None
+            if entry is None:
+                return None, 0
+            self._entries.move_to_end(key)
+        # The summarized prefix ends where the anchor messages match, searching from the newest position
+        for end in range(len(older), 0, -1):
+            if _anchor(older[:end]) == entry.anchor:
+                with self._lock:
+                    self.counters["summary_hits"] += 1
+                return entry.summary, end
+        return None, 0
+
+    def _schedule(self, key: str, summary: Optional[str], older: List[Dict[str, str]], covered: int):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending[key] = None  # reserved until the future exists
+            self.counters["scheduled"] += 1
+        future = self.executor.submit(self._fold, key, summary, older, covered)
+        with self._lock:
+            if key in self._pending and self._pending[key] is None:
+                self._pending[key] = future
+
+    def _fold(self, key: str, summary: Optional[str], older: List[Dict[str, str]], covered: int):
+        try:
+            new_summary = self.summarize(summary, older[covered:])
+            if not new_summary or not new_summary.strip():
+                raise ValueError("empty summary")
+            entry = _SummaryEntry(new_summary.strip(), _anchor(older), self.clock())
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self.counters["completed"] += 1
+        except Exception as e:
+            logger.warning(f"Conversation summary update failed: {e}")
+            with self._lock:
+                self.counters["failed"] += 1
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
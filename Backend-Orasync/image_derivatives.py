@@ -0,0 +1,205 @@
+"""
+Multi-resolution image derivatives and srcset responses.
+
+Each generated image is rendered once into thumbnail / medium / full sizes in
+WebP, JPEG and PNG. Only blob paths are kept (bounded registry, plus the image
+cache record); URLs are signed lazily when a response is built.
+
+create_later() does the rendering and uploads in the background, so the
+image itself is stored without waiting for them. Responses are built after
+wait() has given the pending renders of their images a bounded time to
+finish, so freshly generated images normally carry their srcset too.
+"""
+
+import contextlib
+import logging
+import os
+import posixpath
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional
+from urllib.parse import unquote, urlparse
+
+from caching import LRUCache
+from image_processing import DERIVATIVE_WIDTHS, IMAGE_FORMATS, render_derivatives
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_PREFIX = "images/derivatives"
+
+
+def derivative_blob_path(blob_path: str, size: str, fmt: str) -> str:
+    """images/foo.png -> images/derivatives/foo/thumbnail.webp"""
+    stem = posixpath.splitext(posixpath.basename(blob_path))[0]
+    return f"{DERIVATIVE_PREFIX}/{stem}/{size}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def blob_path_from_url(url: Optional[str], bucket_name: Optional[str] = None) -> Optional[str]:
+    """Recover the blob path from a GCS signed URL (path-style or bucket subdomain)."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if not parsed.scheme.startswith("http"):
+        return None
+    path = unquote(parsed.path).lstrip("/")
+    if parsed.netloc in ("storage.googleapis.com", "storage.cloud.google.com"):
+        bucket, _, path = path.partition("/")
+        if bucket_name and bucket != bucket_name:
+            return None
+    return path or None
+
+
+class DerivativeRegistry:
+    """Bounded map of source blob path -> derivative blob paths and dimensions."""
+
+    def __init__(self, max_entries: int = 2048, workers: int = 2, upload_workers: int = 4, max_pending: int = 32):
+        self._entries = LRUCache(max_entries=max_entries)
+        self.workers = workers
+        self.upload_workers = upload_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._in_flight: Dict[str, Future] = {}  # blob path -> its render
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._uploads: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self.counters = {"scheduled": 0, "completed": 0, "failed": 0, "skipped": 0, "waits": 0, "wait_timeouts": 0}
+
+    def register(self, blob_path: str, sources: List[Dict]):
+        if blob_path and sources:
+            self._entries.set(blob_path, sources)
+
+    def get(self, blob_path: Optional[str]) -> Optional[List[Dict]]:
+        return self._entries.get(blob_path) if blob_path else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._entries.stats(), "pending": self._pending, **self.counters}
+
+    def create(self, image_bytes: bytes, blob_path: str, upload: Callable[[bytes, str, str], bool],
+               formats: Iterable[str] = tuple(IMAGE_FORMATS),
+               render: Callable[..., List[Dict]] = render_derivatives) -> List[Dict]:
+        """Render and upload every derivative of the PNG stored at blob_path.
+
+        The full-size PNG is the uploaded original itself, so it is not
+        re-encoded. upload(data, blob_path, mime_type) returns True on success;
+        uploads run in parallel once create_later() has started the upload
+        pool. render defaults to rendering in this process (see image_workers).
+        """
+        formats = tuple(formats)
+        rendered = render(image_bytes, formats=formats, skip=[("full", "png")])
+        sources = []
+        full_png = next((d for d in rendered if d["size"] == "full"), None)
+        if "png" in formats and full_png:
+            sources.append({"size": "full", "format": "png", "mime_type": IMAGE_FORMATS["png"][1],
+                            "width": full_png["width"], "height": full_png["height"], "blob_path": blob_path})
+        paths = [derivative_blob_path(blob_path, d["size"], d["format"]) for d in rendered]
+        jobs = [(d.pop("data"), path, d["mime_type"]) for d, path in zip(rendered, paths)]
+        uploaded = self._uploads.map(lambda job: upload(*job), jobs) if self._uploads else (upload(*j) for j in jobs)
+        for derivative, path, ok in zip(rendered, paths, uploaded):
+            if ok:
+                sources.append({**derivative, "blob_path": path})
+        self.register(blob_path, sources)
+        logger.debug(f"Registered {len(sources)} derivatives for {blob_path}")
+        return sources
+
+    def create_later(self, image_bytes: bytes, blob_path: str, upload: Callable[[bytes, str, str], bool],
+                     formats: Iterable[str] = tuple(IMAGE_FORMATS),
+                     render: Callable[..., List[Dict]] = render_derivatives,
+                     reserve: Callable[[], ContextManager] = contextlib.nullcontext,
+                     on_ready: Optional[Callable[[List[Dict]], None]] = None) -> Optional[Future]:
+        """create() on a background pool; None (and nothing rendered) when max_pending are already waiting.
+
+        reserve() is entered around the work (e.g. a memory reservation);
+        on_ready(sources) runs once derivatives are registered. Failures are
+        logged, never raised.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.counters["skipped"] += 1
+                logger.warning(f"{self._pending} derivative renders pending; skipping {blob_path}")
+                return None
+            self._pending += 1
+            self.counters["scheduled"] += 1
+            executor = self._ensure_executors()
+
+        def run():
+            try:
+                with reserve():
+                    sources = self.create(image_bytes, blob_path, upload, formats, render)
+                if on_ready and sources:
+                    on_ready(sources)
+                self._finish("completed")
+                return sources
+            except Exception as e:
+                logger.warning(f"Could not create derivatives for {blob_path}: {e}")
+                self._finish("failed")
+                return []
+
+        future = executor.submit(run)
+        with self._lock:
+            self._in_flight[blob_path] = future
+        future.add_done_callback(lambda done: self._forget(blob_path, done))
+        return future
+
+    def wait(self, blob_paths: Iterable[Optional[str]], timeout: float) -> bool:
+        """Block up to timeout seconds for the pending renders of blob_paths; False when some are still running."""
+        with self._lock:
+            futures = [self._in_flight[path] for path in set(blob_paths)
+                       if path in self._in_flight and not self._in_flight[path].done()]
+        if not futures or timeout <= 0:
+            return not futures
+        _, not_done = wait(futures, timeout=timeout)
+        with self._lock:
+            self.counters["waits"] += 1
+            if not_done:
+                self.counters["wait_timeouts"] += 1
+        return not not_done
+
+    def _forget(self, blob_path: str, future: Future):
+        with self._lock:
+            if self._in_flight.get(blob_path) is future:
+                del self._in_flight[blob_path]
+
+    def _ensure_executors(self) -> ThreadPoolExecutor:
+        """Pools are created on first use; recreated in a forked child, which has none of the parent's threads."""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor_pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="derivatives")
+            self._uploads = ThreadPoolExecutor(max_workers=self.upload_workers,
+                                               thread_name_prefix="derivative-uploads")
+        return self._executor
+
+    def _finish(self, counter: str):
+        with self._lock:
+            self._pending -= 1
+            self.counters[counter] += 1
+
+    def srcset(self, url: Optional[str], fmt: str, sign: Callable[[str], Optional[str]],
+               bucket_name: Optional[str] = None) -> Optional[Dict]:
+        """srcset-like structure for the image behind url in the preferred format.
+
+        Falls back to PNG when the preferred format is missing, and returns
+        None for images without registered derivatives (e.g. placeholders).
+        """
+        blob_path = blob_path_from_url(url, bucket_name)
+        sources = self.get(blob_path)
+        if not sources:
+            return None
+        chosen = [s for s in sources if s["format"] == fmt] or [s for s in sources if s["format"] == "png"]
+        if not chosen:
+            return None
+        entries = []
+        seen_widths = set()
+        for source in sorted(chosen, key=lambda s: DERIVATIVE_WIDTHS.get(s["size"], s["width"])):
+            if source["width"] in seen_widths:
+                continue  # small sources collapse to a single width
+            signed = url if source["blob_path"] == blob_path else sign(source["blob_path"])
+            if not signed:
+                continue
+            seen_widths.add(source["width"])
+            entries.append({"size": source["size"], "width": source["width"],
+                            "height": source["height"], "url": signed})
+        if not entries:
+            return None
+        return {"format": chosen[0]["format"], "mime_type": chosen[0]["mime_type"], "sources": entries}
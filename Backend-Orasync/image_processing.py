@@ -0,0 +1,237 @@
+"""
+Pillow helpers for generated images.
+
+Kept free of Flask/Firebase/GenAI imports so the functions can also run in
+worker processes and offline benchmarks.
+"""
+
+import struct
+from collections import namedtuple
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+MAX_IMAGE_SIZE = (1024, 1024)  # Limit image size to save memory
+MIN_IMAGE_BYTES = 1000
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG colour types 4 (grey + alpha) and 6 (RGB + alpha) carry an alpha channel
+PNG_ALPHA_COLOR_TYPES = (4, 6)
+
+# Derivative widths served to clients; "full" matches the upload size limit
+DERIVATIVE_WIDTHS = {"thumbnail": 256, "medium": 640, "full": MAX_IMAGE_SIZE[0]}
+
+# format name -> (Pillow format, MIME type, encoder options)
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+    "png": ("PNG", "image/png", {"optimize": True}),
+}
+DEFAULT_IMAGE_FORMAT = "png"
+
+ImageHeader = namedtuple("ImageHeader", ["format", "width", "height", "has_alpha", "complete"])
+
+
+def inspect_png_header(data: bytes) -> Optional[ImageHeader]:
+    """Read PNG dimensions and alpha info by walking chunk headers, without decoding pixels.
+
+    Returns None when data is not a structurally valid PNG.
+    """
+    if len(data) < 33 or not data.startswith(PNG_SIGNATURE):
+        return None
+    length, chunk_type = struct.unpack(">I4s", data[8:16])
+    if chunk_type != b"IHDR" or length != 13:
+        return None
+    width, height, _bit_depth, color_type = struct.unpack(">IIBB", data[16:26])
+    if width == 0 or height == 0:
+        return None
+
+    has_alpha = color_type in PNG_ALPHA_COLOR_TYPES
+    complete = False
+    offset = 8
+    data_len = len(data)
+    while offset + 8 <= data_len:
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        offset += 12 + length  # length + type + payload + CRC
+        if offset > data_len:
+            break  # Truncated chunk
+        if chunk_type == b"tRNS":
+            has_alpha = True
+        elif chunk_type == b"IEND":
+            complete = True
+            break
+    return ImageHeader("PNG", width, height, has_alpha, complete)
+
+
+def estimate_decode_bytes(data: bytes, copies: int = 3) -> int:
+    """Peak memory for decoding and reworking data: RGBA pixel buffers (source, converted, resized) plus the bytes.
+
+    Falls back to a 10x compression ratio when the header cannot be read.
+    """
+    header = inspect_png_header(data)
+    if header is None:
+        return len(data) * 10
+    return header.width * header.height * 4 * copies + len(data) * 2
+
+
+def needs_transcode(header: Optional[ImageHeader], max_size: Tuple[int, int] = MAX_IMAGE_SIZE) -> bool:
+    """True when the bytes cannot be uploaded as-is (not a complete PNG, alpha, or too large)."""
+    if header is None or not header.complete or header.has_alpha:
+        return True
+    return header.width > max_size[0] or header.height > max_size[1]
+
+
+def transcode_image(data: bytes, max_size: Tuple[int, int] = MAX_IMAGE_SIZE) -> bytes:
+    """Full decode: verify, flatten alpha onto white, downscale and re-encode as PNG."""
+    # Open and verify image
+    image = Image.open(BytesIO(data))
+    image.verify()
+
+    # Reopen for processing
+    image = Image.open(BytesIO(data))
+
+    # Convert RGBA to RGB to save memory
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+
+    # Optimize image size if too large
+    if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
+        image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+    # Save to buffer with optimization
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", optimize=True, compress_level=6)
+    image.close()
+    return buffer.getvalue()
+
+
+def normalize_image_bytes(data: bytes, max_size: Tuple[int, int] = MAX_IMAGE_SIZE,
+                          force_transcode: bool = False) -> Tuple[bytes, bool]:
+    """Return upload-ready PNG bytes and whether a full transcode was needed.
+
+    Complete, opaque PNGs within max_size are passed through untouched; only
+    images that need resizing, alpha removal or format conversion are decoded.
+    """
+    if len(data) < MIN_IMAGE_BYTES:
+        raise ValueError("Image data too small to be a valid image")
+    if not force_transcode and not needs_transcode(inspect_png_header(data), max_size):
+        return data, False
+    return transcode_image(data, max_size), True
+
+
+def _flatten_alpha(image: Image.Image) -> Image.Image:
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+def render_derivatives(data: bytes, widths: Dict[str, int] = DERIVATIVE_WIDTHS,
+                       formats: Iterable[str] = tuple(IMAGE_FORMATS),
+                       skip: Iterable[Tuple[str, str]] = ()) -> List[Dict]:
+    """Decode once and encode every (size, format) pair.
+
+    Images are never upscaled, so small sources yield fewer distinct widths.
+    Returns dicts with size, format, mime_type, width, height and data.
+    """
+    skip = set(skip)
+    image = _flatten_alpha(Image.open(BytesIO(data)))
+    derivatives = []
+    try:
+        for size, width in sorted(widths.items(), key=lambda item: item[1]):
+            if image.width > width:
+                resized = image.resize((width, max(1, round(image.height * width / image.width))),
+                                       Image.Resampling.LANCZOS)
+            else:
+                resized = image
+            for fmt in formats:
+                if (size, fmt) in skip:
+                    continue
+                pil_format, mime_type, options = IMAGE_FORMATS[fmt]
+                buffer = BytesIO()
+                resized.save(buffer, format=pil_format, **options)
+                derivatives.append({
+                    "size": size,
+                    "format": fmt,
+                    "mime_type": mime_type,
+                    "width": resized.width,
+                    "height": resized.height,
+                    "data": buffer.getvalue(),
+                })
+            if resized is not image:
+                resized.close()
+    finally:
+        image.close()
+    return derivatives
+
+
+def render_placeholder(prompt: str, size: Tuple[int, int] = (512, 512)) -> bytes:
+    """PNG showing the prompt as wrapped text, used when every image model failed."""
+    image = Image.new('RGB', size, color='lightblue')
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype("Arial.ttf", 20)
+    except IOError:
+        font = ImageFont.load_default()
+
+    max_chars_line = 40
+    lines = []
+    current_line = ""
+    for word in f"Placeholder:\n{prompt}".split():
+        if len(current_line) + len(word) + 1 <= max_chars_line:
+            current_line += f" {word}" if current_line else word
+        else:
+            lines.append(current_line.strip())
+            current_line = word
+    lines.append(current_line.strip())
+    # Clean text to avoid Unicode encoding issues
+    text = "\n".join(lines).encode('ascii', 'ignore').decode('ascii')
+
+    bbox = draw.textbbox((0, 0), text, font=font, align="center")
+    pos = ((size[0] - (bbox[2] - bbox[0])) // 2, (size[1] - (bbox[3] - bbox[1])) // 2)
+    draw.text(pos, text, fill='black', font=font, align="center")
+
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    image.close()
+    return buffer.getvalue()
+
+
+def negotiate_image_format(requested: Optional[str] = None, accept_header: Optional[str] = None,
+                           default: str = DEFAULT_IMAGE_FORMAT) -> str:
+    """Pick the image format for a response.
+
+    An explicit request field wins; otherwise the highest-q image type in the
+    Accept header is used (ties prefer webp, then jpeg, then png).
+    """
+    if requested:
+        requested = requested.lower().replace("image/", "")
+        requested = "jpeg" if requested == "jpg" else requested
+        if requested in IMAGE_FORMATS:
+            return requested
+
+    best, best_q = None, 0.0
+    preference = list(IMAGE_FORMATS)
+    for item in (accept_header or "").split(","):
+        media_type, _, params = item.strip().partition(";")
+        fmt = media_type.strip().lower().replace("image/", "", 1)
+        fmt = "jpeg" if fmt == "jpg" else fmt
+        if fmt not in IMAGE_FORMATS:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q or (q == best_q and best and preference.index(fmt) < preference.index(best)):
+            best, best_q = fmt, q
+    return best or default
@@ -0,0 +1,281 @@
+"""
+Process pool for CPU-bound Pillow work.
+
+Transcodes, derivative renders and placeholders run in worker processes
+instead of request threads, so they no longer hold the GIL against request
+handling and JSON parsing, and image throughput scales with the instance's
+cores. Image bytes travel through shared memory in both directions; only
+small metadata is pickled.
+
+Workers come from a forkserver (never forked from the threaded server
+process) and are warmed with Pillow's codecs when the pool starts. The
+number of tasks in flight is bounded: callers wait for room instead of
+growing an unbounded queue. Each task reports the CPU time it used.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from image_processing import (MAX_IMAGE_SIZE, MIN_IMAGE_BYTES, inspect_png_header, needs_transcode,
+                              normalize_image_bytes, render_derivatives, render_placeholder)
+from memory_budget import MB, read_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class ImageWorkersBusy(RuntimeError):
+    """No room for another task in the pool within the queue timeout."""
+
+
+def default_worker_count() -> int:
+    """CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- Shared-memory transport: (segment name, blob sizes) is all that gets pickled ---
+
+def _share(blobs: Sequence[bytes]) -> Tuple[Optional[shared_memory.SharedMemory], Tuple[Optional[str], List[int]]]:
+    """Copy blobs back to back into a new segment; returns the open segment and its reference."""
+    sizes = [len(blob) for blob in blobs]
+    if not sum(sizes):
+        return None, (None, sizes)
+    segment = shared_memory.SharedMemory(create=True, size=sum(sizes))
+    offset = 0
+    for blob in blobs:
+        segment.buf[offset:offset + len(blob)] = blob
+        offset += len(blob)
+    return segment, (segment.name, sizes)
+
+
+def _unshare(ref: Tuple[Optional[str], List[int]], unlink: bool) -> List[bytes]:
+    name, sizes = ref
+    if name is None:
+        return [b"" for _ in sizes]
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        blobs, offset = [], 0
+        for size in sizes:
+            blobs.append(bytes(segment.buf[offset:offset + size]))
+            offset += size
+        return blobs
+    finally:
+        segment.close()
+        if unlink:
+            segment.unlink()
+
+
+# --- Worker side ---
+
+def _warm_worker():
+    """Load Pillow's font, decoders and every encoder once, before the first real task."""
+    render_derivatives(render_placeholder("warm-up", size=(32, 32)), widths={"full": 32})
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _run(fn: Callable, ref, kwargs: Dict):
+    started = time.process_time()
+    data = _unshare(ref, unlink=False)[0] if ref is not None else None
+    meta, blobs = fn(data, **kwargs)
+    segment, output = _share(blobs)
+    if segment is not None:
+        segment.close()  # The caller unlinks it once read
+    return meta, output, time.process_time() - started, os.getpid()
+
+
+def _normalize(data: bytes, max_size: Tuple[int, int]):
+    processed, transcoded = normalize_image_bytes(data, max_size, force_transcode=True)
+    return transcoded, [processed]
+
+
+def _derivatives(data: bytes, **options):
+    rendered = render_derivatives(data, **options)
+    return [{key: value for key, value in d.items() if key != "data"} for d in rendered], [d["data"] for d in rendered]
+
+
+def _placeholder(_data, prompt: str, size: Tuple[int, int]):
+    return None, [render_placeholder(prompt, size)]
+
+
+def _mp_context(start_method: str):
+    if start_method not in multiprocessing.get_all_start_methods():
+        start_method = "spawn"
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        # Preload only this module; by default the forkserver would re-import __main__ (the whole app)
+        context.set_forkserver_preload([__name__])
+    return context
+
+
+class ImageWorkerPool:
+    """Bounded process pool running Pillow tasks; with workers=0 tasks run in the calling thread."""
+
+    def __init__(self, workers: int, max_queued: int = 16, queue_timeout: float = 60.0,
+                 start_method: str = "forkserver"):
+        self.workers = max(0, workers)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(self.workers + max_queued) if self.workers else None
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._owner_pid: Optional[int] = None
+        self._pids = set()
+        self._in_flight = 0
+        self.counters = {"tasks": 0, "inline": 0, "busy": 0, "restarts": 0, "shared_mb": 0.0}
+        self.by_task: Dict[str, Dict[str, float]] = {}
+
+    def start(self) -> "ImageWorkerPool":
+        """Start the workers and warm each one; idempotent, and restarts in a forked child."""
+        if not self.workers:
+            return self
+        with self._lock:
+            if self._executor is not None and self._owner_pid == os.getpid():
+                return self
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context(self.start_method),
+                                           initializer=_warm_worker)
+            self._executor, self._owner_pid, self._pids = executor, os.getpid(), set()
+        for _ in range(self.workers):
+            executor.submit(_ping).add_done_callback(self._record_pid)
+        logger.info(f"Started {self.workers} image worker processes ({self.start_method})")
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._owner_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, label: str, fn: Callable, data: Optional[bytes] = None, **kwargs) -> Tuple[object, List[bytes]]:
+        """Run fn(data, **kwargs) -> (meta, blobs) in a worker and return (meta, blobs).
+
+        fn must be a module-level function. Waits while the pool is full and
+        raises ImageWorkersBusy after queue_timeout. If the pool has broken (a
+        worker was killed), it is restarted and this task runs in-process.
+        """
+        if not self.workers:
+            return self._run_inline(label, fn, data, kwargs)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.counters["busy"] += 1
+            raise ImageWorkersBusy(f"{label}: {self.workers + self.max_queued} image tasks already in flight")
+        started = time.perf_counter()
+        segment = None
+        with self._lock:
+            self._in_flight += 1
+        try:
+            executor = self.start()._executor
+            ref = None
+            if data is not None:
+                segment, ref = _share([data])
+            try:
+                meta, output, cpu_seconds, pid = executor.submit(_run, fn, ref, kwargs).result()
+            except BrokenProcessPool:
+                logger.warning(f"Image worker pool broke during {label}; restarting it and running the task here")
+                self._reset(executor)
+                return self._run_inline(label, fn, data, kwargs)
+            self._pids.add(pid)
+            blobs = _unshare(output, unlink=True)
+            shared = len(data or b"") + sum(len(blob) for blob in blobs)
+            self._record(label, cpu_seconds, time.perf_counter() - started, shared)
+            return meta, blobs
+        finally:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def normalize(self, data: bytes, max_size: Tuple[int, int] = MAX_IMAGE_SIZE) -> Tuple[bytes, bool]:
+        """normalize_image_bytes; the pass-through header check stays in-process, transcodes go to a worker."""
+        if len(data) < MIN_IMAGE_BYTES or not needs_transcode(inspect_png_header(data), max_size):
+            return normalize_image_bytes(data, max_size)
+        transcoded, [processed] = self.run("normalize", _normalize, data, max_size=max_size)
+        return processed, transcoded
+
+    def render_derivatives(self, data: bytes, **options) -> List[Dict]:
+        """image_processing.render_derivatives in a worker."""
+        derivatives, blobs = self.run("derivatives", _derivatives, data, **options)
+        return [{**derivative, "data": blob} for derivative, blob in zip(derivatives, blobs)]
+
+    def render_placeholder(self, prompt: str, size: Tuple[int, int] = (512, 512)) -> bytes:
+        """image_processing.render_placeholder in a worker."""
+        _, [png] = self.run("placeholder", _placeholder, prompt=prompt, size=size)
+        return png
+
+    def rss_bytes(self) -> int:
+        """Combined RSS of the worker processes (they are outside this process's own RSS)."""
+        total = 0
+        for pid in list(self._pids):
+            rss = read_rss_bytes(pid)
+            if rss:
+                total += rss
+            else:
+                self._pids.discard(pid)  # Exited or replaced
+        return total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "mode": "processes" if self.workers else "inline",
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "in_flight": self._in_flight,
+                "worker_rss_mb": round(self.rss_bytes() / MB, 1),
+                **{key: round(value, 1) if isinstance(value, float) else value for key, value in self.counters.items()},
+                "by_task": {
+                    label: {
+                        "tasks": int(task["tasks"]),
+                        "cpu_seconds": round(task["cpu_seconds"], 3),
+                        "avg_cpu_ms": round(task["cpu_seconds"] / task["tasks"] * 1000, 1),
+                        "avg_wall_ms": round(task["wall_seconds"] / task["tasks"] * 1000, 1),
+                        "max_cpu_ms": round(task["max_cpu_seconds"] * 1000, 1),
+                    }
+                    for label, task in self.by_task.items()
+                },
+            }
+
+    def _run_inline(self, label: str, fn: Callable, data: Optional[bytes], kwargs: Dict):
+        started_wall, started_cpu = time.perf_counter(), time.thread_time()
+        meta, blobs = fn(data, **kwargs)
+        with self._lock:
+            self.counters["inline"] += 1
+        self._record(label, time.thread_time() - started_cpu, time.perf_counter() - started_wall, 0)
+        return meta, list(blobs)
+
+    def _record(self, label: str, cpu_seconds: float, wall_seconds: float, shared_bytes: int):
+        with self._lock:
+            self.counters["tasks"] += 1
+            self.counters["shared_mb"] += shared_bytes / MB
+            task = self.by_task.setdefault(label, {"tasks": 0, "cpu_seconds": 0.0, "wall_seconds": 0.0,
+                                                   "max_cpu_seconds": 0.0})
+            task["tasks"] += 1
+            task["cpu_seconds"] += cpu_seconds
+            task["wall_seconds"] += wall_seconds
+            task["max_cpu_seconds"] = max(task["max_cpu_seconds"], cpu_seconds)
+
+    def _record_pid(self, future):
+        if future.exception() is None:
+            self._pids.add(future.result())
+        else:
+            logger.warning(f"Image worker failed to start: {future.exception()}")
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.counters["restarts"] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,160 @@
+"""
+Background job execution for long-running generation requests.
+
+Comic, lecture and story generation can take minutes. Instead of holding a
+request thread for the whole job, the endpoint submits the work to a
+JobManager and answers 202 Accepted with the job id; the client polls
+/jobs/<id> (status and progress) and fetches /jobs/<id>/result when done.
+
+Work runs on a bounded worker pool with a bounded queue; finished jobs keep
+their result for result_ttl_seconds.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(RuntimeError):
+    """Too many jobs are already waiting for a worker."""
+
+
+class JobConflict(RuntimeError):
+    """The job id is taken by a job of another kind, payload or caller."""
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class Job:
+    """One submitted unit of work and, once finished, its (payload, status_code) result."""
+
+    def __init__(self, job_id: str, kind: str, submitted_at: float, fingerprint: Optional[str] = None):
+        self.job_id = job_id
+        self.kind = kind
+        self.fingerprint = fingerprint  # hash of the submission (payload and caller); never exposed
+        self.status = QUEUED
+        self.submitted_at = submitted_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.payload: Any = None
+        self.status_code: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "submitted_at": _iso(self.submitted_at),
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at),
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs fn() -> (payload, status_code) jobs on a bounded pool and keeps results for polling."""
+
+    def __init__(self, max_workers: int = 4, max_queued: int = 100, result_ttl_seconds: float = 3600,
+                 clock: Callable[[], float] = time.time):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "deduplicated": 0, "conflicts": 0, "rejected": 0, "succeeded": 0,
+                         "failed": 0}
+
+    def submit(self, kind: str, fn: Callable[[], Tuple[Any, int]], job_id: str,
+               fingerprint: Optional[str] = None) -> Tuple[Job, bool]:
+        """Queue fn under job_id; returns (job, created).
+
+        Resubmitting a known id with the same kind and fingerprint returns the
+        existing job; anything else raises JobConflict, so a supplied id never
+        hands out another requester's job.
+        """
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(job_id)
+            if existing is not None:
+                if existing.kind != kind or existing.fingerprint != fingerprint:
+                    self.counters["conflicts"] += 1
+                    raise JobConflict(f"job {job_id} belongs to another submission")
+                self.counters["deduplicated"] += 1
+                return existing, False
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if queued >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise JobQueueFull(f"{queued} jobs already waiting")
+            job = Job(job_id, kind, self.clock(), fingerprint)
+            self._jobs[job_id] = job
+            self.counters["submitted"] += 1
+        self._executor.submit(self._run, job, fn)
+        logger.info(f"Queued {kind} job {job_id}")
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        """1-based position among queued jobs (None once the job has started)."""
+        with self._lock:
+            if job.status != QUEUED:
+                return None
+            queued = [j for j in self._jobs.values() if j.status == QUEUED]
+            return queued.index(job) + 1 if job in queued else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            by_status = {state: 0 for state in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+            for job in self._jobs.values():
+                by_status[job.status] += 1
+            return {"workers": self.max_workers, "max_queued": self.max_queued, **by_status, **self.counters}
+
+    def _run(self, job: Job, fn: Callable[[], Tuple[Any, int]]):
+        with self._lock:
+            job.status = RUNNING
+            job.started_at = self.clock()
+        try:
+            payload, status_code = fn()
+            error = None
+        except Exception as e:
+            logger.exception(f"{job.kind} job {job.job_id} raised")
+            payload, status_code, error = {"error": str(e)}, 500, str(e)
+        with self._lock:
+            job.payload = payload
+            job.status_code = status_code
+            job.status = SUCCEEDED if status_code < 400 else FAILED
+            if job.status == FAILED:
+                job.error = error or (payload.get("error") if isinstance(payload, dict) else None) or f"HTTP {status_code}"
+            job.finished_at = self.clock()
+            self.counters[job.status] += 1
+        logger.info(f"{job.kind} job {job.job_id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def _prune(self):
+        cutoff = self.clock() - self.result_ttl_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
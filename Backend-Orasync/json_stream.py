@@ -0,0 +1,102 @@
+"""
+Incremental extraction of objects from a streamed JSON array.
+
+Lets the comic pipeline act on each panel as soon as its closing brace
+arrives instead of waiting for the whole panel array. Each character is
+scanned once; only the text of the object currently open is buffered.
+"""
+
+import json
+import logging
+from typing import Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class JsonArrayStream:
+    """Feed chunks of a JSON array ("[{...}, {...}]"), get each top-level element once it is complete.
+
+    Text before the opening bracket (code fences, preamble) is ignored. Only
+    object elements are emitted; an element that fails to decode is counted
+    in .skipped and dropped.
+    """
+
+    def __init__(self):
+        self._started = False      # seen the outer '['
+        self._finished = False     # seen the matching ']'
+        self._depth = 0            # nesting inside the current element
+        self._in_string = False
+        self._escape = False
+        self._current: List[str] = []
+        self.emitted = 0
+        self.skipped = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    @property
+    def pending(self) -> bool:
+        """True when an element has started but not yet closed (e.g. truncated output)."""
+        return self._depth > 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        items = []
+        if self._finished or not chunk:
+            return items
+        if not self._started:
+            bracket = chunk.find("[")
+            if bracket == -1:
+                return items
+            self._started = True
+            chunk = chunk[bracket + 1:]
+
+        depth = self._depth
+        in_string = self._in_string
+        escape = self._escape
+        element_start = 0 if depth > 0 else None
+        for i, char in enumerate(chunk):
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == '"':
+                    in_string = False
+                continue
+            if char == '"':
+                in_string = True
+            elif char in "{[":
+                if depth == 0:
+                    element_start = i
+                depth += 1
+            elif char in "}]":
+                if depth == 0:
+                    if char == "]":
+                        self._finished = True
+                        break
+                    continue
+                depth -= 1
+                if depth == 0:
+                    self._current.append(chunk[element_start:i + 1])
+                    self._emit("".join(self._current), items)
+                    self._current = []
+
+        if depth > 0:
+            # Element still open: keep its text for the next chunk
+            self._current.append(chunk[element_start:])
+        self._depth, self._in_string, self._escape = depth, in_string, escape
+        return items
+
+    def _emit(self, text: str, items: List[Any]):
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.skipped += 1
+            logger.warning(f"Skipping undecodable array element ({e}): {text[:100]}...")
+            return
+        if isinstance(value, dict):
+            self.emitted += 1
+            items.append(value)
+        else:
+            self.skipped += 1
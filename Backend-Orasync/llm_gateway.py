@@ -0,0 +1,467 @@
+"""
+Central gateway for model calls: deadlines, timeouts, hedging and retries.
+
+Every generate_content call goes through LLMGateway.call (or .stream). Each
+call is bounded by its own timeout and by the request deadline carried in a
+context variable (deadline_scope), retryable errors are retried with
+exponential backoff and full jitter, and a call still running past the p95
+latency observed for its label gets one hedged duplicate; whichever finishes
+first wins. Hedges are capped at a fraction of calls so tail-cutting never
+doubles cost, and are not sent while every pool thread is busy.
+
+Latency, the call timeout and the hedge delay are measured from when a call
+starts running on the pool; time spent queued for a thread counts only
+against the request deadline, so a saturated pool does not inflate p95 and
+trigger more hedges.
+
+acall/astream apply the same policies to coroutine functions (the google-genai
+async client) for the ASGI serving path; both paths share one set of stats.
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+
+from model_health import percentile
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("resource_exhausted", "unavailable", "deadline_exceeded", "internal error", "timed out",
+                     "timeout", "connection reset", "connection aborted", "temporarily", "overloaded", "try again")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request deadline passed before the call could complete."""
+
+
+class CallTimeout(TimeoutError):
+    """A single model call exceeded its timeout."""
+
+
+class Deadline:
+    """Absolute point in time by which a request (and every model call it makes) must finish."""
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - self.clock()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar("llm_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def set_deadline(seconds: Optional[float]):
+    """Start a deadline for the current context (never later than an enclosing one); returns a reset token."""
+    outer = current_deadline()
+    deadline = Deadline(seconds) if seconds else None
+    if outer is not None and (deadline is None or outer.expires_at < deadline.expires_at):
+        deadline = outer
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token):
+    _current_deadline.reset(token)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    token = set_deadline(seconds)
+    try:
+        yield current_deadline()
+    finally:
+        reset_deadline(token)
+
+
+def bind_context(fn: Callable) -> Callable:
+    """Wrap fn so it runs with the caller's deadline when submitted to an executor."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def classify_error(error: BaseException) -> str:
+    """RETRYABLE for timeouts, rate limits, overload and transient server errors; FATAL otherwise."""
+    if isinstance(error, DeadlineExceeded):
+        return FATAL
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return RETRYABLE
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return RETRYABLE if code in RETRYABLE_STATUS_CODES else FATAL
+    message = str(error).lower()
+    if any(marker in message for marker in RETRYABLE_MARKERS):
+        return RETRYABLE
+    return FATAL
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Callable[[], float] = random.random) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt))."""
+    return rng() * min(cap, base * (2 ** attempt))
+
+
+class _LabelStats:
+    def __init__(self, window_size: int):
+        self.latencies = deque(maxlen=window_size)
+        self.counters = {"calls": 0, "succeeded": 0, "retries": 0, "hedges": 0, "hedges_skipped": 0,
+                         "hedge_wins": 0, "timeouts": 0, "deadline_exceeded": 0, "fatal": 0, "exhausted": 0}
+
+
+class _Started:
+    """Set by a pool thread when it picks up the call."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.at: Optional[float] = None
+
+    def mark(self, now: float):
+        self.at = now
+        self.event.set()
+
+
+class LLMGateway:
+    """Runs model calls with per-call timeouts, the request deadline, hedging and jittered retries."""
+
+    def __init__(self, max_workers: int = 32, call_timeout: float = 120.0, max_attempts: int = 3,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0, hedge_enabled: bool = True,
+                 hedge_percentile: float = 95, hedge_min_samples: int = 20, hedge_budget: float = 0.1,
+                 window_size: int = 200, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic, rng: Callable[[], float] = random.random,
+                 async_sleep: Callable = asyncio.sleep):
+        self.call_timeout = call_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_budget = hedge_budget
+        self.window_size = window_size
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.clock = clock
+        self.rng = rng
+        # Calls run on this pool so the caller can stop waiting (timeout, hedge winner) without blocking
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+        self._pending = 0  # submitted to the pool and not finished, including timed-out and losing calls
+        self._stats: Dict[str, _LabelStats] = {}
+        self._lock = threading.Lock()
+
+    def call(self, label: str, fn: Callable, *args, timeout: Optional[float] = None,
+             deadline: Optional[Deadline] = None, hedge: bool = True, max_attempts: Optional[int] = None,
+             **kwargs):
+        """fn(*args, **kwargs) under the gateway's policies; raises the last error once retries are spent."""
+        deadline = deadline or current_deadline()
+        attempts = max_attempts or self.max_attempts
+        self._count(label, "calls")
+        last_error = None
+        for attempt in range(attempts):
+            budget = self._budget(label, timeout, deadline, last_error)
+            try:
+                result = self._attempt(label, fn, args, kwargs, budget, hedge and self.hedge_enabled, deadline)
+                self._count(label, "succeeded")
+                return result
+            except Exception as e:
+                last_error = e
+                self.sleep(self._retry_delay(label, e, attempt, attempts, deadline))
+
+    async def acall(self, label: str, fn: Callable, *args, timeout: Optional[float] = None,
+                    deadline: Optional[Deadline] = None, hedge: bool = True, max_attempts: Optional[int] = None,
+                    **kwargs):
+        """Awaitable call(): fn(*args, **kwargs) returns a coroutine, e.g. client.aio.models.generate_content."""
+        deadline = deadline or current_deadline()
+        attempts = max_attempts or self.max_attempts
+        self._count(label, "calls")
+        last_error = None
+        for attempt in range(attempts):
+            budget = self._budget(label, timeout, deadline, last_error)
+            try:
+                result = await self._aattempt(label, fn, args, kwargs, budget, hedge and self.hedge_enabled)
+                self._count(label, "succeeded")
+                return result
+            except Exception as e:
+                last_error = e
+                await self.async_sleep(self._retry_delay(label, e, attempt, attempts, deadline))
+
+    def stream(self, label: str, fn: Callable, *args, deadline: Optional[Deadline] = None,
+               max_attempts: Optional[int] = None, **kwargs) -> Iterator:
+        """Iterate fn(*args, **kwargs); retryable errors before the first chunk are retried, the deadline is checked between chunks."""
+        deadline = deadline or current_deadline()
+        attempts = max_attempts or self.max_attempts
+        self._count(label, "calls")
+        for attempt in range(attempts):
+            if deadline is not None and deadline.expired:
+                self._count(label, "deadline_exceeded")
+                raise DeadlineExceeded(f"{label}: request deadline exceeded")
+            started = self.clock()
+            received = False
+            try:
+                for chunk in fn(*args, **kwargs):
+                    if not received:
+                        received = True
+                        self._record_latency(label, self.clock() - started)
+                    yield chunk
+                    if deadline is not None and deadline.expired:
+                        self._count(label, "deadline_exceeded")
+                        raise DeadlineExceeded(f"{label}: request deadline exceeded mid-stream")
+                self._count(label, "succeeded")
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if received or classify_error(e) == FATAL or attempt == attempts - 1:
+                    self._count(label, "fatal" if classify_error(e) == FATAL else "exhausted")
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap, self.rng)
+                if deadline is not None and deadline.remaining() <= delay:
+                    self._count(label, "deadline_exceeded")
+                    raise DeadlineExceeded(f"{label}: no time left to retry after {e}") from e
+                self._count(label, "retries")
+                logger.warning(f"{label} stream failed before its first chunk ({e}); retrying in {delay:.2f}s")
+                self.sleep(delay)
+
+    async def astream(self, label: str, fn: Callable, *args, deadline: Optional[Deadline] = None,
+                      max_attempts: Optional[int] = None, **kwargs) -> AsyncIterator:
+        """Async stream(): fn(*args, **kwargs) returns an async iterator (or a coroutine resolving to one)."""
+        deadline = deadline or current_deadline()
+        attempts = max_attempts or self.max_attempts
+        self._count(label, "calls")
+        for attempt in range(attempts):
+            if deadline is not None and deadline.expired:
+                self._count(label, "deadline_exceeded")
+                raise DeadlineExceeded(f"{label}: request deadline exceeded")
+            started = self.clock()
+            received = False
+            try:
+                chunks = fn(*args, **kwargs)
+                if inspect.isawaitable(chunks):
+                    chunks = await chunks
+                async for chunk in chunks:
+                    if not received:
+                        received = True
+                        self._record_latency(label, self.clock() - started)
+                    yield chunk
+                    if deadline is not None and deadline.expired:
+                        self._count(label, "deadline_exceeded")
+                        raise DeadlineExceeded(f"{label}: request deadline exceeded mid-stream")
+                self._count(label, "succeeded")
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if received or classify_error(e) == FATAL or attempt == attempts - 1:
+                    self._count(label, "fatal" if classify_error(e) == FATAL else "exhausted")
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap, self.rng)
+                if deadline is not None and deadline.remaining() <= delay:
+                    self._count(label, "deadline_exceeded")
+                    raise DeadlineExceeded(f"{label}: no time left to retry after {e}") from e
+                self._count(label, "retries")
+                logger.warning(f"{label} stream failed before its first chunk ({e}); retrying in {delay:.2f}s")
+                await self.async_sleep(delay)
+
+    def hedge_delay(self, label: str) -> Optional[float]:
+        """Seconds after which a duplicate is sent: the observed latency percentile, once there are enough samples."""
+        with self._lock:
+            stats = self._stats.get(label)
+            if stats is None or len(stats.latencies) < self.hedge_min_samples:
+                return None
+            if stats.counters["hedges"] >= self.hedge_budget * stats.counters["calls"]:
+                return None
+            return percentile(list(stats.latencies), self.hedge_percentile)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            labels = {}
+            for label, stats in self._stats.items():
+                latencies = list(stats.latencies)
+                p50, p95 = percentile(latencies, 50), percentile(latencies, 95)
+                labels[label] = {**stats.counters,
+                                 "p50_seconds": round(p50, 3) if p50 is not None else None,
+                                 "p95_seconds": round(p95, 3) if p95 is not None else None}
+            pending = self._pending
+        return {"call_timeout_seconds": self.call_timeout, "hedge_enabled": self.hedge_enabled,
+                "hedge_budget": self.hedge_budget, "pool_workers": self.max_workers, "pool_pending": pending,
+                "labels": labels}
+
+    def _budget(self, label: str, timeout: Optional[float], deadline: Optional[Deadline], last_error) -> float:
+        budget = timeout or self.call_timeout
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                self._count(label, "deadline_exceeded")
+                raise DeadlineExceeded(f"{label}: request deadline exceeded") from last_error
+            budget = min(budget, remaining)
+        return budget
+
+    def _retry_delay(self, label: str, error: Exception, attempt: int, attempts: int,
+                     deadline: Optional[Deadline]) -> float:
+        """Backoff before the next attempt after error; raises when the call should not be retried."""
+        if isinstance(error, CallTimeout) and deadline is not None and deadline.expired:
+            self._count(label, "deadline_exceeded")
+            raise DeadlineExceeded(f"{label}: request deadline exceeded") from error
+        if classify_error(error) == FATAL:
+            self._count(label, "fatal")
+            raise error
+        if attempt == attempts - 1:
+            self._count(label, "exhausted")
+            raise error
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap, self.rng)
+        if deadline is not None and deadline.remaining() <= delay:
+            self._count(label, "deadline_exceeded")
+            raise DeadlineExceeded(f"{label}: no time left to retry after {error}") from error
+        self._count(label, "retries")
+        logger.warning(f"{label} call failed ({error}); retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+        return delay
+
+    def _attempt(self, label: str, fn: Callable, args, kwargs, budget: float, hedge: bool,
+                 deadline: Optional[Deadline] = None):
+        primary, primary_started = self._submit(fn, args, kwargs)
+        # Wait for a pool thread without spending the call's budget; only the request deadline bounds the wait
+        if not primary_started.event.wait(max(0.0, deadline.remaining()) if deadline is not None else None):
+            primary.cancel()
+            self._count(label, "deadline_exceeded")
+            raise DeadlineExceeded(f"{label}: request deadline exceeded waiting for a call thread")
+        started = primary_started.at
+        if deadline is not None:
+            budget = min(budget, deadline.remaining())
+        futures = {primary: ("primary", primary_started)}
+        hedge_after = self.hedge_delay(label) if hedge else None
+        if hedge_after is not None and hedge_after >= budget:
+            hedge_after = None
+        last_error = None
+        while futures:
+            elapsed = self.clock() - started
+            wait_for = budget - elapsed
+            if hedge_after is not None:
+                wait_for = min(wait_for, hedge_after - elapsed)
+            done, _ = wait(list(futures), timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, future_started = futures.pop(future)
+                error = future.exception()
+                if error is None:
+                    self._record_latency(label, self.clock() - future_started.at)
+                    if kind == "hedge":
+                        self._count(label, "hedge_wins")
+                    return future.result()
+                last_error = error
+            if not futures:
+                break
+            elapsed = self.clock() - started
+            if elapsed >= budget:
+                self._count(label, "timeouts")
+                raise CallTimeout(f"{label} call exceeded {budget:.1f}s")
+            if hedge_after is not None and elapsed >= hedge_after:
+                hedge_after = None
+                if not self._has_idle_worker():
+                    # A hedge would only queue behind other calls and add to the load that made this one slow
+                    self._count(label, "hedges_skipped")
+                    continue
+                self._count(label, "hedges")
+                logger.info(f"{label} call slower than p{self.hedge_percentile:g} ({elapsed:.1f}s); sending hedged request")
+                hedge_future, hedge_started = self._submit(fn, args, kwargs)
+                futures[hedge_future] = ("hedge", hedge_started)
+        raise last_error
+
+    def _submit(self, fn: Callable, args, kwargs):
+        """Submit fn to the pool; the returned _Started is set once a thread picks it up."""
+        started = _Started()
+
+        def run():
+            started.mark(self.clock())
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(run)
+        future.add_done_callback(self._finished)
+        return future, started
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _has_idle_worker(self) -> bool:
+        with self._lock:
+            return self._pending < self.max_workers
+
+    async def _aattempt(self, label: str, fn: Callable, args, kwargs, budget: float, hedge: bool):
+        started = self.clock()
+        tasks = {asyncio.ensure_future(fn(*args, **kwargs)): "primary"}
+        hedge_after = self.hedge_delay(label) if hedge else None
+        if hedge_after is not None and hedge_after >= budget:
+            hedge_after = None
+        last_error = None
+        try:
+            while tasks:
+                elapsed = self.clock() - started
+                wait_for = budget - elapsed
+                if hedge_after is not None:
+                    wait_for = min(wait_for, hedge_after - elapsed)
+                done, _ = await asyncio.wait(list(tasks), timeout=max(0.0, wait_for),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self._record_latency(label, self.clock() - started)
+                        if kind == "hedge":
+                            self._count(label, "hedge_wins")
+                        return task.result()
+                    last_error = error
+                if not tasks:
+                    break
+                elapsed = self.clock() - started
+                if elapsed >= budget:
+                    self._count(label, "timeouts")
+                    raise CallTimeout(f"{label} call exceeded {budget:.1f}s")
+                if hedge_after is not None and elapsed >= hedge_after:
+                    hedge_after = None
+                    self._count(label, "hedges")
+                    logger.info(f"{label} call slower than p{self.hedge_percentile:g} ({elapsed:.1f}s); sending hedged request")
+                    tasks[asyncio.ensure_future(fn(*args, **kwargs))] = "hedge"
+        finally:
+            # Unlike executor threads, losing or timed-out coroutines can actually be stopped
+            for task in tasks:
+                task.cancel()
+        raise last_error
+
+    def _label_stats(self, label: str) -> _LabelStats:
+        stats = self._stats.get(label)
+        if stats is None:
+            stats = self._stats[label] = _LabelStats(self.window_size)
+        return stats
+
+    def _count(self, label: str, counter: str):
+        with self._lock:
+            self._label_stats(label).counters[counter] += 1
+
+    def _record_latency(self, label: str, latency: float):
+        with self._lock:
+            self._label_stats(label).latencies.append(latency)
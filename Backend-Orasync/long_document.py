@@ -0,0 +1,204 @@
+"""
+Map-reduce helpers for documents too long for a single prompt.
+
+Long input is split on semantic boundaries (headings, paragraphs, then
+sentences), the parts are processed concurrently with bounded parallelism,
+and the per-part results are merged back into one result: a block list for
+Detailed Explanation, or condensed notes that feed a single lecture / story /
+flashcard prompt.
+"""
+
+import logging
+import re
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+from block_parser import IMAGE_PLACEHOLDER
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_CHARS = 8000
+MAX_MERGED_QUIZ_QUESTIONS = 10
+
+_BLANK_LINES = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9])")
+_HEADING = re.compile(
+    r"^(#{1,6}\s+\S|\*\*[^*\n]+\*\*$|(chapter|section|part|unit)\s+[\dIVXLC]+\b|\d+(\.\d+)*\.?\s+[A-Z][^.!?]{0,80}$|[A-Z][A-Z0-9 ,:&'-]{3,80}$)",
+    re.IGNORECASE,
+)
+
+
+def is_long(text: Optional[str], max_chars: int = DEFAULT_CHUNK_CHARS) -> bool:
+    return bool(text) and len(text) > max_chars
+
+
+def _is_heading(paragraph: str) -> bool:
+    first_line = paragraph.split("\n", 1)[0].strip()
+    if len(first_line) > 100:
+        return False
+    if first_line.isupper() or first_line.startswith("#") or first_line.startswith("**"):
+        return bool(_HEADING.match(first_line))
+    return bool(_HEADING.match(first_line)) and "\n" not in paragraph.strip()
+
+
+def _split_oversized(paragraph: str, max_chars: int) -> List[str]:
+    """Break a single paragraph longer than max_chars at sentence ends, then hard-wrap."""
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut].rstrip())
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_semantic(text: str, max_chars: int = DEFAULT_CHUNK_CHARS) -> List[str]:
+    """Split text into chunks of at most max_chars, preferring section and paragraph boundaries.
+
+    A new chunk is started before a heading once the current chunk is at
+    least half full, so sections are kept together where possible.
+    """
+    text = (text or "").replace("\r\n", "\n").replace("\r", "\n").strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+
+    paragraphs = []
+    for paragraph in _BLANK_LINES.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            paragraphs.extend(_split_oversized(paragraph, max_chars))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks, current, size = [], [], 0
+    for paragraph in paragraphs:
+        added = len(paragraph) + (2 if current else 0)
+        starts_section = _is_heading(paragraph) and size >= max_chars // 2
+        if current and (size + added > max_chars or starts_section):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+            added = len(paragraph)
+        current.append(paragraph)
+        size += added
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def map_chunks(chunks: List[str], fn: Callable[[int, str], Optional[str]], max_workers: int = 4,
+               executor: Optional[Executor] = None) -> List:
+    """Run fn(index, chunk) for every chunk with at most max_workers in flight.
+
+    Parts run on executor, normally the caller's bulkhead pool, so a long
+    document draws on its priority class's workers rather than adding threads
+    of its own; without one a private pool is used for the call.
+    Results keep chunk order; a part that raises is logged and returned as None.
+    """
+    if not chunks:
+        return []
+    if executor is None:
+        workers = max(1, min(max_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="long-doc") as own:
+            return map_chunks(chunks, fn, workers, own)
+
+    futures, in_flight = [], set()
+    for index, chunk in enumerate(chunks):
+        if len(in_flight) >= max(1, max_workers):
+            _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        future = executor.submit(fn, index, chunk)
+        futures.append(future)
+        in_flight.add(future)
+    results = []
+    for index, future in enumerate(futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Long document part {index + 1}/{len(chunks)} failed: {e}")
+            results.append(None)
+    return results
+
+
+def source_blocks(chunk: str) -> List[Dict]:
+    """A part's own text as heading / paragraph blocks, for when its generation failed."""
+    blocks = []
+    for paragraph in _BLANK_LINES.split(chunk or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if _is_heading(paragraph):
+            blocks.append({"type": "heading", "content": paragraph.lstrip("#* ").rstrip("* "), "id": str(uuid4())})
+        else:
+            blocks.append({"type": "paragraph", "content": paragraph, "id": str(uuid4())})
+    return blocks
+
+
+def condense(text: str, summarize: Callable[[int, int, str], Optional[str]],
+             max_chars: int = DEFAULT_CHUNK_CHARS, max_workers: int = 4, max_rounds: int = 3,
+             executor: Optional[Executor] = None) -> str:
+    """Reduce text to notes of at most max_chars by summarizing its parts in parallel.
+
+    summarize(index, total, chunk) returns the notes for one part; a part
+    whose summary fails is kept verbatim so no content is silently lost.
+    """
+    for round_number in range(max_rounds):
+        if len(text) <= max_chars:
+            break
+        chunks = split_semantic(text, max_chars)
+        notes = map_chunks(chunks, lambda index, chunk: summarize(index, len(chunks), chunk), max_workers, executor)
+        text = "\n\n".join((note or chunk).strip() for note, chunk in zip(notes, chunks))
+        logger.info(f"Condense round {round_number + 1}: {len(chunks)} parts -> {len(text)} chars")
+    return text
+
+
+def merge_block_items(parts: List[List[Dict]], max_quiz_questions: int = MAX_MERGED_QUIZ_QUESTIONS) -> List[Dict]:
+    """Merge per-part parser output into one block list.
+
+    Keeps the first part's summary image only, keeps content in part order,
+    and gathers every part's quiz into a single quiz at the end (questions
+    are taken round-robin so each part is represented).
+    """
+    merged: List[Dict] = []
+    quiz_heading = None
+    questions_by_part: List[List[Dict]] = []
+    summary_seen = False
+    for items in parts:
+        questions = []
+        for item in items or []:
+            item_type = item.get("type")
+            if item_type == IMAGE_PLACEHOLDER and item.get("summary"):
+                if not summary_seen:
+                    summary_seen = True
+                    merged.append(item)
+            elif item_type == "quizHeading":
+                quiz_heading = quiz_heading or item
+            elif item_type == "multipleChoiceQuestion":
+                questions.append(item)
+            else:
+                merged.append(item)
+        questions_by_part.append(questions)
+
+    selected = []
+    for round_index in range(max((len(q) for q in questions_by_part), default=0)):
+        for questions in questions_by_part:
+            if round_index < len(questions) and len(selected) < max_quiz_questions:
+                selected.append(questions[round_index])
+    if selected:
+        merged.append(quiz_heading or {"type": "quizHeading", "content": "Quiz Time", "id": str(uuid4())})
+        merged.extend(selected)
+    return merged
@@ -4,11 +4,12 @@ Main entry point for Google Cloud Run deployment
 """
 
 import os
-from backend import app
+from backend import app, image_workers
 
 if __name__ == "__main__":
     # Get port from environment variable (Cloud Run sets PORT)
     port = int(os.environ.get("PORT", 8080))
+    image_workers.start()
     
     # Run the Flask app
     app.run(host="0.0.0.0", port=port, debug=False) 
\ No newline at end of file
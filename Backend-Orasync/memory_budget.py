@@ -0,0 +1,237 @@
+"""
+Memory budget for image decode, compositing and buffer work.
+
+The budget is a fraction of the container's real memory limit, read from the
+cgroup (v2 memory.max or v1 memory.limit_in_bytes) rather than hardcoded.
+Memory-heavy work reserves its estimated bytes before starting and waits
+while the budget is exhausted; a reservation that cannot be granted in time
+raises MemoryBudgetExceeded (a MemoryError).
+
+Process RSS is read by a cheap background sampler, so request threads read a
+cached value instead of polling psutil, and garbage collection under
+pressure runs on the sampler thread instead of the request path.
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+CGROUP_LIMIT_PATHS = (
+    "/sys/fs/cgroup/memory.max",  # cgroup v2
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+)
+# cgroup v1 reports "no limit" as a huge page-aligned number
+UNLIMITED_THRESHOLD = 1 << 60
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """A reservation could not be granted within its timeout."""
+
+
+def read_cgroup_memory_limit(paths=CGROUP_LIMIT_PATHS) -> Optional[int]:
+    """The container memory limit in bytes, or None when unlimited or not in a cgroup."""
+    for path in paths:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == "max":
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        return limit if 0 < limit < UNLIMITED_THRESHOLD else None
+    return None
+
+
+def read_rss_bytes(pid: Optional[int] = None) -> int:
+    """Resident set size of this process (or pid) from /proc, psutil where /proc is unavailable; 0 if unknown."""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    return 0
+
+
+class Reservation:
+    """Bytes held against the budget until release(); usable as a context manager."""
+
+    def __init__(self, budget: "MemoryBudget", label: str, nbytes: int):
+        self.budget = budget
+        self.label = label
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.budget._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MemoryBudget:
+    """Grants byte reservations while sampled usage plus outstanding reservations fit the budget."""
+
+    def __init__(self, limit_bytes: int, budget_fraction: float = 0.8, gc_fraction: float = 0.8,
+                 sample_interval: float = 1.0, gc_min_interval: float = 10.0,
+                 read_rss: Callable[[], int] = read_rss_bytes, collect: Callable[[], int] = gc.collect,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit_bytes = limit_bytes
+        self.budget_bytes = int(limit_bytes * budget_fraction)
+        self.gc_threshold_bytes = int(self.budget_bytes * gc_fraction)
+        self.sample_interval = sample_interval
+        self.gc_min_interval = gc_min_interval
+        self.read_rss = read_rss
+        self.collect = collect
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._reserved = 0
+        self._active = 0
+        self._rss = read_rss()
+        # RSS seen while nothing was reserved: usage that reservations do not account for
+        self._baseline = self._rss
+        self._last_gc: Optional[float] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._sampler_pid: Optional[int] = None
+        self._stopped = threading.Event()
+        self.counters = {"granted": 0, "waited": 0, "timed_out": 0, "samples": 0, "gc_runs": 0}
+        self._wait_seconds = 0.0
+        self.by_label: Dict[str, int] = {}
+
+    @classmethod
+    def for_container(cls, fallback_limit_bytes: int, override_limit_bytes: Optional[int] = None, **options):
+        """Budget sized from an explicit override, else the cgroup limit, else fallback_limit_bytes."""
+        limit = override_limit_bytes or read_cgroup_memory_limit() or fallback_limit_bytes
+        return cls(limit, **options)
+
+    def start(self):
+        """Start the background sampler (idempotent); restarted in a forked child, which has no sampler thread."""
+        if self._sampler is not None and self._sampler_pid == os.getpid():
+            return self
+        with self._cond:
+            if self._sampler is None or self._sampler_pid != os.getpid():
+                if self._sampler is not None:
+                    # The child's RSS is its own, not the value sampled in the parent before the fork
+                    self._rss = self._baseline = self.read_rss()
+                self._sampler_pid = os.getpid()
+                self._sampler = threading.Thread(target=self._sample_loop, name="memory-sampler", daemon=True)
+                self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def rss_bytes(self) -> int:
+        """Latest sampled RSS; no system call on the caller's thread."""
+        return self._rss
+
+    def used_bytes(self) -> int:
+        """Sampled RSS, or the idle baseline plus reservations when reserved work has not allocated yet."""
+        with self._cond:
+            return self._used()
+
+    def available_bytes(self) -> int:
+        with self._cond:
+            return max(0, self.budget_bytes - self._used())
+
+    def reserve(self, label: str, nbytes: int, timeout: Optional[float] = None) -> Reservation:
+        """Reserve nbytes, waiting while the budget is exhausted (None waits indefinitely).
+
+        A single reservation is always granted when nothing else is reserved,
+        so oversized work still makes progress on its own.
+        """
+        nbytes = max(0, int(nbytes))
+        started = self.clock()
+        expires_at = started + timeout if timeout is not None else None
+        with self._cond:
+            waited = False
+            while self._active and self._used() + nbytes > self.budget_bytes:
+                remaining = expires_at - self.clock() if expires_at is not None else None
+                if remaining is not None and remaining <= 0:
+                    self.counters["timed_out"] += 1
+                    raise MemoryBudgetExceeded(
+                        f"{label}: {nbytes // MB} MB not available within {timeout:g}s "
+                        f"({self._used() // MB}/{self.budget_bytes // MB} MB in use)")
+                waited = True
+                self._cond.wait(remaining if remaining is not None else self.sample_interval)
+            if waited:
+                self.counters["waited"] += 1
+                self._wait_seconds += self.clock() - started
+            self._reserved += nbytes
+            self._active += 1
+            self.counters["granted"] += 1
+            self.by_label[label] = self.by_label.get(label, 0) + 1
+        return Reservation(self, label, nbytes)
+
+    def sample(self):
+        """Take one RSS sample; collects garbage (rate-limited) when usage is past the GC threshold."""
+        rss = self.read_rss()
+        now = self.clock()
+        if rss > self.gc_threshold_bytes and (self._last_gc is None or now - self._last_gc >= self.gc_min_interval):
+            self._last_gc = now
+            self.collect()
+            self.counters["gc_runs"] += 1
+            rss = self.read_rss()
+            logger.info(f"Memory above {self.gc_threshold_bytes // MB} MB; collected garbage, now {rss // MB} MB")
+        with self._cond:
+            self._rss = rss
+            if not self._active:
+                self._baseline = rss
+            self.counters["samples"] += 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waited = self.counters["waited"]
+            return {
+                "limit_mb": round(self.limit_bytes / MB, 1),
+                "budget_mb": round(self.budget_bytes / MB, 1),
+                "rss_mb": round(self._rss / MB, 1),
+                "used_mb": round(self._used() / MB, 1),
+                "reserved_mb": round(self._reserved / MB, 1),
+                "active_reservations": self._active,
+                "avg_wait_seconds": round(self._wait_seconds / waited, 3) if waited else 0.0,
+                **self.counters,
+                "by_label": dict(self.by_label),
+            }
+
+    def _used(self) -> int:
+        return max(self._rss, self._baseline + self._reserved)
+
+    def _release(self, reservation: Reservation):
+        with self._cond:
+            self._reserved -= reservation.nbytes
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.sample_interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Memory sampling failed: {e}")
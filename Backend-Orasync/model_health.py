@@ -0,0 +1,204 @@
+"""
+Model health tracking for the image model fallback chain.
+
+Each model gets a circuit breaker (closed / open / half-open) and a rolling
+window of call outcomes used for p50/p95 latency and error rate. Routing skips
+open circuits and tries the fastest healthy model first.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class CircuitBreaker:
+    """Per-model breaker: opens after repeated failures, probes again after a cool-down."""
+
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 60.0,
+                 half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_calls = 0
+
+    def _maybe_half_open(self, now: float):
+        if self.state == OPEN and now - self.opened_at >= self.recovery_timeout:
+            self.state = HALF_OPEN
+            self.half_open_calls = 0
+
+    def allow_request(self, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        self._maybe_half_open(now)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.half_open_calls < self.half_open_max_calls:
+            self.half_open_calls += 1
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+
+    def record_failure(self, now: Optional[float] = None):
+        now = now or time.time()
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = now
+            self.half_open_calls = 0
+
+
+class ModelHealth:
+    """Rolling window of call outcomes for one model."""
+
+    def __init__(self, name: str, label: str, priority: int, window_size: int = 50, **breaker_options):
+        self.name = name
+        self.label = label
+        self.priority = priority
+        self.outcomes = deque(maxlen=window_size)  # (timestamp, latency_seconds, ok)
+        self.breaker = CircuitBreaker(**breaker_options)
+        self.last_error: Optional[str] = None
+
+    def latencies(self) -> List[float]:
+        return [latency for _, latency, ok in self.outcomes if ok]
+
+    def p50(self) -> Optional[float]:
+        return percentile(self.latencies(), 50)
+
+    def p95(self) -> Optional[float]:
+        return percentile(self.latencies(), 95)
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def snapshot(self) -> Dict:
+        p50, p95 = self.p50(), self.p95()
+        return {
+            "model": self.name,
+            "label": self.label,
+            "priority": self.priority,
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "opened_at": datetime.fromtimestamp(self.breaker.opened_at).isoformat() if self.breaker.opened_at else None,
+            "samples": len(self.outcomes),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 4),
+            "last_error": self.last_error,
+        }
+
+
+class ModelHealthRegistry:
+    """Health registry and router for an ordered chain of interchangeable models."""
+
+    def __init__(self, models: List[Tuple[str, str]], min_samples: int = 3, decision_log_size: int = 50,
+                 **model_options):
+        self.min_samples = min_samples
+        self._models: Dict[str, ModelHealth] = {
+            name: ModelHealth(name, label, priority, **model_options)
+            for priority, (name, label) in enumerate(models)
+        }
+        self._decisions = deque(maxlen=decision_log_size)
+        self._lock = threading.Lock()
+
+    def _speed_key(self, health: ModelHealth):
+        # Measured models go first, fastest first; models without enough
+        # samples follow in configured order, so an untested fallback never
+        # jumps ahead of a primary with a known latency.
+        p50 = health.p50() if len(health.latencies()) >= self.min_samples else None
+        return (p50 is None, p50 if p50 is not None else 0.0, health.priority)
+
+    def route(self) -> List[Tuple[str, str]]:
+        """Models to try: a half-open model's trial call, then the fastest healthy; open circuits are skipped."""
+        now = time.time()
+        with self._lock:
+            closed, probing, skipped = [], [], []
+            for health in self._models.values():
+                health.breaker._maybe_half_open(now)
+                if health.breaker.state == CLOSED:
+                    closed.append(health)
+                elif health.breaker.state == HALF_OPEN:
+                    probing.append(health)
+                else:
+                    skipped.append(health)
+            # A recovering model whose trial slot is free goes first: callers stop at the
+            # first success, so behind a working fallback it would never get its trial call
+            trial = [h for h in probing if h.breaker.half_open_calls < h.breaker.half_open_max_calls]
+            busy = [h for h in probing if h not in trial]
+            ordered = (sorted(trial, key=lambda h: h.priority) + sorted(closed, key=self._speed_key)
+                       + sorted(busy, key=lambda h: h.priority))
+            if not ordered and skipped:
+                # Everything is open: probe the model that has been resting longest
+                ordered = [min(skipped, key=lambda h: h.breaker.opened_at)]
+                skipped.remove(ordered[0])
+            self._decisions.append({
+                "timestamp": datetime.now().isoformat(),
+                "order": [h.name for h in ordered],
+                "skipped_open": [h.name for h in skipped],
+            })
+            return [(h.name, h.label) for h in ordered]
+
+    def allow_request(self, model: str) -> bool:
+        """Gate a single attempt; consumes a half-open trial slot when probing."""
+        with self._lock:
+            if self._models[model].breaker.allow_request():
+                return True
+            # When every circuit is open the router still hands out a last-resort probe
+            return all(h.breaker.state == OPEN for h in self._models.values())
+
+    def record_success(self, model: str, latency: float):
+        with self._lock:
+            health = self._models[model]
+            health.outcomes.append((time.time(), latency, True))
+            health.breaker.record_success()
+
+    def release_trial(self, model: str):
+        """Hand back a half-open trial slot when the attempt ended for a reason unrelated to the model."""
+        with self._lock:
+            breaker = self._models[model].breaker
+            if breaker.state == HALF_OPEN and breaker.half_open_calls:
+                breaker.half_open_calls -= 1
+
+    def record_failure(self, model: str, latency: float, error: Optional[BaseException] = None):
+        with self._lock:
+            health = self._models[model]
+            health.outcomes.append((time.time(), latency, False))
+            previous_state = health.breaker.state
+            health.breaker.record_failure()
+            health.last_error = str(error)[:200] if error else None
+            if previous_state != OPEN and health.breaker.state == OPEN:
+                logger.warning(f"Circuit opened for {health.label} ({model}) after {health.breaker.consecutive_failures} failures")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "models": [h.snapshot() for h in sorted(self._models.values(), key=lambda h: h.priority)],
+                "recent_routing_decisions": list(self._decisions),
+            }
@@ -0,0 +1,258 @@
+"""
+Asynchronous, batched push-notification dispatch.
+
+send_push_notification used to call messaging.send inline at the end of each
+flow, so FCM latency and failures landed on the user's request. Messages are
+now queued and a background thread sends them in batches (send_each, or
+send_each_for_multicast when several tokens share one payload). Transient
+failures are retried with backoff; tokens FCM rejects as unregistered are
+remembered and never sent to again.
+
+FCMTransport wraps firebase_admin.messaging; LocalPushTransport is an
+in-process stand-in so the dispatcher can be exercised without FCM.
+"""
+
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Callable, Dict, List, Optional
+
+from caching import LRUCache
+
+logger = logging.getLogger(__name__)
+
+Notification = namedtuple("Notification", ["token", "title", "body", "data"])
+# status is "sent", "invalid_token" (never retry this token), "transient" (retry) or "failed"
+SendResult = namedtuple("SendResult", ["status", "error"])
+
+# FCM accepts at most 500 messages per send_each / multicast call
+MAX_BATCH_MESSAGES = 500
+
+INVALID_TOKEN_ERRORS = ("UnregisteredError", "SenderIdMismatchError")
+TRANSIENT_ERROR_CODES = ("UNAVAILABLE", "INTERNAL", "UNKNOWN", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED")
+
+
+def classify_error(error: Exception) -> str:
+    """Map a firebase_admin exception to a SendResult status by its class name and code."""
+    if type(error).__name__ in INVALID_TOKEN_ERRORS:
+        return "invalid_token"
+    if type(error).__name__ == "QuotaExceededError" or getattr(error, "code", None) in TRANSIENT_ERROR_CODES:
+        return "transient"
+    return "failed"
+
+
+class FCMTransport:
+    """Sends batches through firebase_admin.messaging."""
+
+    def __init__(self, messaging_module):
+        self.messaging = messaging_module
+
+    def send(self, notifications: List[Notification]) -> List[SendResult]:
+        """One SendResult per notification, in order; a failed call marks its whole batch transient."""
+        results: List[Optional[SendResult]] = [None] * len(notifications)
+        groups: Dict[tuple, List[int]] = {}
+        for index, notification in enumerate(notifications):
+            payload = (notification.title, notification.body, tuple(sorted(notification.data.items())))
+            groups.setdefault(payload, []).append(index)
+
+        singles = []
+        for (title, body, data), indexes in groups.items():
+            if len(indexes) == 1:
+                singles.extend(indexes)
+                continue
+            message = self.messaging.MulticastMessage(
+                notification=self.messaging.Notification(title=title, body=body),
+                data=dict(data),
+                tokens=[notifications[i].token for i in indexes],
+            )
+            self._collect(results, indexes, lambda: self.messaging.send_each_for_multicast(message))
+        if singles:
+            messages = [self._message(notifications[i]) for i in singles]
+            self._collect(results, singles, lambda: self.messaging.send_each(messages))
+        return results
+
+    def _message(self, notification: Notification):
+        return self.messaging.Message(
+            notification=self.messaging.Notification(title=notification.title, body=notification.body),
+            data=notification.data,
+            token=notification.token,
+        )
+
+    @staticmethod
+    def _collect(results: List, indexes: List[int], call: Callable):
+        try:
+            responses = call().responses
+        except Exception as e:
+            for index in indexes:
+                results[index] = SendResult("transient", str(e))
+            return
+        for index, response in zip(indexes, responses):
+            if response.success:
+                results[index] = SendResult("sent", None)
+            else:
+                results[index] = SendResult(classify_error(response.exception), str(response.exception))
+
+
+class LocalPushTransport:
+    """In-process stand-in for FCM: records what was sent, rejects invalid tokens and can fail on demand."""
+
+    def __init__(self, invalid_tokens=(), transient_failures: int = 0):
+        self.invalid_tokens = set(invalid_tokens)
+        self.transient_failures = transient_failures
+        self.sent: List[Notification] = []
+        self.calls = 0
+
+    def send(self, notifications: List[Notification]) -> List[SendResult]:
+        self.calls += 1
+        if self.transient_failures:
+            self.transient_failures -= 1
+            return [SendResult("transient", "UNAVAILABLE") for _ in notifications]
+        results = []
+        for notification in notifications:
+            if notification.token in self.invalid_tokens:
+                results.append(SendResult("invalid_token", "Requested entity was not found."))
+            else:
+                self.sent.append(notification)
+                results.append(SendResult("sent", None))
+        return results
+
+
+class NotificationDispatcher:
+    """Queues notifications and sends them in batches on a background thread."""
+
+    def __init__(self, transport, batch_size: int = MAX_BATCH_MESSAGES, linger_seconds: float = 0.5,
+                 max_attempts: int = 4, retry_base_delay: float = 1.0, max_queued: int = 10000,
+                 max_invalid_tokens: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.transport = transport
+        self.batch_size = min(batch_size, MAX_BATCH_MESSAGES)
+        self.linger_seconds = linger_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.max_queued = max_queued
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._ready = deque()  # (queued_at, attempts, notification)
+        self._delayed = []  # heap of (ready_at, seq, queued_at, attempts, notification)
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._invalid_tokens = LRUCache(max_entries=max_invalid_tokens)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self.counters = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0, "rejected_full": 0,
+                         "invalid_tokens": 0, "skipped_invalid": 0, "batches": 0}
+        atexit.register(self.flush, 5.0)
+
+    def send(self, token: str, title: str, body: str, data: Optional[Dict] = None) -> bool:
+        """Queue a notification; False when the token is known to be invalid or the queue is full."""
+        if self.is_invalid(token):
+            with self._cond:
+                self.counters["skipped_invalid"] += 1
+            return False
+        notification = Notification(token, title, body, {str(k): str(v) for k, v in (data or {}).items()})
+        self._ensure_thread()
+        with self._cond:
+            if len(self._ready) + len(self._delayed) >= self.max_queued:
+                self.counters["rejected_full"] += 1
+                logger.warning(f"Notification queue full ({self.max_queued}); dropping '{title}'")
+                return False
+            self._ready.append((self.clock(), 0, notification))
+            self.counters["queued"] += 1
+            self._cond.notify_all()
+        return True
+
+    def is_invalid(self, token: str) -> bool:
+        return self._invalid_tokens.get(token) is not None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued is sent, retried out or dropped; retries are not waited for past timeout."""
+        deadline = self.clock() + timeout if timeout is not None else None
+        with self._cond:
+            self._cond.notify_all()
+            while self._ready or self._delayed or self._in_flight:
+                remaining = deadline - self.clock() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1) if remaining is not None else 0.1)
+            return True
+
+    def stats(self) -> Dict:
+        with self._cond:
+            oldest = min([queued_at for queued_at, _, _ in self._ready] +
+                         [entry[2] for entry in self._delayed], default=None)
+            return {
+                "queued_now": len(self._ready),
+                "awaiting_retry": len(self._delayed),
+                "queue_lag_seconds": round(self.clock() - oldest, 3) if oldest is not None else 0.0,
+                "known_invalid_tokens": len(self._invalid_tokens),
+                **self.counters,
+            }
+
+    def _ensure_thread(self):
+        """Start the sender thread; restarted in a forked child, where the parent's thread does not exist."""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                self._in_flight = 0
+                self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = self.clock()
+                    while self._delayed and self._delayed[0][0] <= now:
+                        _, _, queued_at, attempts, notification = heapq.heappop(self._delayed)
+                        self._ready.append((queued_at, attempts, notification))
+                    if self._ready and (len(self._ready) >= self.batch_size
+                                        or now - self._ready[0][0] >= self.linger_seconds
+                                        or self._ready[0][1] > 0):
+                        break
+                    waits = [self.linger_seconds - (now - self._ready[0][0])] if self._ready else []
+                    if self._delayed:
+                        waits.append(self._delayed[0][0] - now)
+                    self._cond.wait(max(0.0, min(waits)) if waits else None)
+                batch = [self._ready.popleft() for _ in range(min(self.batch_size, len(self._ready)))]
+                # Drop messages for tokens that were rejected after they were queued
+                batch = [entry for entry in batch if not self.is_invalid(entry[2].token)]
+                self._in_flight = len(batch)
+            if batch:
+                self._send(batch)
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _send(self, batch: List[tuple]):
+        try:
+            results = self.transport.send([notification for _, _, notification in batch])
+        except Exception as e:
+            logger.warning(f"Notification batch of {len(batch)} failed: {e}")
+            results = [SendResult("transient", str(e))] * len(batch)
+        with self._cond:
+            self.counters["batches"] += 1
+            for (queued_at, attempts, notification), result in zip(batch, results):
+                if result.status == "sent":
+                    self.counters["sent"] += 1
+                elif result.status == "invalid_token":
+                    self._invalid_tokens.set(notification.token, True)
+                    self.counters["invalid_tokens"] += 1
+                    logger.info(f"Push token rejected as invalid; will not send to it again ({result.error})")
+                elif result.status == "transient" and attempts + 1 < self.max_attempts:
+                    delay = self.retry_base_delay * (2 ** attempts)
+                    heapq.heappush(self._delayed, (self.clock() + delay, next(self._seq), queued_at, attempts + 1,
+                                                   notification))
+                    self.counters["retried"] += 1
+                elif result.status == "transient":
+                    self.counters["dropped"] += 1
+                    logger.error(f"Giving up on notification '{notification.title}' after {attempts + 1} attempts: "
+                                 f"{result.error}")
+                else:
+                    self.counters["failed"] += 1
+                    logger.error(f"Notification '{notification.title}' failed: {result.error}")
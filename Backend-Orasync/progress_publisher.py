@@ -0,0 +1,210 @@
+"""
+Write-behind publisher for Firestore progress and task-status documents.
+
+Request threads used to make a synchronous Firestore round-trip for every
+progress step and status change. They now queue the write and return at
+once. Queued writes are merged per document, so ten progress steps on one
+request become a single write, and a background thread commits them in
+debounced batches. Terminal writes (completed / failed / cleanup) skip the
+debounce and are flushed at exit, so they are never lost to it.
+
+queue_lag_seconds in stats() is the age of the oldest write not yet sent.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from typing import Callable, Dict, List, Optional
+
+from model_health import percentile
+
+logger = logging.getLogger(__name__)
+
+# op is "merge" (set with merge=True), "set" (replace the document) or "delete"
+Write = namedtuple("Write", ["collection", "document", "op", "fields"])
+
+# Firestore accepts at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+def firestore_batch_commit(db) -> Callable[[List[Write]], None]:
+    """commit() for ProgressPublisher that sends the writes as one Firestore batch."""
+    def commit(writes: List[Write]):
+        batch = db.batch()
+        for write in writes:
+            ref = db.collection(write.collection).document(write.document)
+            if write.op == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, write.fields, merge=(write.op == "merge"))
+        batch.commit()
+    return commit
+
+
+class _Pending:
+    __slots__ = ("op", "fields", "queued_at", "terminal", "attempts")
+
+    def __init__(self, op: str, fields: Optional[Dict], queued_at: float, terminal: bool):
+        self.op = op
+        self.fields = fields
+        self.queued_at = queued_at
+        self.terminal = terminal
+        self.attempts = 0
+
+
+class ProgressPublisher:
+    """Queues document writes, merges them per document and commits debounced batches on a background thread."""
+
+    def __init__(self, commit: Callable[[List[Write]], None], debounce_seconds: float = 1.0,
+                 max_batch: int = MAX_BATCH_WRITES, max_attempts: int = 3, retry_delay: float = 2.0,
+                 window_size: int = 200, clock: Callable[[], float] = time.monotonic):
+        self._commit = commit
+        self.debounce_seconds = debounce_seconds
+        self.max_batch = min(max_batch, MAX_BATCH_WRITES)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[tuple, _Pending]" = OrderedDict()  # (collection, document) -> write
+        self._in_flight = 0
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._lags = deque(maxlen=window_size)
+        self._retry_after = 0.0
+        self.counters = {"queued": 0, "coalesced": 0, "writes": 0, "batches": 0, "failed_batches": 0, "dropped": 0}
+        atexit.register(self.flush, 5.0)
+
+    def merge(self, collection: str, document: str, fields: Dict, terminal: bool = False):
+        """Queue set(fields, merge=True); fields queued earlier for the same document are merged into it."""
+        self._enqueue(collection, document, "merge", fields, terminal)
+
+    def delete(self, collection: str, document: str):
+        """Queue a delete; it replaces any pending write for the document and is flushed without debounce."""
+        self._enqueue(collection, document, "delete", None, True)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued so far; True once nothing is pending or in flight."""
+        self._ensure_writer()
+        deadline = self.clock() + timeout if timeout is not None else None
+        with self._cond:
+            for entry in self._pending.values():
+                entry.terminal = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - self.clock() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+            return True
+
+    def stats(self) -> Dict:
+        with self._cond:
+            now = self.clock()
+            oldest = min((entry.queued_at for entry in self._pending.values()), default=None)
+            lags = list(self._lags)
+            return {
+                "pending_documents": len(self._pending),
+                "queue_lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+                "lag_p50_seconds": _rounded(percentile(lags, 50)),
+                "lag_p95_seconds": _rounded(percentile(lags, 95)),
+                "debounce_seconds": self.debounce_seconds,
+                **self.counters,
+            }
+
+    def _enqueue(self, collection: str, document: str, op: str, fields: Optional[Dict], terminal: bool):
+        self._ensure_writer()
+        key = (collection, document)
+        with self._cond:
+            self.counters["queued"] += 1
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = _Pending(op, dict(fields) if fields else None, self.clock(), terminal)
+            else:
+                self.counters["coalesced"] += 1
+                if op == "delete":
+                    entry.op, entry.fields = "delete", None
+                elif entry.op == "delete":
+                    # Recreated after a delete: the new fields replace the whole document
+                    entry.op, entry.fields = "set", dict(fields)
+                else:
+                    entry.fields.update(fields)
+                entry.terminal = entry.terminal or terminal
+            self._cond.notify_all()
+
+    def _ensure_writer(self):
+        """Start the writer thread; restarted in a forked child, where the parent's thread does not exist."""
+        if self._writer is not None and self._writer_pid == os.getpid():
+            return
+        with self._cond:
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                self._in_flight = 0
+                self._writer = threading.Thread(target=self._run, name="progress-publisher", daemon=True)
+                self._writer.start()
+
+    def _due(self, now: float) -> bool:
+        if not self._pending or now < self._retry_after:
+            return False
+        if any(entry.terminal for entry in self._pending.values()):
+            return True
+        oldest = next(iter(self._pending.values())).queued_at
+        return now - oldest >= self.debounce_seconds
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due(self.clock()):
+                    self._cond.wait(self.debounce_seconds / 4 if self._pending else None)
+                keys = list(self._pending)[:self.max_batch]
+                batch = [(key, self._pending.pop(key)) for key in keys]
+                self._in_flight = len(batch)
+            self._send(batch)
+
+    def _send(self, batch: List[tuple]):
+        writes = [Write(collection, document, entry.op, entry.fields) for (collection, document), entry in batch]
+        try:
+            self._commit(writes)
+        except Exception as e:
+            logger.warning(f"Progress batch of {len(writes)} writes failed: {e}")
+            with self._cond:
+                self.counters["failed_batches"] += 1
+                self._requeue(batch)
+                self._retry_after = self.clock() + self.retry_delay
+                self._in_flight = 0
+                self._cond.notify_all()
+            return
+        with self._cond:
+            now = self.clock()
+            self.counters["writes"] += len(writes)
+            self.counters["batches"] += 1
+            for _, entry in batch:
+                self._lags.append(now - entry.queued_at)
+            self._in_flight = 0
+            self._cond.notify_all()
+
+    def _requeue(self, batch: List[tuple]):
+        """Put a failed batch back under any newer writes for the same documents."""
+        for key, entry in reversed(batch):
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts:
+                self.counters["dropped"] += 1
+                logger.error(f"Dropping {entry.op} of {key[0]}/{key[1]} after {entry.attempts} attempts")
+                continue
+            newer = self._pending.pop(key, None)
+            if newer is not None:
+                if newer.op != "merge":
+                    entry.op, entry.fields = newer.op, newer.fields
+                elif entry.op == "delete":
+                    entry.op, entry.fields = "set", newer.fields
+                else:
+                    entry.fields.update(newer.fields)
+                entry.terminal = entry.terminal or newer.terminal
+            self._pending[key] = entry
+            self._pending.move_to_end(key, last=False)
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
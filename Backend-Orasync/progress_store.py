@@ -0,0 +1,343 @@
+"""
+Shared store for per-request progress and state.
+
+/progress/<request_id> used to read module-level dicts, so a poll only
+worked when it landed on the process running the request. Records now live
+behind the ProgressStore interface; with the SQLite (one host), Redis-protocol
+or Firestore backend any worker or instance can answer the poll.
+
+Records are flat JSON-serialisable dicts. update() merges fields into an
+existing record atomically and refuses to recreate one that was deleted or
+has expired. Every write pushes the record's expiry ttl_seconds ahead, so
+records of crashed requests disappear on their own.
+"""
+
+import abc
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class ProgressStore(abc.ABC):
+    """Interface of the progress backends; each counts its operations in counters."""
+
+    name = "base"
+
+    def __init__(self, ttl_seconds: float = 3600, clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.counters = {"puts": 0, "updates": 0, "missed_updates": 0, "gets": 0, "deletes": 0}
+
+    @abc.abstractmethod
+    def put(self, key: str, record: Dict):
+        """Create or replace the record."""
+
+    @abc.abstractmethod
+    def update(self, key: str, fields: Dict) -> bool:
+        """Merge fields into the live record atomically; False (and no write) when there is none."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        """The live record, or None when it is missing or expired."""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove the record; a no-op when there is none."""
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "ttl_seconds": self.ttl_seconds, **self.counters}
+
+    def _count(self, counter: str):
+        self.counters[counter] += 1
+
+
+class MemoryProgressStore(ProgressStore):
+    """Process-local records: the single-worker default, and for tests."""
+
+    name = "memory"
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, ttl_seconds: float = 3600, clock: Callable[[], float] = time.time):
+        super().__init__(ttl_seconds, clock)
+        self._records: Dict[str, tuple] = {}  # key -> (record, expires_at)
+        self._lock = threading.Lock()
+        self._next_sweep = clock() + self.SWEEP_INTERVAL
+
+    def put(self, key: str, record: Dict):
+        with self._lock:
+            now = self.clock()
+            self._records[key] = (dict(record), now + self.ttl_seconds)
+            self._count("puts")
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.SWEEP_INTERVAL
+                for expired in [k for k, (_, expires_at) in self._records.items() if expires_at <= now]:
+                    del self._records[expired]
+
+    def update(self, key: str, fields: Dict) -> bool:
+        with self._lock:
+            record = self._live(key)
+            if record is None:
+                self._count("missed_updates")
+                return False
+            record.update(fields)
+            self._records[key] = (record, self.clock() + self.ttl_seconds)
+            self._count("updates")
+            return True
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            self._count("gets")
+            record = self._live(key)
+            return dict(record) if record is not None else None
+
+    def delete(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+            self._count("deletes")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**super().stats(), "records": len(self._records)}
+
+    def _live(self, key: str) -> Optional[Dict]:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= self.clock():
+            del self._records[key]
+            return None
+        return entry[0]
+
+
+class SQLiteProgressStore(ProgressStore):
+    """Records in a WAL-mode SQLite file, shared by every worker process on the host."""
+
+    name = "sqlite"
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path: str, ttl_seconds: float = 3600, clock: Callable[[], float] = time.time,
+                 table: str = "progress"):
+        super().__init__(ttl_seconds, clock)
+        if not _IDENTIFIER.match(table):
+            raise ValueError(f"Invalid progress table name '{table}'")
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Set up with a throwaway connection: connections must not cross a gunicorn fork
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                         "(key TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def put(self, key: str, record: Dict):
+        now = self.clock()
+        conn = self._conn()
+        with conn:
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, record, expires_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(record), now + self.ttl_seconds))
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.SWEEP_INTERVAL
+                conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+        self._count("puts")
+
+    def update(self, key: str, fields: Dict) -> bool:
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front, so no other process can interleave its merge
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = self.clock()
+            row = conn.execute(f"SELECT record FROM {self.table} WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                self._count("missed_updates")
+                return False
+            record = {**json.loads(row[0]), **fields}
+            conn.execute(f"UPDATE {self.table} SET record = ?, expires_at = ? WHERE key = ?",
+                         (json.dumps(record), now + self.ttl_seconds, key))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("updates")
+        return True
+
+    def get(self, key: str) -> Optional[Dict]:
+        self._count("gets")
+        row = self._conn().execute(f"SELECT record FROM {self.table} WHERE key = ? AND expires_at > ?",
+                                   (key, self.clock())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        self._count("deletes")
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+
+class RedisProgressStore(ProgressStore):
+    """Records as hashes in any Redis-protocol server (Redis, Valkey, Memorystore), shared by all instances."""
+
+    name = "redis"
+
+    # Merge and refresh the expiry in one server-side step, only while the record exists
+    UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+    def __init__(self, url: Optional[str] = None, ttl_seconds: float = 3600, prefix: str = "progress:",
+                 client=None):
+        super().__init__(ttl_seconds)
+        if client is None:
+            if redis is None:
+                raise RuntimeError("The redis package is required for the redis progress store")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.prefix = prefix
+        self._update_script = client.register_script(self.UPDATE_SCRIPT)
+
+    def put(self, key: str, record: Dict):
+        name = self.prefix + key
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(name)
+        if record:
+            pipe.hset(name, mapping={field: json.dumps(value) for field, value in record.items()})
+            pipe.expire(name, int(self.ttl_seconds))
+        pipe.execute()
+        self._count("puts")
+
+    def update(self, key: str, fields: Dict) -> bool:
+        if not fields:
+            return self.get(key) is not None
+        args = [int(self.ttl_seconds)]
+        for field, value in fields.items():
+            args += [field, json.dumps(value)]
+        if not self._update_script(keys=[self.prefix + key], args=args):
+            self._count("missed_updates")
+            return False
+        self._count("updates")
+        return True
+
+    def get(self, key: str) -> Optional[Dict]:
+        self._count("gets")
+        values = self.client.hgetall(self.prefix + key)
+        if not values:
+            return None
+        return {_text(field): json.loads(value) for field, value in values.items()}
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+        self._count("deletes")
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class FirestoreProgressStore(ProgressStore):
+    """Records as documents in a Firestore collection, shared by all instances.
+
+    Each document carries expires_at, so a Firestore TTL policy on that
+    field removes abandoned records; get() already ignores expired ones.
+    """
+
+    name = "firestore"
+
+    def __init__(self, db, collection: str = "request_progress", ttl_seconds: float = 3600,
+                 clock: Callable[[], float] = time.time):
+        super().__init__(ttl_seconds, clock)
+        self.db = db
+        self.collection = collection
+
+    def put(self, key: str, record: Dict):
+        self._doc(key).set({**record, "expires_at": self._expires_at()})
+        self._count("puts")
+
+    def update(self, key: str, fields: Dict) -> bool:
+        # update() is a server-side field merge that fails when the document does not exist
+        try:
+            self._doc(key).update({**fields, "expires_at": self._expires_at()})
+        except Exception as e:
+            if type(e).__name__ != "NotFound":
+                raise
+            self._count("missed_updates")
+            return False
+        self._count("updates")
+        return True
+
+    def get(self, key: str) -> Optional[Dict]:
+        self._count("gets")
+        snapshot = self._doc(key).get()
+        if not snapshot.exists:
+            return None
+        record = snapshot.to_dict()
+        expires_at = record.pop("expires_at", None)
+        if expires_at is not None and expires_at.timestamp() <= self.clock():
+            return None
+        return record
+
+    def delete(self, key: str):
+        self._doc(key).delete()
+        self._count("deletes")
+
+    def _doc(self, key: str):
+        return self.db.collection(self.collection).document(key)
+
+    def _expires_at(self) -> datetime:
+        return datetime.fromtimestamp(self.clock() + self.ttl_seconds, tz=timezone.utc)
+
+
+def create_progress_store(backend: str, ttl_seconds: float = 3600, url: Optional[str] = None,
+                          firestore_db=None, collection: str = "request_progress") -> ProgressStore:
+    """Build the store named by backend (memory | sqlite | redis | firestore).
+
+    url is the SQLite file path or the redis:// URL; collection names the
+    Firestore collection, SQLite table or Redis key prefix, so stores built
+    with different collections never see each other's records. Falls back to
+    memory when Firestore is requested but not available.
+    """
+    if backend == "sqlite":
+        return SQLiteProgressStore(url or "progress.sqlite3", ttl_seconds=ttl_seconds, table=collection)
+    if backend == "redis":
+        return RedisProgressStore(url, ttl_seconds=ttl_seconds, prefix=f"{collection}:")
+    if backend == "firestore":
+        if firestore_db is not None:
+            return FirestoreProgressStore(firestore_db, collection=collection, ttl_seconds=ttl_seconds)
+        logger.warning("Firestore is not available; keeping request progress in memory")
+    elif backend != "memory":
+        raise ValueError(f"Unknown progress store '{backend}'")
+    return MemoryProgressStore(ttl_seconds=ttl_seconds)
@@ -0,0 +1,269 @@
+"""
+Provider-side caching of large, repeated prompt prefixes.
+
+PromptPrefixCache maps a (model, system instruction, prefix contents) triple
+to a cached-content handle, creates it on first use, refreshes its TTL before
+it expires and falls back to sending the full prompt whenever caching is not
+possible (prefix below the model minimum, API error, backend disabled).
+
+GenAICachedContentBackend talks to the Gemini caches API; LocalCachedContentBackend
+is an in-process stand-in with the same behaviour for offline tests.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Explicit caching rejects prefixes below a per-model token minimum
+DEFAULT_MIN_TOKENS = 1024
+MODEL_MIN_TOKENS = {"gemini-2.5-flash": 1024, "gemini-2.5-pro": 4096}
+
+# What the API answers for a cached_content handle that is gone, expired or not usable by this project
+CACHE_REJECTION_CODES = (400, 403, 404)
+CACHE_REJECTION_STATUSES = ("INVALID_ARGUMENT", "PERMISSION_DENIED", "NOT_FOUND", "FAILED_PRECONDITION")
+
+
+def is_cache_rejection(error: BaseException) -> bool:
+    """True when a request sent with a cached prefix failed with a client error the full prompt may not hit.
+
+    Classified by HTTP code or RPC status (google.genai APIError carries
+    both), never by message text. Timeouts and server errors are not
+    rejections; a genuinely bad request simply fails again on the retry.
+    """
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code in CACHE_REJECTION_CODES
+    status = getattr(error, "status", None)
+    return isinstance(status, str) and status.upper() in CACHE_REJECTION_STATUSES
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token count (~4 characters per token) used to skip prefixes too small to cache."""
+    return len(text) // 4 if text else 0
+
+
+def prefix_key(model: str, system_instruction: Optional[str], contents: Optional[List[str]]) -> str:
+    payload = json.dumps({"model": model, "system_instruction": system_instruction or "",
+                          "contents": list(contents or [])}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedPrefix:
+    __slots__ = ("name", "model", "expires_at", "token_count", "uses")
+
+    def __init__(self, name: str, model: str, expires_at: float, token_count: int):
+        self.name = name
+        self.model = model
+        self.expires_at = expires_at
+        self.token_count = token_count
+        self.uses = 0
+
+
+class GenAICachedContentBackend:
+    """Cached contents stored by the Gemini API (client.caches)."""
+
+    def __init__(self, client, types_module):
+        self.client = client
+        self.types = types_module
+
+    def create(self, model: str, system_instruction: Optional[str], contents: Optional[List[str]],
+               ttl_seconds: int, display_name: str):
+        """Returns (name, expires_at epoch seconds, token_count)."""
+        config = self.types.CreateCachedContentConfig(
+            system_instruction=system_instruction,
+            contents=list(contents) if contents else None,
+            ttl=f"{int(ttl_seconds)}s",
+            display_name=display_name,
+        )
+        cached = self.client.caches.create(model=model, config=config)
+        usage = getattr(cached, "usage_metadata", None)
+        token_count = getattr(usage, "total_token_count", None) or 0
+        return cached.name, _expiry(getattr(cached, "expire_time", None), ttl_seconds), token_count
+
+    def refresh(self, name: str, ttl_seconds: int) -> float:
+        cached = self.client.caches.update(
+            name=name, config=self.types.UpdateCachedContentConfig(ttl=f"{int(ttl_seconds)}s"))
+        return _expiry(getattr(cached, "expire_time", None), ttl_seconds)
+
+    def delete(self, name: str):
+        self.client.caches.delete(name=name)
+
+
+def _expiry(expire_time, ttl_seconds: int) -> float:
+    if expire_time is not None and hasattr(expire_time, "timestamp"):
+        return expire_time.timestamp()
+    return time.time() + ttl_seconds
+
+
+class LocalCachedContentBackend:
+    """In-process stand-in for the caches API: enforces token minimums and expiry."""
+
+    def __init__(self, clock: Callable[[], float] = time.time, min_tokens: Optional[Dict[str, int]] = None):
+        self.clock = clock
+        self.min_tokens = dict(MODEL_MIN_TOKENS if min_tokens is None else min_tokens)
+        self.entries: Dict[str, dict] = {}
+        self.creates = 0
+        self.refreshes = 0
+
+    def create(self, model, system_instruction, contents, ttl_seconds, display_name):
+        token_count = estimate_tokens(system_instruction) + sum(estimate_tokens(c) for c in contents or [])
+        if token_count < self.min_tokens.get(model, DEFAULT_MIN_TOKENS):
+            raise ValueError(f"Cached content is too small: {token_count} tokens")
+        name = f"cachedContents/local-{uuid.uuid4().hex[:12]}"
+        expires_at = self.clock() + ttl_seconds
+        self.entries[name] = {"model": model, "expires_at": expires_at, "token_count": token_count,
+                              "display_name": display_name}
+        self.creates += 1
+        return name, expires_at, token_count
+
+    def refresh(self, name, ttl_seconds):
+        entry = self.entries.get(name)
+        if not entry or entry["expires_at"] <= self.clock():
+            raise KeyError(f"{name} not found")
+        entry["expires_at"] = self.clock() + ttl_seconds
+        self.refreshes += 1
+        return entry["expires_at"]
+
+    def delete(self, name):
+        self.entries.pop(name, None)
+
+
+class PromptPrefixCache:
+    """Creates, refreshes and tracks cached prompt prefixes; returns None when the caller should send the full prompt."""
+
+    def __init__(self, backend, ttl_seconds: int = 3600, refresh_margin_seconds: int = 300,
+                 failure_backoff_seconds: int = 600, max_entries: int = 64,
+                 min_tokens: Optional[Dict[str, int]] = None, clock: Callable[[], float] = time.time):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self.max_entries = max_entries
+        self.min_tokens = dict(MODEL_MIN_TOKENS if min_tokens is None else min_tokens)
+        self.clock = clock
+        self._entries: "OrderedDict[str, CachedPrefix]" = OrderedDict()
+        self._unavailable: Dict[str, float] = {}  # key -> retry-after time
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.counters = {"hits": 0, "creates": 0, "refreshes": 0, "fallbacks": 0, "too_small": 0,
+                         "errors": 0, "evictions": 0}
+        self.usage = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self.usage_by_label: Dict[str, Dict[str, int]] = {}
+
+    def get(self, model: str, system_instruction: Optional[str] = None, contents: Optional[List[str]] = None,
+            label: str = "prefix") -> Optional[str]:
+        """Cached-content name covering system_instruction + contents for model, or None to send them inline."""
+        if self.backend is None:
+            return None
+        tokens = estimate_tokens(system_instruction) + sum(estimate_tokens(c) for c in contents or [])
+        if tokens < self.min_tokens.get(model, DEFAULT_MIN_TOKENS):
+            self._count("too_small")
+            return None
+
+        key = prefix_key(model, system_instruction, contents)
+        with self._lock:
+            if self._unavailable.get(key, 0) > self.clock():
+                self.counters["fallbacks"] += 1
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One creator per prefix; concurrent callers wait instead of creating duplicates
+        with key_lock:
+            now = self.clock()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry.expires_at <= now:
+                    self._entries.pop(key)
+                    entry = None
+                if entry:
+                    self._entries.move_to_end(key)
+            try:
+                if entry and entry.expires_at - now <= self.refresh_margin_seconds:
+                    entry.expires_at = self.backend.refresh(entry.name, self.ttl_seconds)
+                    self._count("refreshes")
+                if entry is None:
+                    name, expires_at, token_count = self.backend.create(
+                        model, system_instruction, contents, self.ttl_seconds, f"liroo-{label}-{key[:12]}")
+                    entry = CachedPrefix(name, model, expires_at, token_count or tokens)
+                    self._count("creates")
+                    logger.info(f"Created cached prefix {name} for {label} ({entry.token_count} tokens)")
+                    self._store(key, entry)
+            except Exception as e:
+                logger.warning(f"Prompt prefix caching unavailable for {label}: {e}")
+                with self._lock:
+                    self._entries.pop(key, None)
+                    now = self.clock()
+                    self._unavailable = {k: t for k, t in self._unavailable.items() if t > now}
+                    self._unavailable[key] = now + self.failure_backoff_seconds
+                    self._key_locks.pop(key, None)
+                    self.counters["errors"] += 1
+                    self.counters["fallbacks"] += 1
+                return None
+
+        with self._lock:
+            entry.uses += 1
+            self.counters["hits"] += 1
+        return entry.name
+
+    def invalidate(self, name: str):
+        """Forget a handle the provider rejected (e.g. expired early); the next get() recreates it."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    self._entries.pop(key)
+
+    def record_usage(self, usage_metadata, label: str = "text") -> Optional[Dict[str, int]]:
+        """Record input tokens billed vs served from cache for one request; returns the per-request numbers."""
+        if usage_metadata is None:
+            return None
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        with self._lock:
+            for bucket in (self.usage, self.usage_by_label.setdefault(
+                    label, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})):
+                bucket["requests"] += 1
+                bucket["prompt_tokens"] += prompt_tokens
+                bucket["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            logger.debug(f"{label}: {cached_tokens}/{prompt_tokens} input tokens served from cached prefix")
+        return {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+
+    def stats(self) -> Dict:
+        now = self.clock()
+        with self._lock:
+            usage = dict(self.usage)
+            usage["saved_ratio"] = round(usage["cached_tokens"] / usage["prompt_tokens"], 4) if usage["prompt_tokens"] else 0.0
+            return {
+                "enabled": self.backend is not None,
+                "entries": [{"name": e.name, "model": e.model, "tokens": e.token_count, "uses": e.uses,
+                             "expires_in_seconds": round(e.expires_at - now)} for e in self._entries.values()],
+                **self.counters,
+                "usage": usage,
+                "usage_by_label": {label: dict(bucket) for label, bucket in self.usage_by_label.items()},
+            }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _store(self, key: str, entry: CachedPrefix):
+        evicted = []
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                old_key, old = self._entries.popitem(last=False)
+                self._key_locks.pop(old_key, None)
+                evicted.append(old)
+                self.counters["evictions"] += 1
+        for old in evicted:
+            try:
+                self.backend.delete(old.name)
+            except Exception as e:
+                logger.debug(f"Could not delete evicted cached prefix {old.name}: {e}")
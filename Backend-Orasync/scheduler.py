@@ -0,0 +1,265 @@
+"""
+Priority classes with one bulkhead per class.
+
+Requests are classed as interactive (character chat, dialogue, explain
+again), standard (text processing, single images, TTS) or batch (comics,
+lectures, stories). Each class gets its own size-limited capacity:
+
+- acquire() bounds how many requests of the class run at once, with a bounded
+  queue of waiters; excess is rejected with a suggested retry delay.
+- submit() runs the class's fan-out work (image renders) on its own thread
+  pool, so a 20-panel comic queues behind its own panels, never in front of
+  a chat reply.
+
+Because the classes share nothing, batch work can never use up the capacity
+reserved for interactive requests. Queue depth and wait times are reported
+per class.
+
+AsyncBulkhead is the request-slot half for coroutines: waiters queue on the
+event loop instead of holding a thread, so the ASGI routes can be given far
+larger limits than a thread pool could serve.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Union
+
+from model_health import percentile
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BATCH = "batch"
+PRIORITY_CLASSES = (INTERACTIVE, STANDARD, BATCH)
+
+
+class BulkheadFull(RuntimeError):
+    """No slot in the class within the wait limit; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Slot:
+    """A running request's place in its bulkhead; release() is idempotent."""
+
+    def __init__(self, bulkhead: Union["Bulkhead", "AsyncBulkhead"], started_at: float):
+        self.bulkhead = bulkhead
+        self.started_at = started_at
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.bulkhead._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Bulkhead(Executor):
+    """Size-limited request slots plus a private worker pool for one priority class."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, pool_workers: int,
+                 window_size: int = 200, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.pool_workers = pool_workers
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._executor = ThreadPoolExecutor(max_workers=pool_workers, thread_name_prefix=f"{name}-pool")
+        self._pool_queued = 0
+        self._pool_running = 0
+        self._waits = deque(maxlen=window_size)
+        self._pool_waits = deque(maxlen=window_size)
+        self._durations = deque(maxlen=window_size)
+        self.counters = {"admitted": 0, "rejected": 0, "timed_out": 0, "tasks": 0}
+
+    def acquire(self, timeout: Optional[float] = None) -> Slot:
+        """Take a request slot, queueing up to timeout seconds (None waits indefinitely)."""
+        arrived = self.clock()
+        with self._cond:
+            if self._running >= self.max_concurrent and self._waiting >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise BulkheadFull(f"{self.name}: {self._running} running, {self._waiting} queued",
+                                   self._retry_after())
+            expires_at = arrived + timeout if timeout is not None else None
+            self._waiting += 1
+            try:
+                while self._running >= self.max_concurrent:
+                    remaining = expires_at - self.clock() if expires_at is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self.counters["timed_out"] += 1
+                        raise BulkheadFull(f"{self.name}: no slot within {timeout:g}s", self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._running += 1
+            self.counters["admitted"] += 1
+            now = self.clock()
+            self._waits.append(now - arrived)
+            return Slot(self, now)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run fn on this class's pool; time spent queued for a worker is recorded."""
+        queued_at = self.clock()
+        with self._cond:
+            self._pool_queued += 1
+            self.counters["tasks"] += 1
+
+        def run():
+            with self._cond:
+                self._pool_queued -= 1
+                self._pool_running += 1
+                self._pool_waits.append(self.clock() - queued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._cond:
+                    self._pool_running -= 1
+
+        return self._executor.submit(run)
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self._executor.shutdown(wait=wait, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waits, pool_waits = list(self._waits), list(self._pool_waits)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "running": self._running,
+                "queue_depth": self._waiting,
+                "wait_p50_seconds": _rounded(percentile(waits, 50)),
+                "wait_p95_seconds": _rounded(percentile(waits, 95)),
+                "pool_workers": self.pool_workers,
+                "pool_running": self._pool_running,
+                "pool_queue_depth": self._pool_queued,
+                "pool_wait_p95_seconds": _rounded(percentile(pool_waits, 95)),
+                **self.counters,
+            }
+
+    def _release(self, slot: Slot):
+        with self._cond:
+            self._running -= 1
+            self._durations.append(self.clock() - slot.started_at)
+            self._cond.notify()
+
+    def _retry_after(self) -> int:
+        return _retry_after(self._durations, self._waiting, self.max_concurrent)
+
+
+class AsyncBulkhead:
+    """Size-limited request slots for one priority class, acquired from coroutines on a single event loop."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, window_size: int = 200,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.clock = clock
+        self._running = 0
+        self._waiters = deque()  # futures of queued acquires, oldest first
+        self._waits = deque(maxlen=window_size)
+        self._durations = deque(maxlen=window_size)
+        self.counters = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    async def acquire(self, timeout: Optional[float] = None) -> Slot:
+        """Take a request slot, queueing up to timeout seconds (None waits indefinitely)."""
+        arrived = self.clock()
+        if self._running < self.max_concurrent:
+            self._running += 1
+        else:
+            if len(self._waiters) >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise BulkheadFull(f"{self.name}: {self._running} running, {len(self._waiters)} queued",
+                                   self._retry_after())
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # A released slot is handed straight to the waiter, so _running is not touched here
+                await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except BaseException as e:
+                if waiter.done():
+                    self._hand_off()  # granted as the wait ended: pass the slot on
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counters["timed_out"] += 1
+                    raise BulkheadFull(f"{self.name}: no slot within {timeout:g}s", self._retry_after()) from None
+                raise
+        self.counters["admitted"] += 1
+        now = self.clock()
+        self._waits.append(now - arrived)
+        return Slot(self, now)
+
+    def stats(self) -> Dict:
+        waits = list(self._waits)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "running": self._running,
+            "queue_depth": len(self._waiters),
+            "wait_p50_seconds": _rounded(percentile(waits, 50)),
+            "wait_p95_seconds": _rounded(percentile(waits, 95)),
+            **self.counters,
+        }
+
+    def _release(self, slot: Slot):
+        self._durations.append(self.clock() - slot.started_at)
+        self._hand_off()
+
+    def _hand_off(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    def _retry_after(self) -> int:
+        return _retry_after(self._durations, len(self._waiters), self.max_concurrent)
+
+
+def _retry_after(durations: Iterable[float], waiting: int, max_concurrent: int) -> int:
+    """Time for the queue ahead to drain at the class's median request duration."""
+    typical = percentile(list(durations), 50)
+    if typical is None:
+        return 5
+    seconds = typical * (waiting + 1) / max_concurrent
+    return int(min(300, max(1, math.ceil(seconds))))
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+class PriorityScheduler:
+    """The bulkhead of every priority class."""
+
+    def __init__(self, bulkheads: Iterable[Bulkhead]):
+        self._bulkheads = {bulkhead.name: bulkhead for bulkhead in bulkheads}
+
+    def bulkhead(self, priority: str) -> Bulkhead:
+        try:
+            return self._bulkheads[priority]
+        except KeyError:
+            raise ValueError(f"Unknown priority class '{priority}'") from None
+
+    def stats(self) -> Dict:
+        return {name: bulkhead.stats() for name, bulkhead in self._bulkheads.items()}
@@ -0,0 +1,315 @@
+"""
+Response schemas for the JSON-producing prompts and a typed validation layer.
+
+Schemas use the OpenAPI subset accepted by Gemini's response_schema, so the
+same dict constrains generation (response_mime_type="application/json") and
+validates the result. Free-form keyed maps (comic style guide, panel dialogue)
+cannot be described by a response schema; they are requested as lists of
+pairs and turned back into the dicts the clients expect after validation.
+
+Outputs that still fail validation go through the legacy repair helpers;
+StructuredOutputStats counts how often that (and retrying) happens.
+"""
+
+import json
+import logging
+import re
+import threading
+from collections import namedtuple
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+JSON_MIME_TYPE = "application/json"
+
+
+class SchemaValidationError(ValueError):
+    """Model output does not match the response schema; path points at the offending value."""
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+def _string(**extra) -> Dict:
+    return {"type": "STRING", **extra}
+
+
+def _object(properties: Dict, required=None, **extra) -> Dict:
+    schema = {"type": "OBJECT", "properties": properties, "propertyOrdering": list(properties), **extra}
+    if required:
+        schema["required"] = list(required)
+    return schema
+
+
+def _array(items: Dict, **extra) -> Dict:
+    return {"type": "ARRAY", "items": items, **extra}
+
+
+FLASHCARDS_SCHEMA = _array(
+    _object({"front": _string(), "back": _string()}, required=["front", "back"]),
+    maxItems=10,
+)
+
+SLIDESHOW_SCHEMA = _array(
+    _object({"title": _string(nullable=True), "content": _array(_string())}, required=["content"]),
+)
+
+STORY_SCHEMA = _object({
+    "title": _string(),
+    "content": _string(),
+    "level": _string(),
+    "chapters": _array(
+        _object({"title": _string(), "content": _string(), "order": {"type": "INTEGER"}},
+                required=["title", "content", "order"]),
+        minItems=1,
+    ),
+}, required=["title", "content", "level", "chapters"])
+
+LECTURE_SCHEMA = _object({
+    "title": _string(),
+    "sections": _array(
+        _object({"title": _string(), "script": _string(), "image_prompt": _string()},
+                required=["title", "script", "image_prompt"]),
+        minItems=1,
+    ),
+}, required=["title", "sections"])
+
+COMIC_CHARACTERS_SCHEMA = _object({
+    "comic_title": _string(),
+    "theme": _string(),
+    "character_style_guide": _array(
+        _object({"name": _string(), "description": _string()}, required=["name", "description"]),
+        minItems=1,
+    ),
+}, required=["comic_title", "theme", "character_style_guide"])
+
+COMIC_PANELS_SCHEMA = _array(
+    _object({
+        "panel_id": {"type": "INTEGER"},
+        "scene": _string(),
+        "image_prompt": _string(),
+        # Empty for a silent panel
+        "dialogue": _array(_object({"speaker": _string(), "line": _string()}, required=["speaker", "line"])),
+    }, required=["panel_id", "scene", "image_prompt", "dialogue"]),
+    minItems=3, maxItems=20,
+)
+
+
+def validate(value: Any, schema: Dict, path: str = "$") -> Any:
+    """Check value against schema and return it with lossless coercions applied.
+
+    Integers given as numeric strings or whole floats are converted; unknown
+    object keys are kept so richer model output is not thrown away.
+    """
+    if value is None:
+        if schema.get("nullable"):
+            return None
+        raise SchemaValidationError(path, "must not be null")
+
+    kind = schema["type"]
+    if kind == "STRING":
+        if not isinstance(value, str):
+            raise SchemaValidationError(path, f"expected string, got {type(value).__name__}")
+        return value
+    if kind == "INTEGER":
+        if isinstance(value, bool):
+            raise SchemaValidationError(path, "expected integer, got bool")
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+            return int(value.strip())
+        if not isinstance(value, int):
+            raise SchemaValidationError(path, f"expected integer, got {type(value).__name__}")
+        return value
+    if kind == "NUMBER":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise SchemaValidationError(path, f"expected number, got {type(value).__name__}")
+        return value
+    if kind == "BOOLEAN":
+        if not isinstance(value, bool):
+            raise SchemaValidationError(path, f"expected boolean, got {type(value).__name__}")
+        return value
+    if kind == "ARRAY":
+        if not isinstance(value, list):
+            raise SchemaValidationError(path, f"expected array, got {type(value).__name__}")
+        if len(value) < schema.get("minItems", 0):
+            raise SchemaValidationError(path, f"expected at least {schema['minItems']} items, got {len(value)}")
+        items = [validate(item, schema["items"], f"{path}[{i}]") for i, item in enumerate(value)]
+        # maxItems is a generation hint; surplus items are trimmed rather than rejected
+        return items[:schema["maxItems"]] if "maxItems" in schema else items
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            raise SchemaValidationError(path, f"expected object, got {type(value).__name__}")
+        for key in schema.get("required", ()):
+            if key not in value:
+                raise SchemaValidationError(path, f"missing required field '{key}'")
+        result = dict(value)
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                result[key] = validate(value[key], sub_schema, f"{path}.{key}")
+        return result
+    raise SchemaValidationError(path, f"unsupported schema type {kind}")
+
+
+# -- keyed maps <-> pair lists -------------------------------------------
+
+def _describe(value: Any) -> str:
+    if isinstance(value, dict):
+        return ", ".join(f"{str(k).replace('_', ' ').title()}: {v}" for k, v in value.items())
+    return value if isinstance(value, str) else str(value)
+
+
+def _map_to_pairs(value: Any, key_field: str, value_field: str) -> Any:
+    """Accept the legacy {name: value} form so free-form and repaired output validate too."""
+    if isinstance(value, dict):
+        return [{key_field: str(k), value_field: _describe(v)} for k, v in value.items()]
+    return value
+
+
+def _pairs_to_map(pairs, key_field: str, value_field: str) -> Dict[str, str]:
+    result = {}
+    for pair in pairs:
+        name = pair[key_field].strip()
+        if name:
+            result[name] = pair[value_field]
+    return result
+
+
+def _prepare_characters(data):
+    if isinstance(data, dict) and "character_style_guide" in data:
+        data = dict(data, character_style_guide=_map_to_pairs(data["character_style_guide"], "name", "description"))
+    return data
+
+
+def _finish_characters(data):
+    data["character_style_guide"] = _pairs_to_map(data["character_style_guide"], "name", "description")
+    return data
+
+
+def _prepare_panels(data):
+    if isinstance(data, list):
+        data = [dict(p, dialogue=_map_to_pairs(p["dialogue"], "speaker", "line"))
+                if isinstance(p, dict) and "dialogue" in p else p for p in data]
+    return data
+
+
+def _finish_panels(data):
+    for panel in data:
+        panel["dialogue"] = _pairs_to_map(panel["dialogue"], "speaker", "line")
+    return data
+
+
+StructuredOutput = namedtuple("StructuredOutput", ["schema", "prepare", "finish"])
+
+STRUCTURED_OUTPUTS = {
+    "flashcards": StructuredOutput(FLASHCARDS_SCHEMA, None, None),
+    "slideshow": StructuredOutput(SLIDESHOW_SCHEMA, None, None),
+    "story": StructuredOutput(STORY_SCHEMA, None, None),
+    "lecture": StructuredOutput(LECTURE_SCHEMA, None, None),
+    "comic_characters": StructuredOutput(COMIC_CHARACTERS_SCHEMA, _prepare_characters, _finish_characters),
+    "comic_panels": StructuredOutput(COMIC_PANELS_SCHEMA, _prepare_panels, _finish_panels),
+}
+
+
+def response_config(kind: Optional[str], enabled: bool = True) -> Dict:
+    """GenerateContentConfig kwargs that constrain the response to kind's schema."""
+    if not kind or not enabled:
+        return {}
+    return {"response_mime_type": JSON_MIME_TYPE, "response_schema": STRUCTURED_OUTPUTS[kind].schema}
+
+
+def validate_output(kind: str, data: Any) -> Any:
+    """Validate already-decoded data and convert it to the client-facing shape."""
+    output = STRUCTURED_OUTPUTS[kind]
+    if output.prepare:
+        data = output.prepare(data)
+    data = validate(data, output.schema)
+    return output.finish(data) if output.finish else data
+
+
+def validate_item(kind: str, item: Any, index: int = 0) -> Any:
+    """Validate one element of an array kind (e.g. a streamed comic panel)."""
+    output = STRUCTURED_OUTPUTS[kind]
+    items = output.prepare([item]) if output.prepare else [item]
+    items = [validate(items[0], output.schema["items"], f"$[{index}]")]
+    return (output.finish(items) if output.finish else items)[0]
+
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_output(kind: str, text: Optional[str]) -> Any:
+    """Decode a structured response (tolerating a code fence) and validate it."""
+    if not text or not text.strip():
+        raise SchemaValidationError("$", "empty response")
+    try:
+        data = json.loads(_CODE_FENCE.sub("", text.strip()))
+    except json.JSONDecodeError as e:
+        raise SchemaValidationError("$", f"invalid JSON: {e}") from e
+    return validate_output(kind, data)
+
+
+class StructuredOutputStats:
+    """Per-kind counters of how structured responses were obtained.
+
+    valid: parsed and validated as returned; repaired: needed a legacy repair
+    pass; failed: unusable; retries: extra model calls spent on bad output.
+    """
+
+    OUTCOMES = ("valid", "repaired", "failed")
+
+    def __init__(self, mode: str = "structured"):
+        self.mode = mode
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, outcome: str):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {name: 0 for name in self.OUTCOMES + ("retries",)})
+            counts[outcome] += 1
+
+    def record_retry(self, kind: str):
+        self.record(kind, "retries")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            kinds = {}
+            for kind, counts in self._counts.items():
+                parsed = sum(counts[name] for name in self.OUTCOMES)
+                kinds[kind] = {
+                    **counts,
+                    "repair_rate": round(counts["repaired"] / parsed, 4) if parsed else 0.0,
+                    "failure_rate": round(counts["failed"] / parsed, 4) if parsed else 0.0,
+                    "retry_rate": round(counts["retries"] / parsed, 4) if parsed else 0.0,
+                }
+        return {"mode": self.mode, "kinds": kinds}
+
+
+def parse_with_repair(kind: str, text: Optional[str], repair: Optional[Callable[[str], Any]] = None,
+                      stats: Optional[StructuredOutputStats] = None) -> Any:
+    """Parse text as kind; on failure run repair(text) and validate its result instead.
+
+    Raises SchemaValidationError (a ValueError) when neither path yields valid data.
+    """
+    try:
+        data = parse_output(kind, text)
+        outcome = "valid"
+    except SchemaValidationError as e:
+        if repair is None or not text:
+            if stats:
+                stats.record(kind, "failed")
+            raise
+        logger.warning(f"{kind} response failed validation ({e}); trying repair")
+        try:
+            data = validate_output(kind, repair(text))
+            outcome = "repaired"
+        except Exception as repair_error:
+            if stats:
+                stats.record(kind, "failed")
+            if isinstance(repair_error, SchemaValidationError):
+                raise
+            raise SchemaValidationError("$", f"repair failed: {repair_error}") from repair_error
+    if stats:
+        stats.record(kind, outcome)
+    return data
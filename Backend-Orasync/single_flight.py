@@ -0,0 +1,122 @@
+"""
+Single-flight coalescing for expensive, idempotent generation calls.
+
+Concurrent callers that share a canonical key wait on the one in-flight call
+instead of issuing a duplicate request to Gemini or Cloud TTS. Results (and
+exceptions) are shared by every caller, so wrapped functions must return
+values that are safe to share, such as strings or bytes.
+
+ado() is the coroutine counterpart used by the ASGI handlers; it shares the
+in-flight table with do(), so threaded and async callers coalesce together.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_groups: Dict[str, "SingleFlight"] = {}
+_groups_lock = threading.Lock()
+
+
+def canonical_key(*parts) -> str:
+    """Hash the call inputs into a stable key (dict ordering and types normalised)."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one in-flight execution."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        with _groups_lock:
+            _groups[name] = self
+
+    def do(self, key: str, fn: Callable, *args, **kwargs):
+        """Run fn once per key at a time; concurrent callers get the same result."""
+        leader, future = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    async def ado(self, key: str, fn: Callable, *args, **kwargs):
+        """Awaitable do(): fn(*args, **kwargs) returns a coroutine; joiners wait without blocking the loop."""
+        leader, future = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _join(self, key: str):
+        """(True, new future) for the caller that must execute, (False, in-flight future) for the others."""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+                self.executions += 1
+                return True, future
+            self.coalesced += 1
+        logger.debug(f"[single-flight:{self.name}] Joining in-flight call {key[:12]}")
+        return False, future
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+                "coalesce_rate": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            }
+
+
+def coalesce(group: SingleFlight, key_fn: Callable) -> Callable:
+    """Decorator: key_fn receives the wrapped function's arguments and returns its key."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(key_fn(*args, **kwargs), fn, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def single_flight_stats() -> Dict[str, dict]:
+    """Stats for every registered single-flight group."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,37 @@
+"""
+Wire formats for streamed responses: Server-Sent Events and NDJSON.
+"""
+
+import json
+from typing import Optional
+
+SSE_MIMETYPE = "text/event-stream"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+STREAM_MIMETYPES = {"sse": SSE_MIMETYPE, "ndjson": NDJSON_MIMETYPE}
+
+# Stop proxies (nginx, Cloud Run front ends) from buffering the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def negotiate_stream_format(stream_field=None, accept_header: Optional[str] = None) -> Optional[str]:
+    """Return "sse", "ndjson" or None (plain JSON) from the request's stream field or Accept header."""
+    if isinstance(stream_field, str) and stream_field.lower() in STREAM_MIMETYPES:
+        return stream_field.lower()
+    if stream_field is True:
+        return "sse"
+    accept = (accept_header or "").lower()
+    if SSE_MIMETYPE in accept:
+        return "sse"
+    if NDJSON_MIMETYPE in accept:
+        return "ndjson"
+    return None
+
+
+def encode_event(stream_format: str, event: str, data: Optional[dict] = None) -> str:
+    """Serialize one event; "ping" becomes an SSE comment / empty NDJSON heartbeat."""
+    if stream_format == "sse":
+        if event == "ping":
+            return ": keep-alive\n\n"
+        return f"event: {event}\ndata: {json.dumps(data or {}, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **(data or {})}, ensure_ascii=False) + "\n"
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Offline tests for cost-aware admission control
+"""
+
+import threading
+import time
+
+from admission import AdmissionController, AdmissionRejected, CostModel
+
+
+def test_cost_model_weights_images_and_speech():
+    model = CostModel(base=1, text_chars_per_unit=1000, units_per_image=4, tts_chars_per_unit=500)
+    assert model.estimate() == 1
+    assert model.estimate(input_chars=3000, images=5, tts_chars=1000) == 1 + 3 + 20 + 2
+
+
+def test_requests_run_within_capacity_then_queue_in_order():
+    controller = AdmissionController(capacity=10, max_queued=5, max_wait_seconds=2)
+    first = controller.acquire("comic", 6)
+    order = []
+
+    def waiter(label, cost):
+        with controller.acquire(label, cost):
+            order.append(label)
+
+    threads = [threading.Thread(target=waiter, args=("lecture", 6)), threading.Thread(target=waiter, args=("image", 1))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    # The small request fits, but must not overtake the lecture waiting ahead of it
+    assert order == [] and controller.stats()["waiting"] == 2
+    first.release()
+    first.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == ["lecture", "image"]
+    stats = controller.stats()
+    assert stats["in_flight_cost"] == 0 and stats["running"] == 0 and stats["admitted"] == 3
+
+
+def test_overload_is_rejected_with_computed_retry_after():
+    now = [0.0]
+    controller = AdmissionController(capacity=10, max_queued=0, default_seconds_per_unit=3.0,
+                                     clock=lambda: now[0])
+    running = controller.acquire("comic", 10)
+    try:
+        controller.acquire("comic", 5)
+        assert False, "full instance should reject"
+    except AdmissionRejected as e:
+        assert e.retry_after == 2  # 5 units over capacity at 10 units per 3s
+    now[0] += 20
+    running.release()  # 2s per unit observed
+    big = controller.acquire("comic", 500)  # oversized requests still run alone
+    assert big.cost == 10
+    try:
+        controller.acquire("story", 10)
+        assert False
+    except AdmissionRejected as e:
+        assert e.retry_after == 2
+    assert controller.stats()["by_label"]["comic"]["rejected"] == 1
+
+
+def test_queued_request_times_out():
+    controller = AdmissionController(capacity=1, max_queued=1)
+    held = controller.acquire("lecture", 1)
+    started = time.monotonic()
+    try:
+        controller.acquire("lecture", 1, timeout=0.05)
+        assert False, "wait should time out"
+    except AdmissionRejected:
+        assert time.monotonic() - started < 1
+    assert controller.stats()["timed_out"] == 1 and controller.stats()["waiting"] == 0
+    held.release()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All admission tests passed!")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the incremental content block parser
+"""
+
+import os
+import random
+import re
+from uuid import uuid4
+
+from block_parser import IMAGE_PLACEHOLDER, IncrementalBlockParser, parse_blocks
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus")
+
+SAMPLE = """[GhibliImage: a quiet valley at dawn]
+**Why Leaves Change Colour**
+Leaves are green because of chlorophyll.
+It captures sunlight.
+
+[Image: a maple leaf in autumn]
+In autumn the chlorophyll breaks down.
+
+**Quiz Time!**
+1. What makes leaves green?
+a) Chlorophyll
+b) Water
+Correct Answer: a
+Explanation: Chlorophyll absorbs red and blue light.
+"""
+
+
+def legacy_parse_blocks(text_content):
+    """Reference copy of the batch parser process_input_text used before the incremental parser.
+
+    Image generation is replaced by placeholder items; everything else is verbatim.
+    """
+    blocks = []
+    current_text_to_process = text_content
+    ghibli_image_match = re.search(r'\[GhibliImage:\s*(.*?)\s*\]\n?', current_text_to_process, re.IGNORECASE)
+    if ghibli_image_match:
+        ghibli_prompt = ghibli_image_match.group(1).strip()
+        blocks.append({"type": IMAGE_PLACEHOLDER, "prompt": ghibli_prompt, "summary": True})
+        current_text_to_process = current_text_to_process.replace(ghibli_image_match.group(0), "", 1)
+    image_placeholders = []
+    for match in re.finditer(r'\[Image:\s*(.*?)\s*\]', current_text_to_process, re.IGNORECASE):
+        image_placeholders.append({'type': 'image', 'prompt': match.group(1).strip(), 'match_obj': match})
+    all_placeholders = sorted(image_placeholders, key=lambda p: p['match_obj'].start())
+    last_idx = 0
+    processed_text_parts = []
+    for placeholder in all_placeholders:
+        match_obj = placeholder['match_obj']
+        if match_obj.start() > last_idx:
+            processed_text_parts.append({'type': 'text_segment', 'content': current_text_to_process[last_idx:match_obj.start()]})
+        processed_text_parts.append(placeholder)
+        last_idx = match_obj.end()
+    if last_idx < len(current_text_to_process):
+        processed_text_parts.append({'type': 'text_segment', 'content': current_text_to_process[last_idx:]})
+    for part in processed_text_parts:
+        if part['type'] == 'text_segment':
+            segment_content = part['content']
+            lines = segment_content.split('\n')
+            quiz_heading_pattern = re.compile(r"^\*\*(Quiz Time!|Test Your Knowledge!?)\*\*", re.IGNORECASE)
+            question_start_pattern = re.compile(r"^\d+\.\s*(.+)$")
+            option_pattern = re.compile(r"^([a-z])\)\s*(.+)$", re.IGNORECASE)
+            correct_answer_pattern = re.compile(r"^Correct Answer:\s*([a-z])$", re.IGNORECASE)
+            explanation_pattern = re.compile(r"^Explanation:\s*(.+)$", re.IGNORECASE)
+            heading_pattern = re.compile(r"^\*\*(?!(?:Quiz Time!|Test Your Knowledge!?)$)(.+?)\*\*$")
+            current_paragraph_lines = []
+            def flush_paragraph_segment(lines_list, block_list_target):
+                if lines_list:
+                    content = "\n".join(lines_list).strip()
+                    if content:
+                        block_list_target.append({"type": "paragraph", "content": content, "id": str(uuid4())})
+                    lines_list.clear()
+            line_idx_segment = 0
+            while line_idx_segment < len(lines):
+                line = lines[line_idx_segment].strip()
+                if not line:
+                    flush_paragraph_segment(current_paragraph_lines, blocks)
+                    line_idx_segment += 1
+                    continue
+                quiz_head_match = quiz_heading_pattern.match(line)
+                if quiz_head_match:
+                    flush_paragraph_segment(current_paragraph_lines, blocks)
+                    quiz_title = line.strip('*!? ')
+                    blocks.append({"type": "quizHeading", "content": quiz_title, "id": str(uuid4())})
+                    line_idx_segment += 1
+                    continue
+                q_start_match = question_start_pattern.match(line)
+                if q_start_match:
+                    flush_paragraph_segment(current_paragraph_lines, blocks)
+                    question_text = q_start_match.group(1).strip()
+                    parsed_options = []
+                    parsed_correct_answer_id = None
+                    parsed_explanation = None
+                    option_id_map = {}
+                    temp_line_idx = line_idx_segment + 1
+                    while temp_line_idx < len(lines):
+                        opt_line = lines[temp_line_idx].strip()
+                        if not opt_line:
+                            temp_line_idx +=1
+                            continue
+                        opt_match = option_pattern.match(opt_line)
+                        if opt_match:
+                            opt_char = opt_match.group(1).lower()
+                            opt_text = opt_match.group(2).strip()
+                            full_opt_id = f"opt-{opt_char}-{uuid4().hex[:6]}"
+                            parsed_options.append({"id": full_opt_id, "text": opt_text})
+                            option_id_map[opt_char] = full_opt_id
+                            temp_line_idx += 1
+                        else:
+                            break
+                    if temp_line_idx < len(lines):
+                        corr_ans_line = lines[temp_line_idx].strip()
+                        if not corr_ans_line and temp_line_idx + 1 < len(lines):
+                            temp_line_idx += 1
+                            corr_ans_line = lines[temp_line_idx].strip()
+                        corr_ans_match = correct_answer_pattern.match(corr_ans_line)
+                        if corr_ans_match:
+                            corr_char = corr_ans_match.group(1).lower()
+                            if corr_char in option_id_map:
+                                parsed_correct_answer_id = option_id_map[corr_char]
+                            temp_line_idx += 1
+                    if temp_line_idx < len(lines):
+                        expl_line = lines[temp_line_idx].strip()
+                        if not expl_line and temp_line_idx + 1 < len(lines):
+                            temp_line_idx += 1
+                            expl_line = lines[temp_line_idx].strip()
+                        expl_match = explanation_pattern.match(expl_line)
+                        if expl_match:
+                            parsed_explanation = expl_match.group(1).strip()
+                            temp_line_idx += 1
+                    if question_text and parsed_options and parsed_correct_answer_id:
+                        blocks.append({
+                            "type": "multipleChoiceQuestion", "content": question_text,
+                            "options": parsed_options, "correctAnswerID": parsed_correct_answer_id,
+                            "explanation": parsed_explanation, "id": str(uuid4())
+                        })
+                        line_idx_segment = temp_line_idx
+                        continue
+                    else:
+                        current_paragraph_lines.append(line)
+                        line_idx_segment += 1
+                        continue
+                head_match = heading_pattern.match(line)
+                if head_match:
+                    flush_paragraph_segment(current_paragraph_lines, blocks)
+                    heading_content = head_match.group(1).strip()
+                    blocks.append({"type": "heading", "content": heading_content, "id": str(uuid4())})
+                    line_idx_segment += 1
+                    continue
+                current_paragraph_lines.append(line)
+                line_idx_segment += 1
+            flush_paragraph_segment(current_paragraph_lines, blocks)
+        elif part['type'] == 'image':
+            blocks.append({"type": IMAGE_PLACEHOLDER, "prompt": part['prompt'], "summary": False})
+    return blocks
+
+
+def load_corpus():
+    corpus = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".txt"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8", newline="") as f:
+                corpus[name] = f.read()
+    return corpus
+
+
+def normalize(items):
+    """Drop random ids (keeping option letters) and put the summary image first, as process_input_text does."""
+    items = sorted(items, key=lambda item: not item.get("summary", False))
+    normalized = []
+    for item in items:
+        item = {k: v for k, v in item.items() if k != "id"}
+        if "options" in item:
+            item["options"] = [{**o, "id": o["id"][:5]} for o in item["options"]]
+            item["correctAnswerID"] = item["correctAnswerID"][:5]
+        normalized.append(item)
+    return normalized
+
+
+def strip_ids(items):
+    return [{k: v for k, v in item.items() if k not in ("id", "options", "correctAnswerID")} for item in items]
+
+
+def feed_in_chunks(text, sizes):
+    parser = IncrementalBlockParser()
+    items, i = [], 0
+    while i < len(text):
+        n = next(sizes)
+        items += parser.feed(text[i:i + n])
+        i += n
+    return items + parser.close()
+
+
+def test_parses_all_block_types():
+    items = parse_blocks(SAMPLE)
+    assert [item["type"] for item in items] == [
+        IMAGE_PLACEHOLDER, "heading", "paragraph", IMAGE_PLACEHOLDER, "paragraph",
+        "quizHeading", "multipleChoiceQuestion",
+    ]
+    assert items[0] == {"type": IMAGE_PLACEHOLDER, "prompt": "a quiet valley at dawn", "summary": True}
+    assert items[2]["content"] == "Leaves are green because of chlorophyll.\nIt captures sunlight."
+    question = items[-1]
+    assert [o["text"] for o in question["options"]] == ["Chlorophyll", "Water"]
+    assert question["correctAnswerID"] == question["options"][0]["id"]
+    assert question["explanation"] == "Chlorophyll absorbs red and blue light."
+
+
+def test_blocks_are_emitted_before_the_text_ends():
+    parser = IncrementalBlockParser()
+    assert parser.feed("**Heading**") == []  # line not complete yet
+    assert [b["type"] for b in parser.feed("\nFirst paragraph.\n")] == ["heading"]
+    assert [b["content"] for b in parser.feed("\n")] == ["First paragraph."]
+
+
+def test_question_waits_for_its_explanation():
+    parser = IncrementalBlockParser()
+    assert parser.feed("1. Pick one\na) Yes\nb) No\nCorrect Answer: b\n") == []
+    items = parser.feed("Explanation: Because.\n")
+    assert items[0]["type"] == "multipleChoiceQuestion"
+    assert items[0]["explanation"] == "Because."
+
+
+def test_placeholder_split_across_chunks():
+    items = feed_in_chunks("Intro [Ima" + "ge: a red  fox ] outro\n", iter([5, 3, 4, 100]))
+    assert strip_ids(items) == [
+        {"type": "paragraph", "content": "Intro"},
+        {"type": IMAGE_PLACEHOLDER, "prompt": "a red  fox", "summary": False},
+        {"type": "paragraph", "content": "outro"},
+    ]
+
+
+def test_chunking_does_not_change_the_result():
+    expected = strip_ids(parse_blocks(SAMPLE))
+    rng = random.Random(7)
+    for _ in range(50):
+        sizes = iter(lambda: rng.randint(1, 9), None)
+        assert strip_ids(feed_in_chunks(SAMPLE, sizes)) == expected
+
+
+def test_corpus_matches_legacy_parser():
+    corpus = load_corpus()
+    assert len(corpus) >= 5
+    for name, text in corpus.items():
+        assert normalize(parse_blocks(text)) == normalize(legacy_parse_blocks(text)), name
+
+
+def test_corpus_matches_legacy_parser_when_streamed():
+    rng = random.Random(11)
+    for name, text in load_corpus().items():
+        expected = normalize(legacy_parse_blocks(text))
+        for _ in range(20):
+            sizes = iter(lambda: rng.randint(1, 40), None)
+            assert normalize(feed_in_chunks(text, sizes)) == expected, name
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All block parser tests passed!")
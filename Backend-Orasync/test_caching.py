@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the tiered image cache (no GCS or Gemini access needed)
+"""
+
+import enum
+import tempfile
+import time
+from types import SimpleNamespace
+
+from caching import (LRUCache, MemoryCacheBackend, LocalDirectoryCacheBackend, TieredImageCache,
+                     TextResponseCache, finished_normally, is_complete_json_response, text_cache_key)
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" becomes most recently used
+    cache.set("c", 3)  # evicts "b"
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["size"] == 2
+
+
+def test_lru_ttl_expiry():
+    cache = LRUCache(max_entries=4, ttl_seconds=0.05)
+    cache.set("a", 1)
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_tiered_cache_promotes_l2_hits():
+    l2 = MemoryCacheBackend()
+    l2.put("key", {"blob_path": "images/x.png", "created_at": time.time()})
+    cache = TieredImageCache(l2, l1_max_entries=4)
+    record = cache.get("key")
+    assert record["blob_path"] == "images/x.png"
+    assert "key" in cache.l1
+    stats = cache.stats()
+    assert stats["l2"]["hits"] == 1
+    assert stats["l1"]["misses"] == 1
+    # Second lookup is served from L1
+    cache.get("key")
+    assert cache.stats()["l1"]["hits"] == 1
+
+
+def test_local_directory_backend_survives_restart():
+    with tempfile.TemporaryDirectory() as root:
+        first = TieredImageCache(LocalDirectoryCacheBackend(root))
+        first.put("abcdef", "images/panel.png")
+        # A new process starts with an empty L1 but the same directory
+        second = TieredImageCache(LocalDirectoryCacheBackend(root))
+        record = second.get("abcdef")
+        assert record["blob_path"] == "images/panel.png"
+
+
+def test_invalid_record_is_dropped():
+    l2 = MemoryCacheBackend()
+    cache = TieredImageCache(l2)
+    l2.put("gone", {"blob_path": "images/deleted.png", "created_at": time.time()})
+    assert cache.get("gone", validate=lambda record: False) is None
+    assert l2.get("gone") is None
+    assert cache.stats()["l2"]["invalidated"] == 1
+
+
+def test_expired_l2_record_is_a_miss():
+    l2 = MemoryCacheBackend()
+    l2.put("old", {"blob_path": "images/old.png", "created_at": time.time() - 100})
+    cache = TieredImageCache(l2, ttl_seconds=10)
+    assert cache.get("old") is None
+    assert cache.stats()["l2"]["misses"] == 1
+
+
+def test_text_cache_key_ignores_formatting_noise():
+    base = text_cache_key("model", "Explain  photosynthesis.\r\n\r\n\r\nLevel: moderate ", "Be kind")
+    assert base == text_cache_key("model", "Explain photosynthesis.\n\nLevel: moderate", " Be kind\n")
+    assert base != text_cache_key("other-model", "Explain photosynthesis.\n\nLevel: moderate", "Be kind")
+    assert base != text_cache_key("model", "Explain photosynthesis.\n\nLevel: beginner", "Be kind")
+    assert base != text_cache_key("model", "Explain photosynthesis.\n\nLevel: moderate", "Be brief")
+    # Composed vs decomposed accents are the same prompt
+    assert text_cache_key("model", "caf\u00e9") == text_cache_key("model", "cafe\u0301")
+    # Streamed and non-streamed callers key the same prompt identically
+    assert text_cache_key("model", "x", "s", structured_output=None) == text_cache_key("model", "x", "s")
+    assert text_cache_key("model", "x", "s", structured_output="flashcards") != text_cache_key("model", "x", "s")
+
+
+def test_text_cache_bypass_and_store():
+    cache = TextResponseCache(max_entries=4)
+    cache.store("k", "   ")
+    assert cache.lookup("k") is None
+    cache.store("k", "answer")
+    assert cache.lookup("k") == "answer"
+    assert cache.lookup("k", bypass=True) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["bypasses"] == 1 and stats["stores"] == 1
+
+
+def test_truncated_json_is_not_cacheable():
+    assert is_complete_json_response('```json\n[{"front": "a", "back": "b"}]\n```')
+    assert is_complete_json_response('Here you go: {"title": "Story", "chapters": []}')
+    assert not is_complete_json_response('[{"front": "a", "back": "b"}, {"front": "c"')
+    assert not is_complete_json_response("")
+
+
+def test_only_responses_that_stopped_on_their_own_are_complete():
+    class FinishReason(enum.Enum):
+        STOP = 1
+        MAX_TOKENS = 2
+
+    def response(reason):
+        return SimpleNamespace(candidates=[SimpleNamespace(finish_reason=reason)])
+
+    assert finished_normally(response(FinishReason.STOP)) and finished_normally(response("STOP"))
+    assert not finished_normally(response(FinishReason.MAX_TOKENS))
+    assert not finished_normally(response(None)) and not finished_normally(SimpleNamespace(candidates=[]))
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All caching tests passed!")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Offline tests for server-side conversation sessions
+"""
+
+from conversation_sessions import ConversationSessionStore, ReplyPrefixFilter, normalize_history
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_client_histories_are_normalized():
+    character = [{"role": "user", "content": "Hi!"}, {"role": "assistant", "content": "Hello there."}]
+    dialogue = [{"sender": "user", "text": "Why?"}, {"sender": "ai", "text": "Because."}, {"sender": "user", "text": " "}]
+    assert normalize_history(character) == [{"role": "user", "text": "Hi!"}, {"role": "model", "text": "Hello there."}]
+    assert normalize_history(dialogue) == [{"role": "user", "text": "Why?"}, {"role": "model", "text": "Because."}]
+    assert normalize_history(None) == []
+
+
+def test_turns_build_contents_and_trim():
+    store = ConversationSessionStore(max_turns=2)
+    session = store.create("character_chat", "You are Chloe.", "model-x", metadata={"character": "Chloe"},
+                           history=[{"role": "assistant", "content": "Welcome!"}])
+    assert session.history == []  # history never starts with a model turn
+
+    for i in range(3):
+        store.record_turn(session, f"question {i}", f"answer {i}")
+    store.record_turn(session, "ignored", "")  # failed replies are not recorded
+
+    contents = session.contents("question 3")
+    assert [c["parts"][0]["text"] for c in contents] == ["question 1", "answer 1", "question 2", "answer 2",
+                                                        "question 3"]
+    assert [c["role"] for c in contents] == ["user", "model", "user", "model", "user"]
+    assert session.turns == 3 and store.stats()["turns"] == 4
+
+
+def test_sliding_expiry_and_capacity():
+    clock = FakeClock()
+    store = ConversationSessionStore(ttl_seconds=60, max_sessions=2, clock=clock)
+    first = store.create("dialogue", "ctx", "model-x")
+    clock.now += 50
+    assert store.get(first.session_id) is first  # touching a session extends it
+    clock.now += 50
+    assert store.get(first.session_id) is first
+    second = store.create("dialogue", "ctx", "model-x")
+    clock.now += 61
+    assert store.get(first.session_id) is None and store.get(second.session_id) is None
+
+    a = store.create("dialogue", "ctx", "model-x")
+    store.create("character_chat", "ctx", "model-x")
+    store.create("character_chat", "ctx", "model-x")
+    assert store.get(a.session_id) is None
+    stats = store.stats()
+    assert stats["active"] == 2 and stats["by_kind"] == {"character_chat": 2, "dialogue": 0}
+    assert stats["expired"] == 2 and stats["evicted"] == 1
+
+
+def test_unknown_kind_rejected():
+    try:
+        ConversationSessionStore().create("lecture", "ctx", "model-x")
+        assert False, "unknown kind should fail"
+    except ValueError:
+        pass
+
+
+def test_reply_prefix_is_stripped_across_chunks():
+    def run(prefix, chunks):
+        reply_filter = ReplyPrefixFilter(prefix)
+        emitted = [reply_filter.feed(chunk) for chunk in chunks]
+        return [text for text in emitted if text] + ([reply_filter.flush()] if reply_filter._pending else [])
+
+    assert run("Chloe:", [" Chl", "oe: Hi", " there"]) == ["Hi", " there"]
+    assert run("Chloe:", ["Hello", " friend"]) == ["Hello", " friend"]
+    assert run("Chloe:", ["Chl"]) == ["Chl"]
+    assert run(None, ["Chloe: hi"]) == ["Chloe: hi"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All conversation session tests passed!")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Offline tests for rolling conversation history compaction
+"""
+
+from conversation_sessions import ConversationSessionStore
+from history_compaction import HistoryCompactor, conversation_key
+from prompt_cache import estimate_tokens
+
+
+def _turns(count, words=30):
+    return [{"role": "user" if i % 2 == 0 else "model", "text": f"message {i} " + "word " * words}
+            for i in range(count)]
+
+
+def _history_tokens(compacted):
+    return estimate_tokens(compacted.as_text())
+
+
+def test_short_history_is_untouched():
+    compactor = HistoryCompactor(lambda summary, turns: "unused", token_budget=2000, recent_messages=6)
+    turns = _turns(4)
+    compacted = compactor.compact("k", turns)
+    assert compacted.summary is None and compacted.turns == turns
+    assert compactor.stats()["scheduled"] == 0
+
+
+def test_older_turns_fold_into_cached_summary():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append((summary, [t["text"].split()[1] for t in turns]))
+        return f"{summary or ''} folded {len(turns)}".strip()
+
+    compactor = HistoryCompactor(summarize, token_budget=400, recent_messages=4)
+    turns = _turns(12)
+    first = compactor.compact("conv", turns)
+    assert first.summary is None and first.turns[-1] == turns[-1]
+    assert _history_tokens(first) <= 400
+    compactor.wait("conv")
+    assert calls == [(None, [str(i) for i in range(8)])]
+
+    # Next request: the summary is reused and only the newly folded turns are summarized
+    turns += _turns(14)[12:]
+    second = compactor.compact("conv", turns)
+    assert second.summary == "folded 8" and second.folded == 8
+    assert [t["text"] for t in second.turns] == [t["text"] for t in turns[8:]]
+    compactor.wait("conv")
+    assert calls[1] == ("folded 8", ["8", "9"])
+    assert compactor.compact("conv", turns).summary == "folded 8 folded 2"
+
+
+def test_budget_holds_for_long_conversations():
+    compactor = HistoryCompactor(lambda summary, turns: "short summary", token_budget=300, recent_messages=6)
+    turns = _turns(200, words=40)
+    compacted = compactor.compact("long", turns)
+    compactor.wait("long")
+    compacted = compactor.compact("long", turns)
+    assert compacted.summary == "short summary"
+    assert _history_tokens(compacted) <= 300
+    assert compacted.turns[0]["role"] == "user" and compacted.turns[-1] == turns[-1]
+
+
+def test_summary_survives_front_trimming_and_failures():
+    compactor = HistoryCompactor(lambda summary, turns: "sum", token_budget=200, recent_messages=2)
+    turns = _turns(10, words=10)
+    compactor.compact("trim", turns)
+    compactor.wait("trim")
+    trimmed = turns[4:]  # e.g. a session dropped its oldest turns
+    assert compactor.compact("trim", trimmed).summary == "sum"
+
+    failing = HistoryCompactor(lambda summary, turns: (_ for _ in ()).throw(RuntimeError("model down")),
+                               token_budget=200, recent_messages=2)
+    failing.compact("f", turns)
+    failing.wait("f")
+    assert failing.compact("f", turns).summary is None and failing.stats()["failed"] >= 1
+
+
+def test_session_contents_use_compactor():
+    compactor = HistoryCompactor(lambda summary, turns: "earlier", token_budget=200, recent_messages=2)
+    session = ConversationSessionStore().create("dialogue", "ctx", "model-x", history=[
+        {"sender": t["role"] if t["role"] == "user" else "ai", "text": t["text"]} for t in _turns(8, words=10)])
+    session.contents("next", compactor=compactor)
+    compactor.wait(session.session_id)
+    contents = session.contents("next", compactor=compactor)
+    assert "earlier" in contents[0]["parts"][0]["text"]
+    assert contents[-1] == {"role": "user", "parts": [{"text": "next"}]}
+    assert conversation_key("a", "b") != conversation_key("ab", "")
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All history compaction tests passed!")
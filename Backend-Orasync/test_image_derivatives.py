@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Offline tests for multi-resolution image derivatives and format negotiation
+"""
+
+import contextlib
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from image_derivatives import DerivativeRegistry, blob_path_from_url, derivative_blob_path
+from image_processing import negotiate_image_format, render_derivatives
+
+SIGNED_URL = "https://storage.googleapis.com/liroo-bucket/images/story_1.png?X-Goog-Signature=abc"
+
+
+def make_png(size=(1024, 768)):
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_render_derivatives_from_one_decode():
+    derivatives = render_derivatives(make_png(), skip=[("full", "png")])
+    pairs = {(d["size"], d["format"]) for d in derivatives}
+    assert len(pairs) == 8 and ("full", "png") not in pairs
+    thumb = next(d for d in derivatives if d["size"] == "thumbnail" and d["format"] == "webp")
+    assert (thumb["width"], thumb["height"]) == (256, 192)
+    assert Image.open(BytesIO(thumb["data"])).format == "WEBP"
+
+
+def test_small_images_are_not_upscaled():
+    derivatives = render_derivatives(make_png((200, 100)), formats=["jpeg"])
+    assert {d["width"] for d in derivatives} == {200}
+
+
+def test_negotiation_prefers_field_then_accept():
+    assert negotiate_image_format("WebP", "image/png") == "webp"
+    assert negotiate_image_format("jpg") == "jpeg"
+    assert negotiate_image_format(None, "image/avif,image/webp,image/png;q=0.8,*/*;q=0.5") == "webp"
+    assert negotiate_image_format(None, "image/webp;q=0.5, image/jpeg") == "jpeg"
+    assert negotiate_image_format(None, "application/json") == "png"
+    assert negotiate_image_format("gif", None) == "png"
+
+
+def test_blob_path_from_signed_url():
+    assert blob_path_from_url(SIGNED_URL) == "images/story_1.png"
+    assert blob_path_from_url(SIGNED_URL, bucket_name="other") is None
+    assert blob_path_from_url("https://liroo-bucket.storage.googleapis.com/images/a%20b.png?x=1") == "images/a b.png"
+    assert blob_path_from_url(None) is None
+
+
+def test_registry_builds_srcset_and_signs_lazily():
+    registry = DerivativeRegistry(max_entries=4)
+    uploaded = {}
+
+    def upload(data, path, mime_type):
+        uploaded[path] = mime_type
+        return True
+
+    sources = registry.create(make_png(), "images/story_1.png", upload)
+    assert derivative_blob_path("images/story_1.png", "thumbnail", "jpeg") in uploaded
+    assert len(sources) == 9
+
+    signed = []
+
+    def sign(path):
+        signed.append(path)
+        return f"https://signed/{path}"
+
+    srcset = registry.srcset(SIGNED_URL, "webp", sign)
+    assert srcset["mime_type"] == "image/webp"
+    assert [s["width"] for s in srcset["sources"]] == [256, 640, 1024]
+    assert len(signed) == 3  # only the requested format is signed
+
+    png = registry.srcset(SIGNED_URL, "png", sign)
+    assert png["sources"][-1]["url"] == SIGNED_URL  # full PNG is the original upload
+    assert registry.srcset("https://storage.googleapis.com/liroo-bucket/images/unknown.png", "webp", sign) is None
+
+
+def test_create_later_registers_in_the_background():
+    registry = DerivativeRegistry(max_entries=4, max_pending=1)
+    uploaded = []
+    ready = []
+    reserved = []
+
+    @contextlib.contextmanager
+    def reserve():
+        reserved.append(1)
+        yield
+
+    def upload(data, path, mime_type):
+        uploaded.append(path)
+        return True
+
+    future = registry.create_later(make_png(), "images/story_2.png", upload, formats=["webp", "png"],
+                                   reserve=reserve, on_ready=ready.append)
+    assert registry.create_later(make_png(), "images/story_3.png", upload) is None  # one render already pending
+    sources = future.result(timeout=30)
+    assert ready == [sources] and reserved == [1] and len(uploaded) == 5
+    assert registry.get("images/story_2.png") == sources and registry.get("images/story_3.png") is None
+    stats = registry.stats()
+    assert stats["completed"] == 1 and stats["skipped"] == 1 and stats["pending"] == 0
+
+
+def test_wait_lets_a_response_pick_up_fresh_derivatives():
+    registry = DerivativeRegistry(max_entries=4)
+    release = threading.Event()
+
+    def slow_upload(data, path, mime_type):
+        release.wait(5)
+        return True
+
+    registry.create_later(make_png(), "images/story_4.png", slow_upload, formats=["webp"])
+    assert registry.wait(["images/story_4.png"], timeout=0.05) is False  # still rendering
+    release.set()
+    assert registry.wait(["images/story_4.png", "images/other.png", None], timeout=30) is True
+    assert registry.get("images/story_4.png")
+    assert registry.wait(["images/story_4.png"], timeout=0) is True  # finished renders are forgotten
+    assert registry.stats()["wait_timeouts"] == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All image derivative tests passed!")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the zero-reencode image fast path
+"""
+
+from io import BytesIO
+
+from PIL import Image
+
+from image_processing import estimate_decode_bytes, inspect_png_header, needs_transcode, normalize_image_bytes
+
+
+def make_image(mode="RGB", size=(256, 256), fmt="PNG"):
+    # Noise keeps the encoded size above the minimum valid image size
+    image = Image.effect_noise(size, 64).convert(mode)
+    buffer = BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_header_reads_dimensions_without_decode():
+    header = inspect_png_header(make_image(size=(320, 200)))
+    assert (header.width, header.height) == (320, 200)
+    assert not header.has_alpha
+    assert header.complete
+
+
+def test_decode_memory_is_estimated_from_header():
+    data = make_image(size=(320, 200))
+    assert estimate_decode_bytes(data) == 320 * 200 * 4 * 3 + len(data) * 2
+    assert estimate_decode_bytes(b"not an image") == len(b"not an image") * 10
+
+
+def test_opaque_png_within_limits_passes_through():
+    data = make_image()
+    processed, transcoded = normalize_image_bytes(data)
+    assert not transcoded
+    assert processed is data
+
+
+def test_alpha_png_is_flattened():
+    data = make_image(mode="RGBA")
+    assert inspect_png_header(data).has_alpha
+    processed, transcoded = normalize_image_bytes(data)
+    assert transcoded
+    assert Image.open(BytesIO(processed)).mode == "RGB"
+
+
+def test_oversized_png_is_resized():
+    data = make_image(size=(1200, 600))
+    processed, transcoded = normalize_image_bytes(data, max_size=(1024, 1024))
+    assert transcoded
+    assert Image.open(BytesIO(processed)).size == (1024, 512)
+
+
+def test_truncated_or_foreign_bytes_take_slow_path():
+    data = make_image()
+    assert not inspect_png_header(data[:-12]).complete
+    assert needs_transcode(inspect_png_header(data[:-12]))
+    assert inspect_png_header(make_image(fmt="JPEG")) is None
+    processed, transcoded = normalize_image_bytes(make_image(fmt="JPEG"))
+    assert transcoded
+    assert processed.startswith(b"\x89PNG")
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All image processing tests passed!")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the Pillow worker process pool
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from image_processing import normalize_image_bytes, render_derivatives
+from image_workers import ImageWorkerPool, ImageWorkersBusy
+
+
+def make_image(mode="RGB", size=(256, 256)):
+    image = Image.effect_noise(size, 64).convert(mode)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _sleep_then_echo(data, seconds):
+    time.sleep(seconds)
+    return os.getpid(), [data]
+
+
+def test_transcode_and_derivatives_run_in_workers():
+    pool = ImageWorkerPool(workers=2).start()
+    try:
+        alpha = make_image("RGBA", (1200, 300))
+        processed, transcoded = pool.normalize(alpha)
+        assert transcoded and processed == normalize_image_bytes(alpha)[0]
+
+        opaque = make_image()
+        assert pool.normalize(opaque) == (opaque, False)  # header check only, never sent to a worker
+
+        derivatives = pool.render_derivatives(processed, formats=("webp", "png"))
+        assert [(d["size"], d["format"], d["width"]) for d in derivatives] == \
+            [(d["size"], d["format"], d["width"]) for d in render_derivatives(processed, formats=("webp", "png"))]
+        assert all(d["data"] for d in derivatives)
+
+        assert Image.open(BytesIO(pool.render_placeholder("A fox", size=(128, 128)))).size == (128, 128)
+
+        stats = pool.stats()
+        assert stats["tasks"] == 3 and stats["inline"] == 0 and stats["shared_mb"] > 0
+        assert stats["by_task"]["normalize"]["tasks"] == 1 and stats["by_task"]["normalize"]["cpu_seconds"] > 0
+        assert stats["worker_rss_mb"] > 0
+    finally:
+        pool.shutdown()
+
+
+def test_worker_errors_reach_the_caller():
+    pool = ImageWorkerPool(workers=1).start()
+    try:
+        pool.normalize(b"\x89PNG" + b"\0" * 2000)
+        assert False, "corrupt bytes must not normalize"
+    except Exception as e:
+        assert not isinstance(e, ImageWorkersBusy)
+    finally:
+        pool.shutdown()
+
+
+def test_full_pool_rejects_after_queue_timeout():
+    pool = ImageWorkerPool(workers=1, max_queued=0, queue_timeout=0.05).start()
+    try:
+        busy = threading.Thread(target=pool.run, args=("slow", _sleep_then_echo, b"x"), kwargs={"seconds": 1})
+        busy.start()
+        time.sleep(0.2)
+        try:
+            pool.run("slow", _sleep_then_echo, b"y", seconds=0)
+            assert False, "pool is full"
+        except ImageWorkersBusy:
+            pass
+        busy.join(5)
+        worker_pid, [echoed] = pool.run("slow", _sleep_then_echo, b"z", seconds=0)
+        assert echoed == b"z" and worker_pid != os.getpid()
+        assert pool.stats()["busy"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_zero_workers_runs_in_process():
+    pool = ImageWorkerPool(workers=0)
+    worker_pid, [echoed] = pool.run("echo", _sleep_then_echo, b"data", seconds=0)
+    assert worker_pid == os.getpid() and echoed == b"data"
+    assert pool.stats()["mode"] == "inline" and pool.stats()["inline"] == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All image worker tests passed!")
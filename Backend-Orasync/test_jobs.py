@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the background job manager
+"""
+
+import threading
+import time
+
+from jobs import FAILED, QUEUED, SUCCEEDED, JobConflict, JobManager, JobQueueFull
+
+
+def _wait_finished(manager, job_id, timeout=2.0):
+    job = manager.get(job_id)
+    for _ in range(int(timeout / 0.01)):
+        if job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_runs_and_keeps_result():
+    manager = JobManager(max_workers=2)
+    job, created = manager.submit("comic", lambda: ({"comic": "ok"}, 200), "req-00000001")
+    assert created and job.kind == "comic"
+    job = _wait_finished(manager, "req-00000001")
+    assert job.status == SUCCEEDED and job.payload == {"comic": "ok"} and job.status_code == 200
+    assert job.to_dict()["finished_at"] is not None
+
+
+def test_failures_keep_status_code_and_error():
+    manager = JobManager(max_workers=1)
+    manager.submit("lecture", lambda: ({"error": "No text provided"}, 400), "bad-input-1")
+
+    def boom():
+        raise RuntimeError("model down")
+
+    manager.submit("lecture", boom, "exploding-1")
+    bad = _wait_finished(manager, "bad-input-1")
+    exploded = _wait_finished(manager, "exploding-1")
+    assert bad.status == FAILED and bad.status_code == 400 and bad.error == "No text provided"
+    assert exploded.status == FAILED and exploded.status_code == 500 and exploded.payload == {"error": "model down"}
+    assert manager.stats()["failed"] == 2
+
+
+def test_resubmitting_an_id_is_idempotent_and_queue_is_bounded():
+    release = threading.Event()
+    manager = JobManager(max_workers=1, max_queued=1)
+    manager.submit("story", lambda: (release.wait(2), 200), "running-01")
+    while manager.get("running-01").status == QUEUED:
+        time.sleep(0.01)
+    queued, _ = manager.submit("story", lambda: ({}, 200), "queued-001")
+    assert manager.queue_position(queued) == 1
+
+    again, created = manager.submit("story", lambda: ({}, 200), "queued-001")
+    assert again is queued and not created
+    for kind, fingerprint in (("comic", None), ("story", "someone-else")):
+        try:
+            manager.submit(kind, lambda: ({}, 200), "queued-001", fingerprint)
+            assert False, "a different submission must not get the job"
+        except JobConflict:
+            pass
+    try:
+        manager.submit("story", lambda: ({}, 200), "overflow-1")
+        assert False, "queue should be full"
+    except JobQueueFull:
+        pass
+    release.set()
+    _wait_finished(manager, "queued-001")
+    counters = manager.stats()
+    assert counters["deduplicated"] == 1 and counters["rejected"] == 1 and counters["conflicts"] == 2
+
+
+def test_finished_results_expire():
+    now = [1000.0]
+    manager = JobManager(result_ttl_seconds=60, clock=lambda: now[0])
+    manager.submit("comic", lambda: ({}, 200), "expiring-1")
+    _wait_finished(manager, "expiring-1")
+    now[0] += 61
+    assert manager.get("expiring-1") is None
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All job tests passed!")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Offline tests for incremental JSON array streaming
+"""
+
+import json
+import random
+
+from json_stream import JsonArrayStream
+
+PANELS = [
+    {"panel_id": 1, "scene": "A leaf { opens", "dialogue": {"Chloe": "Sunlight! \"Yum\" ]"}},
+    {"panel_id": 2, "scene": "Roots drink", "dialogue": {"Narrator": "Water climbs up\\n the stem"}},
+    {"panel_id": 3, "scene": "Oxygen out", "dialogue": {"Chloe": "Here you go [friends]!"}},
+]
+
+
+def feed_in_chunks(text, size):
+    stream = JsonArrayStream()
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(stream.feed(text[i:i + size]))
+    return stream, items
+
+
+def test_objects_emitted_as_soon_as_they_close():
+    text = json.dumps(PANELS)
+    stream = JsonArrayStream()
+    first_close = text.index("}}") + 2
+    assert stream.feed(text[:first_close - 1]) == []
+    assert stream.feed(text[first_close - 1:first_close]) == [PANELS[0]]
+    assert stream.feed(text[first_close:]) == PANELS[1:]
+    assert stream.finished
+
+
+def test_any_chunking_gives_the_same_objects():
+    text = "```json\n" + json.dumps(PANELS, indent=2) + "\n```"
+    rng = random.Random(7)
+    for _ in range(50):
+        _, items = feed_in_chunks(text, rng.randint(1, 25))
+        assert items == PANELS
+
+
+def test_truncated_output_keeps_complete_panels():
+    text = json.dumps(PANELS)
+    cut = text.index('{"panel_id": 3')
+    stream, items = feed_in_chunks(text[:cut + 20], 9)
+    assert items == PANELS[:2]
+    assert stream.pending and not stream.finished
+
+
+def test_non_object_elements_are_skipped():
+    stream, items = feed_in_chunks('[1, "two", {"panel_id": 1}, [3]]', 4)
+    assert items == [{"panel_id": 1}]
+    assert stream.skipped == 1  # only the nested array is a container element
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All JSON stream tests passed!")
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the LLM gateway (timeouts, deadlines, hedging, retries)
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_gateway import (FATAL, RETRYABLE, CallTimeout, DeadlineExceeded, LLMGateway, backoff_delay,
+                         bind_context, classify_error, current_deadline, deadline_scope)
+
+
+class ApiError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(message or f"{code} error")
+        self.code = code
+
+
+def _gateway(**options):
+    sleeps = []
+    options.setdefault("backoff_base", 0.01)
+    gateway = LLMGateway(sleep=sleeps.append, rng=lambda: 1.0, **options)
+    return gateway, sleeps
+
+
+def test_error_classification_and_backoff():
+    assert classify_error(ApiError(429)) == RETRYABLE
+    assert classify_error(ApiError(503)) == RETRYABLE
+    assert classify_error(ApiError(400, "INVALID_ARGUMENT")) == FATAL
+    assert classify_error(TimeoutError()) == RETRYABLE
+    assert classify_error(RuntimeError("503 UNAVAILABLE: model overloaded")) == RETRYABLE
+    assert classify_error(ValueError("bad prompt")) == FATAL
+    assert classify_error(DeadlineExceeded()) == FATAL
+    assert [backoff_delay(n, 0.5, 4, rng=lambda: 1.0) for n in range(5)] == [0.5, 1.0, 2.0, 4, 4]
+    assert backoff_delay(3, 0.5, 4, rng=lambda: 0.25) == 1.0
+
+
+def test_retryable_errors_are_retried_with_backoff():
+    gateway, sleeps = _gateway(max_attempts=3)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ApiError(503)
+        return "ok"
+
+    assert gateway.call("text", flaky) == "ok"
+    assert sleeps == [0.01, 0.02]
+
+    fatal_calls = []
+
+    def fatal():
+        fatal_calls.append(1)
+        raise ApiError(400)
+
+    try:
+        gateway.call("text", fatal)
+        assert False, "fatal error should propagate"
+    except ApiError:
+        assert len(fatal_calls) == 1
+    counters = gateway.stats()["labels"]["text"]
+    assert counters["retries"] == 2 and counters["fatal"] == 1 and counters["succeeded"] == 1
+
+
+def test_call_timeout_and_deadline():
+    gateway, _ = _gateway(call_timeout=0.05, max_attempts=2, hedge_enabled=False)
+    release = threading.Event()
+    try:
+        gateway.call("slow", release.wait, 5)
+        assert False, "call should time out"
+    except CallTimeout:
+        pass
+    assert gateway.stats()["labels"]["slow"]["timeouts"] == 2
+
+    with deadline_scope(0.05):
+        try:
+            gateway.call("slow", release.wait, 5, timeout=10)
+            assert False, "deadline should stop the call"
+        except DeadlineExceeded:
+            pass
+        # An inner scope can shorten but never extend the request deadline
+        with deadline_scope(60) as inner:
+            assert inner.remaining() <= 0.05
+    assert current_deadline() is None
+    release.set()
+
+
+def test_slow_call_is_hedged_past_p95():
+    gateway, _ = _gateway(hedge_min_samples=5, hedge_budget=0.5)
+    for _ in range(10):
+        gateway.call("panels", lambda: "fast")
+    calls = []
+
+    def sometimes_stuck():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "late"
+        return "hedged"
+
+    started = time.monotonic()
+    assert gateway.call("panels", sometimes_stuck) == "hedged"
+    assert time.monotonic() - started < 0.4
+    counters = gateway.stats()["labels"]["panels"]
+    assert counters["hedges"] == 1 and counters["hedge_wins"] == 1
+
+
+def test_queue_time_is_not_latency_and_a_full_pool_is_not_hedged():
+    gateway, _ = _gateway(max_workers=1, call_timeout=0.3, hedge_min_samples=5, hedge_budget=1.0)
+    for _ in range(10):
+        gateway.call("panels", lambda: "fast")
+    release = threading.Event()
+    blocker = threading.Thread(target=gateway.call, args=("other", lambda: release.wait(2)), kwargs={"hedge": False})
+    blocker.start()
+    time.sleep(0.05)
+    threading.Timer(0.4, release.set).start()
+    # Queued 0.4s behind the blocker, longer than its 0.3s timeout: only the time it runs counts
+    assert gateway.call("panels", lambda: "queued") == "queued"
+    blocker.join(2)
+    assert gateway.stats()["labels"]["panels"]["p95_seconds"] < 0.1
+
+    calls = []
+
+    def slow_then_fast():
+        calls.append(1)
+        time.sleep(0.1 if len(calls) == 1 else 0)
+        return len(calls)
+
+    assert gateway.call("panels", slow_then_fast) == 1  # the only thread is busy with it, so no hedge
+    counters = gateway.stats()["labels"]["panels"]
+    assert counters["hedges"] == 0 and counters["hedges_skipped"] == 1 and counters["timeouts"] == 0
+
+
+def test_stream_retries_only_before_first_chunk():
+    gateway, sleeps = _gateway(max_attempts=3)
+    attempts = []
+
+    def stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ApiError(429)
+        yield "a"
+        yield "b"
+
+    assert list(gateway.stream("text_stream", stream)) == ["a", "b"]
+    assert len(attempts) == 2 and len(sleeps) == 1
+
+    def breaks_mid_stream():
+        yield "a"
+        raise ApiError(503)
+
+    received = []
+    try:
+        for chunk in gateway.stream("text_stream", breaks_mid_stream):
+            received.append(chunk)
+        assert False, "mid-stream failures are not retried"
+    except ApiError:
+        assert received == ["a"]
+
+
+def test_deadline_follows_work_into_executors():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with deadline_scope(30):
+            bound = executor.submit(bind_context(lambda: current_deadline())).result()
+            unbound = executor.submit(lambda: current_deadline()).result()
+    assert bound is not None and bound.remaining() > 0
+    assert unbound is None
+
+
+def test_async_calls_share_policies_and_cancel_losers():
+    slept = []
+
+    async def record_sleep(delay):
+        slept.append(delay)
+
+    gateway, _ = _gateway(max_attempts=3, call_timeout=0.05, hedge_enabled=False, async_sleep=record_sleep)
+    attempts = []
+    cancelled = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ApiError(429)
+        if len(attempts) == 2:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+        return "ok"
+
+    async def chunks():
+        yield "a"
+        yield "b"
+
+    async def scenario():
+        result = await gateway.acall("chat", flaky)
+        streamed = [chunk async for chunk in gateway.astream("chat_stream", chunks)]
+        with deadline_scope(0.01):
+            await asyncio.sleep(0.02)
+            try:
+                await gateway.acall("chat", flaky)
+                assert False, "expired deadline should stop the call"
+            except DeadlineExceeded:
+                pass
+        return result, streamed
+
+    assert asyncio.run(scenario()) == ("ok", ["a", "b"])
+    assert len(attempts) == 3 and cancelled == [1] and slept == [0.01, 0.02]
+    counters = gateway.stats()["labels"]["chat"]
+    assert counters["timeouts"] == 1 and counters["retries"] == 2 and counters["deadline_exceeded"] == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All LLM gateway tests passed!")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Offline tests for long-document splitting, parallel mapping and block merging
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from block_parser import IMAGE_PLACEHOLDER
+from long_document import condense, map_chunks, merge_block_items, source_blocks, split_semantic
+
+
+def _section(title, sentences):
+    return f"# {title}\n\n" + " ".join(f"{title} fact number {i} is explained here." for i in range(sentences))
+
+
+def test_split_keeps_everything_and_prefers_headings():
+    text = "\n\n".join(_section(f"Chapter {n}", 12) for n in range(1, 6))
+    chunks = split_semantic(text, max_chars=1200)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 1200 for chunk in chunks)
+    assert all(chunk.startswith("# Chapter") for chunk in chunks)
+    assert "".join(chunks).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
+    assert split_semantic("short text", max_chars=1200) == ["short text"]
+
+
+def test_oversized_paragraph_splits_on_sentences():
+    paragraph = " ".join(f"Sentence {i} ends here." for i in range(200))
+    chunks = split_semantic(paragraph, max_chars=500)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.endswith("here.") for chunk in chunks)
+
+
+def test_map_chunks_bounded_ordered_and_tolerates_failures():
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def work(index, chunk):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        if index == 2:
+            raise RuntimeError("model error")
+        return chunk.upper()
+
+    results = map_chunks(["a", "b", "c", "d", "e", "f"], work, max_workers=2)
+    assert results == ["A", "B", None, "D", "E", "F"]
+    assert peak[0] <= 2
+
+    peak[0] = 0
+    with ThreadPoolExecutor(max_workers=4) as shared:
+        results = map_chunks(["a", "b", "c", "d", "e", "f"], work, max_workers=2, executor=shared)
+    assert results == ["A", "B", None, "D", "E", "F"]
+    assert peak[0] <= 2
+
+
+def test_condense_reduces_until_it_fits():
+    text = "\n\n".join(_section(f"Unit {n}", 20) for n in range(1, 9))
+    calls = []
+
+    def summarize(index, total, chunk):
+        calls.append((index, total))
+        return chunk.split("\n\n", 1)[0] + "\n\n" + chunk[-200:]
+
+    notes = condense(text, summarize, max_chars=2000, max_workers=3)
+    assert len(notes) <= 2000
+    assert {total for _, total in calls} == {len(calls)}
+    assert notes.startswith("# Unit 1") and "Unit 8 fact" in notes
+    assert condense("short", summarize, max_chars=2000) == "short"
+
+    # A part whose summary fails is kept verbatim, not dropped
+    notes = condense(text, lambda index, total, chunk: None if index == 0 else "notes", max_chars=2000,
+                     max_rounds=1)
+    assert notes.startswith(split_semantic(text, 2000)[0])
+
+
+def test_merge_keeps_one_summary_and_one_quiz():
+    def part(n, questions):
+        return ([{"type": IMAGE_PLACEHOLDER, "prompt": f"summary {n}", "summary": True},
+                 {"type": "heading", "content": f"Part {n}"},
+                 {"type": IMAGE_PLACEHOLDER, "prompt": f"image {n}", "summary": False},
+                 {"type": "quizHeading", "content": f"Quiz {n}"}]
+                + [{"type": "multipleChoiceQuestion", "question": f"q{n}.{i}"} for i in range(questions)])
+
+    merged = merge_block_items([part(1, 6), part(2, 6), part(3, 1)], max_quiz_questions=8)
+    summaries = [item for item in merged if item.get("summary")]
+    assert [s["prompt"] for s in summaries] == ["summary 1"]
+    assert [item["content"] for item in merged if item["type"] == "heading"] == ["Part 1", "Part 2", "Part 3"]
+    assert [item["content"] for item in merged if item["type"] == "quizHeading"] == ["Quiz 1"]
+    questions = [item["question"] for item in merged if item["type"] == "multipleChoiceQuestion"]
+    assert len(questions) == 8 and questions[:3] == ["q1.0", "q2.0", "q3.0"]
+    assert merged[-9]["type"] == "quizHeading"
+
+
+
+def test_source_blocks_keep_a_failed_part_readable():
+    blocks = source_blocks("# Unit 2\n\nCells divide.\nThey grow.\n\n\nMitosis has phases.")
+    assert [(b["type"], b["content"]) for b in blocks] == [
+        ("heading", "Unit 2"), ("paragraph", "Cells divide.\nThey grow."), ("paragraph", "Mitosis has phases.")]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All long document tests passed!")
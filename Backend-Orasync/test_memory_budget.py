@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the memory budget (cgroup limit, reservations, background sampling)
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from memory_budget import MB, MemoryBudget, MemoryBudgetExceeded, read_cgroup_memory_limit
+
+
+def _write(directory, name, value):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write(value)
+    return path
+
+
+def test_cgroup_limit_is_read_and_unlimited_ignored():
+    with tempfile.TemporaryDirectory() as directory:
+        v2 = _write(directory, "memory.max", f"{4096 * MB}\n")
+        unlimited = _write(directory, "unlimited", "max\n")
+        v1_unlimited = _write(directory, "limit_in_bytes", "9223372036854771712\n")
+        assert read_cgroup_memory_limit((os.path.join(directory, "missing"), v2)) == 4096 * MB
+        assert read_cgroup_memory_limit((unlimited,)) is None
+        assert read_cgroup_memory_limit((v1_unlimited,)) is None
+    budget = MemoryBudget.for_container(2048 * MB, override_limit_bytes=1000 * MB, read_rss=lambda: 0)
+    assert budget.limit_bytes == 1000 * MB and budget.budget_bytes == 800 * MB
+
+
+def test_reservations_block_until_released():
+    budget = MemoryBudget(1000 * MB, budget_fraction=1.0, read_rss=lambda: 200 * MB)
+    first = budget.reserve("decode", 600 * MB)
+    assert budget.available_bytes() == 200 * MB
+    granted = []
+
+    def second():
+        with budget.reserve("composite", 500 * MB, timeout=2):
+            granted.append(time.monotonic())
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.05)
+    assert granted == []
+    first.release()
+    thread.join(2)
+    assert len(granted) == 1
+    stats = budget.stats()
+    assert stats["waited"] == 1 and stats["active_reservations"] == 0 and stats["reserved_mb"] == 0
+
+
+def test_timeout_raises_memory_error_but_lone_work_always_runs():
+    budget = MemoryBudget(1000 * MB, budget_fraction=1.0, read_rss=lambda: 100 * MB)
+    with budget.reserve("huge", 5000 * MB):  # nothing else reserved, so oversized work still runs
+        try:
+            budget.reserve("decode", 10 * MB, timeout=0.05)
+            assert False, "budget is exhausted"
+        except MemoryError as e:
+            assert isinstance(e, MemoryBudgetExceeded)
+    assert budget.stats()["timed_out"] == 1
+
+
+def test_sampler_tracks_rss_and_collects_under_pressure():
+    rss = [100 * MB]
+    collections = []
+    now = [0.0]
+
+    def collect():
+        collections.append(1)
+        rss[0] = 300 * MB
+        return 0
+
+    budget = MemoryBudget(1000 * MB, budget_fraction=1.0, gc_fraction=0.8, gc_min_interval=10,
+                          read_rss=lambda: rss[0], collect=collect, clock=lambda: now[0])
+    rss[0] = 900 * MB
+    budget.sample()
+    assert collections == [1] and budget.rss_bytes() == 300 * MB
+    rss[0] = 900 * MB
+    now[0] += 5
+    budget.sample()  # rate-limited
+    assert collections == [1] and budget.rss_bytes() == 900 * MB
+    assert budget.stats()["gc_runs"] == 1 and budget.stats()["samples"] == 2
+
+
+def test_sampler_restarts_in_a_forked_child():
+    rss = [100 * MB]
+    budget = MemoryBudget(1000 * MB, sample_interval=0.01, read_rss=lambda: rss[0]).start()
+    parent_sampler = budget._sampler
+    assert budget.start()._sampler is parent_sampler
+    budget._sampler_pid = -1  # as seen from a child forked after start()
+    rss[0] = 400 * MB
+    budget.start()
+    assert budget._sampler is not parent_sampler and budget._sampler.is_alive()
+    assert budget.rss_bytes() == 400 * MB
+    budget.stop()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All memory budget tests passed!")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the image model circuit breakers and latency-aware routing
+"""
+
+import time
+
+from model_health import CLOSED, HALF_OPEN, OPEN, ModelHealthRegistry, percentile
+
+MODELS = [("primary", "Primary"), ("fallback", "Fallback"), ("legacy", "Legacy")]
+
+
+def test_percentile_nearest_rank():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert percentile(values, 50) == 5
+    assert percentile(values, 95) == 10
+    assert percentile([], 50) is None
+
+
+def test_cold_start_uses_configured_priority():
+    registry = ModelHealthRegistry(MODELS)
+    assert [name for name, _ in registry.route()] == ["primary", "fallback", "legacy"]
+
+
+def test_open_circuit_is_skipped():
+    registry = ModelHealthRegistry(MODELS, failure_threshold=2, recovery_timeout=60)
+    registry.record_failure("primary", 1.0, RuntimeError("503"))
+    assert registry.snapshot()["models"][0]["state"] == CLOSED
+    registry.record_failure("primary", 1.0, RuntimeError("503"))
+    assert registry.snapshot()["models"][0]["state"] == OPEN
+    assert [name for name, _ in registry.route()] == ["fallback", "legacy"]
+    decision = registry.snapshot()["recent_routing_decisions"][-1]
+    assert decision["skipped_open"] == ["primary"]
+
+
+def test_half_open_probe_closes_on_success():
+    registry = ModelHealthRegistry(MODELS, failure_threshold=1, recovery_timeout=0.05)
+    registry.record_failure("primary", 1.0)
+    time.sleep(0.06)
+    order = [name for name, _ in registry.route()]
+    assert order[0] == "primary"  # the trial call goes ahead of the healthy fallbacks
+    assert registry.snapshot()["models"][0]["state"] == HALF_OPEN
+    assert registry.allow_request("primary")
+    assert not registry.allow_request("primary")  # only one trial call
+    assert [name for name, _ in registry.route()][-1] == "primary"  # trial taken: others go first
+    registry.release_trial("primary")  # e.g. the request deadline expired mid-call
+    assert registry.allow_request("primary")
+    assert not registry.allow_request("primary")
+    registry.record_success("primary", 2.0)
+    assert registry.snapshot()["models"][0]["state"] == CLOSED
+
+
+def test_fastest_healthy_model_is_preferred():
+    registry = ModelHealthRegistry(MODELS, min_samples=3)
+    for _ in range(3):
+        registry.record_success("primary", 20.0)
+        registry.record_success("fallback", 4.0)
+        registry.record_success("legacy", 8.0)
+    assert [name for name, _ in registry.route()] == ["fallback", "legacy", "primary"]
+    snapshot = registry.snapshot()["models"][1]
+    assert snapshot["p50_seconds"] == 4.0
+    assert snapshot["error_rate"] == 0.0
+
+
+def test_unsampled_models_rank_after_measured_ones():
+    registry = ModelHealthRegistry(MODELS, min_samples=3)
+    for _ in range(3):
+        registry.record_success("legacy", 20.0)
+    assert [name for name, _ in registry.route()] == ["legacy", "primary", "fallback"]
+
+
+def test_all_open_still_probes_one_model():
+    registry = ModelHealthRegistry(MODELS, failure_threshold=1, recovery_timeout=60)
+    for name, _ in MODELS:
+        registry.record_failure(name, 1.0)
+    route = registry.route()
+    assert [name for name, _ in route] == ["primary"]
+    assert registry.allow_request("primary")
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All model health tests passed!")
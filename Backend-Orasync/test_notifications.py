@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the batched push-notification dispatcher
+"""
+
+from types import SimpleNamespace
+
+from notifications import FCMTransport, LocalPushTransport, Notification, NotificationDispatcher
+
+
+def test_notifications_are_queued_and_sent_in_one_batch():
+    transport = LocalPushTransport()
+    dispatcher = NotificationDispatcher(transport, linger_seconds=0.2)
+    for i in range(5):
+        assert dispatcher.send(f"token-{i}", "Comic Ready! 🎨", "Your comic is ready", {"panel_count": 4})
+    assert transport.sent == []  # nothing sent on the caller's thread
+    assert dispatcher.flush(timeout=2)
+    assert transport.calls == 1 and len(transport.sent) == 5
+    assert transport.sent[0].data == {"panel_count": "4"}  # FCM data values must be strings
+    stats = dispatcher.stats()
+    assert stats["sent"] == 5 and stats["batches"] == 1 and stats["queued_now"] == 0
+
+
+def test_transient_failures_are_retried_with_backoff():
+    transport = LocalPushTransport(transient_failures=2)
+    dispatcher = NotificationDispatcher(transport, linger_seconds=0.01, retry_base_delay=0.05)
+    dispatcher.send("token-a", "Dialogue Complete! 💬", "Your dialogue is ready")
+    assert dispatcher.flush(timeout=2)
+    assert transport.calls == 3 and [n.token for n in transport.sent] == ["token-a"]
+    assert dispatcher.stats()["retried"] == 2 and dispatcher.stats()["dropped"] == 0
+
+    gave_up = NotificationDispatcher(LocalPushTransport(transient_failures=5), linger_seconds=0.01,
+                                     max_attempts=2, retry_base_delay=0.01)
+    gave_up.send("token-b", "Story Ready! 📖", "Your story is ready")
+    assert gave_up.flush(timeout=2)
+    assert gave_up.stats()["dropped"] == 1 and gave_up.stats()["sent"] == 0
+
+
+def test_invalid_tokens_are_remembered_and_skipped():
+    transport = LocalPushTransport(invalid_tokens={"stale"})
+    dispatcher = NotificationDispatcher(transport, linger_seconds=0.01)
+    assert dispatcher.send("stale", "Comic Ready! 🎨", "first")
+    assert dispatcher.send("fresh", "Comic Ready! 🎨", "first")
+    assert dispatcher.flush(timeout=2)
+    assert dispatcher.is_invalid("stale") and not dispatcher.is_invalid("fresh")
+    assert dispatcher.send("stale", "Comic Ready! 🎨", "second") is False
+    assert dispatcher.flush(timeout=2)
+    assert transport.calls == 1 and [n.token for n in transport.sent] == ["fresh"]
+    stats = dispatcher.stats()
+    assert stats["invalid_tokens"] == 1 and stats["skipped_invalid"] == 1 and stats["known_invalid_tokens"] == 1
+
+
+class UnregisteredError(Exception):
+    code = "NOT_FOUND"
+
+
+class FakeMessaging:
+    """Just enough of firebase_admin.messaging for FCMTransport."""
+
+    def __init__(self):
+        self.calls = []
+        self.Message = lambda **kwargs: SimpleNamespace(**kwargs)
+        self.MulticastMessage = lambda **kwargs: SimpleNamespace(**kwargs)
+        self.Notification = lambda **kwargs: SimpleNamespace(**kwargs)
+
+    def _responses(self, tokens):
+        return SimpleNamespace(responses=[
+            SimpleNamespace(success=False, exception=UnregisteredError("unregistered")) if token == "stale"
+            else SimpleNamespace(success=True, exception=None) for token in tokens])
+
+    def send_each(self, messages):
+        self.calls.append(("send_each", [m.token for m in messages]))
+        return self._responses([m.token for m in messages])
+
+    def send_each_for_multicast(self, message):
+        self.calls.append(("multicast", list(message.tokens)))
+        raise ConnectionError("UNAVAILABLE")
+
+
+def test_fcm_transport_groups_shared_payloads_and_classifies_errors():
+    messaging = FakeMessaging()
+    batch = [Notification("a", "Story Ready! 📖", "done", {}), Notification("stale", "Lecture Ready", "done", {}),
+             Notification("b", "Story Ready! 📖", "done", {}), Notification("c", "Comic Ready! 🎨", "done", {})]
+    results = FCMTransport(messaging).send(batch)
+    assert messaging.calls == [("multicast", ["a", "b"]), ("send_each", ["stale", "c"])]
+    assert [r.status for r in results] == ["transient", "invalid_token", "transient", "sent"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All notification tests passed!")
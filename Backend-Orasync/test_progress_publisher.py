@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the write-behind Firestore progress publisher
+"""
+
+import threading
+import time
+
+from progress_publisher import ProgressPublisher
+
+
+class RecordingCommit:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.sent = threading.Event()
+
+    def __call__(self, writes):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("DEADLINE_EXCEEDED")
+        self.batches.append(list(writes))
+        self.sent.set()
+
+
+def test_steps_are_merged_per_document_and_debounced():
+    commit = RecordingCommit()
+    publisher = ProgressPublisher(commit, debounce_seconds=0.2)
+    for step in range(1, 9):
+        publisher.merge("request_progress", "req-1", {"step_number": step, "details": f"image {step}"})
+    publisher.merge("background_tasks", "req-1", {"status": "started"})
+    assert commit.batches == []  # nothing sent on the caller's thread
+    assert commit.sent.wait(2)
+    [batch] = commit.batches
+    assert [(w.collection, w.op, w.fields) for w in batch] == [
+        ("request_progress", "merge", {"step_number": 8, "details": "image 8"}),
+        ("background_tasks", "merge", {"status": "started"}),
+    ]
+    stats = publisher.stats()
+    assert stats["coalesced"] == 7 and stats["writes"] == 2 and stats["lag_p95_seconds"] >= 0.2
+    assert stats["pending_documents"] == 0 and stats["queue_lag_seconds"] == 0.0
+
+
+def test_terminal_writes_skip_the_debounce():
+    commit = RecordingCommit()
+    publisher = ProgressPublisher(commit, debounce_seconds=30)
+    publisher.merge("request_progress", "req-2", {"step": "Generating"})
+    publisher.delete("request_progress", "req-2")
+    publisher.merge("background_tasks", "req-2", {"status": "completed"}, terminal=True)
+    assert commit.sent.wait(2)
+    assert [(w.document, w.op) for w in commit.batches[0]] == [("req-2", "delete"), ("req-2", "merge")]
+
+
+def test_failed_batches_are_retried_under_newer_writes():
+    commit = RecordingCommit(failures=1)
+    publisher = ProgressPublisher(commit, debounce_seconds=0.01, retry_delay=0.05)
+    publisher.merge("background_tasks", "req-3", {"status": "started", "attempt": 1}, terminal=True)
+    time.sleep(0.02)
+    publisher.merge("background_tasks", "req-3", {"status": "completed"})
+    assert publisher.flush(timeout=2)
+    assert commit.batches[-1][0].fields == {"status": "completed", "attempt": 1}
+    assert publisher.stats()["failed_batches"] == 1 and publisher.stats()["dropped"] == 0
+
+
+def test_flush_sends_pending_writes_and_reports_lag():
+    commit = RecordingCommit()
+    publisher = ProgressPublisher(commit, debounce_seconds=60)
+    publisher.merge("request_progress", "req-4", {"step_number": 1})
+    time.sleep(0.05)
+    assert publisher.stats()["queue_lag_seconds"] >= 0.05
+    assert publisher.flush(timeout=2)
+    assert len(commit.batches) == 1 and publisher.stats()["pending_documents"] == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All progress publisher tests passed!")
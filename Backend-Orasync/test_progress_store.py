@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the shared progress store (memory and SQLite backends)
+"""
+
+import os
+import tempfile
+import threading
+
+from progress_store import MemoryProgressStore, SQLiteProgressStore, create_progress_store
+
+
+def check_contract(store):
+    assert store.get("req-1") is None
+    assert store.update("req-1", {"step": "orphan"}) is False  # never recreates a missing record
+    store.put("req-1", {"step": "Starting...", "step_number": 0, "total_steps": 5})
+    assert store.update("req-1", {"step": "Generating", "step_number": 2}) is True
+    assert store.get("req-1") == {"step": "Generating", "step_number": 2, "total_steps": 5}
+    store.delete("req-1")
+    assert store.get("req-1") is None and store.update("req-1", {"step": "late"}) is False
+    assert store.stats()["missed_updates"] == 2
+
+
+def check_expiry(store, now):
+    store.put("req-2", {"step": "Starting..."})
+    now[0] += 50
+    assert store.update("req-2", {"step_number": 1})  # each write pushes the expiry ahead
+    now[0] += 50
+    assert store.get("req-2") == {"step": "Starting...", "step_number": 1}
+    now[0] += 61
+    assert store.get("req-2") is None and store.update("req-2", {"step_number": 2}) is False
+
+
+def test_memory_store():
+    now = [1000.0]
+    check_contract(MemoryProgressStore())
+    check_expiry(MemoryProgressStore(ttl_seconds=60, clock=lambda: now[0]), now)
+
+
+def test_sqlite_store():
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as directory:
+        check_contract(SQLiteProgressStore(os.path.join(directory, "progress.sqlite3")))
+        check_expiry(SQLiteProgressStore(os.path.join(directory, "ttl.sqlite3"), ttl_seconds=60,
+                                         clock=lambda: now[0]), now)
+
+
+def test_sqlite_updates_from_several_writers_are_all_kept():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "progress.sqlite3")
+        writers = [SQLiteProgressStore(path) for _ in range(4)]  # as if one per worker process
+        writers[0].put("comic", {"step": "Generating panel images"})
+
+        def mark_panels(store, worker):
+            for panel in range(10):
+                store.update("comic", {f"panel_{worker}_{panel}": "done"})
+
+        threads = [threading.Thread(target=mark_panels, args=(store, i)) for i, store in enumerate(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        record = SQLiteProgressStore(path).get("comic")
+        assert len(record) == 1 + 4 * 10 and record["step"] == "Generating panel images"
+
+
+def test_factory_selects_backend():
+    assert create_progress_store("memory").name == "memory"
+    assert create_progress_store("firestore", firestore_db=None).name == "memory"
+    assert create_progress_store("firestore", firestore_db=object()).collection == "request_progress"
+    assert create_progress_store("firestore", firestore_db=object(), collection="request_context").collection == \
+        "request_context"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "p.sqlite3")
+        progress = create_progress_store("sqlite", url=path)
+        context = create_progress_store("sqlite", url=path, collection="request_context")
+        assert progress.name == "sqlite" and context.table == "request_context"
+        context.put("abc12345", {"user_token": "secret"})
+        assert progress.get("abc12345") is None and context.get("abc12345") == {"user_token": "secret"}
+    try:
+        create_progress_store("etcd")
+        assert False
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All progress store tests passed!")
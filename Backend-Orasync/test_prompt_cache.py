@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Offline tests for prompt prefix caching, using the local cached-content stand-in
+"""
+
+from types import SimpleNamespace
+
+from prompt_cache import LocalCachedContentBackend, PromptPrefixCache, is_cache_rejection
+
+MODEL = "gemini-2.5-flash"
+BIG_INSTRUCTION = "You are an expert assistant. " * 400  # ~2.8k tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(**kwargs):
+    clock = FakeClock()
+    backend = LocalCachedContentBackend(clock=clock)
+    return PromptPrefixCache(backend, clock=clock, **kwargs), backend, clock
+
+
+def test_large_prefix_is_created_once_and_reused():
+    cache, backend, _ = make_cache()
+    first = cache.get(MODEL, BIG_INSTRUCTION, label="text")
+    assert first and cache.get(MODEL, BIG_INSTRUCTION) == first
+    assert backend.creates == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_small_prefix_falls_back_without_api_call():
+    cache, backend, _ = make_cache()
+    assert cache.get(MODEL, "Be brief.") is None
+    assert backend.creates == 0 and cache.stats()["too_small"] == 1
+
+
+def test_entry_refreshed_before_expiry_and_recreated_after():
+    cache, backend, clock = make_cache(ttl_seconds=600, refresh_margin_seconds=60)
+    name = cache.get(MODEL, BIG_INSTRUCTION)
+    clock.now += 550  # inside the refresh margin
+    assert cache.get(MODEL, BIG_INSTRUCTION) == name
+    assert backend.refreshes == 1
+    clock.now += 700  # past the refreshed expiry
+    assert cache.get(MODEL, BIG_INSTRUCTION) != name
+    assert backend.creates == 2
+
+
+def test_backend_errors_back_off_to_full_prompt():
+    cache, backend, clock = make_cache(failure_backoff_seconds=120)
+    backend.min_tokens[MODEL] = 10 ** 6  # provider rejects the prefix
+    assert cache.get(MODEL, BIG_INSTRUCTION) is None
+    backend.min_tokens[MODEL] = 1024
+    assert cache.get(MODEL, BIG_INSTRUCTION) is None  # still backing off
+    clock.now += 121
+    assert cache.get(MODEL, BIG_INSTRUCTION) is not None
+    stats = cache.stats()
+    assert stats["errors"] == 1 and stats["fallbacks"] == 2
+
+
+def test_per_document_prefixes_are_bounded():
+    cache, backend, _ = make_cache(max_entries=2)
+    for doc in ("a", "b", "c"):
+        assert cache.get(MODEL, "Comic writer.", [doc * 8000], label="comic_panels")
+    assert len(backend.entries) == 2 and cache.stats()["evictions"] == 1
+
+
+def test_usage_records_input_token_savings():
+    cache, _, _ = make_cache()
+    cache.record_usage(SimpleNamespace(prompt_token_count=3000, cached_content_token_count=2500), "text")
+    cache.record_usage(SimpleNamespace(prompt_token_count=1000, cached_content_token_count=None), "comic_panels")
+    usage = cache.stats()["usage"]
+    assert usage["cached_tokens"] == 2500 and usage["prompt_tokens"] == 4000
+    assert usage["saved_ratio"] == 0.625
+    assert cache.stats()["usage_by_label"]["text"]["cached_tokens"] == 2500
+
+
+def test_disabled_cache_always_falls_back():
+    cache = PromptPrefixCache(None)
+    assert cache.get(MODEL, BIG_INSTRUCTION) is None
+    assert cache.stats()["enabled"] is False
+
+
+
+class APIError(Exception):
+    def __init__(self, code, status, message):
+        super().__init__(message)
+        self.code, self.status = code, status
+
+
+def test_cache_rejections_are_classified_by_status_not_text():
+    assert is_cache_rejection(APIError(404, "NOT_FOUND", "CachedContent not found"))
+    assert is_cache_rejection(APIError(403, "PERMISSION_DENIED", "denied"))
+    assert not is_cache_rejection(APIError(503, "UNAVAILABLE", "cache service overloaded"))
+    assert not is_cache_rejection(TimeoutError("cache lookup timed out"))
+    assert is_cache_rejection(SimpleNamespace(code=None, status="failed_precondition"))
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All prompt cache tests passed!")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Offline tests for priority classes and per-class bulkheads
+"""
+
+import asyncio
+import threading
+import time
+
+from scheduler import BATCH, INTERACTIVE, AsyncBulkhead, Bulkhead, BulkheadFull, PriorityScheduler
+
+
+def test_full_class_rejects_while_other_classes_keep_running():
+    scheduler = PriorityScheduler([Bulkhead(INTERACTIVE, 2, 2, 1), Bulkhead(BATCH, 1, 0, 1)])
+    comic = scheduler.bulkhead(BATCH).acquire()
+    try:
+        scheduler.bulkhead(BATCH).acquire(timeout=1)
+        assert False, "batch class is full"
+    except BulkheadFull as e:
+        assert e.retry_after == 5  # no durations observed yet
+    with scheduler.bulkhead(INTERACTIVE).acquire(timeout=0):
+        with scheduler.bulkhead(INTERACTIVE).acquire(timeout=0):
+            pass
+    comic.release()
+    comic.release()
+    stats = scheduler.stats()
+    assert stats[BATCH]["rejected"] == 1 and stats[BATCH]["running"] == 0
+    assert stats[INTERACTIVE]["admitted"] == 2
+    try:
+        scheduler.bulkhead("urgent")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_queued_request_gets_released_slot_and_wait_is_recorded():
+    bulkhead = Bulkhead(BATCH, 1, 1, 1)
+    held = bulkhead.acquire()
+    granted = []
+
+    def waiter():
+        with bulkhead.acquire(timeout=2):
+            granted.append(1)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert granted == [] and bulkhead.stats()["queue_depth"] == 1
+    held.release()
+    thread.join(2)
+    stats = bulkhead.stats()
+    assert granted == [1] and stats["queue_depth"] == 0 and stats["wait_p95_seconds"] >= 0.04
+
+
+def test_wait_times_out_with_retry_after_from_durations():
+    now = [0.0]
+    bulkhead = Bulkhead(BATCH, 1, 5, 1, clock=lambda: now[0])
+    first = bulkhead.acquire()
+    now[0] += 40
+    first.release()  # a batch request takes 40s
+    held = bulkhead.acquire()
+    try:
+        bulkhead.acquire(timeout=0)
+        assert False, "wait should time out"
+    except BulkheadFull as e:
+        assert e.retry_after == 80  # itself plus the one running, one slot
+    assert bulkhead.stats()["timed_out"] == 1
+    held.release()
+
+
+def test_pool_runs_tasks_only_on_its_own_workers():
+    batch = Bulkhead(BATCH, 1, 0, 2)
+    interactive = Bulkhead(INTERACTIVE, 1, 0, 1)
+    gate = threading.Event()
+    panels = [batch.submit(gate.wait, 2) for _ in range(4)]
+    # Batch workers are all busy, yet the interactive pool answers at once
+    assert interactive.submit(lambda: threading.current_thread().name).result(1).startswith("interactive-pool")
+    assert batch.stats()["pool_queue_depth"] == 2 and batch.stats()["pool_running"] == 2
+    gate.set()
+    assert all(panel.result(2) for panel in panels)
+    assert batch.stats()["tasks"] == 4 and batch.stats()["pool_queue_depth"] == 0
+    batch.shutdown()
+    interactive.shutdown()
+
+
+def test_async_bulkhead_queues_on_the_loop_and_hands_slots_over():
+    async def scenario():
+        bulkhead = AsyncBulkhead(INTERACTIVE, max_concurrent=2, max_queued=1)
+        first, second = await bulkhead.acquire(), await bulkhead.acquire()
+        queued = asyncio.ensure_future(bulkhead.acquire(timeout=2))
+        await asyncio.sleep(0.01)
+        assert bulkhead.stats()["queue_depth"] == 1
+        try:
+            await bulkhead.acquire(timeout=1)
+            assert False, "queue is full"
+        except BulkheadFull as e:
+            assert e.retry_after == 5
+        first.release()
+        third = await queued
+        assert bulkhead.stats()["running"] == 2
+        try:
+            await bulkhead.acquire(timeout=0.02)
+            assert False, "wait should time out"
+        except BulkheadFull:
+            pass
+        cancelled = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        second.release()
+        third.release()
+        stats = bulkhead.stats()
+        assert stats["running"] == 0 and stats["queue_depth"] == 0
+        assert stats["admitted"] == 3 and stats["rejected"] == 1 and stats["timed_out"] == 1
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All scheduler tests passed!")
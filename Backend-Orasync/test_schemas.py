@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the structured-output schemas and validation layer
+"""
+
+import json
+
+from schemas import (SchemaValidationError, StructuredOutputStats, parse_output, parse_with_repair,
+                     response_config, validate, validate_item, STORY_SCHEMA)
+
+
+def test_response_config_constrains_json():
+    config = response_config("flashcards")
+    assert config["response_mime_type"] == "application/json"
+    assert config["response_schema"]["type"] == "ARRAY"
+    assert response_config("flashcards", enabled=False) == {}
+    assert response_config(None) == {}
+
+
+def test_validation_reports_path_and_coerces_integers():
+    story = {"title": "T", "content": "C", "level": "beginner",
+             "chapters": [{"title": "One", "content": "...", "order": "1"}]}
+    assert validate(story, STORY_SCHEMA)["chapters"][0]["order"] == 1
+    del story["chapters"][0]["content"]
+    try:
+        validate(story, STORY_SCHEMA)
+        assert False, "missing field should fail"
+    except SchemaValidationError as e:
+        assert e.path == "$.chapters[0]"
+
+
+def test_comic_pairs_become_client_dicts():
+    characters = parse_output("comic_characters", json.dumps({
+        "comic_title": "Leaf Life", "theme": "Science",
+        "character_style_guide": [{"name": "Chloe", "description": "Green cape"}],
+    }))
+    assert characters["character_style_guide"] == {"Chloe": "Green cape"}
+
+    panels = parse_output("comic_panels", json.dumps([
+        {"panel_id": i, "scene": "s", "image_prompt": "p", "dialogue": [{"speaker": "Chloe", "line": "Hi!"}]}
+        for i in range(1, 4)
+    ]))
+    assert panels[0]["dialogue"] == {"Chloe": "Hi!"}
+
+    # Streamed panels are validated one at a time
+    panel = validate_item("comic_panels", {"panel_id": "4", "scene": "s", "image_prompt": "p",
+                                           "dialogue": [{"speaker": "Chloe", "line": "Bye!"}]}, 3)
+    assert panel["panel_id"] == 4 and panel["dialogue"] == {"Chloe": "Bye!"}
+
+    # A silent panel is valid as it is, not a repair
+    silent = validate_item("comic_panels", {"panel_id": 5, "scene": "s", "image_prompt": "p", "dialogue": []}, 4)
+    assert silent["dialogue"] == {}
+
+
+def test_legacy_map_form_still_validates():
+    characters = parse_output("comic_characters", json.dumps({
+        "comic_title": "Leaf Life", "theme": "Science",
+        "character_style_guide": {"Chloe": {"clothing": "green cape"}},
+    }))
+    assert characters["character_style_guide"] == {"Chloe": "Clothing: green cape"}
+
+
+def test_repair_path_is_counted():
+    stats = StructuredOutputStats()
+    cards = parse_with_repair("flashcards", '[{"front": "a", "back": "b"}]', stats=stats)
+    assert cards == [{"front": "a", "back": "b"}]
+
+    truncated = 'Sure! [{"front": "a", "back": "b"},'
+    repaired = parse_with_repair("flashcards", truncated, stats=stats,
+                                 repair=lambda text: json.loads(text[text.index("["):].rstrip(",") + "]"))
+    assert repaired == [{"front": "a", "back": "b"}]
+
+    try:
+        parse_with_repair("flashcards", '[{"front": "a"}]', stats=stats, repair=json.loads)
+        assert False, "schema violation should survive repair"
+    except SchemaValidationError:
+        pass
+
+    stats.record_retry("flashcards")
+    counts = stats.stats()["kinds"]["flashcards"]
+    assert (counts["valid"], counts["repaired"], counts["failed"], counts["retries"]) == (1, 1, 1, 1)
+    assert counts["repair_rate"] == round(1 / 3, 4)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All schema tests passed!")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Offline tests for single-flight coalescing of identical generation calls
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from single_flight import SingleFlight, canonical_key, coalesce
+
+
+def test_concurrent_identical_calls_execute_once():
+    group = SingleFlight("test_identical")
+    executions = []
+
+    @coalesce(group, lambda text: canonical_key(text))
+    def slow_generate(text):
+        executions.append(text)
+        time.sleep(0.2)
+        return text.upper()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(slow_generate, ["same passage"] * 8))
+
+    assert results == ["SAME PASSAGE"] * 8
+    assert len(executions) == 1
+    stats = group.stats()
+    assert stats["calls"] == 8
+    assert stats["executions"] == 1
+    assert stats["coalesced"] == 7
+    assert stats["in_flight"] == 0
+
+
+def test_different_keys_do_not_coalesce():
+    group = SingleFlight("test_distinct")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda n: group.do(str(n), lambda: n * 2), range(4)))
+    assert results == [0, 2, 4, 6]
+    assert group.stats()["coalesced"] == 0
+
+
+def test_errors_reach_every_waiter():
+    group = SingleFlight("test_errors")
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("model unavailable")
+
+    errors = []
+
+    def call():
+        try:
+            group.do("k", failing)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join()
+    follower.join()
+    assert errors == ["model unavailable", "model unavailable"]
+
+
+def test_canonical_key_ignores_dict_order():
+    assert canonical_key({"a": 1, "b": 2}) == canonical_key({"b": 2, "a": 1})
+    assert canonical_key("x", None) != canonical_key("x", "")
+
+
+def test_async_callers_coalesce_without_blocking_the_loop():
+    group = SingleFlight("test_async")
+    executions = []
+
+    async def synthesize(text):
+        executions.append(text)
+        await asyncio.sleep(0.05)
+        return text.encode()
+
+    async def scenario():
+        key = canonical_key("tts", "hello")
+        return await asyncio.gather(*(group.ado(key, synthesize, "hello") for _ in range(20)))
+
+    assert asyncio.run(scenario()) == [b"hello"] * 20
+    assert executions == ["hello"]
+    assert group.stats()["coalesced"] == 19 and group.stats()["in_flight"] == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All single-flight tests passed!")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Offline tests for SSE / NDJSON stream encoding
+"""
+
+import json
+
+from streaming import encode_event, negotiate_stream_format
+
+
+def test_negotiation():
+    assert negotiate_stream_format(None, "application/json") is None
+    assert negotiate_stream_format(True, None) == "sse"
+    assert negotiate_stream_format("NDJSON", None) == "ndjson"
+    assert negotiate_stream_format(None, "text/event-stream") == "sse"
+    assert negotiate_stream_format(None, "application/x-ndjson") == "ndjson"
+    assert negotiate_stream_format(False, "application/json") is None
+
+
+def test_sse_encoding():
+    frame = encode_event("sse", "block", {"index": 2, "block": {"type": "heading", "content": "Hi"}})
+    assert frame.startswith("event: block\ndata: ")
+    assert frame.endswith("\n\n")
+    assert json.loads(frame.split("data: ", 1)[1])["index"] == 2
+    assert encode_event("sse", "ping") == ": keep-alive\n\n"
+
+
+def test_ndjson_encoding():
+    line = encode_event("ndjson", "done", {"block_count": 3})
+    assert line.endswith("\n") and line.count("\n") == 1
+    assert json.loads(line) == {"event": "done", "block_count": 3}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("✅ All streaming tests passed!")